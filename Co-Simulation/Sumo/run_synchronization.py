@@ -14,9 +14,14 @@ Script to integrate CARLA and SUMO simulations
 # ==================================================================================================
 
 import argparse
+import collections
+import concurrent.futures
 import logging
+import threading
 import time
 
+import numpy as np
+
 # ==================================================================================================
 # -- find carla module -----------------------------------------------------------------------------
 # ==================================================================================================
@@ -56,6 +61,13 @@ from sumo_integration.sumo_simulation import SumoSimulation  # pylint: disable=w
 # ==================================================================================================
 
 
+# Frames exchanged between both simulators at each step.
+SumoFrame = collections.namedtuple(
+    'SumoFrame', 'spawned destroyed actor_ids locations rotations signals traffic_lights')
+CarlaFrame = collections.namedtuple(
+    'CarlaFrame', 'spawned destroyed actor_ids locations rotations lights traffic_lights')
+
+
 class SimulationSynchronization(object):
     """
     SimulationSynchronization class is responsible for the synchronization of sumo and carla
@@ -66,7 +78,8 @@ class SimulationSynchronization(object):
                  carla_simulation,
                  tls_manager='none',
                  sync_vehicle_color=False,
-                 sync_vehicle_lights=False):
+                 sync_vehicle_lights=False,
+                 pipeline=False):
 
         self.sumo = sumo_simulation
         self.carla = carla_simulation
@@ -96,16 +109,86 @@ class SimulationSynchronization(object):
         traffic_manager = self.carla.client.get_trafficmanager()
         traffic_manager.set_synchronous_mode(True)
 
+        # Pipelined mode: sumo steps in a worker thread, frames are exchanged between steps.
+        self.pipeline = pipeline
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1) if pipeline else None
+        self._sumo_step = None
+        self._carla_frame = None
+
+        # Accumulated duration of each phase of the synchronization step.
+        self._timings = {}
+        self._timings_lock = threading.Lock()
+
     def tick(self):
         """
         Tick to simulation synchronization
         """
+        if self.pipeline:
+            self._pipelined_tick()
+        else:
+            self._sequential_tick()
+
+    def _sequential_tick(self):
+        """
+        Runs sumo and carla one after the other. Each simulator receives the state of the other one
+        for the current step.
+        """
+        step_start = time.time()
+
         # -----------------
         # sumo-->carla sync
         # -----------------
-        self.sumo.tick()
+        self._timed('sumo_tick', self.sumo.tick)
+        sumo_frame = self._timed('read_sumo', self._read_sumo)
+        self._timed('write_carla', self._write_carla, sumo_frame)
+
+        # -----------------
+        # carla-->sumo sync
+        # -----------------
+        self._timed('carla_tick', self.carla.tick)
+        carla_frame = self._timed('read_carla', self._read_carla)
+        self._timed('write_sumo', self._write_sumo, carla_frame)
+
+        self._record('step', time.time() - step_start)
+
+    def _pipelined_tick(self):
+        """
+        Runs the sumo step t+1 in a worker thread while carla processes the step t. Only the worker
+        thread talks to sumo while it steps, and the carla state is pushed to sumo one step later
+        than in the sequential mode.
+        """
+        step_start = time.time()
+
+        if self._sumo_step is None:
+            self._sumo_step = self._executor.submit(self._timed, 'sumo_tick', self.sumo.tick)
+
+        # Waiting for the sumo step running in the background.
+        wait_start = time.time()
+        self._sumo_step.result()
+        self._sumo_step = None
+        self._record('sumo_wait', time.time() - wait_start)
+
+        # Exchanging the double-buffered frames while sumo is idle.
+        sumo_frame = self._timed('read_sumo', self._read_sumo)
+        if self._carla_frame is not None:
+            self._timed('write_sumo', self._write_sumo, self._carla_frame)
+            self._carla_frame = None
 
-        # Spawning new sumo actors in carla (i.e, not controlled by carla).
+        # Next sumo step, overlapped with the current carla step.
+        self._sumo_step = self._executor.submit(self._timed, 'sumo_tick', self.sumo.tick)
+
+        self._timed('write_carla', self._write_carla, sumo_frame)
+        self._timed('carla_tick', self.carla.tick)
+        self._carla_frame = self._timed('read_carla', self._read_carla)
+
+        self._record('step', time.time() - step_start)
+
+    def _read_sumo(self):
+        """
+        Collects the sumo state needed by carla for the current step.
+        """
+        # New sumo actors (i.e, not controlled by carla).
+        spawned = []
         sumo_spawned_actors = self.sumo.spawned_actors - set(self.carla2sumo_ids.values())
         for sumo_actor_id in sumo_spawned_actors:
             self.sumo.subscribe(sumo_actor_id)
@@ -115,102 +198,179 @@ class SimulationSynchronization(object):
             if carla_blueprint is not None:
                 carla_transform = BridgeHelper.get_carla_transform(sumo_actor.transform,
                                                                    sumo_actor.extent)
-
-                carla_actor_id = self.carla.spawn_actor(carla_blueprint, carla_transform)
-                if carla_actor_id != INVALID_ACTOR_ID:
-                    self.sumo2carla_ids[sumo_actor_id] = carla_actor_id
+                spawned.append((sumo_actor_id, carla_blueprint, carla_transform))
             else:
                 self.sumo.unsubscribe(sumo_actor_id)
 
+        # State of all the actors synchronized in carla, from the subscription results.
+        actor_ids = list(self.sumo2carla_ids.keys()) + [actor[0] for actor in spawned]
+        actor_ids = [actor_id for actor_id in actor_ids if actor_id not in self.sumo.destroyed_actors]
+        locations, rotations, extents, signals = self.sumo.get_actors_state(actor_ids)
+        carla_locations, carla_rotations = BridgeHelper.get_carla_transforms(
+            locations, rotations, extents[:, 0])
+
+        traffic_lights = {}
+        if self.tls_manager == 'sumo':
+            common_landmarks = self.sumo.traffic_light_ids & self.carla.traffic_light_ids
+            for landmark_id in common_landmarks:
+                traffic_lights[landmark_id] = self.sumo.get_traffic_light_state(landmark_id)
+
+        return SumoFrame(spawned, set(self.sumo.destroyed_actors), actor_ids, carla_locations,
+                         carla_rotations, signals, traffic_lights)
+
+    def _write_carla(self, sumo_frame):
+        """
+        Applies a sumo frame to carla.
+        """
+        # Spawning new sumo actors in carla.
+        for sumo_actor_id, carla_blueprint, carla_transform in sumo_frame.spawned:
+            carla_actor_id = self.carla.spawn_actor(carla_blueprint, carla_transform)
+            if carla_actor_id != INVALID_ACTOR_ID:
+                self.sumo2carla_ids[sumo_actor_id] = carla_actor_id
+
         # Destroying sumo arrived actors in carla.
-        for sumo_actor_id in self.sumo.destroyed_actors:
+        for sumo_actor_id in sumo_frame.destroyed:
             if sumo_actor_id in self.sumo2carla_ids:
                 self.carla.destroy_actor(self.sumo2carla_ids.pop(sumo_actor_id))
 
-        # Updating sumo actors in carla.
-        for sumo_actor_id in self.sumo2carla_ids:
-            carla_actor_id = self.sumo2carla_ids[sumo_actor_id]
-
-            sumo_actor = self.sumo.get_actor(sumo_actor_id)
-            carla_actor = self.carla.get_actor(carla_actor_id)
+        # Updating sumo actors in carla, with a single batch of commands.
+        rows = [
+            row for row, actor_id in enumerate(sumo_frame.actor_ids)
+            if actor_id in self.sumo2carla_ids
+        ]
+        if rows:
+            carla_actor_ids = [self.sumo2carla_ids[sumo_frame.actor_ids[row]] for row in rows]
 
-            carla_transform = BridgeHelper.get_carla_transform(sumo_actor.transform,
-                                                               sumo_actor.extent)
             if self.sync_vehicle_lights:
-                carla_lights = BridgeHelper.get_carla_lights_state(carla_actor.get_light_state(),
-                                                                   sumo_actor.signals)
+                carla_lights = [
+                    BridgeHelper.get_carla_lights_state(
+                        self.carla.get_vehicle_light_state(carla_actor_id), sumo_frame.signals[row])
+                    for carla_actor_id, row in zip(carla_actor_ids, rows)
+                ]
             else:
                 carla_lights = None
 
-            self.carla.synchronize_vehicle(carla_actor_id, carla_transform, carla_lights)
+            self.carla.synchronize_vehicles(carla_actor_ids, sumo_frame.locations[rows],
+                                            sumo_frame.rotations[rows], carla_lights)
 
         # Updates traffic lights in carla based on sumo information.
-        if self.tls_manager == 'sumo':
+        for landmark_id, sumo_tl_state in sumo_frame.traffic_lights.items():
+            carla_tl_state = BridgeHelper.get_carla_traffic_light_state(sumo_tl_state)
+            self.carla.synchronize_traffic_light(landmark_id, carla_tl_state)
+
+    def _read_carla(self):
+        """
+        Collects the carla state needed by sumo for the current step. Only carla is accessed here.
+        """
+        # New carla actors (not controlled by sumo).
+        spawned = [
+            self.carla.get_actor(carla_actor_id)
+            for carla_actor_id in self.carla.spawned_actors - set(self.sumo2carla_ids.values())
+        ]
+
+        # State of all the actors synchronized in sumo, from the world snapshot.
+        actor_ids = list(self.carla2sumo_ids.keys()) + [actor.id for actor in spawned]
+        carla_locations, carla_rotations, found = self.carla.get_actors_transform(actor_ids)
+        actor_ids = [actor_id for actor_id, is_found in zip(actor_ids, found) if is_found]
+
+        extents = np.array([self.carla.get_actor_extent(actor_id)
+                            for actor_id in actor_ids]).reshape(-1, 3)
+        sumo_locations, sumo_rotations = BridgeHelper.get_sumo_transforms(
+            carla_locations[found], carla_rotations[found], extents[:, 0])
+
+        if self.sync_vehicle_lights:
+            lights = [self.carla.get_actor_light_state(actor_id) for actor_id in actor_ids]
+        else:
+            lights = None
+
+        traffic_lights = {}
+        if self.tls_manager == 'carla':
             common_landmarks = self.sumo.traffic_light_ids & self.carla.traffic_light_ids
             for landmark_id in common_landmarks:
-                sumo_tl_state = self.sumo.get_traffic_light_state(landmark_id)
-                carla_tl_state = BridgeHelper.get_carla_traffic_light_state(sumo_tl_state)
-
-                self.carla.synchronize_traffic_light(landmark_id, carla_tl_state)
-
-        # -----------------
-        # carla-->sumo sync
-        # -----------------
-        self.carla.tick()
+                traffic_lights[landmark_id] = self.carla.get_traffic_light_state(landmark_id)
 
-        # Spawning new carla actors (not controlled by sumo)
-        carla_spawned_actors = self.carla.spawned_actors - set(self.sumo2carla_ids.values())
-        for carla_actor_id in carla_spawned_actors:
-            carla_actor = self.carla.get_actor(carla_actor_id)
+        return CarlaFrame(spawned, set(self.carla.destroyed_actors), actor_ids, sumo_locations,
+                          sumo_rotations, lights, traffic_lights)
 
+    def _write_sumo(self, carla_frame):
+        """
+        Applies a carla frame to sumo.
+        """
+        # Spawning new carla actors in sumo.
+        for carla_actor in carla_frame.spawned:
             type_id = BridgeHelper.get_sumo_vtype(carla_actor)
             color = carla_actor.attributes.get('color', None) if self.sync_vehicle_color else None
             if type_id is not None:
                 sumo_actor_id = self.sumo.spawn_actor(type_id, color)
                 if sumo_actor_id != INVALID_ACTOR_ID:
-                    self.carla2sumo_ids[carla_actor_id] = sumo_actor_id
+                    self.carla2sumo_ids[carla_actor.id] = sumo_actor_id
                     self.sumo.subscribe(sumo_actor_id)
 
         # Destroying required carla actors in sumo.
-        for carla_actor_id in self.carla.destroyed_actors:
+        for carla_actor_id in carla_frame.destroyed:
             if carla_actor_id in self.carla2sumo_ids:
                 self.sumo.destroy_actor(self.carla2sumo_ids.pop(carla_actor_id))
 
         # Updating carla actors in sumo.
-        for carla_actor_id in self.carla2sumo_ids:
-            sumo_actor_id = self.carla2sumo_ids[carla_actor_id]
-
-            carla_actor = self.carla.get_actor(carla_actor_id)
-            sumo_actor = self.sumo.get_actor(sumo_actor_id)
+        rows = [
+            row for row, actor_id in enumerate(carla_frame.actor_ids)
+            if actor_id in self.carla2sumo_ids
+        ]
+        if rows:
+            sumo_actor_ids = [self.carla2sumo_ids[carla_frame.actor_ids[row]] for row in rows]
 
-            sumo_transform = BridgeHelper.get_sumo_transform(carla_actor.get_transform(),
-                                                             carla_actor.bounding_box.extent)
             if self.sync_vehicle_lights:
-                carla_lights = self.carla.get_actor_light_state(carla_actor_id)
-                if carla_lights is not None:
-                    sumo_lights = BridgeHelper.get_sumo_lights_state(sumo_actor.signals,
-                                                                     carla_lights)
-                else:
-                    sumo_lights = None
+                _, _, _, sumo_signals = self.sumo.get_actors_state(sumo_actor_ids)
+                sumo_lights = []
+                for row, signals in zip(rows, sumo_signals):
+                    carla_lights = carla_frame.lights[row]
+                    if carla_lights is not None:
+                        sumo_lights.append(BridgeHelper.get_sumo_lights_state(signals, carla_lights))
+                    else:
+                        sumo_lights.append(None)
             else:
                 sumo_lights = None
 
-            self.sumo.synchronize_vehicle(sumo_actor_id, sumo_transform, sumo_lights)
+            self.sumo.synchronize_vehicles(sumo_actor_ids, carla_frame.locations[rows],
+                                           carla_frame.rotations[rows], sumo_lights)
 
         # Updates traffic lights in sumo based on carla information.
-        if self.tls_manager == 'carla':
-            common_landmarks = self.sumo.traffic_light_ids & self.carla.traffic_light_ids
-            for landmark_id in common_landmarks:
-                carla_tl_state = self.carla.get_traffic_light_state(landmark_id)
-                sumo_tl_state = BridgeHelper.get_sumo_traffic_light_state(carla_tl_state)
+        for landmark_id, carla_tl_state in carla_frame.traffic_lights.items():
+            sumo_tl_state = BridgeHelper.get_sumo_traffic_light_state(carla_tl_state)
 
-                # Updates all the sumo links related to this landmark.
-                self.sumo.synchronize_traffic_light(landmark_id, sumo_tl_state)
+            # Updates all the sumo links related to this landmark.
+            self.sumo.synchronize_traffic_light(landmark_id, sumo_tl_state)
+
+    def _timed(self, phase, function, *args):
+        """
+        Calls the given function and records its duration under the given phase name.
+        """
+        start = time.time()
+        result = function(*args)
+        self._record(phase, time.time() - start)
+        return result
+
+    def _record(self, phase, elapsed):
+        with self._timings_lock:
+            count, total = self._timings.get(phase, (0, 0.0))
+            self._timings[phase] = (count + 1, total + elapsed)
+
+    def get_timings(self):
+        """
+        Returns the mean duration (in seconds) of each phase of the synchronization step.
+        """
+        with self._timings_lock:
+            return {phase: total / count for phase, (count, total) in self._timings.items()}
 
     def close(self):
         """
         Cleans synchronization.
         """
+        if self._executor is not None:
+            if self._sumo_step is not None:
+                self._sumo_step.result()
+            self._executor.shutdown()
+
         # Configuring carla simulation in async mode.
         settings = self.carla.world.get_settings()
         settings.synchronous_mode = False
@@ -238,7 +398,8 @@ def synchronization_loop(args):
     carla_simulation = CarlaSimulation(args.carla_host, args.carla_port, args.step_length)
 
     synchronization = SimulationSynchronization(sumo_simulation, carla_simulation, args.tls_manager,
-                                                args.sync_vehicle_color, args.sync_vehicle_lights)
+                                                args.sync_vehicle_color, args.sync_vehicle_lights,
+                                                args.pipeline)
     try:
         while True:
             start = time.time()
@@ -254,6 +415,9 @@ def synchronization_loop(args):
         logging.info('Cancelled by user.')
 
     finally:
+        for phase, elapsed in sorted(synchronization.get_timings().items()):
+            logging.info('Mean %s time: %.2f ms', phase, elapsed * 1000.0)
+
         logging.info('Cleaning synchronization')
 
         synchronization.close()
@@ -304,6 +468,10 @@ if __name__ == '__main__':
                            choices=['none', 'sumo', 'carla'],
                            help="select traffic light manager (default: none)",
                            default='none')
+    argparser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='run the sumo step concurrently with the carla step, with one step of lag (default: False)')
     argparser.add_argument('--debug', action='store_true', help='enable debug messages')
     arguments = argparser.parse_args()
 
@@ -16,6 +16,8 @@ import logging
 import math
 import random
 
+import numpy as np
+
 import carla  # pylint: disable=import-error
 import traci  # pylint: disable=import-error
 
@@ -92,6 +94,64 @@ class BridgeHelper(object):
 
         return out_transform
 
+    @staticmethod
+    def get_carla_transforms(sumo_locations, sumo_rotations, extents):
+        """
+        Vectorised version of get_carla_transform for several actors at once.
+
+            :param sumo_locations: (N, 3) array with sumo locations (x, y, z).
+            :param sumo_rotations: (N, 3) array with sumo rotations (pitch, yaw, roll).
+            :param extents: (N,) array with the half length of each actor.
+            :return: (N, 3) carla locations and (N, 3) carla rotations.
+        """
+        offset = BridgeHelper.offset
+        sumo_locations = np.asarray(sumo_locations, dtype=np.float64).reshape(-1, 3)
+        sumo_rotations = np.asarray(sumo_rotations, dtype=np.float64).reshape(-1, 3)
+        extents = np.asarray(extents, dtype=np.float64).reshape(-1)
+
+        # From front-center-bumper to center (sumo reference system).
+        yaw = np.radians(-1 * sumo_rotations[:, 1] + 90)
+        pitch = np.radians(sumo_rotations[:, 0])
+        out_locations = np.empty_like(sumo_locations)
+        out_locations[:, 0] = sumo_locations[:, 0] - np.cos(yaw) * extents - offset[0]
+        out_locations[:, 1] = -(sumo_locations[:, 1] - np.sin(yaw) * extents - offset[1])
+        out_locations[:, 2] = sumo_locations[:, 2] - np.sin(pitch) * extents
+
+        # Transform to carla reference system (left-handed system).
+        out_rotations = sumo_rotations.copy()
+        out_rotations[:, 1] -= 90
+
+        return out_locations, out_rotations
+
+    @staticmethod
+    def get_sumo_transforms(carla_locations, carla_rotations, extents):
+        """
+        Vectorised version of get_sumo_transform for several actors at once.
+
+            :param carla_locations: (N, 3) array with carla locations (x, y, z).
+            :param carla_rotations: (N, 3) array with carla rotations (pitch, yaw, roll).
+            :param extents: (N,) array with the half length of each actor.
+            :return: (N, 3) sumo locations and (N, 3) sumo rotations.
+        """
+        offset = BridgeHelper.offset
+        carla_locations = np.asarray(carla_locations, dtype=np.float64).reshape(-1, 3)
+        carla_rotations = np.asarray(carla_rotations, dtype=np.float64).reshape(-1, 3)
+        extents = np.asarray(extents, dtype=np.float64).reshape(-1)
+
+        # From center to front-center-bumper (carla reference system).
+        yaw = np.radians(-1 * carla_rotations[:, 1])
+        pitch = np.radians(carla_rotations[:, 0])
+        out_locations = np.empty_like(carla_locations)
+        out_locations[:, 0] = carla_locations[:, 0] + np.cos(yaw) * extents + offset[0]
+        out_locations[:, 1] = -(carla_locations[:, 1] - np.sin(yaw) * extents - offset[1])
+        out_locations[:, 2] = carla_locations[:, 2] - np.sin(pitch) * extents
+
+        # Transform to sumo reference system.
+        out_rotations = carla_rotations.copy()
+        out_rotations[:, 1] += 90
+
+        return out_locations, out_rotations
+
     @staticmethod
     def _get_recommended_carla_blueprint(sumo_actor):
         """
@@ -13,6 +13,8 @@
 
 import logging
 
+import numpy as np
+
 import carla  # pylint: disable=import-error
 
 from .constants import INVALID_ACTOR_ID, SPAWN_OFFSET_Z
@@ -39,6 +41,13 @@ class CarlaSimulation(object):
         self.spawned_actors = set()
         self.destroyed_actors = set()
 
+        # World snapshot of the current frame and static information of the known actors.
+        self.snapshot = None
+        self._actors = {}  # {actor_id: carla_actor}, vehicles only
+        self._extents = {}  # {actor_id: (x, y, z)}, vehicles only
+        self._ignored_actors = set()  # Non-vehicle actors already seen.
+        self._light_states = {}  # {actor_id: light state last sent in a batch}
+
         # Set traffic lights.
         self._tls = {}  # {landmark_id: traffic_ligth_actor}
 
@@ -55,6 +64,8 @@ class CarlaSimulation(object):
         """
         Accessor for carla actor.
         """
+        if actor_id in self._actors:
+            return self._actors[actor_id]
         return self.world.get_actor(actor_id)
 
     # This is a workaround to fix synchronization issues when other carla clients remove an actor in
@@ -72,6 +83,54 @@ class CarlaSimulation(object):
         except RuntimeError:
             return None
 
+    def get_actor_extent(self, actor_id):
+        """
+        Accessor for the bounding box extent of a vehicle, cached the first time it is seen.
+        """
+        if actor_id not in self._extents:
+            extent = self.get_actor(actor_id).bounding_box.extent
+            self._extents[actor_id] = (extent.x, extent.y, extent.z)
+        return self._extents[actor_id]
+
+    def get_vehicle_light_state(self, actor_id):
+        """
+        Accessor for the light state of a vehicle whose lights are set by this client. The last
+        state sent in a batch is returned, so only the first access needs a call to the server.
+        """
+        if actor_id not in self._light_states:
+            light_state = self.get_actor_light_state(actor_id)
+            self._light_states[actor_id] = light_state if light_state is not None else \
+                carla.VehicleLightState.NONE
+        return self._light_states[actor_id]
+
+    def get_actors_transform(self, actor_ids):
+        """
+        Accessor for the transform of several actors, read from the world snapshot of the current
+        frame.
+
+            :param actor_ids: list of carla actor ids.
+            :return: (N, 3) locations, (N, 3) rotations (pitch, yaw, roll) and a (N,) boolean mask
+                of the actors found in the snapshot.
+        """
+        count = len(actor_ids)
+        locations = np.zeros((count, 3))
+        rotations = np.zeros((count, 3))
+        found = np.zeros(count, dtype=bool)
+        if self.snapshot is None:
+            return locations, rotations, found
+
+        for index, actor_id in enumerate(actor_ids):
+            actor_snapshot = self.snapshot.find(actor_id)
+            if actor_snapshot is None:
+                continue
+            transform = actor_snapshot.get_transform()
+            locations[index] = (transform.location.x, transform.location.y, transform.location.z)
+            rotations[index] = (transform.rotation.pitch, transform.rotation.yaw,
+                                transform.rotation.roll)
+            found[index] = True
+
+        return locations, rotations, found
+
     @property
     def traffic_light_ids(self):
         return set(self._tls.keys())
@@ -146,6 +205,31 @@ class CarlaSimulation(object):
             vehicle.set_light_state(carla.VehicleLightState(lights))
         return True
 
+    def synchronize_vehicles(self, vehicle_ids, locations, rotations, lights=None):
+        """
+        Updates the state of several vehicles with a single batch of commands.
+
+            :param vehicle_ids: ids of the actors to be updated.
+            :param locations: (N, 3) array with the new locations.
+            :param rotations: (N, 3) array with the new rotations (pitch, yaw, roll).
+            :param lights: list with the new vehicle light states, or None.
+        """
+        batch = []
+        for index, vehicle_id in enumerate(vehicle_ids):
+            x, y, z = locations[index].tolist()
+            pitch, yaw, roll = rotations[index].tolist()
+            transform = carla.Transform(carla.Location(x, y, z), carla.Rotation(pitch, yaw, roll))
+            batch.append(carla.command.ApplyTransform(vehicle_id, transform))
+
+            if lights is not None and lights[index] is not None:
+                if self._light_states.get(vehicle_id) != lights[index]:
+                    batch.append(carla.command.SetVehicleLightState(
+                        vehicle_id, carla.VehicleLightState(lights[index])))
+                self._light_states[vehicle_id] = lights[index]
+
+        if batch:
+            self.client.apply_batch(batch)
+
     def synchronize_traffic_light(self, landmark_id, state):
         """
         Updates traffic light state.
@@ -167,14 +251,31 @@ class CarlaSimulation(object):
         Tick to carla simulation.
         """
         self.world.tick()
+        self.snapshot = self.world.get_snapshot()
+
+        # Only the actors never seen before are requested to the server, to know their type.
+        snapshot_ids = set([actor_snapshot.id for actor_snapshot in self.snapshot])
+        new_ids = snapshot_ids - self._ignored_actors - set(self._actors)
+        if new_ids:
+            for actor in self.world.get_actors(list(new_ids)):
+                if actor.type_id.startswith('vehicle.'):
+                    self._actors[actor.id] = actor
+                    extent = actor.bounding_box.extent
+                    self._extents[actor.id] = (extent.x, extent.y, extent.z)
+            self._ignored_actors.update(new_ids - set(self._actors))
 
         # Update data structures for the current frame.
-        current_actors = set(
-            [vehicle.id for vehicle in self.world.get_actors().filter('vehicle.*')])
+        current_actors = snapshot_ids & set(self._actors)
         self.spawned_actors = current_actors.difference(self._active_actors)
         self.destroyed_actors = self._active_actors.difference(current_actors)
         self._active_actors = current_actors
 
+        for actor_id in self.destroyed_actors:
+            self._actors.pop(actor_id, None)
+            self._extents.pop(actor_id, None)
+            self._light_states.pop(actor_id, None)
+        self._ignored_actors &= snapshot_ids
+
     def close(self):
         """
         Closes carla client.
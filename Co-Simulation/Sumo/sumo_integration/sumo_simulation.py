@@ -16,6 +16,8 @@ import enum
 import logging
 import os
 
+import numpy as np
+
 import carla  # pylint: disable=import-error
 import sumolib  # pylint: disable=import-error
 import traci  # pylint: disable=import-error
@@ -414,6 +416,35 @@ class SumoSimulation(object):
 
         return SumoActor(type_id, vclass, transform, signals, extent, color)
 
+    @staticmethod
+    def get_actors_state(actor_ids):
+        """
+        Accessor for the state of several sumo actors at once. The state is read exclusively from
+        the subscription results of the current step, which are retrieved in a single call.
+
+            :param actor_ids: list of sumo actor ids.
+            :return: (N, 3) locations, (N, 3) rotations (pitch, yaw, roll), (N, 3) extents and the
+                list of signals of the given actors.
+        """
+        all_results = traci.vehicle.getAllSubscriptionResults()
+
+        count = len(actor_ids)
+        locations = np.zeros((count, 3))
+        rotations = np.zeros((count, 3))
+        extents = np.zeros((count, 3))
+        signals = []
+        for index, actor_id in enumerate(actor_ids):
+            results = all_results[actor_id]
+            locations[index] = results[traci.constants.VAR_POSITION3D]
+            rotations[index, 0] = results[traci.constants.VAR_SLOPE]
+            rotations[index, 1] = results[traci.constants.VAR_ANGLE]
+            extents[index] = (results[traci.constants.VAR_LENGTH] / 2.0,
+                              results[traci.constants.VAR_WIDTH] / 2.0,
+                              results[traci.constants.VAR_HEIGHT] / 2.0)
+            signals.append(results[traci.constants.VAR_SIGNALS])
+
+        return locations, rotations, extents, signals
+
     def spawn_actor(self, type_id, color=None):
         """
         Spawns a new actor.
@@ -475,6 +506,22 @@ class SumoSimulation(object):
             traci.vehicle.setSignals(vehicle_id, signals)
         return True
 
+    def synchronize_vehicles(self, vehicle_ids, locations, rotations, signals=None):
+        """
+        Updates the state of several vehicles.
+
+            :param vehicle_ids: ids of the actors to be updated.
+            :param locations: (N, 3) array with the new locations.
+            :param rotations: (N, 3) array with the new rotations (pitch, yaw, roll).
+            :param signals: list with the new vehicle signals, or None.
+        """
+        for index, vehicle_id in enumerate(vehicle_ids):
+            traci.vehicle.moveToXY(vehicle_id, "", 0, float(locations[index, 0]),
+                                   float(locations[index, 1]), angle=float(rotations[index, 1]),
+                                   keepRoute=2)
+            if signals is not None and signals[index] is not None:
+                traci.vehicle.setSignals(vehicle_id, signals[index])
+
     def synchronize_traffic_light(self, landmark_id, state):
         """
         Updates traffic light state.
@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2020 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+"""
+Checks the batched synchronization (vectorised transforms, subscription results read at once, one
+carla batch per tick) against the scalar per-vehicle conversions, with fake carla and traci
+objects. Run from Co-Simulation/Sumo:
+
+    python -m unittest test_batched_synchronization
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+try:
+    import carla  # pylint: disable=import-error
+    import traci  # pylint: disable=import-error
+except ImportError as error:
+    raise unittest.SkipTest('the carla and traci python packages are needed: {}'.format(error))
+
+# traci installed as a python package does not need the tools folder of SUMO_HOME.
+with mock.patch.dict(os.environ, {'SUMO_HOME': os.environ.get('SUMO_HOME', tempfile.gettempdir())}):
+    from run_synchronization import SimulationSynchronization  # pylint: disable=wrong-import-position
+    from sumo_integration.bridge_helper import BridgeHelper  # pylint: disable=wrong-import-position
+    from sumo_integration.carla_simulation import CarlaSimulation  # pylint: disable=wrong-import-position
+    from sumo_integration.sumo_simulation import (  # pylint: disable=wrong-import-position
+        SumoSimulation, SumoVehSignal)
+
+NET_OFFSET = (12.5, -7.25)
+
+# ==================================================================================================
+# -- fake carla ------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+class FakeActor(object):
+    def __init__(self, world, actor_id, type_id, transform, extent=(2.0, 1.0, 0.8)):
+        self.world = world
+        self.id = actor_id
+        self.type_id = type_id
+        self.attributes = {}
+        self.bounding_box = carla.BoundingBox(carla.Location(), carla.Vector3D(*extent))
+        self.transform = transform
+        self.light_state = carla.VehicleLightState.NONE
+
+    def get_transform(self):
+        return self.transform
+
+    def get_light_state(self):
+        return self.light_state
+
+    def destroy(self):
+        del self.world.actors[self.id]
+        return True
+
+
+class FakeSnapshot(object):
+    def __init__(self, actors):
+        self._transforms = {actor.id: actor.transform for actor in actors}
+
+    def __iter__(self):
+        return iter([mock.Mock(id=actor_id) for actor_id in self._transforms])
+
+    def find(self, actor_id):
+        if actor_id not in self._transforms:
+            return None
+        return mock.Mock(get_transform=mock.Mock(return_value=self._transforms[actor_id]))
+
+
+class FakeWorld(object):
+    """Carla world whose actors keep the transforms they are given, logging the actor requests"""
+
+    def __init__(self):
+        self.actors = {}
+        self.requested = []
+
+    def add_actor(self, actor_id, type_id, transform, extent=(2.0, 1.0, 0.8)):
+        self.actors[actor_id] = FakeActor(self, actor_id, type_id, transform, extent)
+        return actor_id
+
+    def tick(self):
+        pass
+
+    def get_snapshot(self):
+        return FakeSnapshot(self.actors.values())
+
+    def get_actors(self, actor_ids=None):
+        self.requested.append(sorted(actor_ids) if actor_ids is not None else None)
+        if actor_ids is None:
+            return list(self.actors.values())
+        return [self.actors[actor_id] for actor_id in actor_ids if actor_id in self.actors]
+
+    def get_actor(self, actor_id):
+        return self.actors.get(actor_id)
+
+    def get_map(self):
+        return mock.Mock(get_all_landmarks_of_type=mock.Mock(return_value=[]))
+
+    def get_blueprint_library(self):
+        return []
+
+    def get_settings(self):
+        return mock.Mock()
+
+    def apply_settings(self, settings):
+        pass
+
+
+class FakeClient(object):
+    """Carla client applying the transforms and light states of the batches to the fake world"""
+
+    def __init__(self, world):
+        self.world = world
+        self.batches = []
+
+    def set_timeout(self, timeout):
+        pass
+
+    def get_world(self):
+        return self.world
+
+    def get_trafficmanager(self):
+        return mock.Mock()
+
+    def apply_batch(self, batch):
+        self.batches.append(list(batch))
+        for command in batch:
+            actor = self.world.actors[command.actor_id]
+            if isinstance(command, carla.command.ApplyTransform):
+                actor.transform = command.transform
+            else:
+                actor.light_state = command.light_state
+
+
+def make_carla_simulation(world):
+    client = FakeClient(world)
+    with mock.patch('carla.Client', lambda host, port: client):
+        return CarlaSimulation('localhost', 2000, 0.05)
+
+
+# ==================================================================================================
+# -- fake traci ------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+class FakeTraci(object):
+    """Subscription results of the sumo vehicles, and the vehicle commands sent to sumo"""
+
+    def __init__(self):
+        self.results = {}
+        self.departed = []
+        self.added = []
+        self.moves = {}
+        self.signals = {}
+
+    def set_vehicle(self, actor_id, position, angle, slope=0.0, signals=0, length=4.0, width=1.8,
+                    height=1.5):
+        self.results[actor_id] = {
+            traci.constants.VAR_TYPE: 'vehicle.audi.a2',
+            traci.constants.VAR_VEHICLECLASS: 'passenger',
+            traci.constants.VAR_COLOR: (255, 0, 0, 255), traci.constants.VAR_LENGTH: length,
+            traci.constants.VAR_WIDTH: width, traci.constants.VAR_HEIGHT: height,
+            traci.constants.VAR_POSITION3D: tuple(position), traci.constants.VAR_ANGLE: angle,
+            traci.constants.VAR_SLOPE: slope, traci.constants.VAR_SIGNALS: signals,
+        }
+
+    def patch(self, test):
+        patches = [
+            mock.patch.object(traci, 'simulationStep', lambda: None),
+            mock.patch.object(traci.simulation, 'getDepartedIDList', lambda: self.departed),
+            mock.patch.object(traci.simulation, 'getArrivedIDList', lambda: []),
+            mock.patch.object(traci.vehicle, 'getSubscriptionResults',
+                              lambda actor_id: self.results[actor_id]),
+            mock.patch.object(traci.vehicle, 'getAllSubscriptionResults',
+                              lambda: dict(self.results)),
+            mock.patch.object(traci.vehicle, 'subscribe', lambda actor_id, variables: None),
+            mock.patch.object(traci.vehicle, 'add', self.add),
+            mock.patch.object(traci.vehicle, 'moveToXY', self.move_to_xy),
+            mock.patch.object(traci.vehicle, 'setSignals', self.set_signals),
+        ]
+        for patch in patches:
+            patch.start()
+            test.addCleanup(patch.stop)
+
+    def add(self, actor_id, route_id, typeID):
+        self.added.append((actor_id, typeID))
+
+    def move_to_xy(self, actor_id, edge_id, lane, x, y, angle, keepRoute):
+        self.moves.setdefault(actor_id, []).append((x, y, angle))
+
+    def set_signals(self, actor_id, signals):
+        self.signals.setdefault(actor_id, []).append(signals)
+
+
+def make_sumo_simulation():
+    """SumoSimulation without its sumo server"""
+    sumo = SumoSimulation.__new__(SumoSimulation)
+    sumo.net = mock.Mock(getLocationOffset=mock.Mock(return_value=NET_OFFSET))
+    sumo._sequential_id = 0
+    sumo.spawned_actors = set()
+    sumo.destroyed_actors = set()
+    sumo.traffic_light_manager = mock.Mock(get_all_landmarks=mock.Mock(return_value=set()))
+    return sumo
+
+
+def transform_array(transform):
+    return ([transform.location.x, transform.location.y, transform.location.z],
+            [transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll])
+
+
+def random_transforms(rng, count):
+    return [carla.Transform(carla.Location(*rng.uniform(-200.0, 200.0, 3).tolist()),
+                            carla.Rotation(*rng.uniform(-180.0, 180.0, 3).tolist()))
+            for _ in range(count)]
+
+
+# ==================================================================================================
+# -- tests -----------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+class TestVectorisedTransforms(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.object(BridgeHelper, 'offset', NET_OFFSET)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.rng = np.random.default_rng(0)
+
+    def check(self, scalar, vectorised):
+        transforms = random_transforms(self.rng, 50)
+        extents = self.rng.uniform(0.5, 6.0, 50)
+        arrays = [transform_array(transform) for transform in transforms]
+        locations, rotations = vectorised(np.array([a[0] for a in arrays]),
+                                          np.array([a[1] for a in arrays]), extents)
+        for index, (transform, extent) in enumerate(zip(transforms, extents)):
+            expected = scalar(transform, carla.Vector3D(float(extent), 1.0, 1.0))
+            expected_location, expected_rotation = transform_array(expected)
+            # carla stores the transforms in float32
+            np.testing.assert_allclose(locations[index], expected_location, atol=1e-3)
+            np.testing.assert_allclose(rotations[index], expected_rotation, atol=1e-3)
+
+    def test_carla_transforms(self):
+        self.check(BridgeHelper.get_carla_transform, BridgeHelper.get_carla_transforms)
+
+    def test_sumo_transforms(self):
+        self.check(BridgeHelper.get_sumo_transform, BridgeHelper.get_sumo_transforms)
+
+    def test_no_actor(self):
+        locations, rotations = BridgeHelper.get_carla_transforms(np.zeros((0, 3)), np.zeros((0, 3)),
+                                                                 np.zeros(0))
+        self.assertEqual((locations.shape, rotations.shape), ((0, 3), (0, 3)))
+
+
+class TestCarlaSimulation(unittest.TestCase):
+    def setUp(self):
+        self.world = FakeWorld()
+        self.world.add_actor(1, 'spectator', carla.Transform())
+        self.world.add_actor(10, 'vehicle.tesla.model3', carla.Transform(carla.Location(1, 2, 0)),
+                             (2.4, 1.1, 0.7))
+        self.carla = make_carla_simulation(self.world)
+
+    def test_tick_requests_new_actors_once(self):
+        self.carla.tick()
+        self.assertEqual(self.carla.spawned_actors, set([10]))
+        self.world.add_actor(11, 'vehicle.audi.tt', carla.Transform())
+        self.carla.tick()
+        self.carla.tick()
+        # the spectator is not requested again, nor the known vehicles
+        self.assertEqual(self.world.requested, [[1, 10], [11]])
+        self.assertEqual(self.carla.spawned_actors, set())
+        np.testing.assert_allclose(self.carla.get_actor_extent(10), (2.4, 1.1, 0.7), rtol=1e-6)
+
+        self.world.actors[10].destroy()
+        self.carla.tick()
+        self.assertEqual(self.carla.destroyed_actors, set([10]))
+        self.assertNotIn(10, self.carla._extents)
+
+    def test_transforms_from_snapshot(self):
+        self.carla.tick()
+        locations, rotations, found = self.carla.get_actors_transform([10, 42])
+        self.assertEqual(found.tolist(), [True, False])
+        self.assertEqual(locations[0].tolist(), [1.0, 2.0, 0.0])
+        # the transforms are the ones of the tick, not the current ones
+        self.world.actors[10].transform = carla.Transform(carla.Location(5, 5, 5))
+        self.assertEqual(self.carla.get_actors_transform([10])[0][0].tolist(), [1.0, 2.0, 0.0])
+
+    def test_one_batch(self):
+        self.world.add_actor(11, 'vehicle.audi.tt', carla.Transform())
+        self.carla.tick()
+        locations = np.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+        rotations = np.array([[0.0, 90.0, 0.0], [0.0, -45.0, 0.0]])
+        brake = int(carla.VehicleLightState.Brake)
+        self.carla.synchronize_vehicles([10, 11], locations, rotations, [brake, None])
+        self.carla.synchronize_vehicles([10, 11], locations + 1, rotations, [brake, None])
+        self.carla.synchronize_vehicles([10, 11], locations, rotations, None)
+
+        client = self.carla.client
+        self.assertEqual([len(batch) for batch in client.batches], [3, 2, 2])
+        # unchanged light states are not sent again
+        light_commands = [command for batch in client.batches for command in batch
+                          if isinstance(command, carla.command.SetVehicleLightState)]
+        light_states = [(command.actor_id, int(command.light_state)) for command in light_commands]
+        self.assertEqual(light_states, [(10, brake)])
+        self.assertEqual(self.carla.get_vehicle_light_state(10), brake)
+        self.assertEqual(transform_array(self.world.actors[11].transform),
+                         ([4.0, 5.0, 6.0], [0.0, -45.0, 0.0]))
+
+
+class TestSumoSimulation(unittest.TestCase):
+    def setUp(self):
+        self.traci = FakeTraci()
+        self.traci.patch(self)
+
+    def test_actors_state(self):
+        self.traci.set_vehicle('a', (1.0, 2.0, 3.0), 90.0, slope=2.0, signals=8, length=5.0)
+        self.traci.set_vehicle('b', (4.0, 5.0, 6.0), 180.0)
+        locations, rotations, extents, signals = SumoSimulation.get_actors_state(['b', 'a'])
+        for row, actor_id in enumerate(['b', 'a']):
+            actor = SumoSimulation.get_actor(actor_id)
+            # carla stores the transforms of get_actor in float32
+            location, rotation = transform_array(actor.transform)
+            np.testing.assert_allclose(locations[row], location, rtol=1e-6)
+            np.testing.assert_allclose(rotations[row], rotation, rtol=1e-6)
+            extent = [actor.extent.x, actor.extent.y, actor.extent.z]
+            np.testing.assert_allclose(extents[row], extent, rtol=1e-6)
+            self.assertEqual(signals[row], actor.signals)
+        self.assertEqual(SumoSimulation.get_actors_state([])[0].shape, (0, 3))
+
+    def test_synchronize_vehicles(self):
+        sumo = make_sumo_simulation()
+        sumo.synchronize_vehicles(['a', 'b'], np.array([[1.0, 2.0, 0.0], [3.0, 4.0, 0.0]]),
+                                  np.array([[0.0, 30.0, 0.0], [0.0, 60.0, 0.0]]), [None, 2])
+        self.assertEqual(self.traci.moves, {'a': [(1.0, 2.0, 30.0)], 'b': [(3.0, 4.0, 60.0)]})
+        self.assertEqual(self.traci.signals, {'b': [2]})
+
+
+class TestBatchedSynchronization(unittest.TestCase):
+    """
+    A sumo vehicle mirrored in carla and a carla vehicle mirrored in sumo, through the real
+    SimulationSynchronization, CarlaSimulation and SumoSimulation.
+    """
+    def setUp(self):
+        self.traci = FakeTraci()
+        self.traci.patch(self)
+        patches = [
+            mock.patch.object(BridgeHelper, 'blueprint_library', []),
+            mock.patch.object(BridgeHelper, 'offset', (0, 0)),
+            mock.patch.object(BridgeHelper, 'get_carla_blueprint',
+                              staticmethod(lambda actor, sync_color=False: actor.type_id)),
+            mock.patch.object(BridgeHelper, 'get_sumo_vtype',
+                              staticmethod(lambda carla_actor: carla_actor.type_id)),
+            mock.patch.object(CarlaSimulation, 'spawn_actor', self.spawn_carla_actor),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.world = FakeWorld()
+        self.world.add_actor(1, 'spectator', carla.Transform())
+        self.world.add_actor(100, 'vehicle.tesla.model3',
+                             carla.Transform(carla.Location(30.0, -4.0, 0.5),
+                                             carla.Rotation(0.0, 20.0, 0.0)),
+                             (2.4, 1.1, 0.7))
+        self.carla = make_carla_simulation(self.world)
+        self.sumo = make_sumo_simulation()
+        self.synchronization = SimulationSynchronization(self.sumo, self.carla,
+                                                         sync_vehicle_lights=True)
+
+    def spawn_carla_actor(self, blueprint, transform):
+        return self.world.add_actor(1000 + len(self.world.actors), blueprint, transform)
+
+    def test_ticks(self):
+        self.assertEqual(BridgeHelper.offset, NET_OFFSET)
+        self.traci.departed = ['veh0']
+        self.traci.set_vehicle('veh0', (50.0, 60.0, 0.0), 45.0, signals=0)
+        self.traci.set_vehicle('carla0', (0.0, 0.0, 0.0), 0.0, signals=0)
+        self.synchronization.tick()
+
+        # the sumo vehicle is spawned and moved in carla, the carla vehicle is added to sumo
+        self.assertEqual(self.synchronization.sumo2carla_ids, {'veh0': 1002})
+        self.assertEqual(self.synchronization.carla2sumo_ids, {100: 'carla0'})
+        self.assertEqual(self.traci.added, [('carla0', 'vehicle.tesla.model3')])
+        self.assertEqual(len(self.carla.client.batches), 1)
+
+        for step in range(1, 4):
+            self.traci.departed = []
+            signals = int(SumoVehSignal.BRAKELIGHT) if step >= 2 else 0
+            self.traci.set_vehicle('veh0', (50.0 + step, 60.0 - step, 0.0), 45.0 + step,
+                                   signals=signals)
+            self.world.actors[100].transform = carla.Transform(
+                carla.Location(30.0 + 2 * step, -4.0, 0.5), carla.Rotation(0.0, 20.0 - step, 0.0))
+            self.synchronization.tick()
+
+            # one batch of commands per tick, with the scalar conversion of the sumo state
+            self.assertEqual(len(self.carla.client.batches), step + 1)
+            expected = BridgeHelper.get_carla_transform(SumoSimulation.get_actor('veh0').transform,
+                                                        SumoSimulation.get_actor('veh0').extent)
+            location, rotation = transform_array(self.world.actors[1002].transform)
+            expected_location, expected_rotation = transform_array(expected)
+            np.testing.assert_allclose(location, expected_location, atol=1e-3)
+            np.testing.assert_allclose(rotation, expected_rotation, atol=1e-3)
+
+            # sumo gets the scalar conversion of the carla state of the tick
+            expected = BridgeHelper.get_sumo_transform(self.world.actors[100].transform,
+                                                       self.world.actors[100].bounding_box.extent)
+            x, y, angle = self.traci.moves['carla0'][-1]
+            np.testing.assert_allclose([x, y, angle], [expected.location.x, expected.location.y,
+                                                       expected.rotation.yaw], atol=1e-3)
+
+        # the brake light of the sumo vehicle is sent once, when it changes
+        light_commands = [(command.actor_id, int(command.light_state))
+                          for batch in self.carla.client.batches for command in batch
+                          if isinstance(command, carla.command.SetVehicleLightState)]
+        self.assertEqual(light_commands, [(1002, int(carla.VehicleLightState.Brake))])
+        # the actors are requested once, when they appear
+        self.assertEqual(self.world.requested, [[1, 100, 1002]])
+
+
+if __name__ == '__main__':
+    unittest.main()
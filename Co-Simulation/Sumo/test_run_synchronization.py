@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2020 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+"""
+Checks that the pipelined and the sequential synchronization issue the same synchronization calls
+in the same order, and that the pipelined mode overlaps the sumo and carla steps, with stub sumo
+and carla simulations. Run from Co-Simulation/Sumo:
+
+    python -m unittest test_run_synchronization
+"""
+
+import collections
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+# The stub simulations never load the SUMO tools, run_synchronization only checks SUMO_HOME is set.
+with mock.patch.dict(os.environ, {'SUMO_HOME': os.environ.get('SUMO_HOME', tempfile.gettempdir())}):
+    from run_synchronization import BridgeHelper, SimulationSynchronization  # pylint: disable=wrong-import-position
+
+# ==================================================================================================
+# -- stub simulations ------------------------------------------------------------------------------
+# ==================================================================================================
+
+SumoActor = collections.namedtuple('SumoActor', 'type_id transform extent')
+CarlaActor = collections.namedtuple('CarlaActor', 'id type_id attributes')
+
+
+class StubSumoSimulation(object):
+    """
+    Sumo simulation whose actors only depend on its own step: sumo vehicles spawn and arrive on
+    fixed steps, their positions are a function of the step. Every synchronization call is logged.
+    """
+    SPAWNS = {1: ['s0'], 2: ['s1'], 4: ['s2']}
+    ARRIVALS = {5: ['s0'], 7: ['s2']}
+
+    def __init__(self):
+        self.step = 0
+        self.spawned_actors = set()
+        self.destroyed_actors = set()
+        self.traffic_light_ids = set(['tl0', 'tl1'])
+        self.calls = []
+        self._spawned = 0
+
+    def tick(self):
+        self.step += 1
+        self.spawned_actors = set(self.SPAWNS.get(self.step, []))
+        self.destroyed_actors = set(self.ARRIVALS.get(self.step, []))
+
+    def get_net_offset(self):
+        return (0, 0)
+
+    def switch_off_traffic_lights(self):
+        pass
+
+    def subscribe(self, actor_id):
+        pass
+
+    def unsubscribe(self, actor_id):
+        pass
+
+    def get_actor(self, actor_id):
+        return SumoActor('vehicle.' + actor_id, None, None)
+
+    def get_actors_state(self, actor_ids):
+        index = [int(actor_id[1:]) for actor_id in actor_ids]
+        locations = np.array([[self.step, i, 0.0] for i in index]).reshape(-1, 3)
+        rotations = np.array([[0.0, 10.0 * self.step + i, 0.0] for i in index]).reshape(-1, 3)
+        extents = np.ones((len(actor_ids), 3))
+        return locations, rotations, extents, [0] * len(actor_ids)
+
+    def get_traffic_light_state(self, landmark_id):
+        return 'G' if (self.step + int(landmark_id[2:])) % 3 else 'r'
+
+    def spawn_actor(self, type_id, color=None):
+        self.calls.append(('spawn_actor', type_id))
+        self._spawned += 1
+        return 'carla%d' % self._spawned
+
+    def destroy_actor(self, actor_id):
+        self.calls.append(('destroy_actor', actor_id))
+
+    def synchronize_vehicles(self, vehicle_ids, locations, rotations, lights=None):
+        self.calls.append(('synchronize_vehicles', list(vehicle_ids), locations.tolist(),
+                           rotations.tolist()))
+
+    def synchronize_traffic_light(self, landmark_id, state):
+        self.calls.append(('synchronize_traffic_light', landmark_id, state))
+
+    def close(self):
+        pass
+
+
+class StubCarlaSimulation(object):
+    """
+    Carla simulation whose own actors only depend on its step. Every tick and synchronization call
+    is logged.
+    """
+    SPAWNS = {1: [100], 3: [101]}
+    DESTRUCTIONS = {4: [100]}
+
+    def __init__(self):
+        self.step = 0
+        self.step_length = 0.05
+        self.spawned_actors = set()
+        self.destroyed_actors = set()
+        self.traffic_light_ids = set(['tl0', 'tl1'])
+        self.world = mock.MagicMock()
+        self.client = mock.MagicMock()
+        self.calls = []
+        self._live = set()
+        self._spawned = 0
+
+    def tick(self):
+        self.calls.append(('tick',))
+        self.step += 1
+        self.spawned_actors = set(self.SPAWNS.get(self.step, []))
+        self.destroyed_actors = set(self.DESTRUCTIONS.get(self.step, []))
+        self._live = (self._live | self.spawned_actors) - self.destroyed_actors
+
+    def switch_off_traffic_lights(self):
+        pass
+
+    def get_actor(self, actor_id):
+        return CarlaActor(actor_id, 'vehicle.carla%d' % actor_id, {})
+
+    def get_actors_transform(self, actor_ids):
+        found = np.array([actor_id in self._live for actor_id in actor_ids], dtype=bool)
+        locations = np.array([[self.step, actor_id, 0.0] for actor_id in actor_ids]).reshape(-1, 3)
+        rotations = np.array([[0.0, 5.0 * self.step, 0.0] for actor_id in actor_ids]).reshape(-1, 3)
+        return locations, rotations, found
+
+    def get_actor_extent(self, actor_id):
+        return (2.0, 1.0, 1.0)
+
+    def get_traffic_light_state(self, landmark_id):
+        return 'Red' if (self.step + int(landmark_id[2:])) % 2 else 'Green'
+
+    def spawn_actor(self, blueprint, transform):
+        self.calls.append(('spawn_actor', blueprint))
+        self._spawned += 1
+        return 1000 + self._spawned
+
+    def destroy_actor(self, actor_id):
+        self.calls.append(('destroy_actor', actor_id))
+
+    def synchronize_vehicles(self, vehicle_ids, locations, rotations, lights=None):
+        self.calls.append(('synchronize_vehicles', list(vehicle_ids), locations.tolist(),
+                           rotations.tolist()))
+
+    def synchronize_traffic_light(self, landmark_id, state):
+        self.calls.append(('synchronize_traffic_light', landmark_id, state))
+
+    def close(self):
+        pass
+
+
+class SleepingTicks(object):
+    """
+    Mixin making the tick of a stub simulation sleep, recording when each tick ran and on which
+    thread.
+    """
+    TICK_DURATION = 0.05
+
+    def __init__(self):
+        super(SleepingTicks, self).__init__()
+        self.intervals = []
+        self.threads = set()
+
+    def tick(self):
+        start = time.time()
+        time.sleep(self.TICK_DURATION)
+        super(SleepingTicks, self).tick()
+        self.intervals.append((start, time.time()))
+        self.threads.add(threading.current_thread().ident)
+
+
+class SleepingSumoSimulation(SleepingTicks, StubSumoSimulation):
+    pass
+
+
+class SleepingCarlaSimulation(SleepingTicks, StubCarlaSimulation):
+    pass
+
+
+# ==================================================================================================
+# -- tests -----------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+class TestPipelinedSynchronization(unittest.TestCase):
+    def setUp(self):
+        # Conversions between both simulators are identities, the blueprints are the type ids.
+        patches = [
+            mock.patch.object(BridgeHelper, 'blueprint_library', []),
+            mock.patch.object(BridgeHelper, 'offset', (0, 0)),
+            mock.patch.object(BridgeHelper, 'get_carla_blueprint',
+                              staticmethod(lambda sumo_actor, sync_color=False: sumo_actor.type_id)),
+            mock.patch.object(BridgeHelper, 'get_carla_transform',
+                              staticmethod(lambda transform, extent: transform)),
+            mock.patch.object(BridgeHelper, 'get_carla_transforms',
+                              staticmethod(lambda locations, rotations, extents: (locations, rotations))),
+            mock.patch.object(BridgeHelper, 'get_sumo_transforms',
+                              staticmethod(lambda locations, rotations, extents: (locations, rotations))),
+            mock.patch.object(BridgeHelper, 'get_sumo_vtype',
+                              staticmethod(lambda carla_actor: carla_actor.type_id)),
+            mock.patch.object(BridgeHelper, 'get_carla_traffic_light_state', staticmethod(lambda state: state)),
+            mock.patch.object(BridgeHelper, 'get_sumo_traffic_light_state', staticmethod(lambda state: state)),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def run_synchronization(self, ticks, tls_manager, pipeline):
+        sumo = StubSumoSimulation()
+        carla = StubCarlaSimulation()
+        synchronization = SimulationSynchronization(sumo, carla, tls_manager, pipeline=pipeline)
+        for _ in range(ticks):
+            synchronization.tick()
+        sumo_calls, carla_calls = list(sumo.calls), list(carla.calls)
+        synchronization.close()
+        return sumo_calls, carla_calls
+
+    def test_same_calls(self):
+        ticks = 8
+        for tls_manager in ('none', 'sumo', 'carla'):
+            with self.subTest(tls_manager=tls_manager):
+                sumo_calls, carla_calls = self.run_synchronization(ticks, tls_manager, pipeline=False)
+                # The carla state reaches sumo one tick later in the pipelined mode.
+                pipelined_sumo_calls, pipelined_carla_calls = self.run_synchronization(
+                    ticks + 1, tls_manager, pipeline=True)
+
+                self.assertEqual(carla_calls.count(('tick',)), ticks)
+                self.assertEqual(pipelined_carla_calls[:len(carla_calls)], carla_calls)
+                self.assertEqual(pipelined_sumo_calls, sumo_calls)
+
+                # Every kind of synchronization is exercised.
+                kinds = set(call[0] for call in sumo_calls + carla_calls)
+                self.assertTrue(set(['spawn_actor', 'destroy_actor', 'synchronize_vehicles']) <= kinds)
+                if tls_manager != 'none':
+                    self.assertIn('synchronize_traffic_light', kinds)
+
+    def run_sleeping(self, ticks, pipeline):
+        sumo = SleepingSumoSimulation()
+        carla = SleepingCarlaSimulation()
+        synchronization = SimulationSynchronization(sumo, carla, pipeline=pipeline)
+        start = time.time()
+        for _ in range(ticks):
+            synchronization.tick()
+        elapsed = time.time() - start
+        timings = synchronization.get_timings()
+        synchronization.close()
+        return sumo, carla, elapsed, timings
+
+    def test_steps_overlap(self):
+        ticks = 6
+        duration = SleepingTicks.TICK_DURATION
+        sumo, carla, elapsed, timings = self.run_sleeping(ticks, pipeline=True)
+
+        # Sumo steps in the worker thread while carla steps in the caller.
+        self.assertNotIn(threading.current_thread().ident, sumo.threads)
+        self.assertEqual(carla.threads, set([threading.current_thread().ident]))
+
+        # Every carla step but the first one runs while the next sumo step is in progress.
+        self.assertEqual(len(carla.intervals), ticks)
+        for carla_start, carla_end in carla.intervals[1:]:
+            overlap = max(min(carla_end, sumo_end) - max(carla_start, sumo_start)
+                          for sumo_start, sumo_end in sumo.intervals)
+            self.assertGreater(overlap, duration / 2)
+
+        # One step lasts about one tick instead of the sum of both ticks.
+        self.assertLess(elapsed, (ticks + 1) * duration * 1.5)
+        self.assertLess(timings['sumo_wait'], duration / 2)
+
+    def test_sequential_steps_do_not_overlap(self):
+        ticks = 4
+        sumo, carla, elapsed, _ = self.run_sleeping(ticks, pipeline=False)
+        intervals = sorted(sumo.intervals + carla.intervals)
+        for (_, end), (start, _) in zip(intervals, intervals[1:]):
+            self.assertLessEqual(end, start)
+        self.assertGreaterEqual(elapsed, 2 * ticks * SleepingTicks.TICK_DURATION)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,6 +17,8 @@ the net and inserts, manually, the traffic light landmarks retrieved from the op
 import argparse
 import bisect
 import collections
+import hashlib
+import json
 import logging
 import shutil
 import subprocess
@@ -157,10 +159,62 @@ class SumoTopology(object):
         """
         return list(self._paths.get((odr_road_id, odr_lane_id), set()))
 
+    def save(self, path):
+        """
+        Saves the topology as json. Each map is stored as a list of [key, [value, ...]] pairs, as
+        json does not support tuples as keys.
+        """
+        def dump(mapping):
+            return [[list(key), sorted(value)] for key, value in mapping.items()]
+
+        data = {
+            'topology': dump(self._topology),
+            'paths': dump(self._paths),
+            'odr2sumo_ids': dump(self._odr2sumo_ids)
+        }
+        # Written aside and renamed, so that a concurrent reader never sees a partial file.
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path):
+        """
+        Loads a topology saved with `SumoTopology.save`.
+        """
+        with open(path, 'r') as f:
+            data = json.load(f)
+
+        def sumo_ids(values):
+            return set((edge_id, lane_index) for edge_id, lane_index in values)
+
+        topology = {tuple(key): sumo_ids(value) for key, value in data['topology']}
+        paths = {
+            tuple(key): set((tuple(from_), tuple(to_)) for from_, to_ in value)
+            for key, value in data['paths']
+        }
+        odr2sumo_ids = {tuple(key): sumo_ids(value) for key, value in data['odr2sumo_ids']}
+        return SumoTopology(topology, paths, odr2sumo_ids)
+
+
+def _parse_odr_ids(orig_ids):
+    """
+    Splits an "origId" parameter into (odr_road_id, odr_lane_id) pairs.
+    """
+    result = []
+    for odr_id in orig_ids.split():
+        odr_road_id, odr_lane_id = odr_id.split('_')
+        result.append((odr_road_id, int(odr_lane_id)))
+    return result
+
 
 def build_topology(sumo_net):
     """
     Builds sumo topology.
+
+    Every edge and its outgoing connections are visited once, the cost is linear in the number of
+    edges and connections of the net.
     """
     # --------------------------
     # OpenDrive->Sumo mapped ids
@@ -168,8 +222,25 @@ def build_topology(sumo_net):
     # Only takes into account standard roads.
     #
     #   odr2sumo_ids = {(odr_road_id, odr_lane_id) : [(sumo_edge_id, sumo_lane_index), ...], ...}
+    #
+    # -----------
+    # Connections
+    # -----------
+    #
+    #   topology -- {(sumo_road_id, sumo_lane_index): [(sumo_road_id, sumo_lane_index), ...], ...}
+    #   paths    -- {(odr_road_id, odr_lane_id): [
+    #                   ((sumo_edge_id, sumo_lane_index), (sumo_edge_id, sumo_lane_index))
+    #               ]}
     odr2sumo_ids = {}
-    for edge in sumo_net.getEdges():
+    topology = {}
+    paths = {}
+
+    edges = sumo_net.getEdges()
+    # Only the connections between the listed edges are taken into account.
+    edge_set = set(edges)
+
+    for edge in edges:
+        edge_id = edge.getID()
         for lane in edge.getLanes():
             if lane.getParam('origId') is None:
                 raise RuntimeError(
@@ -179,36 +250,21 @@ def build_topology(sumo_net):
             if len(lane.getParam('origId').split()) > 1:
                 logging.warning('[Building topology] Sumo net contains joined opendrive roads.')
 
-            for odr_id in lane.getParam('origId').split():
-                odr_road_id, odr_lane_id = odr_id.split('_')
-                if (odr_road_id, int(odr_lane_id)) not in odr2sumo_ids:
-                    odr2sumo_ids[(odr_road_id, int(odr_lane_id))] = set()
-                odr2sumo_ids[(odr_road_id, int(odr_lane_id))].add((edge.getID(), lane.getIndex()))
+            for odr_id in _parse_odr_ids(lane.getParam('origId')):
+                odr2sumo_ids.setdefault(odr_id, set()).add((edge_id, lane.getIndex()))
 
-    # -----------
-    # Connections
-    # -----------
-    #
-    #   topology -- {(sumo_road_id, sumo_lane_index): [(sumo_road_id, sumo_lane_index), ...], ...}
-    #   paths    -- {(odr_road_id, odr_lane_id): [
-    #                   ((sumo_edge_id, sumo_lane_index), (sumo_edge_id, sumo_lane_index))
-    #               ]}
-    topology = {}
-    paths = {}
+        for to_edge, connections in edge.getOutgoing().items():
+            if to_edge not in edge_set:
+                continue
 
-    for from_edge in sumo_net.getEdges():
-        for to_edge in sumo_net.getEdges():
-            connections = from_edge.getConnections(to_edge)
             for connection in connections:
                 from_ = connection.getFromLane()
                 to_ = connection.getToLane()
                 from_edge_id, from_lane_index = from_.getEdge().getID(), from_.getIndex()
                 to_edge_id, to_lane_index = to_.getEdge().getID(), to_.getIndex()
 
-                if (from_edge_id, from_lane_index) not in topology:
-                    topology[(from_edge_id, from_lane_index)] = set()
-
-                topology[(from_edge_id, from_lane_index)].add((to_edge_id, to_lane_index))
+                topology.setdefault((from_edge_id, from_lane_index), set()).add(
+                    (to_edge_id, to_lane_index))
 
                 # Checking if the connection is an opendrive path.
                 conn_odr_ids = connection.getParam('origId')
@@ -217,18 +273,72 @@ def build_topology(sumo_net):
                         logging.warning(
                             '[Building topology] Sumo net contains joined opendrive paths.')
 
-                    for odr_id in conn_odr_ids.split():
-
-                        odr_road_id, odr_lane_id = odr_id.split('_')
-                        if (odr_road_id, int(odr_lane_id)) not in paths:
-                            paths[(odr_road_id, int(odr_lane_id))] = set()
-
-                        paths[(odr_road_id, int(odr_lane_id))].add(
+                    for odr_id in _parse_odr_ids(conn_odr_ids):
+                        paths.setdefault(odr_id, set()).add(
                             ((from_edge_id, from_lane_index), (to_edge_id, to_lane_index)))
 
     return SumoTopology(topology, paths, odr2sumo_ids)
 
 
+def default_topology_cache_dir():
+    """
+    Returns the default directory of the cached topologies.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'carla', 'sumo_topology')
+
+
+def _net_content_hash(net_file):
+    """
+    Returns the sha1 of a sumo net without its leading XML declaration and comments. netconvert writes
+    there the generation time and its configuration, output file included, which change on every run.
+    """
+    with open(net_file, 'rb') as f:
+        content = f.read()
+    start = 0
+    while True:
+        while start < len(content) and content[start:start + 1].isspace():
+            start += 1
+        if content.startswith(b'<?', start):
+            end = content.find(b'?>', start)
+            start = len(content) if end < 0 else end + 2
+        elif content.startswith(b'<!--', start):
+            end = content.find(b'-->', start)
+            start = len(content) if end < 0 else end + 3
+        else:
+            break
+    return hashlib.sha1(content[start:]).hexdigest()
+
+
+def load_topology(net_file, cache_dir=None):
+    """
+    Returns the topology of the given sumo net. The topology is cached on disk, keyed by the hash of
+    the net content (header comments excluded), so the net is only parsed the first time.
+
+        :param net_file: sumo net file (*.net.xml)
+        :param cache_dir: directory of the cached topologies. If None, the default one is used.
+        :returns: SumoTopology
+    """
+    if cache_dir is None:
+        cache_dir = default_topology_cache_dir()
+
+    cache_file = os.path.join(cache_dir, _net_content_hash(net_file) + '.topology.json')
+
+    if os.path.exists(cache_file):
+        try:
+            return SumoTopology.load(cache_file)
+        except (ValueError, KeyError, TypeError):
+            logging.warning('Discarding corrupted topology cache %s.', cache_file)
+
+    sumo_topology = build_topology(sumolib.net.readNet(net_file))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        sumo_topology.save(cache_file)
+    except OSError as error:
+        logging.warning('Could not cache the topology of %s: %s', net_file, error)
+    return sumo_topology
+
+
 # ==================================================================================================
 # -- sumo definitions ------------------------------------------------------------------------------
 # ==================================================================================================
@@ -362,7 +472,7 @@ class SumoTrafficLight(object):
 # ==================================================================================================
 
 
-def _netconvert_carla_impl(xodr_file, output, tmpdir, guess_tls=False):
+def _netconvert_carla_impl(xodr_file, output, tmpdir, guess_tls=False, topology_cache_dir=None):
     """
     Implements netconvert carla.
     """
@@ -396,8 +506,7 @@ def _netconvert_carla_impl(xodr_file, output, tmpdir, guess_tls=False):
     # --------
     # Sumo net
     # --------
-    sumo_net = sumolib.net.readNet(tmp_sumo_net)
-    sumo_topology = build_topology(sumo_net)
+    sumo_topology = load_topology(tmp_sumo_net, topology_cache_dir)
 
     # ---------
     # Carla map
@@ -507,18 +616,19 @@ def _netconvert_carla_impl(xodr_file, output, tmpdir, guess_tls=False):
     tree.write(output, pretty_print=True, encoding='UTF-8', xml_declaration=True)
 
 
-def netconvert_carla(xodr_file, output, guess_tls=False):
+def netconvert_carla(xodr_file, output, guess_tls=False, topology_cache_dir=None):
     """
     Generates sumo net.
 
         :param xodr_file: opendrive file (*.xodr)
         :param output: output file (*.net.xml)
         :param guess_tls: guess traffic lights at intersections.
+        :param topology_cache_dir: directory of the cached topologies (default: ~/.cache/carla/sumo_topology)
         :returns: path to the generated sumo net.
     """
     try:
         tmpdir = tempfile.mkdtemp()
-        _netconvert_carla_impl(xodr_file, output, tmpdir, guess_tls)
+        _netconvert_carla_impl(xodr_file, output, tmpdir, guess_tls, topology_cache_dir)
 
     finally:
         if os.path.exists(tmpdir):
@@ -536,6 +646,10 @@ if __name__ == '__main__':
     argparser.add_argument('--guess-tls',
                            action='store_true',
                            help='guess traffic lights at intersections (default: False)')
+    argparser.add_argument('--topology-cache',
+                           default=None,
+                           type=str,
+                           help='directory of the cached topologies (default: ~/.cache/carla/sumo_topology)')
     args = argparser.parse_args()
 
-    netconvert_carla(args.xodr_file, args.output, args.guess_tls)
+    netconvert_carla(args.xodr_file, args.output, args.guess_tls, args.topology_cache)
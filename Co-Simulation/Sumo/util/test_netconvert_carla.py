@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2020 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+"""
+Checks the single pass topology builder against the former pairwise one on the example nets, and the
+topology cache. Run from Co-Simulation/Sumo:
+
+    python -m unittest util.test_netconvert_carla
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import lxml.etree as ET  # pylint: disable=import-error
+
+try:
+    import sumolib
+except ImportError:
+    raise unittest.SkipTest('sumolib is not installed')
+
+# sumolib installed as a python package does not need the tools folder of SUMO_HOME.
+with mock.patch.dict(os.environ, {'SUMO_HOME': os.environ.get('SUMO_HOME', tempfile.gettempdir())}):
+    try:
+        from util import netconvert_carla  # pylint: disable=wrong-import-position
+    except ImportError as error:
+        raise unittest.SkipTest('netconvert_carla dependencies are missing: {}'.format(error))
+
+NET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'examples', 'net')
+NETS = ['Town01.net.xml', 'Town04.net.xml', 'Town05.net.xml']
+
+# ==================================================================================================
+# -- reference builder -----------------------------------------------------------------------------
+# ==================================================================================================
+
+
+def pairwise_build_topology(sumo_net):
+    """
+    build_topology as it was before the single pass: every pair of edges is visited.
+    """
+    odr2sumo_ids = {}
+    for edge in sumo_net.getEdges():
+        for lane in edge.getLanes():
+            for odr_id in lane.getParam('origId').split():
+                odr_road_id, odr_lane_id = odr_id.split('_')
+                if (odr_road_id, int(odr_lane_id)) not in odr2sumo_ids:
+                    odr2sumo_ids[(odr_road_id, int(odr_lane_id))] = set()
+                odr2sumo_ids[(odr_road_id, int(odr_lane_id))].add((edge.getID(), lane.getIndex()))
+
+    topology = {}
+    paths = {}
+    for from_edge in sumo_net.getEdges():
+        for to_edge in sumo_net.getEdges():
+            connections = from_edge.getConnections(to_edge)
+            for connection in connections:
+                from_ = connection.getFromLane()
+                to_ = connection.getToLane()
+                from_edge_id, from_lane_index = from_.getEdge().getID(), from_.getIndex()
+                to_edge_id, to_lane_index = to_.getEdge().getID(), to_.getIndex()
+
+                if (from_edge_id, from_lane_index) not in topology:
+                    topology[(from_edge_id, from_lane_index)] = set()
+                topology[(from_edge_id, from_lane_index)].add((to_edge_id, to_lane_index))
+
+                conn_odr_ids = connection.getParam('origId')
+                if conn_odr_ids is not None:
+                    for odr_id in conn_odr_ids.split():
+                        odr_road_id, odr_lane_id = odr_id.split('_')
+                        if (odr_road_id, int(odr_lane_id)) not in paths:
+                            paths[(odr_road_id, int(odr_lane_id))] = set()
+                        paths[(odr_road_id, int(odr_lane_id))].add(
+                            ((from_edge_id, from_lane_index), (to_edge_id, to_lane_index)))
+
+    return netconvert_carla.SumoTopology(topology, paths, odr2sumo_ids)
+
+
+def add_original_names(net_file, output):
+    """
+    The example nets were generated without --output.original-names. The opendrive ids are rebuilt
+    from the sumo ids: edge "-12.0.00" is road 12, the via lane ":26_1_0" of a connection is the
+    path 26.1 of the junction. Every fifth lane is also given a joined opendrive road.
+    """
+    tree = ET.parse(net_file)
+    count = 0
+    for edge in tree.getroot().iter('edge'):
+        if edge.get('function') == 'internal':
+            continue
+        road = edge.get('id').lstrip('-').split('.')[0]
+        sign = 1 if edge.get('id').startswith('-') else -1
+        for lane in edge.iter('lane'):
+            orig_id = '{}_{}'.format(road, sign * (int(lane.get('index')) + 1))
+            if count % 5 == 0:
+                orig_id += ' {}_{}'.format(road, sign * 10)
+            ET.SubElement(lane, 'param', key='origId', value=orig_id)
+            count += 1
+    for connection in tree.getroot().iter('connection'):
+        via = connection.get('via')
+        if via is not None:
+            junction, index, _ = via[1:].rsplit('_', 2)
+            ET.SubElement(connection, 'param', key='origId', value='{}.{}_-1'.format(junction, index))
+    tree.write(output, encoding='UTF-8', xml_declaration=True)
+
+
+# ==================================================================================================
+# -- tests -----------------------------------------------------------------------------------------
+# ==================================================================================================
+
+
+class NetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def net(self, name):
+        output = os.path.join(self.tmpdir, name)
+        if not os.path.exists(output):
+            add_original_names(os.path.join(NET_DIR, name), output)
+        return output
+
+    def assertSameTopology(self, first, second):
+        self.assertEqual(first._topology, second._topology)
+        self.assertEqual(first._paths, second._paths)
+        self.assertEqual(first._odr2sumo_ids, second._odr2sumo_ids)
+
+
+class TestBuildTopology(NetTestCase):
+    def test_same_as_pairwise(self):
+        for name in NETS:
+            with self.subTest(net=name):
+                sumo_net = sumolib.net.readNet(self.net(name))
+                expected = pairwise_build_topology(sumo_net)
+                topology = netconvert_carla.build_topology(sumo_net)
+
+                self.assertSameTopology(topology, expected)
+                self.assertTrue(topology._topology and topology._paths and topology._odr2sumo_ids)
+
+    def test_missing_original_names(self):
+        sumo_net = sumolib.net.readNet(os.path.join(NET_DIR, NETS[0]))
+        with self.assertRaises(RuntimeError):
+            netconvert_carla.build_topology(sumo_net)
+
+
+class TestTopologyCache(NetTestCase):
+    def test_save_load(self):
+        topology = netconvert_carla.build_topology(sumolib.net.readNet(self.net(NETS[0])))
+        path = os.path.join(self.tmpdir, 'topology.json')
+        topology.save(path)
+        loaded = netconvert_carla.SumoTopology.load(path)
+
+        self.assertSameTopology(loaded, topology)
+        road, lane = next(iter(topology._odr2sumo_ids))
+        self.assertEqual(loaded.get_sumo_id(road, lane), topology.get_sumo_id(road, lane))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), sorted(['topology.json', NETS[0]]))
+
+    def test_load_topology(self):
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        net_file = self.net(NETS[0])
+        topology = netconvert_carla.load_topology(net_file, cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        # A cache hit does not read the net.
+        with mock.patch.object(sumolib.net, 'readNet', side_effect=AssertionError('net parsed')):
+            self.assertSameTopology(netconvert_carla.load_topology(net_file, cache_dir), topology)
+
+        # The header written by netconvert does not change the key.
+        with open(net_file, 'rb') as f:
+            content = f.read()
+        declaration, body = content.split(b'?>', 1)
+        other_net = os.path.join(self.tmpdir, 'other.net.xml')
+        with open(other_net, 'wb') as f:
+            f.write(declaration + b'?>\n<!-- generated on another day -->' + body)
+        with mock.patch.object(sumolib.net, 'readNet', side_effect=AssertionError('net parsed')):
+            self.assertSameTopology(netconvert_carla.load_topology(other_net, cache_dir), topology)
+
+    def test_corrupted_cache(self):
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        net_file = self.net(NETS[0])
+        topology = netconvert_carla.load_topology(net_file, cache_dir)
+        cache_file = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+        with open(cache_file, 'w') as f:
+            f.write('{"topology": [')
+
+        self.assertSameTopology(netconvert_carla.load_topology(net_file, cache_dir), topology)
+        self.assertSameTopology(netconvert_carla.SumoTopology.load(cache_file), topology)
+
+
+if __name__ == '__main__':
+    unittest.main()
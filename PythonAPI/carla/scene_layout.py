@@ -4,8 +4,15 @@
 # This work is licensed under the terms of the MIT license.
 # For a copy, see <https://opensource.org/licenses/MIT>.
 # Provides map data for users.
+#
+# The static layout of a map is computed once and stored as typed arrays (SceneLayout), cached on
+# disk keyed by the hash of the OpenDRIVE of the map. Dynamic objects are extracted as columnar
+# arrays from a single world snapshot (DynamicObjectExtractor). get_scene_layout() and
+# get_dynamic_objects() keep returning the dictionaries of the previous versions.
 
 import glob
+import hashlib
+import math
 import os
 import sys
 
@@ -20,24 +27,205 @@ except IndexError:
 import carla
 import random
 
+import numpy as np
+
+EARTH_RADIUS_EQUA = 6378137.0
+LAYOUT_VERSION = 1
+LAYOUT_PRECISION = 0.05
+
+
+# ==================================================================================================
+# -- geometry --------------------------------------------------------------------------------------
+# ==================================================================================================
 
-def get_scene_layout(carla_map):
+def _rotation_matrices(rotations):
     """
-    Function to extract the full scene layout to be used as a full scene description to be
-    given to the user
-    :return: a dictionary describing the scene.
+    Rotation matrices of an (N, 3) array of pitch, yaw, roll in degrees, same convention as
+    carla.Transform.
+    :return: (N, 3, 3) array.
+    """
+    pitch, yaw, roll = np.radians(np.asarray(rotations, dtype=np.float64)).T
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+    cr, sr = np.cos(roll), np.sin(roll)
+    return np.stack([
+        np.stack([cp * cy, cy * sp * sr - sy * cr, -cy * sp * cr - sy * sr], axis=-1),
+        np.stack([cp * sy, sy * sp * sr + cy * cr, -sy * sp * cr + cy * sr], axis=-1),
+        np.stack([sp, -cp * sr, cp * cr], axis=-1)], axis=-2)
+
+
+class GeoReference(object):
+    """
+    Vectorised carla.Map.transform_to_geolocation, from the geo reference of the map.
+    """
+
+    def __init__(self, latitude, longitude, altitude):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.altitude = altitude
+
+    @staticmethod
+    def from_map(carla_map):
+        origin = carla_map.transform_to_geolocation(carla.Location(0.0, 0.0, 0.0))
+        return GeoReference(origin.latitude, origin.longitude, origin.altitude)
+
+    def transform(self, locations):
+        """
+        Same Mercator projection as carla::geom::GeoLocation::Transform.
+        :return: (N, 3) array of latitude, longitude, altitude.
+        """
+        locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+        scale = math.cos(self.latitude * math.pi / 180.0)
+        mx = scale * self.longitude * math.pi * EARTH_RADIUS_EQUA / 180.0 + locations[:, 0]
+        my = scale * EARTH_RADIUS_EQUA * math.log(math.tan((90.0 + self.latitude) * math.pi / 360.0)) - locations[:, 1]
+        longitude = mx * 180.0 / (math.pi * EARTH_RADIUS_EQUA * scale)
+        latitude = 360.0 * np.arctan(np.exp(my / (EARTH_RADIUS_EQUA * scale))) / math.pi - 90.0
+        return np.stack([latitude, longitude, self.altitude + locations[:, 2]], axis=-1)
+
+    def check(self, carla_map, locations, tolerance=1e-6):
+        """
+        Checks the projection against the simulator on a few locations.
+        """
+        expected = []
+        for x, y, z in np.asarray(locations)[:8]:
+            geo = carla_map.transform_to_geolocation(carla.Location(float(x), float(y), float(z)))
+            expected.append([geo.latitude, geo.longitude, geo.altitude])
+        return np.allclose(self.transform(np.asarray(locations)[:8]), expected, rtol=0.0, atol=tolerance)
+
+
+def geolocations(carla_map, locations, geo_reference=None):
+    """
+    transform_to_geolocation of an (N, 3) array of locations, computed in one go.
+    :return: (N, 3) array of latitude, longitude, altitude.
     """
+    locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+    if geo_reference is None:
+        geo_reference = GeoReference.from_map(carla_map)
+    if len(locations) == 0 or geo_reference.check(carla_map, locations):
+        return geo_reference.transform(locations)
+    # Maps with a projection other than the default one are converted location by location.
+    result = np.empty_like(locations)
+    for i, (x, y, z) in enumerate(locations):
+        geo = carla_map.transform_to_geolocation(carla.Location(float(x), float(y), float(z)))
+        result[i] = (geo.latitude, geo.longitude, geo.altitude)
+    return result
+
+
+# ==================================================================================================
+# -- static layout ---------------------------------------------------------------------------------
+# ==================================================================================================
+
+class SceneLayout(object):
+    """
+    Static layout of a map as typed arrays. Waypoints of a lane are contiguous, the lanes form a CSR
+    structure over the waypoints:
+
+        - ids, road_ids, lane_ids: (N,) waypoint ids and their opendrive road and lane.
+        - locations: (N, 3) world positions.
+        - positions, left_margins, right_margins: (N, 3) latitude, longitude, altitude of the
+          waypoints and of their lane markings.
+        - orientations: (N, 3) roll, pitch, yaw.
+        - lane_indptr: (L + 1,) waypoints of lane l are rows lane_indptr[l]:lane_indptr[l + 1].
+        - lane_of: (N,) lane of each waypoint.
+        - left_index, right_index: (N,) row of the waypoint at the same position in the left and
+          right lanes, -1 if there is none.
+
+    The successors of a waypoint are the following waypoints of its lane.
+    """
+
+    FIELDS = ('ids', 'road_ids', 'lane_ids', 'locations', 'positions', 'orientations',
+              'left_margins', 'right_margins', 'lane_indptr', 'left_index', 'right_index')
+
+    def __init__(self, **arrays):
+        for name in self.FIELDS:
+            setattr(self, name, arrays[name])
+        self.lane_of = np.repeat(np.arange(len(self.lane_indptr) - 1), np.diff(self.lane_indptr))
+        self._rows = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def rows(self):
+        """Row of each waypoint id."""
+        if self._rows is None:
+            self._rows = {int(waypoint_id): row for row, waypoint_id in enumerate(self.ids)}
+        return self._rows
+
+    def next_rows(self, row):
+        """Rows of the waypoints following the given one in its lane."""
+        return np.arange(row + 1, self.lane_indptr[self.lane_of[row] + 1])
+
+    def save(self, path):
+        """
+        Saves the arrays in a npz file, written aside and renamed so that concurrent readers never
+        see a partial file.
+        """
+        tmp_path = '{}.{}.tmp.npz'.format(path, os.getpid())
+        np.savez(tmp_path, version=np.array(LAYOUT_VERSION),
+                 **{name: getattr(self, name) for name in self.FIELDS})
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as data:
+            if int(data['version']) != LAYOUT_VERSION:
+                raise ValueError('{} has layout version {}'.format(path, int(data['version'])))
+            return SceneLayout(**{name: data[name] for name in SceneLayout.FIELDS})
+
+    def to_dict(self):
+        """
+        Dictionary of the waypoints, in the format of get_scene_layout.
+        """
+        ids = self.ids.tolist()
+        road_ids = self.road_ids.tolist()
+        lane_ids = self.lane_ids.tolist()
+        positions = self.positions.tolist()
+        orientations = self.orientations.tolist()
+        left_margins = self.left_margins.tolist()
+        right_margins = self.right_margins.tolist()
+        left_ids = [ids[row] if row >= 0 else -1 for row in self.left_index.tolist()]
+        right_ids = [ids[row] if row >= 0 else -1 for row in self.right_index.tolist()]
+        lane_ends = self.lane_indptr[self.lane_of + 1].tolist()
+
+        waypoints_graph = dict()
+        for row in range(len(ids)):
+            waypoints_graph[ids[row]] = {
+                "road_id": road_ids[row],
+                "lane_id": lane_ids[row],
+                "position": positions[row],
+                "orientation": orientations[row],
+                "left_margin_position": left_margins[row],
+                "right_margin_position": right_margins[row],
+                "next_waypoints_ids": ids[row + 1:lane_ends[row]],
+                "left_lane_waypoint_id": left_ids[row],
+                "right_lane_waypoint_id": right_ids[row]
+            }
+        return waypoints_graph
+
+
+def opendrive_hash(carla_map):
+    """
+    Hash of the OpenDRIVE of the map, which keys the cached layouts.
+    """
+    return hashlib.sha1(carla_map.to_opendrive().encode('utf-8')).hexdigest()
+
 
-    def _lateral_shift(transform, shift):
-        transform.rotation.yaw += 90
-        return transform.location + shift * transform.get_forward_vector()
+def default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'carla', 'scene_layout')
 
+
+def _lane_waypoints(carla_map, precision):
+    """
+    Waypoints of each lane, walked from the start of every topology segment.
+    :return: dictionary {road_id: {lane_id: [waypoint, ...]}}.
+    """
     topology = [x[0] for x in carla_map.get_topology()]
     topology = sorted(topology, key=lambda w: w.transform.location.z)
 
     # A road contains a list of lanes, a each lane contains a list of waypoints
     map_dict = dict()
-    precision = 0.05
     for waypoint in topology:
         waypoints = [waypoint]
         nxt = waypoint.next(precision)
@@ -51,234 +239,296 @@ def get_scene_layout(carla_map):
                 else:
                     break
 
-        left_marking = [_lateral_shift(w.transform, -w.lane_width * 0.5) for w in waypoints]
-        right_marking = [_lateral_shift(w.transform, w.lane_width * 0.5) for w in waypoints]
-
-        lane = {
-            "waypoints": waypoints,
-            "left_marking": left_marking,
-            "right_marking": right_marking
-        }
-
         if map_dict.get(waypoint.road_id) is None:
             map_dict[waypoint.road_id] = {}
-        map_dict[waypoint.road_id][waypoint.lane_id] = lane
-
-    # Generate waypoints graph
-    waypoints_graph = dict()
-    for road_key in map_dict:
-        for lane_key in map_dict[road_key]:
-            # List of waypoints
-            lane = map_dict[road_key][lane_key]
-
-            for i in range(0, len(lane["waypoints"])):
-                next_ids = [w.id for w in lane["waypoints"][i + 1:len(lane["waypoints"])]]
-
-                # Get left and right lane keys
-                left_lane_key = lane_key - 1 if lane_key - 1 != 0 else lane_key - 2
-                right_lane_key = lane_key + 1 if lane_key + 1 != 0 else lane_key + 2
-
-                # Get left and right waypoint ids only if they are valid
-                left_lane_waypoint_id = -1
-                if left_lane_key in map_dict[road_key]:
-                    left_lane_waypoints = map_dict[road_key][left_lane_key]["waypoints"]
-                    if i < len(left_lane_waypoints):
-                        left_lane_waypoint_id = left_lane_waypoints[i].id
-
-                right_lane_waypoint_id = -1
-                if right_lane_key in map_dict[road_key]:
-                    right_lane_waypoints = map_dict[road_key][right_lane_key]["waypoints"]
-                    if i < len(right_lane_waypoints):
-                        right_lane_waypoint_id = right_lane_waypoints[i].id
-
-                # Get left and right margins (aka markings)
-                lm = carla_map.transform_to_geolocation(lane["left_marking"][i])
-                rm = carla_map.transform_to_geolocation(lane["right_marking"][i])
-
-                # Waypoint Position
-                wl = carla_map.transform_to_geolocation(lane["waypoints"][i].transform.location)
-
-                # Waypoint Orientation
-                wo = lane["waypoints"][i].transform.rotation
-
-                # Waypoint dict
-                waypoint_dict = {
-                    "road_id": road_key,
-                    "lane_id": lane_key,
-                    "position": [wl.latitude, wl.longitude, wl.altitude],
-                    "orientation": [wo.roll, wo.pitch, wo.yaw],
-                    "left_margin_position": [lm.latitude, lm.longitude, lm.altitude],
-                    "right_margin_position": [rm.latitude, rm.longitude, rm.altitude],
-                    "next_waypoints_ids": next_ids,
-                    "left_lane_waypoint_id": left_lane_waypoint_id,
-                    "right_lane_waypoint_id": right_lane_waypoint_id
-                }
-                waypoints_graph[map_dict[road_key][lane_key]["waypoints"][i].id] = waypoint_dict
-
-    return waypoints_graph
-
-
-def get_dynamic_objects(carla_world, carla_map):
-    # Private helper functions
-    def _get_bounding_box(actor):
-        bb = actor.bounding_box.extent
-        corners = [
-            carla.Location(x=-bb.x, y=-bb.y),
-            carla.Location(x=bb.x, y=-bb.y),
-            carla.Location(x=bb.x, y=bb.y),
-            carla.Location(x=-bb.x, y=bb.y)]
-        t = actor.get_transform()
-        t.transform(corners)
-        corners = [carla_map.transform_to_geolocation(p) for p in corners]
-        return corners
-
-    def _get_trigger_volume(actor):
-        bb = actor.trigger_volume.extent
-        corners = [carla.Location(x=-bb.x, y=-bb.y),
-                   carla.Location(x=bb.x, y=-bb.y),
-                   carla.Location(x=bb.x, y=bb.y),
-                   carla.Location(x=-bb.x, y=bb.y),
-                   carla.Location(x=-bb.x, y=-bb.y)]
-        corners = [x + actor.trigger_volume.location for x in corners]
-        t = actor.get_transform()
-        t.transform(corners)
-        corners = [carla_map.transform_to_geolocation(p) for p in corners]
-        return corners
-
-    def _split_actors(actors):
-        vehicles = []
-        traffic_lights = []
-        speed_limits = []
-        walkers = []
-        stops = []
-        static_obstacles = []
-        for actor in actors:
-            if 'vehicle' in actor.type_id:
-                vehicles.append(actor)
-            elif 'traffic_light' in actor.type_id:
-                traffic_lights.append(actor)
-            elif 'speed_limit' in actor.type_id:
-                speed_limits.append(actor)
-            elif 'walker' in actor.type_id:
-                walkers.append(actor)
-            elif 'stop' in actor.type_id:
-                stops.append(actor)
-            elif 'static.prop' in actor.type_id:
-                static_obstacles.append(actor)
-
-
-        return (vehicles, traffic_lights, speed_limits, walkers, stops, static_obstacles)
-
-    # Public functions
-    def get_stop_signals(stops):
-        stop_signals_dict = dict()
-        for stop in stops:
-            st_transform = stop.get_transform()
-            location_gnss = carla_map.transform_to_geolocation(st_transform.location)
-            st_dict = {
-                "id": stop.id,
-                "position": [location_gnss.latitude, location_gnss.longitude, location_gnss.altitude],
-                "trigger_volume": [[v.longitude, v.latitude, v.altitude] for v in _get_trigger_volume(stop)]
-            }
-            stop_signals_dict[stop.id] = st_dict
-        return stop_signals_dict
-
-    def get_traffic_lights(traffic_lights):
-        traffic_lights_dict = dict()
-        for traffic_light in traffic_lights:
-            tl_transform = traffic_light.get_transform()
-            location_gnss = carla_map.transform_to_geolocation(tl_transform.location)
-            tl_dict = {
-                "id": traffic_light.id,
-                "state": int(traffic_light.state),
-                "position": [location_gnss.latitude, location_gnss.longitude, location_gnss.altitude],
-                "trigger_volume": [[v.longitude, v.latitude, v.altitude] for v in _get_trigger_volume(traffic_light)]
-            }
-            traffic_lights_dict[traffic_light.id] = tl_dict
-        return traffic_lights_dict
-
-    def get_vehicles(vehicles):
-        vehicles_dict = dict()
-        for vehicle in vehicles:
-            v_transform = vehicle.get_transform()
-            location_gnss = carla_map.transform_to_geolocation(v_transform.location)
-            v_dict = {
-                "id": vehicle.id,
-                "position": [location_gnss.latitude, location_gnss.longitude, location_gnss.altitude],
-                "orientation": [v_transform.rotation.roll, v_transform.rotation.pitch, v_transform.rotation.yaw],
-                "bounding_box": [[v.longitude, v.latitude, v.altitude] for v in _get_bounding_box(vehicle)]
-            }
-            vehicles_dict[vehicle.id] = v_dict
-        return vehicles_dict
+        map_dict[waypoint.road_id][waypoint.lane_id] = waypoints
+    return map_dict
 
-    def get_hero_vehicle(hero_vehicle):
-        if hero_vehicle is None:
-            return hero_vehicle
 
-        hero_waypoint = carla_map.get_waypoint(hero_vehicle.get_location())
-        hero_transform = hero_vehicle.get_transform()
-        location_gnss = carla_map.transform_to_geolocation(hero_transform.location)
+def build_scene_layout(carla_map, precision=LAYOUT_PRECISION):
+    """
+    Computes the static layout of the map.
+    :return: SceneLayout.
+    """
+    map_dict = _lane_waypoints(carla_map, precision)
+
+    lanes = [(road_key, lane_key, waypoints)
+             for road_key, road in map_dict.items() for lane_key, waypoints in road.items()]
+    lane_indptr = np.zeros(len(lanes) + 1, dtype=np.int64)
+    lane_indptr[1:] = np.cumsum([len(waypoints) for _, _, waypoints in lanes])
+    lane_start = {(road_key, lane_key): lane_indptr[l] for l, (road_key, lane_key, _) in enumerate(lanes)}
+
+    count = int(lane_indptr[-1])
+    ids = np.empty(count, dtype=np.uint64)
+    road_ids = np.empty(count, dtype=np.int32)
+    lane_ids = np.empty(count, dtype=np.int32)
+    locations = np.empty((count, 3))
+    rotations = np.empty((count, 3))
+    lane_widths = np.empty(count)
+    left_index = np.full(count, -1, dtype=np.int64)
+    right_index = np.full(count, -1, dtype=np.int64)
+
+    for l, (road_key, lane_key, waypoints) in enumerate(lanes):
+        start, end = lane_indptr[l], lane_indptr[l + 1]
+        road_ids[start:end] = road_key
+        lane_ids[start:end] = lane_key
+        for row, w in enumerate(waypoints, start):
+            t = w.transform
+            ids[row] = w.id
+            locations[row] = (t.location.x, t.location.y, t.location.z)
+            rotations[row] = (t.rotation.pitch, t.rotation.yaw, t.rotation.roll)
+            lane_widths[row] = w.lane_width
+
+        # Waypoint i of a lane is next to waypoint i of the left and right lanes, if they are long
+        # enough.
+        left_lane_key = lane_key - 1 if lane_key - 1 != 0 else lane_key - 2
+        right_lane_key = lane_key + 1 if lane_key + 1 != 0 else lane_key + 2
+        for neighbour_key, index in ((left_lane_key, left_index), (right_lane_key, right_index)):
+            if (road_key, neighbour_key) in lane_start:
+                neighbour_start = lane_start[(road_key, neighbour_key)]
+                neighbour_length = len(map_dict[road_key][neighbour_key])
+                length = min(end - start, neighbour_length)
+                index[start:start + length] = np.arange(neighbour_start, neighbour_start + length)
+
+    # Lane markings are the waypoints shifted by half the lane width, perpendicular to their
+    # direction.
+    shifted = rotations.copy()
+    shifted[:, 1] += 90.0
+    lateral = _rotation_matrices(shifted)[:, :, 0]
+    left_markings = locations - (lane_widths * 0.5)[:, None] * lateral
+    right_markings = locations + (lane_widths * 0.5)[:, None] * lateral
+
+    geo_reference = GeoReference.from_map(carla_map)
+    return SceneLayout(
+        ids=ids,
+        road_ids=road_ids,
+        lane_ids=lane_ids,
+        locations=locations,
+        positions=geolocations(carla_map, locations, geo_reference),
+        orientations=rotations[:, [2, 0, 1]],
+        left_margins=geolocations(carla_map, left_markings, geo_reference),
+        right_margins=geolocations(carla_map, right_markings, geo_reference),
+        lane_indptr=lane_indptr,
+        left_index=left_index,
+        right_index=right_index)
+
+
+def load_scene_layout(carla_map, cache_dir=None, precision=LAYOUT_PRECISION):
+    """
+    Static layout of the map, computed the first time and then loaded from the cache.
+    :param cache_dir: directory of the cached layouts, ~/.cache/carla/scene_layout by default.
+    :return: SceneLayout.
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    path = os.path.join(cache_dir, '{}_{:g}.npz'.format(opendrive_hash(carla_map), precision))
+    if os.path.exists(path):
+        try:
+            return SceneLayout.load(path)
+        except (ValueError, KeyError, IOError):
+            pass
+
+    layout = build_scene_layout(carla_map, precision)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        layout.save(path)
+    except OSError:
+        pass
+    return layout
+
+
+def get_scene_layout(carla_map, cache_dir=None):
+    """
+    Function to extract the full scene layout to be used as a full scene description to be
+    given to the user
+    :return: a dictionary describing the scene.
+    """
+    return load_scene_layout(carla_map, cache_dir).to_dict()
+
+
+# ==================================================================================================
+# -- dynamic objects -------------------------------------------------------------------------------
+# ==================================================================================================
+
+def _actor_category(type_id):
+    if 'vehicle' in type_id:
+        return 'vehicles'
+    elif 'traffic_light' in type_id:
+        return 'traffic_lights'
+    elif 'speed_limit' in type_id:
+        return 'speed_limits'
+    elif 'walker' in type_id:
+        return 'walkers'
+    elif 'stop' in type_id:
+        return 'stop_signs'
+    elif 'static.prop' in type_id:
+        return 'static_obstacles'
+    return None
+
+
+class DynamicObjectExtractor(object):
+    """
+    Extracts the dynamic objects of a world as columnar arrays, the transforms of all the actors
+    being read from a single snapshot. Type, bounding box and trigger volume of each actor are read
+    only the first time the actor is seen.
+    """
 
-        hero_vehicle_dict = {
-            "id": hero_vehicle.id,
-            "position": [location_gnss.latitude, location_gnss.longitude, location_gnss.altitude],
+    CATEGORIES = ('vehicles', 'walkers', 'traffic_lights', 'stop_signs', 'speed_limits',
+                  'static_obstacles')
+
+    def __init__(self, carla_world, carla_map):
+        self.world = carla_world
+        self.map = carla_map
+        self.geo_reference = GeoReference.from_map(carla_map)
+        self._geo_checked = False
+        self.actors = {}
+        self.categories = {}
+        # Local corners of the bounding boxes (4, 3) and trigger volumes (5, 3).
+        self.local_corners = {}
+        self.speeds = {}
+        self.heroes = set()
+
+    def _register(self, actors):
+        for actor in actors:
+            category = _actor_category(actor.type_id)
+            self.actors[actor.id] = actor
+            self.categories[actor.id] = category
+            if category in ('vehicles', 'walkers'):
+                bb = actor.bounding_box.extent
+                self.local_corners[actor.id] = np.array([
+                    [-bb.x, -bb.y, 0.0], [bb.x, -bb.y, 0.0], [bb.x, bb.y, 0.0], [-bb.x, bb.y, 0.0]])
+                if category == 'vehicles' and actor.attributes.get('role_name') == 'hero':
+                    self.heroes.add(actor.id)
+            elif category in ('traffic_lights', 'stop_signs'):
+                bb = actor.trigger_volume.extent
+                offset = actor.trigger_volume.location
+                self.local_corners[actor.id] = np.array([
+                    [-bb.x, -bb.y, 0.0], [bb.x, -bb.y, 0.0], [bb.x, bb.y, 0.0], [-bb.x, bb.y, 0.0],
+                    [-bb.x, -bb.y, 0.0]]) + [offset.x, offset.y, offset.z]
+            elif category == 'speed_limits':
+                self.speeds[actor.id] = int(actor.type_id.split('.')[2])
+
+    def _geolocations(self, locations):
+        if not self._geo_checked and len(locations):
+            if not self.geo_reference.check(self.map, locations):
+                self.geo_reference = None
+            self._geo_checked = True
+        if self.geo_reference is None:
+            return geolocations(self.map, locations, GeoReference.from_map(self.map))
+        return self.geo_reference.transform(locations)
+
+    def extract(self, snapshot=None):
+        """
+        :return: dictionary {category: {column: array}} with the columns
+            - ids (N,), positions (N, 3) latitude, longitude, altitude, for every category.
+            - orientations (N, 3) roll, pitch, yaw and bounding_box (N, 4, 3) longitude,
+              latitude, altitude, for the vehicles and walkers.
+            - trigger_volume (N, 5, 3) longitude, latitude, altitude for the traffic lights and
+              stop signs, states (N,) for the traffic lights, speeds (N,) for the speed limits.
+            and 'hero_vehicle', the ids of the hero vehicles.
+        """
+        if snapshot is None:
+            snapshot = self.world.get_snapshot()
+        actor_snapshots = list(snapshot)
+        new_ids = [a.id for a in actor_snapshots if a.id not in self.categories]
+        if new_ids:
+            self._register(self.world.get_actors(new_ids))
+            for actor_id in new_ids:
+                self.categories.setdefault(actor_id, None)
+
+        actor_snapshots = [a for a in actor_snapshots if self.categories[a.id] is not None]
+        count = len(actor_snapshots)
+        ids = np.empty(count, dtype=np.int64)
+        transforms = np.empty((count, 2, 3))
+        for row, a in enumerate(actor_snapshots):
+            t = a.get_transform()
+            ids[row] = a.id
+            transforms[row] = ((t.location.x, t.location.y, t.location.z),
+                               (t.rotation.pitch, t.rotation.yaw, t.rotation.roll))
+        categories = np.array([self.categories[actor_id] for actor_id in ids.tolist()], dtype=object)
+        locations = transforms[:, 0]
+        rotations = transforms[:, 1]
+        positions = self._geolocations(locations)
+
+        result = {}
+        for category in self.CATEGORIES:
+            rows = np.flatnonzero(categories == category)
+            category_ids = ids[rows]
+            columns = {'ids': category_ids, 'positions': positions[rows]}
+            if category in ('vehicles', 'walkers', 'traffic_lights', 'stop_signs'):
+                corner_count = 4 if category in ('vehicles', 'walkers') else 5
+                corners = np.array([self.local_corners[actor_id] for actor_id in category_ids.tolist()])
+                corners = corners.reshape(len(rows), corner_count, 3)
+                world_corners = np.einsum('nij,nkj->nki', _rotation_matrices(rotations[rows]), corners) + \
+                    locations[rows][:, None, :]
+                geo = self._geolocations(world_corners.reshape(-1, 3)).reshape(world_corners.shape)
+                # Corners are given as longitude, latitude, altitude.
+                geo = geo[:, :, [1, 0, 2]]
+                if category in ('vehicles', 'walkers'):
+                    columns['orientations'] = rotations[rows][:, [2, 0, 1]]
+                    columns['bounding_box'] = geo
+                else:
+                    columns['trigger_volume'] = geo
+            if category == 'traffic_lights':
+                columns['states'] = np.array([int(self.actors[actor_id].state)
+                                              for actor_id in category_ids.tolist()], dtype=np.int32)
+            if category == 'speed_limits':
+                columns['speeds'] = np.array([self.speeds[actor_id] for actor_id in category_ids.tolist()],
+                                             dtype=np.int32)
+            result[category] = columns
+
+        result['hero_vehicle'] = np.array([actor_id for actor_id in result['vehicles']['ids'].tolist()
+                                           if actor_id in self.heroes], dtype=np.int64)
+        return result
+
+    def hero_vehicle(self, objects):
+        """
+        Dictionary of a random hero vehicle of the extracted objects, None if there is none.
+        """
+        if len(objects['hero_vehicle']) == 0:
+            return None
+        hero = self.actors[random.choice(objects['hero_vehicle'].tolist())]
+        row = int(np.flatnonzero(objects['vehicles']['ids'] == hero.id)[0])
+        position = objects['vehicles']['positions'][row].tolist()
+        hero_waypoint = self.map.get_waypoint(hero.get_location())
+        return {
+            "id": hero.id,
+            "position": position,
             "road_id": hero_waypoint.road_id,
             "lane_id": hero_waypoint.lane_id
         }
-        return hero_vehicle_dict
-
-    def get_walkers(walkers):
-        walkers_dict = dict()
-        for walker in walkers:
-            w_transform = walker.get_transform()
-            location_gnss = carla_map.transform_to_geolocation(w_transform.location)
-            w_dict = {
-                "id": walker.id,
-                "position": [location_gnss.latitude, location_gnss.longitude, location_gnss.altitude],
-                "orientation": [w_transform.rotation.roll, w_transform.rotation.pitch, w_transform.rotation.yaw],
-                "bounding_box": [[v.longitude, v.latitude, v.altitude] for v in _get_bounding_box(walker)]
-            }
-            walkers_dict[walker.id] = w_dict
-        return walkers_dict
-
-    def get_speed_limits(speed_limits):
-        speed_limits_dict = dict()
-        for speed_limit in speed_limits:
-            sl_transform = speed_limit.get_transform()
-            location_gnss = carla_map.transform_to_geolocation(sl_transform.location)
-            sl_dict = {
-                "id": speed_limit.id,
-                "position": [location_gnss.latitude, location_gnss.longitude, location_gnss.altitude],
-                "speed": int(speed_limit.type_id.split('.')[2])
-            }
-            speed_limits_dict[speed_limit.id] = sl_dict
-        return speed_limits_dict
-
-    def get_static_obstacles(static_obstacles):
-        static_obstacles_dict = dict()
-        for static_prop in static_obstacles:
-            sl_transform = static_prop.get_transform()
-            location_gnss = carla_map.transform_to_geolocation(sl_transform.location)
-            sl_dict = {
-                "id": static_prop.id,
-                "position": [location_gnss.latitude, location_gnss.longitude, location_gnss.altitude]
-            }
-            static_obstacles_dict[static_prop.id] = sl_dict
-        return static_obstacles_dict
 
-    actors = carla_world.get_actors()
-    vehicles, traffic_lights, speed_limits, walkers, stops, static_obstacles = _split_actors(actors)
 
-    hero_vehicles = [vehicle for vehicle in vehicles if
-                     'vehicle' in vehicle.type_id and vehicle.attributes['role_name'] == 'hero']
-    hero = None if len(hero_vehicles) == 0 else random.choice(hero_vehicles)
+def _objects_dict(columns, keys):
+    """
+    Dictionary {id: {"id": id, key: value, ...}} of columnar objects, keys being (key, column) pairs.
+    """
+    ids = columns['ids'].tolist()
+    values = [(key, columns[column].tolist()) for key, column in keys]
+    return {actor_id: dict([("id", actor_id)] + [(key, column[row]) for key, column in values])
+            for row, actor_id in enumerate(ids)}
+
+
+def get_dynamic_objects(carla_world, carla_map, extractor=None):
+    """
+    Dynamic objects of the world as dictionaries. Pass the same DynamicObjectExtractor across calls
+    to read the static attributes of the actors only once.
+    """
+    if extractor is None:
+        extractor = DynamicObjectExtractor(carla_world, carla_map)
+    objects = extractor.extract()
 
+    moving = [("position", 'positions'), ("orientation", 'orientations'), ("bounding_box", 'bounding_box')]
     return {
-        'vehicles': get_vehicles(vehicles),
-        'hero_vehicle': get_hero_vehicle(hero),
-        'walkers': get_walkers(walkers),
-        'traffic_lights': get_traffic_lights(traffic_lights),
-        'stop_signs': get_stop_signals(stops),
-        'speed_limits': get_speed_limits(speed_limits),
-        'static_obstacles': get_static_obstacles(static_obstacles)
+        'vehicles': _objects_dict(objects['vehicles'], moving),
+        'hero_vehicle': extractor.hero_vehicle(objects),
+        'walkers': _objects_dict(objects['walkers'], moving),
+        'traffic_lights': _objects_dict(objects['traffic_lights'], [
+            ("state", 'states'), ("position", 'positions'), ("trigger_volume", 'trigger_volume')]),
+        'stop_signs': _objects_dict(objects['stop_signs'], [
+            ("position", 'positions'), ("trigger_volume", 'trigger_volume')]),
+        'speed_limits': _objects_dict(objects['speed_limits'], [
+            ("position", 'positions'), ("speed", 'speeds')]),
+        'static_obstacles': _objects_dict(objects['static_obstacles'], [("position", 'positions')])
     }
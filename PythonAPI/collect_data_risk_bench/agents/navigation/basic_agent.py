@@ -9,6 +9,7 @@ waypoints and avoiding other vehicles. The agent also responds to traffic lights
 It can also make use of the global route planner to follow a specifed route
 """
 
+import numpy as np
 import carla
 from shapely.geometry import Polygon
 
@@ -17,6 +18,7 @@ from agents.navigation.global_route_planner import GlobalRoutePlanner
 from agents.tools.misc import (get_speed, is_within_distance,
                                get_trafficlight_trigger_location,
                                compute_distance)
+from agents.tools.world_snapshot import WorldSnapshotCache, VEHICLE
 
 
 class BasicAgent(object):
@@ -102,6 +104,9 @@ class BasicAgent(object):
         self._lights_list = self._world.get_actors().filter("*traffic_light*")
         self._lights_map = {}  # Dictionary mapping a traffic light to a wp corrspoing to its trigger volume location
 
+        # Per-tick cache of the dynamic actors, shared by all the hazard checks
+        self._perception = WorldSnapshotCache(self._world)
+
     def add_emergency_stop(self, control):
         """
         Overwrites the throttle a brake values of a control to perform an emergency stop.
@@ -190,14 +195,11 @@ class BasicAgent(object):
         """Execute one step of navigation."""
         hazard_detected = False
 
-        # Retrieve all relevant actors
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
-
         vehicle_speed = get_speed(self._vehicle) / 3.6
 
-        # Check for possible vehicle obstacles
+        # Check for possible vehicle obstacles, using the actors of the snapshot cache
         max_vehicle_distance = self._base_vehicle_threshold + self._speed_ratio * vehicle_speed
-        affected_by_vehicle, _, _ = self._vehicle_obstacle_detected(vehicle_list, max_vehicle_distance)
+        affected_by_vehicle, _, _ = self._vehicle_obstacle_detected(None, max_vehicle_distance)
         if affected_by_vehicle:
             hazard_detected = True
 
@@ -312,8 +314,8 @@ class BasicAgent(object):
         """
         Method to check if there is a vehicle in front of the agent blocking its path.
 
-            :param vehicle_list (list of carla.Vehicle): list contatining vehicle objects.
-                If None, all vehicle in the scene are used
+            :param vehicle_list (list of carla.Vehicle): list contatining vehicle objects,
+                or array of rows of the snapshot cache. If None, all vehicle in the scene are used
             :param max_distance: max freespace to check for obstacles.
                 If None, the base threshold value is used
         """
@@ -345,9 +347,6 @@ class BasicAgent(object):
         if self._ignore_vehicles:
             return (False, None, -1)
 
-        if not vehicle_list:
-            vehicle_list = self._world.get_actors().filter("*vehicle*")
-
         if not max_distance:
             max_distance = self._base_vehicle_threshold
 
@@ -355,6 +354,12 @@ class BasicAgent(object):
         ego_location = ego_transform.location
         ego_wpt = self._map.get_waypoint(ego_location)
 
+        if vehicle_list is None or len(vehicle_list) == 0:
+            self._perception.update()
+            vehicle_list = self._perception.query_radius(
+                ego_location, max_distance + self._vehicle.bounding_box.extent.x,
+                kind=VEHICLE, exclude_id=self._vehicle.id)
+
         # Get the right offset
         if ego_wpt.lane_id < 0 and lane_offset != 0:
             lane_offset *= -1
@@ -370,11 +375,11 @@ class BasicAgent(object):
         # Get the route bounding box
         route_polygon = get_route_polygon()
 
-        for target_vehicle in vehicle_list:
+        for target_vehicle, target_transform, in_cone in self._obstacle_candidates(
+                vehicle_list, ego_location, ego_front_transform, max_distance, [low_angle_th, up_angle_th]):
             if target_vehicle.id == self._vehicle.id:
                 continue
 
-            target_transform = target_vehicle.get_transform()
             if target_transform.location.distance(ego_location) > max_distance:
                 continue
 
@@ -384,12 +389,12 @@ class BasicAgent(object):
             if (use_bbs or target_wpt.is_junction) and route_polygon:
 
                 target_bb = target_vehicle.bounding_box
-                target_vertices = target_bb.get_world_vertices(target_vehicle.get_transform())
+                target_vertices = target_bb.get_world_vertices(target_transform)
                 target_list = [[v.x, v.y, v.z] for v in target_vertices]
                 target_polygon = Polygon(target_list)
 
                 if route_polygon.intersects(target_polygon):
-                    return (True, target_vehicle, compute_distance(target_vehicle.get_location(), ego_location))
+                    return (True, target_vehicle, compute_distance(target_transform.location, ego_location))
 
             # Simplified approach, using only the plan waypoints (similar to TM)
             else:
@@ -401,19 +406,44 @@ class BasicAgent(object):
                     if target_wpt.road_id != next_wpt.road_id or target_wpt.lane_id != next_wpt.lane_id  + lane_offset:
                         continue
 
-                target_forward_vector = target_transform.get_forward_vector()
-                target_extent = target_vehicle.bounding_box.extent.x
-                target_rear_transform = target_transform
-                target_rear_transform.location -= carla.Location(
-                    x=target_extent * target_forward_vector.x,
-                    y=target_extent * target_forward_vector.y,
-                )
-
-                if is_within_distance(target_rear_transform, ego_front_transform, max_distance, [low_angle_th, up_angle_th]):
+                if in_cone is None:
+                    target_forward_vector = target_transform.get_forward_vector()
+                    target_extent = target_vehicle.bounding_box.extent.x
+                    target_rear_transform = target_transform
+                    target_rear_transform.location -= carla.Location(
+                        x=target_extent * target_forward_vector.x,
+                        y=target_extent * target_forward_vector.y,
+                    )
+                    in_cone = is_within_distance(
+                        target_rear_transform, ego_front_transform, max_distance, [low_angle_th, up_angle_th])
+
+                if in_cone:
                     return (True, target_vehicle, compute_distance(target_transform.location, ego_transform.location))
 
         return (False, None, -1)
 
+    def _obstacle_candidates(self, vehicle_list, ego_location, ego_front_transform, max_distance, angle_interval):
+        """
+        Yields the (actor, transform, in_cone) triplets checked by '_vehicle_obstacle_detected'.
+        For rows of the snapshot cache, the distance and angle checks are computed at once
+        for all the candidates, and no call is made to the server. For actor lists, in_cone
+        is None and the check is done one actor at a time.
+        """
+        if not isinstance(vehicle_list, np.ndarray):
+            for target_vehicle in vehicle_list:
+                yield target_vehicle, target_vehicle.get_transform(), None
+            return
+
+        perception = self._perception
+        center = np.array([ego_location.x, ego_location.y, ego_location.z])
+        rows = vehicle_list[np.linalg.norm(perception.locations[vehicle_list] - center, axis=1) <= max_distance]
+        in_cone = perception.query_cone(rows, ego_front_transform, max_distance, angle_interval, rear=True)
+        for row, inside in zip(rows, in_cone):
+            target_vehicle = perception.actor(row)
+            if target_vehicle is None:
+                continue
+            yield target_vehicle, perception.transform(row), bool(inside)
+
     def _generate_lane_change_path(self, waypoint, direction='left', distance_same_lane=10,
                                 distance_other_lane=25, lane_change_distance=25,
                                 check=True, lane_changes=1, step_distance=2):
@@ -16,6 +16,7 @@ from agents.navigation.local_planner import RoadOption
 from agents.navigation.behavior_types import Cautious, Aggressive, Normal
 
 from agents.tools.misc import get_speed, positive, is_within_distance, compute_distance
+from agents.tools.world_snapshot import VEHICLE, WALKER, TRAFFIC_LIGHT
 
 class BehaviorAgent(BasicAgent):
     """
@@ -80,12 +81,21 @@ class BehaviorAgent(BasicAgent):
         if self._incoming_direction is None:
             self._incoming_direction = RoadOption.LANEFOLLOW
 
+    def _actor_speed(self, vehicle):
+        """
+        Speed of a vehicle in Km/h, from the snapshot cache when it holds
+        the vehicle, from the simulator otherwise.
+
+            :param vehicle: carla.Vehicle
+        """
+        row = self._perception.row(vehicle.id)
+        return get_speed(vehicle) if row is None else self._perception.speed(row)
+
     def traffic_light_manager(self):
         """
         This method is in charge of behaviors for red lights.
         """
-        actor_list = self._world.get_actors()
-        lights_list = actor_list.filter("*traffic_light*")
+        lights_list = self._perception.actors(self._perception.rows_of_kind(TRAFFIC_LIGHT))
         affected, _ = self._affected_by_traffic_light(lights_list)
 
         return affected
@@ -96,7 +106,7 @@ class BehaviorAgent(BasicAgent):
 
             :param location: current location of the agent
             :param waypoint: current waypoint of the agent
-            :param vehicle_list: list of all the nearby vehicles
+            :param vehicle_list: rows of the snapshot cache of all the nearby vehicles
         """
 
         left_turn = waypoint.left_lane_marking.lane_change
@@ -107,7 +117,7 @@ class BehaviorAgent(BasicAgent):
 
         behind_vehicle_state, behind_vehicle, _ = self._vehicle_obstacle_detected(vehicle_list, max(
             self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, low_angle_th=160)
-        if behind_vehicle_state and self._speed < get_speed(behind_vehicle):
+        if behind_vehicle_state and self._speed < self._actor_speed(behind_vehicle):
             if (right_turn == carla.LaneChange.Right or right_turn ==
                     carla.LaneChange.Both) and waypoint.lane_id * right_wpt.lane_id > 0 and right_wpt.lane_type == carla.LaneType.Driving:
                 new_vehicle_state, _, _ = self._vehicle_obstacle_detected(vehicle_list, max(
@@ -140,9 +150,8 @@ class BehaviorAgent(BasicAgent):
             :return distance: distance to nearby vehicle
         """
 
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
-        def dist(v): return v.get_location().distance(waypoint.transform.location)
-        vehicle_list = [v for v in vehicle_list if dist(v) < 45 and v.id != self._vehicle.id]
+        vehicle_list = self._perception.query_radius(
+            waypoint.transform.location, 45, kind=VEHICLE, exclude_id=self._vehicle.id)
 
         if self._direction == RoadOption.CHANGELANELEFT:
             vehicle_state, vehicle, distance = self._vehicle_obstacle_detected(
@@ -177,9 +186,7 @@ class BehaviorAgent(BasicAgent):
             :return distance: distance to nearby walker
         """
 
-        walker_list = self._world.get_actors().filter("*walker.pedestrian*")
-        def dist(w): return w.get_location().distance(waypoint.transform.location)
-        walker_list = [w for w in walker_list if dist(w) < 10]
+        walker_list = self._perception.query_radius(waypoint.transform.location, 10, kind=WALKER)
 
         if self._direction == RoadOption.CHANGELANELEFT:
             walker_state, walker, distance = self._vehicle_obstacle_detected(walker_list, max(
@@ -204,7 +211,7 @@ class BehaviorAgent(BasicAgent):
             :return control: carla.VehicleControl
         """
 
-        vehicle_speed = get_speed(vehicle)
+        vehicle_speed = self._actor_speed(vehicle)
         delta_v = max(1, (self._speed - vehicle_speed) / 3.6)
         ttc = distance / delta_v if delta_v != 0 else distance / np.nextafter(0., 1.)
 
@@ -244,6 +251,7 @@ class BehaviorAgent(BasicAgent):
             :return control: carla.VehicleControl
         """
         self._update_information()
+        self._perception.update()
 
         control = None
         if self._behavior.tailgate_counter > 0:
@@ -0,0 +1,260 @@
+# Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+This module implements a per-tick cache of the dynamic actors of the world.
+The state of every actor is read once per frame from a single world snapshot
+and stored as NumPy arrays, so that the proximity queries of the agents are
+answered without any additional call to the server.
+"""
+
+import math
+import numpy as np
+import carla
+
+VEHICLE = 0
+WALKER = 1
+TRAFFIC_LIGHT = 2
+OTHER = 3
+
+
+def actor_kind(type_id):
+    """
+    Map a blueprint id to one of the actor kinds handled by the cache.
+
+        :param type_id: blueprint id of the actor, e.g. 'vehicle.tesla.model3'
+        :return: VEHICLE, WALKER, TRAFFIC_LIGHT or OTHER
+    """
+    if type_id.startswith('vehicle.'):
+        return VEHICLE
+    if type_id.startswith('walker.pedestrian'):
+        return WALKER
+    if type_id.startswith('traffic.traffic_light'):
+        return TRAFFIC_LIGHT
+    return OTHER
+
+
+def _actor_state(actor_snapshot):
+    """Location, rotation and velocity of an actor snapshot, as nested tuples"""
+    transform = actor_snapshot.get_transform()
+    velocity = actor_snapshot.get_velocity()
+    location, rotation = transform.location, transform.rotation
+    return ((location.x, location.y, location.z),
+            (rotation.pitch, rotation.yaw, rotation.roll),
+            (velocity.x, velocity.y, velocity.z))
+
+
+class WorldSnapshotCache(object):
+    """
+    WorldSnapshotCache holds the ids, kinds, positions, rotations, velocities and
+    bounding box extents of all the actors of the world for the current frame.
+    The static part of an actor (its handle, kind and extent) is fetched only
+    once, when the actor first shows up in a snapshot. Positions are bucketed
+    in a uniform grid so that radius queries only look at the nearby cells.
+    """
+
+    def __init__(self, world, cell_size=20.0):
+        """
+        Constructor method.
+
+            :param world: carla.World (or any object providing get_snapshot and get_actors)
+            :param cell_size: side of the grid cells used to index positions, in meters
+        """
+        self._world = world
+        self._cell_size = cell_size
+        self._frame = None
+
+        # Static information, filled once per actor
+        self._actors = {}
+        self._kinds = {}
+        self._extents = {}
+
+        # Per-frame arrays, one row per actor
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.kinds = np.zeros(0, dtype=np.int8)
+        self.locations = np.zeros((0, 3))
+        self.rotations = np.zeros((0, 3))
+        self.velocities = np.zeros((0, 3))
+        self.extents = np.zeros((0, 3))
+        self._rows = {}
+
+        # Grid index: sorted cell keys and the rows belonging to them
+        self._cell_keys = np.zeros(0, dtype=np.int64)
+        self._cell_order = np.zeros(0, dtype=np.int64)
+
+    @property
+    def frame(self):
+        """Frame of the snapshot the cache was last built from"""
+        return self._frame
+
+    def update(self, snapshot=None):
+        """
+        Rebuild the cache from a world snapshot. Calling it several times
+        within the same frame is cheap, as only the first call does any work.
+        Only the transforms and velocities are read on every frame, the
+        per-actor information is refreshed when actors spawn or are destroyed.
+
+            :param snapshot: carla.WorldSnapshot. If None, the current one is requested to the world
+        """
+        if snapshot is None:
+            snapshot = self._world.get_snapshot()
+        if snapshot.frame == self._frame:
+            return
+        self._frame = snapshot.frame
+
+        actor_snapshots = list(snapshot)
+        count = len(actor_snapshots)
+        ids = np.fromiter((a.id for a in actor_snapshots), dtype=np.int64, count=count)
+        if not np.array_equal(ids, self.ids):
+            self._refresh_actors(ids)
+
+        state = np.array([_actor_state(a) for a in actor_snapshots]).reshape(count, 3, 3)
+        self.locations = state[:, 0]
+        self.rotations = state[:, 1]
+        self.velocities = state[:, 2]
+        self._build_grid()
+
+    @property
+    def yaws(self):
+        """Yaw of every row, in degrees"""
+        return self.rotations[:, 1]
+
+    def _refresh_actors(self, ids):
+        """Register the spawned actors, forget the destroyed ones and rebuild the per-actor arrays"""
+        new_ids = [i for i in ids.tolist() if i not in self._kinds]
+        if new_ids:
+            self._register(new_ids)
+
+        if len(self._kinds) > len(ids):
+            alive = set(ids.tolist())
+            for actor_id in [i for i in self._kinds if i not in alive]:
+                self._actors.pop(actor_id, None)
+                self._kinds.pop(actor_id, None)
+                self._extents.pop(actor_id, None)
+
+        self.ids = ids
+        self.kinds = np.array([self._kinds.get(i, OTHER) for i in ids.tolist()], dtype=np.int8)
+        self.extents = np.array([self._extents.get(i, (0.0, 0.0, 0.0)) for i in ids.tolist()]).reshape(len(ids), 3)
+        self._rows = {actor_id: row for row, actor_id in enumerate(ids.tolist())}
+
+    def _register(self, actor_ids):
+        """Fetch the static information of the actors seen for the first time"""
+        for actor in self._world.get_actors(actor_ids):
+            kind = actor_kind(actor.type_id)
+            self._actors[actor.id] = actor
+            self._kinds[actor.id] = kind
+            if kind in (VEHICLE, WALKER):
+                extent = actor.bounding_box.extent
+                self._extents[actor.id] = (extent.x, extent.y, extent.z)
+        # Actors without a handle (e.g. the spectator) are still indexed
+        for actor_id in actor_ids:
+            self._kinds.setdefault(actor_id, OTHER)
+
+    def _cells(self, xy):
+        """Integer grid keys of an (N, 2) array of positions"""
+        cells = np.floor(xy / self._cell_size).astype(np.int64)
+        return cells[:, 0] * 1000003 + cells[:, 1]
+
+    def _build_grid(self):
+        """Sort the rows by grid cell, to answer radius queries with binary searches"""
+        keys = self._cells(self.locations[:, :2])
+        self._cell_order = np.argsort(keys, kind='stable')
+        self._cell_keys = keys[self._cell_order]
+
+    def _grid_candidates(self, x, y, radius):
+        """Rows whose grid cell overlaps the square of side 2 * radius around (x, y)"""
+        cx0 = int(math.floor((x - radius) / self._cell_size))
+        cx1 = int(math.floor((x + radius) / self._cell_size))
+        cy0 = int(math.floor((y - radius) / self._cell_size))
+        cy1 = int(math.floor((y + radius) / self._cell_size))
+        chunks = []
+        for cx in range(cx0, cx1 + 1):
+            low = np.searchsorted(self._cell_keys, cx * 1000003 + cy0, side='left')
+            high = np.searchsorted(self._cell_keys, cx * 1000003 + cy1, side='right')
+            if high > low:
+                chunks.append(self._cell_order[low:high])
+        if not chunks:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(chunks)
+
+    def row(self, actor_id):
+        """Row of the given actor id, or None if it isn't part of the current frame"""
+        return self._rows.get(actor_id)
+
+    def actor(self, row):
+        """carla.Actor handle of a row"""
+        return self._actors.get(int(self.ids[row]))
+
+    def actors(self, rows):
+        """List of carla.Actor handles of several rows"""
+        return [self.actor(r) for r in rows]
+
+    def transform(self, row):
+        """carla.Transform of a row, built from the snapshot"""
+        x, y, z = self.locations[row]
+        pitch, yaw, roll = self.rotations[row]
+        return carla.Transform(carla.Location(x=float(x), y=float(y), z=float(z)),
+                               carla.Rotation(pitch=float(pitch), yaw=float(yaw), roll=float(roll)))
+
+    def speed(self, row):
+        """Speed of a row, in Km/h"""
+        return 3.6 * float(np.linalg.norm(self.velocities[row]))
+
+    def rows_of_kind(self, kind):
+        """Rows of all the actors of a given kind"""
+        return np.flatnonzero(self.kinds == kind)
+
+    def query_radius(self, location, radius, kind=None, exclude_id=None):
+        """
+        Rows of the actors within a certain distance of a location, closest first.
+
+            :param location: carla.Location used as center
+            :param radius: maximum distance, in meters
+            :param kind: if given, only actors of this kind are returned
+            :param exclude_id: actor id to leave out, usually the ego vehicle
+            :return: array of rows
+        """
+        rows = self._grid_candidates(location.x, location.y, radius)
+        if kind is not None:
+            rows = rows[self.kinds[rows] == kind]
+        if exclude_id is not None:
+            rows = rows[self.ids[rows] != exclude_id]
+        center = np.array([location.x, location.y, location.z])
+        dist = np.linalg.norm(self.locations[rows] - center, axis=1)
+        keep = dist < radius
+        rows, dist = rows[keep], dist[keep]
+        return rows[np.argsort(dist, kind='stable')]
+
+    def query_cone(self, rows, reference_transform, max_distance, angle_interval, rear=False):
+        """
+        Vectorised version of 'is_within_distance', applied to several rows at once.
+
+            :param rows: rows to check
+            :param reference_transform: carla.Transform of the reference object
+            :param max_distance: maximum allowed distance
+            :param angle_interval: only locations between [min, max] angles are kept
+            :param rear: if True, the rear of each actor is used instead of its center
+            :return: boolean mask, aligned with rows
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        targets = self.locations[rows, :2]
+        if rear:
+            yaw = np.radians(self.yaws[rows])
+            ext = self.extents[rows, 0]
+            targets = targets - np.stack([ext * np.cos(yaw), ext * np.sin(yaw)], axis=1)
+
+        ref = reference_transform.location
+        vectors = targets - np.array([ref.x, ref.y])
+        norms = np.linalg.norm(vectors, axis=1)
+
+        fwd = reference_transform.get_forward_vector()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cos = (vectors[:, 0] * fwd.x + vectors[:, 1] * fwd.y) / norms
+        angles = np.degrees(np.arccos(np.clip(cos, -1., 1.)))
+
+        inside = (norms <= max_distance)
+        if angle_interval:
+            inside &= (angle_interval[0] < angles) & (angles < angle_interval[1])
+        return inside | (norms < 0.001)
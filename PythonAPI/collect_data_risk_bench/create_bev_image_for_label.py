@@ -8,6 +8,7 @@ from bird_eye_view.Mask import PixelDimensions, square_fitting_rect_at_any_rotat
 from bird_eye_view.BirdViewProducer import BirdViewProducer, BirdView
 import math
 import cv2 
+from util.dataset_catalog import DatasetCatalog
 
 
 
@@ -85,14 +86,13 @@ if __name__ == "__main__":
 
     all_data = []
     scenario_list = [ "interactive", "non-interactive", "collision", "obstacle"]
-    for scenario in scenario_list:
-        basic_scenario_list = os.listdir(os.path.join(dataset_dir, scenario))
-        for basic_scenario in basic_scenario_list:
-            variant_scenario_list = os.listdir(os.path.join(dataset_dir, scenario, basic_scenario, "variant_scenario"))
-            for variant_scenario in variant_scenario_list:
-                path = os.path.join(dataset_dir, scenario, basic_scenario, "variant_scenario", variant_scenario )
-                all_data.append(path)
-                break
+    # first variant of every basic scenario, from the catalog of the dataset
+    with DatasetCatalog.open(dataset_dir) as catalog:
+        basic_scenarios = set()
+        for episode in catalog.episodes(scenario_type=scenario_list):
+            if (episode["scenario_type"], episode["basic_scenario"]) not in basic_scenarios:
+                basic_scenarios.add((episode["scenario_type"], episode["basic_scenario"]))
+                all_data.append(episode.abspath)
 
     # print(len(all_data)) # total 7218
 
@@ -1,6 +1,10 @@
 import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from util.dataset_catalog import DatasetCatalog
 # Find bad variant scenario 
-# You need to manually remove it 
+# You need to manually remove it, the printed episodes are forgotten by the catalog of the dataset
 
 if __name__ =="__main__":
     import argparse
@@ -14,29 +18,8 @@ if __name__ =="__main__":
     args = parser.parse_args()
     scenario = args.scenario_type
     if os.path.exists(f"./{scenario}"):
-        basic_scenario_list = sorted(os.listdir(f"./{scenario}"))
-
-        for basic_scenario in basic_scenario_list:
-            
-            town_id = basic_scenario.split("_")[0]
-            if town_id[0] =="A" or town_id[0] =="B":
-                town = town_id
-            elif town_id[:2] == "10":
-                town = "Town10HD"
-            else:
-                town = f"Town0{town_id[0]}"
-            variant_scenario_list = sorted(os.listdir(f"./{scenario}/{basic_scenario}/variant_scenario"))
-            for variant_scenario in variant_scenario_list:
-
-            
-
-                weather = variant_scenario.split("_")[0]
-                actor = variant_scenario.split("_")[1]
-
-                # check random_seed exists? 
-                if not os.path.exists(f"./{scenario}/{basic_scenario}/variant_scenario/{variant_scenario}/seed.txt"):
-                    print(f"rm -r ./{scenario}/{basic_scenario}/variant_scenario/{variant_scenario}")
-                
-     
-        
-                    
+        # variant scenarios without seed.txt, listed by the catalog of the dataset
+        with DatasetCatalog.open(".") as catalog:
+            for episode in catalog.episodes(scenario_type=scenario, has_seed=False):
+                print(f"rm -r ./{episode['path']}")
+                catalog.remove(episode['path'])
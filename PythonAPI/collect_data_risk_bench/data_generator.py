@@ -53,14 +53,18 @@ import re
 import matplotlib
 matplotlib.use('Agg')
 from PIL import Image, ImageDraw
-import pandas as pd
 import pygame
 import numpy as np
 from util.KeyboardControl import KeyboardControl
 from util.hud import HUD
 from util.sensors import CollisionSensor, LaneInvasionSensor, GnssSensor, IMUSensor, RadarSensor, CameraManager
 from util.data_collection import Data_Collection
-from torchvision.ops.boxes import masks_to_boxes
+from util.instance_storage import InstanceEncoder
+from util import profiling
+from util.sensor_profile import SensorProfile
+from util.actor_index import ActorIndex
+from models.tracks import nearby_tracks
+from util.actor_state import ActorStateCollector, VEHICLE as ACTOR_VEHICLE, PEDESTRIAN as ACTOR_PEDESTRIAN, OBSTACLE as ACTOR_OBSTACLE
 from torchvision import transforms
         
 # ==============================================================================
@@ -128,6 +132,7 @@ class World(object):
         self.ego_data = {}
         self.save_mode = not args.no_save
         self.inference_mode = args.inference
+        self.sensor_profile = SensorProfile.load(args.sensor_profile) if args.sensor_profile else SensorProfile()
         
         
         self.restart(self.args, seeds)
@@ -222,7 +227,7 @@ class World(object):
         self.gnss_sensor = GnssSensor(self.player, self.ego_data)
         self.imu_sensor = IMUSensor(self.player, self.ego_data)
         self.camera_manager = CameraManager(
-            self.player, self.hud, self._gamma, self.save_mode, self.inference_mode)
+            self.player, self.hud, self._gamma, self.save_mode, self.inference_mode, self.sensor_profile)
         self.camera_manager.transform_index = cam_pos_index
         self.camera_manager.set_sensor(cam_index, notify=False)
         self.camera_manager.background = True
@@ -482,6 +487,10 @@ class PIDController(object):
 
         return self._K_P * error + self._K_I * integral + self._K_D * derivative
         
+# risk models whose risky ids are instance segmentation ids
+INSTANCE_ID_MODES = ("DSA", "RRL", "BP", "BCP", "BCP_smoothing", "BP_smoothing", "RRL_smoothing", "DSA_smoothing")
+
+
 class Inference():
     def __init__(self, args, variant_path, weather) -> None:
         from models.LBC.map_model import MapModel
@@ -502,20 +511,37 @@ class Inference():
 
         self.gt_obstacle_id_list = []
         self.gt_obstacle_id_nearest = -1
+        self.actor_state_collector = None
+        # full actor ids <-> instance segmentation ids of the live actors, updated with every actor frame
+        self.actor_index = ActorIndex()
+        # instance ids already reported as shared, each one is logged once per episode
+        self.reported_collisions = set()
+        self.instance_encoder = InstanceEncoder()
 
         self.birdview_producer = BirdViewProducer(
                 self.args.map, 
                 PixelDimensions(width=256, height=256), 
                 pixels_per_meter=5)
 
+        # models shared with the other workers through the inference server, loaded here otherwise
+        self.inference_client = None
+        self.remote_net = None
+        self.remote_risk_model = None
+        if args.inference_server:
+            from util.inference_server import InferenceClient
+            self.inference_client = InferenceClient(args.inference_server)
+
         # load LBC model 
-        if self.scenario_type =="interactive":
-            self.net = MapModel.load_from_checkpoint("./models/weights/LBC/interactive.ckpt")
-        elif self.scenario_type =="obstacle":
-            self.net = MapModel.load_from_checkpoint("./models/weights/LBC/obstacle.ckpt")
+        if self.inference_client is not None:
+            self.remote_net = self.inference_client.model("LBC_" + self.scenario_type)
+        else:
+            if self.scenario_type =="interactive":
+                self.net = MapModel.load_from_checkpoint("./models/weights/LBC/interactive.ckpt")
+            elif self.scenario_type =="obstacle":
+                self.net = MapModel.load_from_checkpoint("./models/weights/LBC/obstacle.ckpt")
 
-        self.net.cuda()
-        self.net.eval()
+            self.net.cuda()
+            self.net.eval()
         self.variant_path = variant_path
 
         target = self.load_dict(os.path.join(variant_path, "target_point.pkl"))["target_point"]
@@ -602,6 +628,10 @@ class Inference():
 
             from models.QCNet.QCNet import QCNet_inference
             self.QCNet_inference = QCNet_inference
+        elif (self.mode == "BP" or self.mode ==  "BCP" or self.mode == "BCP_smoothing" or self.mode == "BP_smoothing") and self.inference_client is not None:
+            self.remote_risk_model = self.inference_client.model("two_stage")
+        elif (self.mode == "DSA" or self.mode =="DSA_smoothing" or self.mode == "RRL" or self.mode == "RRL_smoothing") and self.inference_client is not None:
+            self.remote_risk_model = self.inference_client.model(self.mode.split("_")[0])
         elif self.mode == "BP" or self.mode ==  "BCP" or self.mode == "BCP_smoothing" or self.mode == "BP_smoothing":
             from models.two_stage.inference import testing
             from models.two_stage.models import GCN as Model
@@ -736,231 +766,52 @@ class Inference():
 
 
 
+    @profiling.profiled("collect_actor_data")
     def collect_actor_data(self, world, frame):
 
-        all_id_list = []
-
         if self.mode == "Kalman_Filter" or self.mode == "MANTRA" or self.mode == "Social-GAN" or self.mode == "QCNet":
             if self.df_start_frame == 0:
                 self.df_start_frame = frame
 
-        vehicles_id_list = []
-        bike_blueprint = ["vehicle.bh.crossbike","vehicle.diamondback.century","vehicle.gazelle.omafiets"]
-        motor_blueprint = ["vehicle.harley-davidson.low_rider","vehicle.kawasaki.ninja","vehicle.yamaha.yzf","vehicle.vespa.zx125"]
-        
-        def get_xyz(method, rotation=False):
-
-            if rotation:
-                roll = method.roll
-                pitch = method.pitch
-                yaw = method.yaw
-                return {"pitch": pitch, "yaw": yaw, "roll": roll}
-
-            else:
-                x = method.x
-                y = method.y
-                z = method.z
-
-                # return x, y, z
-                return {"x": x, "y": y, "z": z}
-
-        ego_loc = world.player.get_location()
-        data = {}
-
-        vehicles = world.world.get_actors().filter("*vehicle*")
-        for actor in vehicles:
-
-        
-            _id = actor.id
-            actor_loc = actor.get_location()
-            location = get_xyz(actor_loc)
-            transform = actor.get_transform().rotation
-            rotation = get_xyz(transform, True)
-
-
-            cord_bounding_box = {}
-            bbox = actor.bounding_box
-            if actor.type_id in motor_blueprint:
-                bbox.extent.x = 1.177870
-                bbox.extent.y = 0.381839
-                bbox.extent.z = 0.75
-                bbox.location = carla.Location(0, 0, bbox.extent.z)
-            elif actor.type_id in bike_blueprint:
-                bbox.extent.x = 0.821422
-                bbox.extent.y = 0.186258
-                bbox.extent.z = 0.9
-                bbox.location = carla.Location(0, 0, bbox.extent.z)
-                
-            verts = [v for v in bbox.get_world_vertices(
-                actor.get_transform())]
-            counter = 0
-            for loc in verts:
-                cord_bounding_box["cord_"+str(counter)] = [loc.x, loc.y, loc.z]
-                counter += 1
-
-            distance = ego_loc.distance(actor_loc)
-
-
-            if distance < 35:
-                if _id != self.ego_id:
-                    all_id_list.append(_id)
+        # state of every actor from one snapshot, static attributes are cached per episode
+        if self.actor_state_collector is None or self.actor_state_collector.ego_id != self.ego_id:
+            self.actor_state_collector = ActorStateCollector(world.world, self.ego_id)
+        actor_frame = self.actor_state_collector.collect(compass=self.compass)
+        self.actor_index.update(actor_frame.ids)
+        new_collisions = self.actor_index.collisions - self.reported_collisions
+        if new_collisions:
+            # the boxes of these instance ids match every actor sharing them
+            logging.warning("instance ids shared by several actors: %s", sorted(new_collisions))
+            self.reported_collisions |= new_collisions
 
-
-
-            vehicles_id_list.append(_id)
-
-            acceleration = get_xyz(actor.get_acceleration())
-            
-            angular_velocity = get_xyz(actor.get_angular_velocity())
-
-            v = actor.get_velocity()
-            velocity = get_xyz(v)
-
-            speed = math.sqrt(v.x**2 + v.y**2 + v.z**2)
-
-            vehicle_control = actor.get_control()
-            control = {
-                "throttle": vehicle_control.throttle,
-                "steer": vehicle_control.steer,
-                "brake": vehicle_control.brake,
-                "hand_brake": vehicle_control.hand_brake,
-                "reverse": vehicle_control.reverse,
-                "manual_gear_shift": vehicle_control.manual_gear_shift,
-                "gear": vehicle_control.gear
-            }
-
-            data[_id] = {}
-            data[_id]["location"] = location
-            data[_id]["rotation"] = rotation
-            data[_id]["distance"] = distance
-            data[_id]["acceleration"] = acceleration
-            data[_id]["velocity"] = velocity
-            data[_id]["speed"] = speed
-            data[_id]["angular_velocity"] = angular_velocity
-            data[_id]["control"] = control
-            if _id == self.ego_id:
-                data[_id]["compass"] = self.compass
-            data[_id]["cord_bounding_box"] = cord_bounding_box
-            data[_id]["type"] = "vehicle"
-
-
-            if self.mode == "Kalman_Filter" or self.mode == "MANTRA" or self.mode == "Social-GAN" or self.mode == "QCNet":
+        if self.mode == "Kalman_Filter" or self.mode == "MANTRA" or self.mode == "Social-GAN" or self.mode == "QCNet":
+            ids = actor_frame.ids.tolist()
+            x = actor_frame.locations[:, 0].tolist()
+            y = actor_frame.locations[:, 1].tolist()
+            vx = actor_frame.velocities[:, 0].tolist()
+            vy = actor_frame.velocities[:, 1].tolist()
+            yaw = actor_frame.rotations[:, 1].tolist()
+
+            for row in actor_frame.rows(ACTOR_VEHICLE).tolist():
+                _id = ids[row]
                 if _id == self.ego_id:
-                    self.df_list.append([frame, _id, 'EGO', str(actor_loc.x), str(actor_loc.y), v.x , v.y, transform.yaw])
+                    label = 'EGO'
                 elif _id == self.gt_interactor:
-                    self.df_list.append([frame, _id, 'ACTOR', str(actor_loc.x), str(actor_loc.y), v.x , v.y, transform.yaw])
+                    label = 'ACTOR'
                 else:
-                    self.df_list.append([frame, _id, 'vehicle', str(actor_loc.x), str(actor_loc.y), v.x , v.y, transform.yaw])
-
-        pedestrian_id_list = []
-
-        walkers = world.world.get_actors().filter("*pedestrian*")
-        for actor in walkers:
-
-            _id = actor.id
+                    label = 'vehicle'
+                self.df_list.append([frame, _id, label, str(x[row]), str(y[row]), vx[row], vy[row], yaw[row]])
 
-            actor_loc = actor.get_location()
-            location = get_xyz(actor_loc)
-            transform = actor.get_transform().rotation
-            rotation = get_xyz(transform, True)
-
-            cord_bounding_box = {}
-            bbox = actor.bounding_box
-            verts = [v for v in bbox.get_world_vertices(
-                actor.get_transform())]
-            counter = 0
-            for loc in verts:
-                cord_bounding_box["cord_"+str(counter)] = [loc.x, loc.y, loc.z]
-                counter += 1
-
-            distance = ego_loc.distance(actor_loc)
-
-            if distance < 35:
-                
-                all_id_list.append(_id)
-
-            
-            pedestrian_id_list.append(_id)
-
-            acceleration = get_xyz(actor.get_acceleration())
-            v = actor.get_velocity()
-            velocity = get_xyz(v)
-            angular_velocity = get_xyz(actor.get_angular_velocity())
-
-            walker_control = actor.get_control()
-            control = {"direction": get_xyz(walker_control.direction),
-                       "speed": walker_control.speed, "jump": walker_control.jump}
-
-            data[_id] = {}
-            data[_id]["location"] = location
-            data[_id]["distance"] = distance
-            data[_id]["acceleration"] = acceleration
-            data[_id]["velocity"] = velocity
-            data[_id]["angular_velocity"] = angular_velocity
-            data[_id]["control"] = control
-
-            data[_id]["cord_bounding_box"] = cord_bounding_box
-            data[_id]["type"] = 'pedestrian'
-
-            if self.mode == "Kalman_Filter" or self.mode == "MANTRA" or self.mode == "Social-GAN" or self.mode == "QCNet":
-                if _id == self.gt_interactor:
-                    self.df_list.append([frame, _id, 'ACTOR', str(actor_loc.x), str(actor_loc.y), v.x , v.y, control["direction"]["y"]])
-                else:
-                    self.df_list.append([frame, _id, 'pedestrian', str(actor_loc.x), str(actor_loc.y), v.x , v.y, control["direction"]["y"] ])
-
-        obstacle_id_list = []
-
-        obstacle = world.world.get_actors().filter("*static.prop*")
-
-        data["obstacle"]= {}
-        for actor in obstacle:
-
-            _id = actor.id
-            type_id = actor.type_id
-
-            actor_loc = actor.get_location()
-            location = get_xyz(actor_loc)
-            transform = actor.get_transform().rotation
-            rotation = get_xyz(transform, True)
-            distance = ego_loc.distance(actor_loc)
-
-
-            if distance < 35:
-                all_id_list.append(_id)
-
-            bbox = actor.bounding_box
-
-            cord_bounding_box = {}
-            verts = [v for v in bbox.get_world_vertices(
-                actor.get_transform())]
-            
-            counter = 0
-            for loc in verts:
-                cord_bounding_box["cord_"+str(counter)] = [loc.x, loc.y, loc.z]
-                counter += 1
-
-            #if distance < 50:
-            obstacle_id_list.append(_id)
-
-            data["obstacle"][_id] = {}
-            data["obstacle"][_id]["distance"] = distance
-            data["obstacle"][_id]["type_id"] = type_id
-            # 
-            data["obstacle"][_id]["type"] = "obstacle"
-            data["obstacle"][_id]["cord_bounding_box"] = cord_bounding_box
-
-            if self.mode == "Kalman_Filter" or self.mode == "MANTRA" or self.mode == "Social-GAN" or self.mode == "QCNet":
-                self.df_list.append([frame, _id, type_id, str(actor_loc.x), str(actor_loc.y), 0 , 0, transform.yaw])
+            for row in actor_frame.rows(ACTOR_PEDESTRIAN).tolist():
+                _id = ids[row]
+                label = 'ACTOR' if _id == self.gt_interactor else 'pedestrian'
+                direction = actor_frame.controls[_id]["direction"]["y"]
+                self.df_list.append([frame, _id, label, str(x[row]), str(y[row]), vx[row], vy[row], direction])
 
+            for row in actor_frame.rows(ACTOR_OBSTACLE).tolist():
+                self.df_list.append([frame, ids[row], actor_frame.type_ids[row], str(x[row]), str(y[row]), 0, 0, yaw[row]])
 
-        # data["traffic_light_ids"] = traffic_id_list
-
-        data["obstacle_ids"] = obstacle_id_list
-        data["vehicles_ids"] = vehicles_id_list
-        data["pedestrian_ids"] = pedestrian_id_list
-        data["all_ids"] = all_id_list
-
-        return data
+        return actor_frame.to_inference_dict(radius=35)
     
     def set_scenario_type(self, sceanrio):
         self.scenario_type = sceanrio
@@ -972,47 +823,23 @@ class Inference():
         self.gt_interactor = id
 
 
+    @profiling.profiled("get_ids")
     def get_ids(self, mask, area_threshold=400):
         """
             Args:
-                mask: instance image
+                mask: (H, W, 4) instance segmentation image, as in carla.Image.raw_data
         """
-        obstacle_boxes,obstacle_ids = [], []
-        h,w = mask.shape[1:]
-        # print("h, w", h, w)
-        mask_2 = torch.zeros((2,h,w), device="cuda:0")
-        mask_2[0] = mask[0]
-        mask_2[1] = mask[1]+mask[2]*256
-
+        # ids, pixel counts and boxes of every instance come from one pass of the instance codec
+        frame = self.instance_encoder.analyse(mask)
+        obstacle_boxes, obstacle_ids = [], []
         if self.scenario_type =="obstacle":
-            condition = mask[0]== 21 # Obstacle
-            obstacle_ids = torch.unique(mask_2[1,condition])
-            masks = mask_2[1] == obstacle_ids[:, None, None]
-            masks = masks*condition
-            area_condition = masks.long().sum((1,2))>=area_threshold
-            masks = masks[area_condition]
-            
-            obstacle_ids = obstacle_ids[area_condition].type(torch.int).cpu().numpy()
-            obstacle_boxes = masks_to_boxes(masks).type(torch.int16).cpu().numpy()
-            assert len(obstacle_ids) == len(obstacle_boxes)
-
-        condition = mask_2[0]== 14 # Car
-        condition += mask_2[0]== 15 # Truck
-        condition += mask_2[0]== 16 # Bus
-        condition += mask_2[0]== 12 # Pedestrian
-        condition += mask[0]== 18 # Motorcycle
-        condition += mask[0]== 19 # Bicycle
-        obj_ids = torch.unique(mask_2[1,condition])
-        masks = mask_2[1] == obj_ids[:, None, None]
-        masks = masks*condition
-        area_condition = masks.long().sum((1,2))>=area_threshold
-        masks = masks[area_condition]
-        
-        obj_ids = obj_ids[area_condition].type(torch.int).cpu().numpy()
-        boxes = masks_to_boxes(masks).type(torch.int16).cpu().numpy()
-        assert len(obj_ids) == len(boxes)
+            obstacle_ids, _, _, obstacle_boxes = frame.objects([21], area_threshold) # Obstacle
+            obstacle_ids = obstacle_ids.astype(np.int32)
+            obstacle_boxes = obstacle_boxes.astype(np.int16)
 
-        return boxes, obj_ids, obstacle_boxes, obstacle_ids
+        # Car, Truck, Bus, Pedestrian, Motorcycle, Bicycle
+        obj_ids, _, _, boxes = frame.objects([14, 15, 16, 12, 18, 19], area_threshold)
+        return boxes.astype(np.int16), obj_ids.astype(np.int32), obstacle_boxes, obstacle_ids
     
     
     def set_autopilot(self, world):
@@ -1026,15 +853,16 @@ class Inference():
     def run_inference(self, frame, world, pre_get_data = False):
         
         
-        while True:
-            if world.camera_manager.ss_front.frame == frame:
-                self.ss_front = world.camera_manager.ss_front
-                break
+        with profiling.span("sensor_wait"):
+            while True:
+                if world.camera_manager.ss_front.frame == frame:
+                    self.ss_front = world.camera_manager.ss_front
+                    break
 
-        while True:
-            if world.camera_manager.rgb_front.frame == frame:
-                self.rgb_front = world.camera_manager.rgb_front
-                break
+            while True:
+                if world.camera_manager.rgb_front.frame == frame:
+                    self.rgb_front = world.camera_manager.rgb_front
+                    break
 
         # ins_front_array = torch.from_numpy(ins_front_array.copy())[:,:,:3].type(torch.int).permute((2,0,1))
         #produce_bbx(ins_front_array, actor_list_and_position, frame)
@@ -1042,12 +870,7 @@ class Inference():
 
         instance = np.frombuffer(self.ss_front.raw_data, dtype=np.dtype("uint8"))
         instance = np.reshape(instance, (self.ss_front.height, self.ss_front.width, 4))
-        instance = instance[:, :, :3]
-        instance_torch = torch.flip(torch.from_numpy(instance.copy()).type(torch.int).permute(2,0,1),[0])
-        # print(instance_torch.shape) # torch.Size([3, 256, 640])
-
-        instance_torch = instance_torch.to("cuda:0")
-        boxes, obj_ids, obstacle_boxes, obstacle_ids = self.get_ids(instance_torch)
+        boxes, obj_ids, obstacle_boxes, obstacle_ids = self.get_ids(instance)
 
 
 
@@ -1056,7 +879,8 @@ class Inference():
         rgb = rgb[:, :, :3]
 
         
-        self.front_rgb_out.write(rgb)
+        with profiling.span("video_write"):
+            self.front_rgb_out.write(rgb)
 
         camera_transforms = transforms.Compose([
         # transforms.Resize(image_resize),
@@ -1151,199 +975,230 @@ class Inference():
         for id in obstacle_id_list:
             obstacle_dict[id] = actor_dict["obstacle"][id]["type_id"]
 
-        # trajectory based method 
-        if self.mode == "Kalman_Filter" or self.mode == "MANTRA" or self.mode == "Social-GAN" or self.mode == "QCNet":
-            vehicle_list = []
-            traj_df = pd.DataFrame(self.df_list, columns=['FRAME', 'TRACK_ID', 'OBJECT_TYPE', 'X', 'Y', 'VELOCITY_X', 'VELOCITY_Y', 'YAW'])
-
-            for _, remain_df in traj_df.groupby('TRACK_ID'): # actor id 
-                filter = (remain_df.FRAME > ( int(frame) - 20))
-
-                remain_df = remain_df[filter].reset_index(drop=True)
-                #print("remain_df: ", remain_df)
-                remain_df = remain_df.reset_index(drop=True)
-
-                now_df = remain_df[remain_df.FRAME == int(frame)]
-                actor_pos_x = float(now_df["X"].values[0])
-                actor_pos_y = float(now_df["Y"].values[0])
-                # actor_pos_x = float( remain_df.loc[19, 'X'])
-                # actor_pos_y = float( remain_df.loc[ int(frame), 'Y'])
-                dist_x = actor_pos_x - actor_dict[ego_id]["location"]["x"]
-                dist_y = actor_pos_y - actor_dict[ego_id]["location"]["y"]
-                remain_df["X"] = remain_df["X"].astype(float)
-                remain_df["Y"] = remain_df["Y"].astype(float)
-                #print(actor_pos_x, actor_pos_y, "dist_x", dist_x, "dist_y", dist_y)
-                if abs(dist_x) <= 37.5 and abs(dist_y) <= 37.5:
-                    vehicle_list.append(remain_df)
-            if self.mode == "Kalman_Filter":
-                risky_ids = self.kf_inference(vehicle_list, frame, ego_id, pedestrian_id_list, vehicle_id_list, obstacle_id_list)
-                risky_ids = risky_ids[:1]
-            if self.mode == "MANTRA":
-                risky_ids = self.mantra_inference(vehicle_list, frame, ego_id, pedestrian_id_list, vehicle_id_list, obstacle_dict)
-                risky_ids = risky_ids[:1]
-            if self.mode == "Social-GAN":
-                risky_ids = self.socal_gan_inference(vehicle_list, frame, ego_id, pedestrian_id_list, vehicle_id_list, obstacle_dict, self._args, self.generator)
-                risky_ids = risky_ids[:1]
-            if self.mode == "QCNet":
-                risky_ids = self.QCNet_inference(vehicle_list, frame, ego_id, pedestrian_id_list, vehicle_id_list, obstacle_dict)
-                risky_ids = risky_ids[:1]
-        # vision based methods
-        elif self.mode == "DSA" or self.mode == "RRL" or self.mode == "RRL_smoothing" or self.mode == "DSA_smoothing" :
-
-            if self.mode == "DSA":
-                threshold = 0.9
-            else:
-                threshold = 0.8
-            #  input 
-            imgs_input = torch.stack(self.rgb_list_bc_method) # 1 5 3 H W
-            imgs_input = imgs_input.unsqueeze(0).cuda()
+        with profiling.span("risk_model"):
+            # trajectory based method 
+            if self.mode == "Kalman_Filter" or self.mode == "MANTRA" or self.mode == "Social-GAN" or self.mode == "QCNet":
+                vehicle_list = nearby_tracks(self.df_list, frame, actor_dict[ego_id]["location"])
+                if self.mode == "Kalman_Filter":
+                    risky_ids = self.kf_inference(vehicle_list, frame, ego_id, pedestrian_id_list, vehicle_id_list, obstacle_id_list)
+                    risky_ids = risky_ids[:1]
+                if self.mode == "MANTRA":
+                    risky_ids = self.mantra_inference(vehicle_list, frame, ego_id, pedestrian_id_list, vehicle_id_list, obstacle_dict)
+                    risky_ids = risky_ids[:1]
+                if self.mode == "Social-GAN":
+                    risky_ids = self.socal_gan_inference(vehicle_list, frame, ego_id, pedestrian_id_list, vehicle_id_list, obstacle_dict, self._args, self.generator)
+                    risky_ids = risky_ids[:1]
+                if self.mode == "QCNet":
+                    risky_ids = self.QCNet_inference(vehicle_list, frame, ego_id, pedestrian_id_list, vehicle_id_list, obstacle_dict,
+                                                     town=self.map, carla_map=world.map)
+                    risky_ids = risky_ids[:1]
+            # vision based methods
+            elif self.mode == "DSA" or self.mode == "RRL" or self.mode == "RRL_smoothing" or self.mode == "DSA_smoothing" :
+
+                if self.mode == "DSA":
+                    threshold = 0.9
+                else:
+                    threshold = 0.8
+                #  input 
+                imgs_input = torch.stack(self.rgb_list_bc_method) # 1 5 3 H W
+                imgs_input = imgs_input.unsqueeze(0).cuda()
 
-            bbox_input = torch.from_numpy(np.array(self.bbox_list_DSA).astype(np.float32))
+                bbox_input = torch.from_numpy(np.array(self.bbox_list_DSA).astype(np.float32))
             
-            bbox_input = bbox_input.unsqueeze(0).cuda()
+                bbox_input = bbox_input.unsqueeze(0).cuda()
 
-            bbox_id_input = self.bbox_id_list_DSA
+                bbox_id_input = self.bbox_id_list_DSA
 
-            risky_ids = []
-            tmp_dict = {}
+                risky_ids = []
+                tmp_dict = {}
 
-            with torch.no_grad():
-                _, all_alphas, _ = self.dsa_model(imgs_input, bbox_input)
+                with torch.no_grad():
+                    if self.remote_risk_model is not None:
+                        all_alphas = torch.from_numpy(self.remote_risk_model(imgs_input.cpu().numpy(), bbox_input.cpu().numpy()))
+                    else:
+                        _, all_alphas, _ = self.dsa_model(imgs_input, bbox_input)
                 
-                all_alphas = all_alphas[0]
+                    all_alphas = all_alphas[0]
                 
-                n_frame = -1
-                max_score = 0
-                for score, id in zip(all_alphas[n_frame], bbox_id_input[n_frame]):
+                    n_frame = -1
+                    max_score = 0
+                    for score, id in zip(all_alphas[n_frame], bbox_id_input[n_frame]):
 
                     
-                    score, id = score.cpu().numpy(), id
-                    if id == -1:
-                        break
-                    score = round(float(score),2)
+                        score, id = score.cpu().numpy(), id
+                        if id == -1:
+                            break
+                        score = round(float(score),2)
 
-                    tmp_dict[int(id)] = score
+                        tmp_dict[int(id)] = score
 
-                    if score > max_score:
-                        risky_ids = [int(id)]
-                        max_score = score
-                    if max_score  <  threshold:
-                        risky_ids = []
-                    # if round(float(score),2) > threshold: # 0.8
-                        # risky_ids.append(int(id))
+                        if score > max_score:
+                            risky_ids = [int(id)]
+                            max_score = score
+                        if max_score  <  threshold:
+                            risky_ids = []
+                        # if round(float(score),2) > threshold: # 0.8
+                            # risky_ids.append(int(id))
 
-            # mean filter 
+                # mean filter 
 
-            if self.mode ==  "RRL_smoothing" or self.mode == "DSA_smoothing":
-                if len(self.Mean_filter_list) < 5:
-                    self.Mean_filter_list.append(tmp_dict)
-                else:
-                    self.Mean_filter_list.pop(0) # pop first one 
-                    self.Mean_filter_list.append(tmp_dict)
-                    # take the avg 
-                    # get all ids
-                    mean_filter_id_list = []
-                    for i in range(5):
-                        mean_filter_id_list += list(self.Mean_filter_list[i].keys())
-                    
-                    # take the avg 
-                    result_dict = {}
-                    for mean_filter_id in mean_filter_id_list:
-                        counter = 0
-                        score = 0
+                if self.mode ==  "RRL_smoothing" or self.mode == "DSA_smoothing":
+                    if len(self.Mean_filter_list) < 5:
+                        self.Mean_filter_list.append(tmp_dict)
+                    else:
+                        self.Mean_filter_list.pop(0) # pop first one 
+                        self.Mean_filter_list.append(tmp_dict)
+                        # take the avg 
+                        # get all ids
+                        mean_filter_id_list = []
                         for i in range(5):
-                            if mean_filter_id in self.Mean_filter_list[i].keys():
-                                counter+=1
-                                score+=self.Mean_filter_list[i][mean_filter_id]
-                        avg_score = float(score/counter)
-
-                        # threshold 
-                        if avg_score > 0.25:
-                            result_dict[mean_filter_id] = avg_score
+                            mean_filter_id_list += list(self.Mean_filter_list[i].keys())
                     
+                        # take the avg 
+                        result_dict = {}
+                        for mean_filter_id in mean_filter_id_list:
+                            counter = 0
+                            score = 0
+                            for i in range(5):
+                                if mean_filter_id in self.Mean_filter_list[i].keys():
+                                    counter+=1
+                                    score+=self.Mean_filter_list[i][mean_filter_id]
+                            avg_score = float(score/counter)
 
-                    if len(result_dict) != 0:
-                        # final find the max
-                        # max_id = [key for key, value in result_dict.items() if value == max(result_dict.values())]
-                        # risky_ids = max_id
-                        # two_result = max_id
-                        max_score = 0
-                        for key in  self.Mean_filter_list[-1].keys():
-                            if key in result_dict.keys():
-                                value = result_dict[key]
-                                if value > max_score:
-                                    value = max_score
-                                    risky_ids = [key]
+                            # threshold 
+                            if avg_score > 0.25:
+                                result_dict[mean_filter_id] = avg_score
+                    
 
+                        if len(result_dict) != 0:
+                            # final find the max
+                            # max_id = [key for key, value in result_dict.items() if value == max(result_dict.values())]
+                            # risky_ids = max_id
+                            # two_result = max_id
+                            max_score = 0
+                            for key in  self.Mean_filter_list[-1].keys():
+                                if key in result_dict.keys():
+                                    value = result_dict[key]
+                                    if value > max_score:
+                                        value = max_score
+                                        risky_ids = [key]
 
-                    else:
-                        # two_result = []
-                        risky_ids = []
+
+                        else:
+                            # two_result = []
+                            risky_ids = []
                         
 
-        elif self.mode == "BP" or self.mode == "BCP" or self.mode == "BCP_smoothing" or self.mode == "BP_smoothing":
-            tracking_results = []
-            for i in range(5):
-                for actor_id in self.bbox_list_bc_method[i]:
+            elif self.mode == "BP" or self.mode == "BCP" or self.mode == "BCP_smoothing" or self.mode == "BP_smoothing":
+                tracking_results = []
+                for i in range(5):
+                    for actor_id in self.bbox_list_bc_method[i]:
 
-                    bbox = self.bbox_list_bc_method[i][actor_id]
-                    w = bbox[2]-bbox[0]
-                    h = bbox[3]-bbox[1]
+                        bbox = self.bbox_list_bc_method[i][actor_id]
+                        w = bbox[2]-bbox[0]
+                        h = bbox[3]-bbox[1]
 
-                    if w*h < 100: #MIN_AREA:
-                        continue
+                        if w*h < 100: #MIN_AREA:
+                            continue
 
-                    tracking_results.append([int(i), int(actor_id), bbox[0], bbox[1], bbox[2], bbox[3], 1, -1, -1, -1])
-            tracking = np.array(tracking_results)
+                        tracking_results.append([int(i), int(actor_id), bbox[0], bbox[1], bbox[2], bbox[3], 1, -1, -1, -1])
+                tracking = np.array(tracking_results)
 
-            two_result = []
-            single_result = []
+                two_result = []
+                single_result = []
     
-            if tracking.shape[0] != 0:
-                t_array = tracking[:, 0]
-
-                tracking_id = tracking[np.where(t_array == 4)[0], 1]
-
-                trackers = np.zeros([5, 25, 4])
-
-                for t in range(5):
-                    current_tracking = tracking[np.where(t_array == t)[0]]
-
-                    for i, object_id in enumerate(tracking_id):
-                        current_actor_id_idx = np.where(
-                            current_tracking[:, 1] == object_id)[0]
-
-                        if len(current_actor_id_idx) != 0:
-                            # x1, y1, x2, y2
-                            bbox = current_tracking[current_actor_id_idx, 2:6]
-                            trackers[t, i, :] = bbox
+                if tracking.shape[0] != 0:
+                    t_array = tracking[:, 0]
+
+                    tracking_id = tracking[np.where(t_array == 4)[0], 1]
+
+                    trackers = np.zeros([5, 25, 4])
+
+                    for t in range(5):
+                        current_tracking = tracking[np.where(t_array == t)[0]]
+
+                        for i, object_id in enumerate(tracking_id):
+                            current_actor_id_idx = np.where(
+                                current_tracking[:, 1] == object_id)[0]
+
+                            if len(current_actor_id_idx) != 0:
+                                # x1, y1, x2, y2
+                                bbox = current_tracking[current_actor_id_idx, 2:6]
+                                trackers[t, i, :] = bbox
+
+                    # return trackers, tracking_id
+                    with torch.no_grad():
+                        """
+                            single_result, two_result: Dictionary
+                            e.g.
+                            {
+                                object_id1 (str): True
+                                object_id2 (str): False
+                                object_id3 (str): True
+                                ...
+                            }
+                        """
+                        if self.remote_risk_model is not None:
+                            single_result, two_result, two_score_dict, single_score_dict = self.remote_risk_model(
+                                torch.stack(self.rgb_list_bc_method[:5]).numpy(), trackers, tracking_id)
+                        else:
+                            single_result, two_result, two_score_dict, single_score_dict = self.BC_testing(self.BC_model, self.rgb_list_bc_method, trackers, tracking_id)
 
-                # return trackers, tracking_id
-                with torch.no_grad():
-                    """
-                        single_result, two_result: Dictionary
-                        e.g.
-                        {
-                            object_id1 (str): True
-                            object_id2 (str): False
-                            object_id3 (str): True
-                            ...
-                        }
-                    """
-                    single_result, two_result, two_score_dict, single_score_dict = self.BC_testing(self.BC_model, self.rgb_list_bc_method, trackers, tracking_id)
-
-                    if self.mode ==  "BP_smoothing" : #or  :
+                        if self.mode ==  "BP_smoothing" : #or  :
+                            if len(self.Mean_filter_list) < 5:
+                                self.Mean_filter_list.append(single_score_dict)
+                            else:
+                                self.Mean_filter_list.pop(0) # pop first one 
+                                self.Mean_filter_list.append(single_score_dict)
+                                # take the avg 
+                                # get all ids
+                                mean_filter_id_list = []
+                                for i in range(5):
+                                    mean_filter_id_list += list(self.Mean_filter_list[i].keys())
+                            
+                                # take the avg 
+                                result_dict = {}
+                                for mean_filter_id in mean_filter_id_list:
+                                    counter = 0
+                                    score = 0
+                                    for i in range(5):
+                                        if mean_filter_id in self.Mean_filter_list[i].keys():
+                                            counter+=1
+                                            score+=self.Mean_filter_list[i][mean_filter_id]
+                                    avg_score = float(score/counter)
+
+                                    # threshold 
+                                    if avg_score > 0.18:
+                                        result_dict[mean_filter_id] = avg_score
+
+                                if len(result_dict) != 0:
+                                    # final find the max
+                                    # max_id = [key for key, value in result_dict.items() if value == max(result_dict.values())]
+                                    # two_result = max_id
+
+                                    max_score = 0
+                                
+                                    for key in  self.Mean_filter_list[-1].keys():
+                                        if key in result_dict.keys():
+                                            value = result_dict[key]
+                                            if value > max_score:
+                                                value = max_score
+                                                single_result = [key]
+                                else:
+                                    single_result = []
+
+                    if self.mode ==  "BCP_smoothing" : #or  :
                         if len(self.Mean_filter_list) < 5:
-                            self.Mean_filter_list.append(single_score_dict)
+                            self.Mean_filter_list.append(two_score_dict)
                         else:
                             self.Mean_filter_list.pop(0) # pop first one 
-                            self.Mean_filter_list.append(single_score_dict)
+                            self.Mean_filter_list.append(two_score_dict)
                             # take the avg 
                             # get all ids
                             mean_filter_id_list = []
                             for i in range(5):
                                 mean_filter_id_list += list(self.Mean_filter_list[i].keys())
-                            
+                        
                             # take the avg 
                             result_dict = {}
                             for mean_filter_id in mean_filter_id_list:
@@ -1365,126 +1220,72 @@ class Inference():
                                 # two_result = max_id
 
                                 max_score = 0
-                                
+                            
                                 for key in  self.Mean_filter_list[-1].keys():
                                     if key in result_dict.keys():
                                         value = result_dict[key]
                                         if value > max_score:
                                             value = max_score
-                                            single_result = [key]
+                                            two_result = [key]
                             else:
-                                single_result = []
-
-                if self.mode ==  "BCP_smoothing" : #or  :
-                    if len(self.Mean_filter_list) < 5:
-                        self.Mean_filter_list.append(two_score_dict)
-                    else:
-                        self.Mean_filter_list.pop(0) # pop first one 
-                        self.Mean_filter_list.append(two_score_dict)
-                        # take the avg 
-                        # get all ids
-                        mean_filter_id_list = []
-                        for i in range(5):
-                            mean_filter_id_list += list(self.Mean_filter_list[i].keys())
-                        
-                        # take the avg 
-                        result_dict = {}
-                        for mean_filter_id in mean_filter_id_list:
-                            counter = 0
-                            score = 0
-                            for i in range(5):
-                                if mean_filter_id in self.Mean_filter_list[i].keys():
-                                    counter+=1
-                                    score+=self.Mean_filter_list[i][mean_filter_id]
-                            avg_score = float(score/counter)
-
-                            # threshold 
-                            if avg_score > 0.18:
-                                result_dict[mean_filter_id] = avg_score
-
-                        if len(result_dict) != 0:
-                            # final find the max
-                            # max_id = [key for key, value in result_dict.items() if value == max(result_dict.values())]
-                            # two_result = max_id
-
-                            max_score = 0
-                            
-                            for key in  self.Mean_filter_list[-1].keys():
-                                if key in result_dict.keys():
-                                    value = result_dict[key]
-                                    if value > max_score:
-                                        value = max_score
-                                        two_result = [key]
-                        else:
-                            two_result = []
+                                two_result = []
                             
 
-            if self.mode == "BCP" or  self.mode == "BCP_smoothing":
-                risky_ids = two_result
-            else:
-                risky_ids = single_result
-
-        # rule based methods
-        elif self.mode == "Random":
-            # ids = list(obstacle_ids) + list(obj_ids)
+                if self.mode == "BCP" or  self.mode == "BCP_smoothing":
+                    risky_ids = two_result
+                else:
+                    risky_ids = single_result
 
-            # for id in ids:
-            #     if id == (self.ego_id % 65536):
-            #         ids.remove(id)
-            # all_ids_list
+            # rule based methods
+            elif self.mode == "Random":
+                # ids = list(obstacle_ids) + list(obj_ids)
 
-            if len(all_ids_list) != 0 :
-                risky_ids = [random.choice(all_ids_list)]
                 # for id in ids:
-                #     if random.random() > 0.5:
-                #         risky_ids.append(id)
+                #     if id == (self.ego_id % 65536):
+                #         ids.remove(id)
+                # all_ids_list
 
-            else:
-                risky_ids = []
-                
-        elif self.mode == "Range":
-            ids = list(obstacle_ids) + list(obj_ids)
-            if len(ids) == 0 :
-                risky_ids = []
-            else:
-                # risky_ids = []
-                # find nearest object 
-                min_distance = 1000
-                min_id = -1
-
-                for id in self.obestacle_id_list:
-                    id_tmp = id % 65536 
-                    if id_tmp in ids:
-                        distance = actor_dict["obstacle"][id]["distance"]
+                if len(all_ids_list) != 0 :
+                    risky_ids = [random.choice(all_ids_list)]
+                    # for id in ids:
+                    #     if random.random() > 0.5:
+                    #         risky_ids.append(id)
 
+                else:
+                    risky_ids = []
+                
+            elif self.mode == "Range":
+                ids = list(obstacle_ids) + list(obj_ids)
+                if len(ids) == 0 :
+                    risky_ids = []
+                else:
+                    # risky_ids = []
+                    # find nearest object 
+                    min_distance = 1000
+                    min_id = -1
+
+                    # actors of the instance ids in view
+                    scenario_obstacles = set(self.obestacle_id_list)
+                    for id in sorted(self.actor_index.resolve(ids)):
+                        if id in scenario_obstacles:
+                            distance = actor_dict["obstacle"][id]["distance"]
+                        elif id != self.ego_id and id in actor_dict:
+                            # vehicles and pedestrians
+                            distance = actor_dict[id]["distance"]
+                        else:
+                            continue
                         if distance < min_distance:
                             min_distance = distance
                             min_id = id
 
-                for id in vehicle_id_list:
-                    if id == self.ego_id:
-                        continue
-                    id_tmp = id % 65536 
-                    if id_tmp in ids:
-                        distance = actor_dict[id]["distance"]
-                        if distance < min_distance:
-                            min_distance = distance
-                            min_id = id
-                for id in pedestrian_id_list:
-                    id_tmp = id % 65536
-                    if id_tmp in ids:
-                        distance = actor_dict[id]["distance"]
-                        if distance < min_distance:
-                            min_distance = distance
-                            min_id = id
+                    if min_distance > 10 :#15:
+                        risky_ids = []
+                    else:
+                        risky_ids = [min_id]
 
-                if min_distance > 10 :#15:
-                    risky_ids = []
-                else:
-                    risky_ids = [min_id]
+            else:
+                risky_ids = []
 
-        else:
-            risky_ids = []
         # Get bbox for lbc Input 
 
         print("***************************************************")
@@ -1493,6 +1294,12 @@ class Inference():
         for id in risky_ids:
             tmp.append(int(id))
         risky_ids = tmp
+        # the vision based methods rank the boxes of the instance segmentation, their ids are the lower 16 bits of
+        # the actor ids
+        if self.mode in INSTANCE_ID_MODES:
+            risky_actor_ids = self.actor_index.resolve(risky_ids)
+        else:
+            risky_actor_ids = set(risky_ids)
         print("          risky id: ", risky_ids)    
         print("Ground obstacle id: ", self.gt_obstacle_id_list)
         print("     Interactor id: ", self.gt_interactor)
@@ -1501,9 +1308,7 @@ class Inference():
         if self.args.obstacle_region:
             if not (self.mode == "Ground_Truth" or self.mode == "Full_Observation"):     
                 for id in self.gt_obstacle_id_list:
-                    if self.mode == "Range" or  self.mode == "DSA" or self.mode == "RRL" or self.mode == "BP" or self.mode == "BCP" or  self.mode == "BCP_smoothing" or self.mode == "BP_smoothing" or self.mode == "RRL_smoothing" or self.mode == "DSA_smoothing":
-                        id = id % 65536
-                    if id in risky_ids:
+                    if id in risky_actor_ids:
 
                         for gt_id in self.gt_obstacle_id_list:
                             try:
@@ -1593,9 +1398,7 @@ class Inference():
                         pos_2 = actor_dict["obstacle"][id]["cord_bounding_box"]["cord_6"]
                         pos_3 = actor_dict["obstacle"][id]["cord_bounding_box"]["cord_2"]
 
-                        if self.mode == "Range" or  self.mode == "DSA" or self.mode == "RRL" or self.mode == "BP" or self.mode == "BCP" or  self.mode == "BCP_smoothing" or self.mode == "BP_smoothing" or self.mode == "RRL_smoothing" or self.mode == "DSA_smoothing" :
-                            id = id % 65536
-                        if id in risky_ids:
+                        if id in risky_actor_ids:
                             obstacle_bbox_list.append([Loc(x=pos_0[0], y=pos_0[1]), 
                                                         Loc(x=pos_1[0], y=pos_1[1]), 
                                                         Loc(x=pos_2[0], y=pos_2[1]), 
@@ -1665,11 +1468,7 @@ class Inference():
                 pos_2 = actor_dict[id]["cord_bounding_box"]["cord_6"]
                 pos_3 = actor_dict[id]["cord_bounding_box"]["cord_2"]
 
-                if self.mode == "Range" or  self.mode == "DSA" or self.mode == "RRL" or self.mode == "BP" or self.mode == "BCP" or  self.mode == "BCP_smoothing" or self.mode == "BP_smoothing" or self.mode == "RRL_smoothing" or self.mode == "DSA_smoothing" :
-                    id = id % 65536
-
-                
-                if id in risky_ids:
+                if id in risky_actor_ids:
                     if self.scenario_type == "obstacle":
                         obstacle_bbox_list.append([Loc(x=pos_0[0], y=pos_0[1]), 
                                 Loc(x=pos_1[0], y=pos_1[1]), 
@@ -1712,11 +1511,7 @@ class Inference():
                 pos_2 = actor_dict[id]["cord_bounding_box"]["cord_6"]
                 pos_3 = actor_dict[id]["cord_bounding_box"]["cord_2"]
 
-                if self.mode == "Range" or  self.mode == "DSA" or self.mode == "RRL" or self.mode == "BP" or self.mode == "BCP" or  self.mode == "BCP_smoothing" or self.mode == "BP_smoothing" or self.mode == "RRL_smoothing" or self.mode == "DSA_smoothing":
-                    id = id % 65536
-
-                if id in risky_ids:
-                    # mod 65536
+                if id in risky_actor_ids:
                     
                     pedestrian_bbox_list.append([Loc(x=pos_0[0], y=pos_0[1]), 
                                                 Loc(x=pos_1[0], y=pos_1[1]), 
@@ -1754,11 +1549,7 @@ class Inference():
                                             ])
             else:
                 # other method 
-                if self.mode == "Range" or  self.mode == "DSA" or self.mode == "RRL" or self.mode == "BP" or self.mode == "BCP" or  self.mode == "BCP_smoothing" or self.mode == "BP_smoothing" or self.mode == "RRL_smoothing" or self.mode == "DSA_smoothing" :
-                    id = id % 65536
-
-                if id in risky_ids:
-                    # mod 65536
+                if id in risky_actor_ids:
                     risk_bbox_list.append([Loc(x=pos_0[0], y=pos_0[1]), 
                                                 Loc(x=pos_1[0], y=pos_1[1]), 
                                                 Loc(x=pos_2[0], y=pos_2[1]), 
@@ -1807,11 +1598,7 @@ class Inference():
                                             ])
             else:
                 # other method 
-                if self.mode == "Range" or self.mode == "DSA" or self.mode == "RRL" or self.mode == "BP" or self.mode == "BCP" or  self.mode == "BCP_smoothing" or self.mode == "BP_smoothing" or self.mode == "RRL_smoothing" or self.mode == "DSA_smoothing" :
-                    id = id % 65536
-
-                if id in risky_ids:
-                    # mod 65536
+                if id in risky_actor_ids:
                     risk_bbox_list.append([Loc(x=pos_0[0], y=pos_0[1]), 
                                                 Loc(x=pos_1[0], y=pos_1[1]), 
                                                 Loc(x=pos_2[0], y=pos_2[1]), 
@@ -1849,9 +1636,7 @@ class Inference():
                 in_risky_id_flag = False
                 
                 for gt_id in self.gt_obstacle_id_list:
-                    if self.mode == "Range" or self.mode == "DSA" or self.mode == "RRL" or self.mode == "BP" or self.mode == "BCP" or  self.mode == "BCP_smoothing" or self.mode == "BP_smoothing" or self.mode == "RRL_smoothing" or self.mode == "DSA_smoothing" : 
-                        id = gt_id % 65536
-                    if id in risky_ids:
+                    if gt_id in risky_actor_ids:
                         in_risky_id_flag = True
                 
                 
@@ -1899,12 +1684,9 @@ class Inference():
                                         Loc(x=pos_3[0], y=pos_3[1]), 
                                         ]) 
                 else:
-                    if self.mode == "Range" or self.mode == "DSA" or self.mode == "RRL" or self.mode == "BP" or self.mode == "BCP" or  self.mode == "BCP_smoothing" or self.mode == "BP_smoothing" or self.mode == "RRL_smoothing" or self.mode == "DSA_smoothing": 
-                        id = gt_id % 65536
-
                     if not self.args.obstacle_region:
 
-                        if id in risky_ids:
+                        if gt_id in risky_actor_ids:
                             risk_bbox_list.append([Loc(x=pos_0[0], y=pos_0[1]), 
                                                         Loc(x=pos_1[0], y=pos_1[1]), 
                                                         Loc(x=pos_2[0], y=pos_2[1]), 
@@ -1930,11 +1712,12 @@ class Inference():
         if self.mode == "Full_Observation" or self.mode == "AUTO":
             vehicle_bbox_list = vehicle_bbox_list + self.static_vehicle_bbox_list
 
-        birdview: BirdView = self.birdview_producer.produce(ego_pos, yaw=ego_yaw,
-                                                       agent_bbox_list=agent_bbox_list, 
-                                                       vehicle_bbox_list=vehicle_bbox_list,
-                                                       pedestrians_bbox_list=pedestrian_bbox_list,
-                                                       obstacle_bbox_list=obstacle_bbox_list)
+        with profiling.span("bev_render"):
+            birdview: BirdView = self.birdview_producer.produce(ego_pos, yaw=ego_yaw,
+                                                           agent_bbox_list=agent_bbox_list, 
+                                                           vehicle_bbox_list=vehicle_bbox_list,
+                                                           pedestrians_bbox_list=pedestrian_bbox_list,
+                                                           obstacle_bbox_list=obstacle_bbox_list)
     
 
 
@@ -1942,14 +1725,6 @@ class Inference():
 
         topdown = BirdViewProducer.as_ss(birdview)
 
-        # N_CLASSES
-
-        topdown = torch.LongTensor(topdown)
-        topdown = torch.nn.functional.one_hot(topdown, 7).permute(2, 0, 1).float()
-
-        topdown = topdown.reshape([1, 7, 256, 256])
-        topdown = topdown.to(device)
-
 
 
         u = np.float32([ego_pos.x, ego_pos.y])
@@ -1975,36 +1750,49 @@ class Inference():
         target_xy = target_xy.to(device)
         
         
-        if self.mode == "AUTO":
+        with profiling.span("control"):
+            if self.mode == "AUTO":
             
-            control = self.agent.run_step()
-            control.manual_gear_shift = False
-            # world.player.apply_control(control)
+                control = self.agent.run_step()
+                control.manual_gear_shift = False
+                # world.player.apply_control(control)
             
-        else:
+            else:
 
-            with torch.no_grad():
-                points_pred = self.net.forward(topdown, target_xy)
-                control = self.net.controller(points_pred).cpu().data.numpy()[0]
+                with torch.no_grad():
+                    if self.remote_net is not None:
+                        # the server one-hot encodes the semantic classes, on the device of the batch
+                        output = self.remote_net(topdown[None], target_xy.cpu().numpy())[0]
+                        points_pred = torch.from_numpy(output[None, :-1])
+                        control = output[-1]
+                    else:
+                        # N_CLASSES
+                        topdown = torch.LongTensor(topdown)
+                        topdown = torch.nn.functional.one_hot(topdown, 7).permute(2, 0, 1).float()
+                        topdown = topdown.reshape([1, 7, 256, 256])
+                        topdown = topdown.to(device)
+
+                        points_pred = self.net.forward(topdown, target_xy)
+                        control = self.net.controller(points_pred).cpu().data.numpy()[0]
 
-            steer = control[0] 
-            desired_speed = control[1] 
+                steer = control[0] 
+                desired_speed = control[1] 
             
-            speed = world.player.get_velocity()
-            speed = ((speed.x)**2 + (speed.y)**2+(speed.z)**2)**(0.5)
+                speed = world.player.get_velocity()
+                speed = ((speed.x)**2 + (speed.y)**2+(speed.z)**2)**(0.5)
 
-            brake = desired_speed < 0.4 or (speed / desired_speed) > 1.1
+                brake = desired_speed < 0.4 or (speed / desired_speed) > 1.1
 
 
-            delta = np.clip(desired_speed - speed, 0.0, 0.5)
-            throttle = self.ego_speed_controller.step(delta)
-            throttle = np.clip(throttle, 0.0, 0.75) 
-            throttle = throttle if not brake else 0.0
+                delta = np.clip(desired_speed - speed, 0.0, 0.5)
+                throttle = self.ego_speed_controller.step(delta)
+                throttle = np.clip(throttle, 0.0, 0.75) 
+                throttle = throttle if not brake else 0.0
 
-            control = carla.VehicleControl()
-            control.steer = float(steer)
-            control.throttle = float(throttle) 
-            control.brake = float(brake)
+                control = carla.VehicleControl()
+                control.steer = float(steer)
+                control.throttle = float(throttle) 
+                control.brake = float(brake)
         
         
     
@@ -2013,14 +1801,15 @@ class Inference():
         # vis the result 
         # draw target point on BEV map 
 
-        birdview: BirdView = self.birdview_producer.produce(ego_pos, yaw=ego_yaw,
-                                                agent_bbox_list=agent_bbox_list, 
-                                                vehicle_bbox_list=[],
-                                                pedestrians_bbox_list=[],
-                                                obstacle_bbox_list=[],
-                                                risk_bbox_list=risk_bbox_list,
-                                                other_bbox_list=other_bbox_list,
-                                                risk_vis=True)
+        with profiling.span("bev_render_vis"):
+            birdview: BirdView = self.birdview_producer.produce(ego_pos, yaw=ego_yaw,
+                                                    agent_bbox_list=agent_bbox_list, 
+                                                    vehicle_bbox_list=[],
+                                                    pedestrians_bbox_list=[],
+                                                    obstacle_bbox_list=[],
+                                                    risk_bbox_list=risk_bbox_list,
+                                                    other_bbox_list=other_bbox_list,
+                                                    risk_vis=True)
 
         topview_rgb = BirdViewProducer.as_rgb(birdview)
         _topdown = Image.fromarray(topview_rgb)
@@ -2084,6 +1873,7 @@ class Inference():
         self.counter+=1
         return control, isReach
     
+    @profiling.profiled("save_video")
     def save_video(self):
 
         self.front_rgb_out.release()
@@ -2328,6 +2118,9 @@ def game_loop(args):
         data_collection = Data_Collection()
         data_collection.set_scenario_type(args.scenario_type)
         data_collection.set_ego_id(world)
+        data_collection.sensor_profile = world.sensor_profile
+        if args.compact_storage:
+            data_collection.use_compact_storage()
         data_collection.set_attribute(
             args.scenario_type, args.scenario_id, weather, args.random_actors, args.random_seed, args.map)
         
@@ -2376,8 +2169,12 @@ def game_loop(args):
         collision_counter = 0
 
     while (1):
-        clock.tick_busy_loop(40)
-        frame = world.world.tick()
+        profiling.tick()
+        with profiling.span("clock_wait"):
+            clock.tick_busy_loop(40)
+        with profiling.span("world.tick"):
+            frame = world.world.tick()
+        profiling.set_frame(frame)
 
         hud.frame = frame
         iter_tick += 1
@@ -2397,66 +2194,69 @@ def game_loop(args):
                     data_collection.set_gt_interactor(gt_interactor_id)
 
             # iterate actors
-            for actor_id, _ in filter_dict.items():
+            with profiling.span("actor_control"):
+                for actor_id, _ in filter_dict.items():
 
-                # apply recorded location and velocity on the controller
-                actors = world.world.get_actors()
-                # reproduce traffic light state
-                if actor_id == 'player' and ref_light:
-                    set_light_state(
-                        lights, light_dict, actor_transform_index[actor_id], annotate)
+                    # apply recorded location and velocity on the controller
+                    actors = world.world.get_actors()
+                    # reproduce traffic light state
+                    if actor_id == 'player' and ref_light:
+                        set_light_state(
+                            lights, light_dict, actor_transform_index[actor_id], annotate)
 
-                if actor_transform_index[actor_id] < len(transform_dict[actor_id]):
-                    x = transform_dict[actor_id][actor_transform_index[actor_id]].location.x
-                    y = transform_dict[actor_id][actor_transform_index[actor_id]].location.y
+                    if actor_transform_index[actor_id] < len(transform_dict[actor_id]):
+                        x = transform_dict[actor_id][actor_transform_index[actor_id]].location.x
+                        y = transform_dict[actor_id][actor_transform_index[actor_id]].location.y
 
-                    if 'vehicle' in filter_dict[actor_id]:
+                        if 'vehicle' in filter_dict[actor_id]:
 
-                        if not detect_start:
+                            if not detect_start:
                         
-                            if args.inference and actor_id == 'player':
-                                # Not to apply control for ego vehicle ( player )
-                                continue
-
-                        target_speed = (
-                            velocity_dict[actor_id][actor_transform_index[actor_id]])*3.6
-                        waypoint = transform_dict[actor_id][actor_transform_index[actor_id]]
-
-                        agents_dict[actor_id].apply_control(
-                            controller_dict[actor_id].run_step(target_speed, waypoint))
-                        # agents_dict[actor_id].apply_control(controller_dict[actor_id].run_step(
-                        #     (velocity_dict[actor_id][actor_transform_index[actor_id]])*3.6, transform_dict[actor_id][actor_transform_index[actor_id]]))
-
-                        v = agents_dict[actor_id].get_velocity()
-                        v = ((v.x)**2 + (v.y)**2+(v.z)**2)**(0.5)
-
-                        # to avoid the actor slowing down for the dense location around
-                        if agents_dict[actor_id].get_transform().location.distance(transform_dict[actor_id][actor_transform_index[actor_id]].location) < 2.0:
-                            actor_transform_index[actor_id] += 2
-                        elif agents_dict[actor_id].get_transform().location.distance(transform_dict[actor_id][actor_transform_index[actor_id]].location) > 6.0:
-                            actor_transform_index[actor_id] += 6
-                        else:
-                            actor_transform_index[actor_id] += 1
+                                if args.inference and actor_id == 'player':
+                                    # Not to apply control for ego vehicle ( player )
+                                    continue
+
+                            target_speed = (
+                                velocity_dict[actor_id][actor_transform_index[actor_id]])*3.6
+                            waypoint = transform_dict[actor_id][actor_transform_index[actor_id]]
+
+                            agents_dict[actor_id].apply_control(
+                                controller_dict[actor_id].run_step(target_speed, waypoint))
+                            # agents_dict[actor_id].apply_control(controller_dict[actor_id].run_step(
+                            #     (velocity_dict[actor_id][actor_transform_index[actor_id]])*3.6, transform_dict[actor_id][actor_transform_index[actor_id]]))
+
+                            v = agents_dict[actor_id].get_velocity()
+                            v = ((v.x)**2 + (v.y)**2+(v.z)**2)**(0.5)
+
+                            # to avoid the actor slowing down for the dense location around
+                            if agents_dict[actor_id].get_transform().location.distance(transform_dict[actor_id][actor_transform_index[actor_id]].location) < 2.0:
+                                actor_transform_index[actor_id] += 2
+                            elif agents_dict[actor_id].get_transform().location.distance(transform_dict[actor_id][actor_transform_index[actor_id]].location) > 6.0:
+                                actor_transform_index[actor_id] += 6
+                            else:
+                                actor_transform_index[actor_id] += 1
 
-                    elif 'pedestrian' in filter_dict[actor_id]:
-                        agents_dict[actor_id].apply_control(
-                            ped_control_dict[actor_id][actor_transform_index[actor_id]])
-                        actor_transform_index[actor_id] += 1
-                else:
-                    finish[actor_id] = True
+                        elif 'pedestrian' in filter_dict[actor_id]:
+                            agents_dict[actor_id].apply_control(
+                                ped_control_dict[actor_id][actor_transform_index[actor_id]])
+                            actor_transform_index[actor_id] += 1
+                    else:
+                        finish[actor_id] = True
 
             if args.inference:
                 if detect_start:
                     
                     if args.mode == "BP" or  args.mode == "BCP" or  args.mode ==  "DSA" or  args.mode ==  "RRL" or args.mode =="BCP_smoothing" or args.mode == "BP_smoothing" or args.mode == "RRL_smoothing" or args.mode == "DSA_smoothing":
-                        inference.run_inference(frame, world, True)
+                        with profiling.span("inference"):
+                            inference.run_inference(frame, world, True)
                     else:
                         inference.collect_actor_data(world, frame)
                 
                 
                 if not detect_start:
                     if args.inference:
-                        control, isReach = inference.run_inference(frame, world)
+                        with profiling.span("inference"):
+                            control, isReach = inference.run_inference(frame, world)
                         world.player.apply_control(control)
 
                         if isReach:
@@ -2506,14 +2306,16 @@ def game_loop(args):
 
                 if not args.no_save and (not abandon_scenario) and collection_flag and detect_start == False and not args.inference:
                     # collect data in sensor's list
-                    data_collection.collect_sensor(frame, world)
+                    with profiling.span("collect_sensor"):
+                        data_collection.collect_sensor(frame, world)
 
-                view = pygame.surfarray.array3d(display)
-                #  convert from (width, height, channel) to (height, width, channel)
-                view = view.transpose([1, 0, 2])
-                #  convert from rgb to bgr
-                image = cv2.cvtColor(view, cv2.COLOR_RGB2BGR)
-                out.write(image)
+                with profiling.span("video_write"):
+                    view = pygame.surfarray.array3d(display)
+                    #  convert from (width, height, channel) to (height, width, channel)
+                    view = view.transpose([1, 0, 2])
+                    #  convert from rgb to bgr
+                    image = cv2.cvtColor(view, cv2.COLOR_RGB2BGR)
+                    out.write(image)
 
                 ego_loc = world.player.get_location()
                 x = ego_loc.x
@@ -2529,6 +2331,7 @@ def game_loop(args):
                             detect_end = True
                             if not args.no_save and not args.inference:
                                 data_collection.set_start_frame(frame)
+                                world.camera_manager.set_start_frame(frame)
 
                     if not args.inference or not args.no_save:
                         # check end point
@@ -2558,9 +2361,10 @@ def game_loop(args):
                     break
 
             # cehck end position
-        world.tick(clock)
-        world.render(display)
-        pygame.display.flip()
+        with profiling.span("pygame_render"):
+            world.tick(clock)
+            world.render(display)
+            pygame.display.flip()
 
     if args.no_save and args.generate_random_seed and (not abandon_scenario) and not args.test:
         # save random_seed
@@ -2572,10 +2376,13 @@ def game_loop(args):
         # save for only one time
         data_collection.collect_actor_attr(world)
         data_collection.collect_static_actor_data(world)
-        data_collection.save_data(stored_path)
+        with profiling.span("save_data"):
+            data_collection.save_data(stored_path)
 
     # to save a top view video
     out.release()
+    profiling.end("tick")
+    profiling.dump()
     print('Closing...')
 
     print('destroying vehicles')
@@ -2716,6 +2523,29 @@ def main():
         help='enable roaming actors')
     
 
+    argparser.add_argument(
+        '--inference_server',
+        type=str,
+        default=None,
+        help='Unix socket of a running util/inference_server.py, to share the models with other workers')
+
+    argparser.add_argument(
+        '--profile',
+        type=str,
+        default=None,
+        help='directory of the Chrome trace and latency summary of the tick phases, no profiling by default')
+
+    argparser.add_argument(
+        '--sensor_profile',
+        type=str,
+        default=None,
+        help='JSON file of the enabled sensors, their sampling period and active window (see util/sensor_profile.py), every sensor on every tick by default')
+
+    argparser.add_argument(
+        '--compact_storage',
+        action='store_true',
+        help='save the lidar, depth and instance segmentation frames into per-episode containers (lidar.zip, depth_<view>.zip, instance_<view>.zip) read by util/replay.py, one file per frame by default')
+
     argparser.add_argument(
         '--obstacle_region',
         # default=False,
@@ -2731,6 +2561,9 @@ def main():
 
     logging.info('listening to server %s:%s', args.host, args.port)
 
+    if args.profile:
+        profiling.enable(args.profile, "inference" if args.inference else "collection")
+
 
     try:
 
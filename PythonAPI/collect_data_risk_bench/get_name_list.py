@@ -1,6 +1,7 @@
 import os
 # Generate name list for collecting data
 # useage: python get_name_list > name.txt
+from util.dataset_catalog import DatasetCatalog
 
 if __name__ =="__main__":
     import argparse
@@ -14,26 +15,8 @@ if __name__ =="__main__":
     args = parser.parse_args()
     scenario = args.scenario_type
     if os.path.exists(f"./data_collection/{scenario}"):
-        basic_scenario_list = sorted(os.listdir(f"./data_collection/{scenario}"))
-
-        for basic_scenario in basic_scenario_list:
-            
-            town_id = basic_scenario.split("_")[0]
-            if town_id[0] =="A" or town_id[0] =="B":
-                town = town_id
-            elif town_id[:2] == "10":
-                town = "Town10HD"
-            else:
-                town = f"Town0{town_id[0]}"
-            variant_scenario_list = sorted(os.listdir(f"./data_collection/{scenario}/{basic_scenario}/variant_scenario"))
-            for variant_scenario in variant_scenario_list:
-
-                weather = variant_scenario.split("_")[0]
-                actor = variant_scenario.split("_")[1]
-                with open(f"./data_collection/{scenario}/{basic_scenario}/variant_scenario/{variant_scenario}/seed.txt") as f:
-                    random_seed = int(f.readline())
-                print(scenario, basic_scenario, town, weather, actor, random_seed)
-                
-     
-        
-                    
+        # episodes are listed by the catalog, the seed of those without seed.txt is unknown
+        with DatasetCatalog.open("./data_collection") as catalog:
+            for episode in catalog.episodes(scenario_type=scenario, has_seed=True):
+                print(scenario, episode["basic_scenario"], episode["town"], episode["weather"],
+                      episode["random_actors"], episode["random_seed"])
@@ -16,7 +16,8 @@ class KalmanFilter:
         measured = np.array([[np.float32(coordX)], [np.float32(coordY)]])
         self.kf.correct(measured)
         predicted = self.kf.predict()
-        return predicted
+        # (4, 1) state, its rows as scalars: numpy 2 refuses a 1-element array in a scalar slot
+        return predicted[:, 0]
 
 def angle_vectors(v1, v2):
     """ Returns angle between two vectors.  """
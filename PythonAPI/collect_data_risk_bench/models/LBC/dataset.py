@@ -8,6 +8,7 @@ import ujson
 
 from bird_eye_view.Mask import PixelDimensions, square_fitting_rect_at_any_rotation, MapMaskGenerator, RenderingWindow, BirdViewMasks, Coord, Loc, COLOR_OFF, COLOR_ON
 from bird_eye_view.BirdViewProducer import BirdViewProducer, BirdView
+from util.dataset_catalog import DatasetCatalog, describe_episode
 
 
 
@@ -105,21 +106,19 @@ class CarlaDataset(torch.utils.data.Dataset):
         self.dataset_dir = root_dir
         self.is_train  = is_train
 
+        # scenario_list = ["interactive", "non-interactive", "collision", "obstacle"]
+        scenario_list = [ "obstacle", "collision" , "interactive", "non-interactive"]
+        with DatasetCatalog.open(self.dataset_dir) as catalog:
+            episodes = {os.path.normpath(episode.abspath): episode
+                        for episode in catalog.episodes(scenario_type=scenario_list)}
+
         if not os.path.exists("./train_val_dataset.pkl"):
-            # scenario_list = ["interactive", "non-interactive", "collision", "obstacle"]
-            scenario_list = [ "obstacle", "collision" , "interactive", "non-interactive"]
             train_data, val_data = [], []
-            for scenario in scenario_list:
-                basic_scenario_list = os.listdir(os.path.join(self.dataset_dir, scenario))
-                for basic_scenario in basic_scenario_list:
-                    variant_scenario_list = os.listdir(os.path.join(self.dataset_dir, scenario, basic_scenario, "variant_scenario"))
-                    for variant_scenario in variant_scenario_list:
-    
-                        path = os.path.join(self.dataset_dir, scenario, basic_scenario, "variant_scenario", variant_scenario )
-                        if random.random() > 0.2:
-                            train_data.append(path)
-                        else:
-                            val_data.append(path)  
+            for path in episodes:
+                if random.random() > 0.2:
+                    train_data.append(path)
+                else:
+                    val_data.append(path)  
                         
                             
             dataset_dict = {}
@@ -158,17 +157,19 @@ class CarlaDataset(torch.utils.data.Dataset):
             else:
                 scenario = "non-interactive"
                 
-            # All frame starts from 1     
-            frame_path_list =  sorted(os.listdir( os.path.join(subroot,"actors_data")))
-            num_of_frame = len(frame_path_list)
+            # All frame starts from 1, frame counts and collision frames come from the catalog
+            episode = episodes.get(os.path.normpath(subroot))
+            if episode is None:
+                # episode of an older train_val_dataset.pkl, removed from the tree or not cataloged yet
+                if not os.path.isdir(subroot):
+                    continue
+                episode = describe_episode(subroot, self.dataset_dir)
+            num_of_frame = episode["num_frames"]
 
                     
             # if scenario is collision -- > we use collision frame as final frame 
             if scenario == "collision":
-                with open(os.path.join(subroot,"collision_frame.json") ) as f:
-                    collision_frame_json = ujson.load(f)
-                    collision_frame = collision_frame_json["frame"]
-                    num_of_frame = collision_frame - 1
+                num_of_frame = episode["collision_frame"] - 1
             
             for i in range(1, num_of_frame + 1 - GAP * STEPS):
                 sub_frame_path = []
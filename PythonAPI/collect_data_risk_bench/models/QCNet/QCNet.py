@@ -1,7 +1,5 @@
 import os
-from itertools import chain
-from itertools import compress
-from typing import Any, Dict, List,Optional
+from typing import Any, Dict
 
 import numpy as np
 import pandas as pd
@@ -49,83 +47,144 @@ def obstacle_collision(car_length, car_width, obs_length, obs_width, ego_x, ego_
             abs(obs_axisX_1 * ego_cos - obs_axisY_1 * ego_cos) + abs(obs_axisX_2 * ego_sin + obs_axisY_2 * ego_cos) + vehicle_width / 2:
         return now_id
     
-def get_agent_features(df: pd.DataFrame, num_historical_steps: int, dim=2) -> Dict[str, Any]:
+AGENT_TYPES = ['vehicle', 'pedestrian', 'obstacle']
+OBSTACLE_TYPES = ['static.prop.trafficcone01', 'static.prop.streetbarrier', 'static.prop.trafficwarning']
+HISTORY_COLUMNS = ['X', 'Y', 'VELOCITY_X', 'VELOCITY_Y', 'YAW']
+
+_models = {}
+_map_caches = {}
+
+
+def load_model(ckpt_path):
     '''
-    df: FRAME, TRACK_ID, OBJECT_TYPE (vehicle, pedestrian, obstacle), X, Y, VELOCITY_X, VELOCITY_Y, YAW
+    Load a QCNet checkpoint once and keep it on the inference device.
     '''
-    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-    agent_types = ['vehicle', 'pedestrian', 'obstacle']
-    vector_repr = True
-    predict_unseen_agents = False
-    if not predict_unseen_agents:  # filter out agents that are unseen during the historical time steps
-        # historical_df = df[df['timestep'] < self.num_historical_steps]
-        agent_ids = list(df['TRACK_ID'].unique())
-        df = df[df['TRACK_ID'].isin(agent_ids)]
-    else:
-        agent_ids = list(df['TRACK_ID'].unique())
-    df.loc[df.OBJECT_TYPE == 'EGO', 'OBJECT_TYPE'] = 'vehicle'
-    df.loc[df.OBJECT_TYPE == 'static.prop.trafficcone01', 'OBJECT_TYPE'] = 'obstacle'
-    df.loc[df.OBJECT_TYPE == 'static.prop.streetbarrier', 'OBJECT_TYPE'] = 'obstacle'
-    df.loc[df.OBJECT_TYPE == 'static.prop.trafficwarning', 'OBJECT_TYPE'] = 'obstacle'
+    if ckpt_path not in _models:
+        device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        model = QCNet.load_from_checkpoint(checkpoint_path=ckpt_path)
+        _models[ckpt_path] = model.to(device).eval()
+    return _models[ckpt_path]
+
+
+def get_map_cache(ckpt_path):
+    '''
+    Per-town map encoding cache of a map-aware checkpoint, None when the checkpoint has no map encoder.
+    '''
+    model = load_model(ckpt_path)
+    if model.encoder.map_encoder is None:
+        return None
+    if ckpt_path not in _map_caches:
+        from models.QCNet.map_cache import MapEncodingCache
+        checkpoint_name = os.path.splitext(os.path.basename(ckpt_path))[0]
+        _map_caches[ckpt_path] = MapEncodingCache(model, checkpoint_name)
+    return _map_caches[ckpt_path]
+
+
+def agent_type_code(object_type):
+    '''
+    Index in AGENT_TYPES of an OBJECT_TYPE value (EGO is a vehicle, the static props are obstacles).
+    '''
+    if object_type == 'EGO':
+        return AGENT_TYPES.index('vehicle')
+    if object_type in OBSTACLE_TYPES:
+        return AGENT_TYPES.index('obstacle')
+    return AGENT_TYPES.index(object_type)
 
+
+def get_agent_history(df: pd.DataFrame, num_historical_steps: int):
+    '''
+    df: FRAME, TRACK_ID, OBJECT_TYPE, X, Y, VELOCITY_X, VELOCITY_Y, YAW, rows of a track in time order
+
+    Returns:
+        agent_ids: list of the N track ids, in order of appearance
+        history: float32 array [N, num_historical_steps, 5] (X, Y, VELOCITY_X, VELOCITY_Y, YAW)
+        valid: bool array [N, num_historical_steps], False where a track is shorter than the history
+        agent_type: uint8 array [N], index in AGENT_TYPES
+    '''
+    codes, agent_ids = pd.factorize(df['TRACK_ID'])
     num_agents = len(agent_ids)
+    # the last row of every track goes to the last historical step
+    step = num_historical_steps - 1 - df.groupby(codes).cumcount(ascending=False).to_numpy()
+    keep = step >= 0
+
+    history = np.zeros((num_agents, num_historical_steps, len(HISTORY_COLUMNS)), dtype=np.float32)
+    valid = np.zeros((num_agents, num_historical_steps), dtype=bool)
+    history[codes[keep], step[keep]] = df[HISTORY_COLUMNS].to_numpy(dtype=np.float32)[keep]
+    valid[codes[keep], step[keep]] = True
 
-    # initialization
-    valid_mask = torch.zeros(num_agents, num_historical_steps, dtype=torch.bool).to(device)
-    current_valid_mask = torch.zeros(num_agents, dtype=torch.bool).to(device)
-    predict_mask = torch.zeros(num_agents, num_historical_steps, dtype=torch.bool).to(device)
-    agent_id: List[Optional[str]] = [None] * num_agents
-    agent_type = torch.zeros(num_agents, dtype=torch.uint8).to(device)
-    position = torch.zeros(num_agents, num_historical_steps, dim, dtype=torch.float).to(device)
-    heading = torch.zeros(num_agents, num_historical_steps, dtype=torch.float).to(device)
-    velocity = torch.zeros(num_agents, num_historical_steps, dim, dtype=torch.float).to(device)
-
-    for track_id, track_df in df.groupby('TRACK_ID'):
-        agent_idx = agent_ids.index(track_id)
-        # agent_steps = track_df['timestep'].values
-
-        # valid_mask[agent_idx, agent_steps] = True
-        valid_mask[agent_idx, :] = True
-        current_valid_mask[agent_idx] = valid_mask[agent_idx, num_historical_steps - 1]
-        # predict_mask[agent_idx, agent_steps] = True
-        predict_mask[agent_idx, :] = True
-        if vector_repr:  # a time step t is valid only when both t and t-1 are valid
-            valid_mask[agent_idx, 1: num_historical_steps] = (
-                    valid_mask[agent_idx, :num_historical_steps - 1] &
-                    valid_mask[agent_idx, 1: num_historical_steps])
-            valid_mask[agent_idx, 0] = False
-        predict_mask[agent_idx, :num_historical_steps] = False
-        if not current_valid_mask[agent_idx]:
-            predict_mask[agent_idx, num_historical_steps:] = False
-
-        agent_id[agent_idx] = track_id
-        agent_type[agent_idx] = agent_types.index(track_df['OBJECT_TYPE'].values[0])
-        # position[agent_idx, agent_steps, :2] = torch.from_numpy(np.stack([track_df['position_x'].values,
-        #                                                                     track_df['position_y'].values],
-        #                                                                     axis=-1)).float()
-        # heading[agent_idx, agent_steps] = torch.from_numpy(track_df['heading'].values).float()
-        # velocity[agent_idx, agent_steps, :2] = torch.from_numpy(np.stack([track_df['velocity_x'].values,
-        #                                                                     track_df['velocity_y'].values],
-        #                                                                     axis=-1)).float()
-        position[agent_idx, :, :2] = torch.from_numpy(np.stack([track_df['X'].values,
-                                                                            track_df['Y'].values],
-                                                                            axis=-1)).float()
-        heading[agent_idx, :] = torch.from_numpy(track_df['YAW'].values).float()
-        velocity[agent_idx, :, :2] = torch.from_numpy(np.stack([track_df['VELOCITY_X'].values,
-                                                                            track_df['VELOCITY_Y'].values],
-                                                                            axis=-1)).float()
+    first_type = df['OBJECT_TYPE'].groupby(codes).first()
+    type_map = {t: agent_type_code(t) for t in first_type.unique()}
+    agent_type = first_type.map(type_map).to_numpy(dtype=np.uint8)
+    return list(agent_ids), history, valid, agent_type
+
+
+def get_agent_features_from_array(agent_ids, history, valid, agent_type, num_historical_steps: int) -> Dict[str, Any]:
+    '''
+    Build the HeteroData agent dict from the arrays of get_agent_history, with a single host to device copy.
+    '''
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    num_agents = len(agent_ids)
+
+    # X, Y, VELOCITY_X, VELOCITY_Y, YAW, valid, type packed in one buffer
+    packed = np.empty((num_agents, num_historical_steps, 7), dtype=np.float32)
+    packed[..., :5] = history[:, -num_historical_steps:]
+    packed[..., 5] = valid[:, -num_historical_steps:]
+    packed[..., 6] = np.asarray(agent_type)[:, None]
+    packed = torch.from_numpy(packed).to(device)
+
+    # vector_repr: a time step t is valid only when both t and t-1 are valid
+    valid_mask = packed[..., 5] > 0.5
+    valid_mask = torch.cat([valid_mask.new_zeros(num_agents, 1), valid_mask[:, :-1] & valid_mask[:, 1:]], dim=1)
 
     return {
         'num_nodes': num_agents,
-        'valid_mask': valid_mask.to(device),
-        'predict_mask': predict_mask.to(device),
-        'id': agent_id,
-        'type': agent_type.to(device),
-        'position': position.to(device),
-        'heading': heading.to(device),
-        'velocity': velocity.to(device),
+        'valid_mask': valid_mask,
+        'predict_mask': torch.zeros_like(valid_mask),
+        'id': list(agent_ids),
+        'type': packed[:, 0, 6].to(torch.uint8),
+        'position': packed[..., 0:2],
+        'heading': packed[..., 4],
+        'velocity': packed[..., 2:4],
     }
 
+
+def get_agent_features(df: pd.DataFrame, num_historical_steps: int, dim=2) -> Dict[str, Any]:
+    '''
+    df: FRAME, TRACK_ID, OBJECT_TYPE (vehicle, pedestrian, obstacle), X, Y, VELOCITY_X, VELOCITY_Y, YAW
+    '''
+    return get_agent_features_from_array(*get_agent_history(df, num_historical_steps), num_historical_steps)
+
+
+@torch.no_grad()
+def predict(agent: Dict[str, Any], model, num_historical_steps=20, output_dim=2, map_data=None):
+    '''
+    Args:
+        agent: dict of get_agent_features_from_array
+        model: pretrained model, already on the inference device
+        map_data: optional map node and edge stores, either the raw polygons of map_cache.get_map_features
+            or a map_polygon store with cached embeddings from MapEncodingCache.crop
+
+    Returns:
+        traj_pred: array [N, num_future_steps, 2] in world coordinates
+    '''
+    data = HeteroData({'agent': agent, **(map_data or {})})
+    pred = model(data)
+    loc_refine = pred['loc_refine_pos'][..., :output_dim]
+    if loc_refine.size(1) > 1:
+        best_mode = pred['pi'].argmax(dim=-1)
+        loc_refine = loc_refine[torch.arange(loc_refine.size(0), device=loc_refine.device), best_mode]
+    else:
+        loc_refine = loc_refine[:, 0]
+
+    origin = agent['position'][:, num_historical_steps - 1]
+    theta = agent['heading'][:, num_historical_steps - 1]
+    cos, sin = theta.cos(), theta.sin()
+    rot_mat = torch.stack([torch.stack([cos, sin], dim=-1),
+                           torch.stack([-sin, cos], dim=-1)], dim=-2)
+    traj_eval = torch.matmul(loc_refine[..., :2], rot_mat) + origin[:, :2].unsqueeze(1)
+    return traj_eval.cpu().numpy()
+
+
 def inference(input_df, model, num_historical_steps=20, output_dim=2):
     '''
     Args:
@@ -135,87 +194,29 @@ def inference(input_df, model, num_historical_steps=20, output_dim=2):
     Returns:
         out_df: columns=['FRAME', 'TRACK_ID', 'X', 'Y']
     '''
-    # Check device
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-
-    # Preprocessing
-    data = {}
-    data['agent'] = get_agent_features(input_df, num_historical_steps)
-    #print("before:", data)
-    data = HeteroData(data)
-    data = data.to(device)
     model = model.to(device)
-    #print("after:", data)
-    # print(data['agent']['num_nodes'])
-    # print(data['agent']['valid_mask'])
-    # print(data['agent']['predict_mask'])
-    # print(data['agent']['id'])
-    # print(data['agent']['type'])
-    # print(data['agent']['position'])
-    # print(data['agent']['heading'])
-    # print(data['agent']['velocity'])
-
-    # inference
-    pred = model(data)
-    if model.output_head:
-        traj_refine = torch.cat([pred['loc_refine_pos'][..., :output_dim],
-                                    pred['loc_refine_head'],
-                                    pred['scale_refine_pos'][..., :output_dim],
-                                    pred['conc_refine_head']], dim=-1)
-    else:
-        traj_refine = torch.cat([pred['loc_refine_pos'][..., :output_dim],
-                                    pred['scale_refine_pos'][..., :output_dim]], dim=-1)
-
-    eval_mask = data['agent']['type'] < 3
-
-    origin_eval = data['agent']['position'][eval_mask, num_historical_steps - 1]
-    theta_eval = data['agent']['heading'][eval_mask, num_historical_steps - 1]
-    cos, sin = theta_eval.cos(), theta_eval.sin()
-    rot_mat = torch.zeros(eval_mask.sum(), 2, 2, device=device)
-    rot_mat[:, 0, 0] = cos
-    rot_mat[:, 0, 1] = sin
-    rot_mat[:, 1, 0] = -sin
-    rot_mat[:, 1, 1] = cos
-    traj_eval = torch.matmul(traj_refine[eval_mask, :, :, :2],
-                                rot_mat.unsqueeze(1)) + origin_eval[:, :2].reshape(-1, 1, 1, 2)
-    traj_eval = traj_eval.detach().cpu().numpy() #.cpu().numpy()
-    traj_pred = traj_eval.squeeze() # shape: [n, 30, 2]
-
-    ##################################################################3
-    #agent_ids = list(compress(list(chain(*data['agent']['id'])), eval_mask)) # shape: n
-    agent_ids = data['agent']['id']
-
-    # To dataframe
-    num_agents = len(agent_ids)
-    num_future_frame = traj_pred.shape[1]
-    out_np_arr = np.zeros((num_agents*num_future_frame, 4)) # shape: [n*30, 4]
+    agent = get_agent_features(input_df, num_historical_steps)
+    traj_pred = predict(agent, model, num_historical_steps, output_dim)  # shape: [n, 30, 2]
+
+    # To dataframe, rows ordered by frame then agent
+    num_agents, num_future_frame = traj_pred.shape[:2]
     start_frame = list(input_df['FRAME'].unique())[-1] + 1
-    frame_list = np.arange(start_frame, start_frame+30)
-    for idx, traj in enumerate(traj_pred):
-        indices = list(range(idx, num_future_frame*num_agents, num_agents))
-        # print("indices:", indices)
-        # print("frame_list:", frame_list)
-        # print("out_np_arr[indices]:", out_np_arr[indices].shape, out_np_arr[indices])
-        # out_np_arr[indices][0] = frame_list
-        # out_np_arr[indices][1] = agent_ids[idx]
-        # out_np_arr[indices][2:] = traj
-        out_np_arr[indices, 0] = frame_list
-        out_np_arr[indices, 1] = agent_ids[idx]
-        out_np_arr[indices, 2:] = traj
-
-
-    out_df = pd.DataFrame(data=out_np_arr, columns=['FRAME', 'TRACK_ID', 'X', 'Y'])
-    out_df['FRAME'] = out_df['FRAME'].astype("int")
-    out_df['TRACK_ID'] = out_df['TRACK_ID'].astype("int").astype("str")
+    out_df = pd.DataFrame({
+        'FRAME': np.repeat(np.arange(start_frame, start_frame + num_future_frame), num_agents),
+        'TRACK_ID': np.tile(np.asarray(agent['id']).astype("int").astype("str"), num_future_frame),
+        'X': traj_pred[:, :, 0].T.reshape(-1),
+        'Y': traj_pred[:, :, 1].T.reshape(-1),
+    })
     out_df = pd.concat([input_df, out_df])
     out_df['X'] = out_df['X'].astype("float")
     out_df['Y'] = out_df['Y'].astype("float")
     out_df = out_df.drop(columns=['OBJECT_TYPE', 'VELOCITY_X', 'VELOCITY_Y', 'YAW'])
     out_df = out_df.reset_index(drop=True)
-    #print("out_df:", out_df)
     return out_df
 
-def QCNet_inference(vehicle_list, specific_frame, variant_ego_id, pedestrian_id_list, vehicle_id_list, obstacle_dict):
+def QCNet_inference(vehicle_list, specific_frame, variant_ego_id, pedestrian_id_list, vehicle_id_list, obstacle_dict,
+                    town=None, carla_map=None):
 
     vehicle_length = 4.7
     vehicle_width = 2
@@ -231,65 +232,52 @@ def QCNet_inference(vehicle_list, specific_frame, variant_ego_id, pedestrian_id_
 
     #config
     future_len = 30
-    #print(vehicle_list)
+    num_historical_steps = 20
 
     ckpt_path = './models/weights/QCNet/epoch38.ckpt'
-    model = {
-        'QCNet': QCNet,
-    }['QCNet'].load_from_checkpoint(checkpoint_path=ckpt_path)
-    # print(pd.concat(vehicle_list))
+    model = load_model(ckpt_path)
     inference_df = pd.concat(vehicle_list)
-    
-    #print("before ids:", len(list(set(inference_df['TRACK_ID'].values))), list(set(inference_df['TRACK_ID'].values)))
-    
-    #print("obstacle_dict:", obstacle_dict)
-    for track_id, rest_df in inference_df.groupby('TRACK_ID'):
-        if track_id in vehicle_id_list:
-            inference_df.loc[inference_df.OBJECT_TYPE == 'ACTOR', 'OBJECT_TYPE'] = 'vehicle'
-        elif track_id in pedestrian_id_list:
-            inference_df.loc[inference_df.OBJECT_TYPE == 'ACTOR', 'OBJECT_TYPE'] = 'pedestrian'
-    inference_df.loc[inference_df.OBJECT_TYPE == 'ACTOR', 'OBJECT_TYPE'] = 'vehicle'
-    temp_df = inference(inference_df, model)
-    temp_df['TRACK_ID'] = temp_df['TRACK_ID'].astype("int")
-    
-    #print("ids:", len(list(set(temp_df['TRACK_ID'].values))), list(set(temp_df['TRACK_ID'].values)))
-    
-    #print("temp_df:", temp_df)
-    vehicle_list = []
-    for track_id, remain_df in temp_df.groupby('TRACK_ID'):
-        vehicle_list.append(remain_df)
-        # if int(track_id) == 97712:
-        #     print(track_id, remain_df)
+
+    # the interactor is labelled ACTOR, give it the type of its own track
+    actor_mask = (inference_df.OBJECT_TYPE == 'ACTOR').to_numpy()
+    if actor_mask.any():
+        is_pedestrian = inference_df.TRACK_ID.isin(pedestrian_id_list).to_numpy()
+        inference_df = inference_df.assign(OBJECT_TYPE=np.where(
+            actor_mask, np.where(is_pedestrian, 'pedestrian', 'vehicle'), inference_df.OBJECT_TYPE))
+
+    agent_ids, history, valid, agent_types = get_agent_history(inference_df, num_historical_steps)
+    agent = get_agent_features_from_array(agent_ids, history, valid, agent_types, num_historical_steps)
+
+    # map-aware checkpoints get the cached polygon embeddings around the ego
+    map_data = None
+    map_cache = get_map_cache(ckpt_path)
+    if map_cache is not None and town is not None:
+        ego_rows = [n for n, track_id in enumerate(agent_ids) if int(track_id) == int(variant_ego_id)]
+        if ego_rows:
+            center = history[ego_rows[0], -1, :2]
+        else:
+            center = history[:, -1, :2].mean(axis=0)
+        # actors are kept within 37.5 m of the ego on each axis, polygons up to pl2a_radius around them
+        radius = 37.5 * math.sqrt(2) + model.pl2a_radius
+        map_data = {'map_polygon': map_cache.crop(town, center.tolist(), radius, carla_map)}
+    traj_pred = predict(agent, model, num_historical_steps, map_data=map_data)
+
+    # vl : history then prediction, x, y
+    trajectories = np.concatenate([history[:, :, :2], traj_pred], axis=1)
 
     risky_vehicle_list = []
     ego_prediction = np.zeros((future_len, 2))
-    #print("vehicle_list:", vehicle_list)
-    for n in range(len(vehicle_list)):
-        vl = vehicle_list[n].to_numpy()
-        now_id = int(vl[0][1])
+    for n, now_id in enumerate(agent_ids):
         if int(now_id) == int(variant_ego_id):
-            ego_now_pos_x = vl[0][2]
-            ego_now_pos_y = vl[0][3]
-            for pred_t in range(future_len - 1):
-                real_pred_x = vl[pred_t + 20][2]
-                real_pred_x_next = vl[pred_t + 21][2]
-                real_pred_y = vl[pred_t + 20][3]
-                real_pred_y_next = vl[pred_t + 21][3]
-                ego_prediction[pred_t][0] = real_pred_x
-                ego_prediction[pred_t][1] = real_pred_y
-                if pred_t == int(future_len - 2):
-                    ego_prediction[pred_t +
-                                   1][0] = real_pred_x_next
-                    ego_prediction[pred_t +
-                                   1][1] = real_pred_y_next
+            ego_prediction[:] = traj_pred[n, :future_len]
 
     agent_type = 0
-    for val_vehicle_num in range(len(vehicle_list)):
+    for val_vehicle_num, now_id in enumerate(agent_ids):
         #ego, agent, other = 0, 0, 0
-        vl = vehicle_list[val_vehicle_num].to_numpy()
-        # vl : frame, id, x, y
-        #print("vl:", vl)
-        now_id = vl[0][1]
+        vl = trajectories[val_vehicle_num]
+        now_id = int(now_id)
+        # static obstacles, position of the last observed step
+        obs_x, obs_y = vl[num_historical_steps - 1]
         if str(int(now_id)) in pedestrian_id_list:
             agent_type = 1
         elif str(int(now_id)) in vehicle_id_list:
@@ -300,14 +288,15 @@ def QCNet_inference(vehicle_list, specific_frame, variant_ego_id, pedestrian_id_
         for pred_t in range(future_len - 1):
             if int(now_id) == int(variant_ego_id):
                 continue
-            real_pred_x = vl[pred_t + 20][2]
-            real_pred_x_next = vl[pred_t + 21][2]
-            real_pred_y = vl[pred_t + 20][3]
-            real_pred_y_next = vl[pred_t + 21][3]
+            real_pred_x = vl[pred_t + 20][0]
+            real_pred_x_next = vl[pred_t + 21][0]
+            real_pred_y = vl[pred_t + 20][1]
+            real_pred_y_next = vl[pred_t + 21][1]
             #print(now_id, obstacle_id_list)
             
             #if str(int(now_id)) in obstacle_id_list:
-            if int(now_id) in list(obstacle_dict):
+            if now_id in obstacle_dict:
+                temp = None
                 # temp = obstacle_collision(vehicle_length, vehicle_width, 2, 2, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
                 #                                  pred_t + 1][0], ego_prediction[pred_t + 1][1], vl[0][2], vl[0][3], 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
                 
@@ -322,13 +311,13 @@ def QCNet_inference(vehicle_list, specific_frame, variant_ego_id, pedestrian_id_
                 #                                 pred_t + 1][0], ego_prediction[pred_t + 1][1], vl[0][2], vl[0][3], 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
                 if obstacle_dict[now_id] == 'static.prop.trafficcone01':
                     temp = obstacle_collision(vehicle_length, vehicle_width, 0.85, 0.85, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                                                pred_t + 1][0], ego_prediction[pred_t + 1][1], vl[0][2], vl[0][3], 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
+                                                pred_t + 1][0], ego_prediction[pred_t + 1][1], obs_x, obs_y, 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
                 elif obstacle_dict[now_id] == 'static.prop.streetbarrier':
                     temp = obstacle_collision(vehicle_length, vehicle_width, 1.25, 0.375, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                                                pred_t + 1][0], ego_prediction[pred_t + 1][1], vl[0][2], vl[0][3], 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
+                                                pred_t + 1][0], ego_prediction[pred_t + 1][1], obs_x, obs_y, 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
                 elif obstacle_dict[now_id] == 'static.prop.trafficwarning':
                     temp = obstacle_collision(vehicle_length, vehicle_width, 3, 2.33, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                                                pred_t + 1][0], ego_prediction[pred_t + 1][1], vl[0][2], vl[0][3], 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
+                                                pred_t + 1][0], ego_prediction[pred_t + 1][1], obs_x, obs_y, 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
 
                 if temp != None:
                     risky_vehicle_list.append(temp)
@@ -377,8 +366,7 @@ def QCNet_inference(vehicle_list, specific_frame, variant_ego_id, pedestrian_id_
                         abs(vehicle_axisX_1 * ego_cos - vehicle_axisY_1 * ego_cos) + abs(vehicle_axisX_2 * ego_sin + vehicle_axisY_2 * ego_cos) + agent_area[agent_type][1] / 2:
                     # risky_vehicle_list.append(
                     #     [specific_frame, int(vl[0][1])])
-                    risky_vehicle_list.append(
-                        vl[0][1])
+                    risky_vehicle_list.append(now_id)
 
 
     # file_d = {}
@@ -0,0 +1,142 @@
+'''
+Per-frame latency of QCNet with and without the per-town map encoding cache.
+
+Run from PythonAPI/collect_data_risk_bench, with a CARLA server running the town (or an OpenDRIVE file):
+
+    python -m models.QCNet.benchmark_map_cache --town Town05 --frames 200 --agents 20
+
+Three variants are timed on the same synthetic scenes, agents driving along the lanes around the ego:
+    agent_only: no map input
+    map_encoder: the polygons around the ego are encoded by QCNetMapEncoder at every frame
+    map_cache: the cached polygon embeddings around the ego are cropped and fed to the agent encoder
+The map weights are random when the checkpoint has no map encoder, which does not change the latency.
+'''
+import argparse
+import math
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from models.QCNet.QCNet import get_agent_features_from_array
+from models.QCNet.QCNet import predict
+from models.QCNet.map_cache import MapEncodingCache
+from models.QCNet.map_cache import crop_map_features
+from models.QCNet.map_cache import get_map_features
+from models.QCNet.predictors import QCNet
+
+
+def load_carla_map(args):
+    import carla
+    if args.xodr:
+        with open(args.xodr) as f:
+            return carla.Map(args.town, f.read())
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(20.0)
+    world = client.get_world()
+    if not world.get_map().name.endswith(args.town):
+        world = client.load_world(args.town)
+    return world.get_map()
+
+
+def synthetic_scene(map_data, num_agents, num_historical_steps, rng):
+    '''
+    Agents placed on random lane polygons around a random ego polygon, moving along the lane.
+    '''
+    position = map_data['map_polygon']['position'].numpy()
+    orientation = map_data['map_polygon']['orientation'].numpy()
+    lanes = np.flatnonzero(map_data['map_polygon']['type'].numpy() == 0)
+    ego = rng.choice(lanes)
+    nearby = lanes[np.all(np.abs(position[lanes] - position[ego]) <= 37.5, axis=1)]
+    rows = np.concatenate([[ego], rng.choice(nearby, size=num_agents - 1)])
+
+    speed = rng.uniform(0.0, 10.0, size=num_agents)
+    direction = np.stack([np.cos(orientation[rows]), np.sin(orientation[rows])], axis=-1)
+    t = (np.arange(num_historical_steps) - (num_historical_steps - 1)) * 0.1
+    history = np.zeros((num_agents, num_historical_steps, 5), dtype=np.float32)
+    history[..., :2] = position[rows, None] + (speed[:, None] * t)[..., None] * direction[:, None]
+    history[..., 2:4] = (speed[:, None] * direction)[:, None]
+    history[..., 4] = orientation[rows, None]
+    valid = np.ones((num_agents, num_historical_steps), dtype=bool)
+    agent_type = np.zeros(num_agents, dtype=np.uint8)
+    return list(range(num_agents)), history, valid, agent_type
+
+
+def timed(fn):
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) * 1000.0
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--town', default='Town05')
+    argparser.add_argument('--xodr', default=None, help='OpenDRIVE file of the town, instead of a CARLA server')
+    argparser.add_argument('--host', default='127.0.0.1')
+    argparser.add_argument('--port', default=2000, type=int)
+    argparser.add_argument('--ckpt', default='./models/weights/QCNet/epoch38.ckpt')
+    argparser.add_argument('--frames', default=200, type=int)
+    argparser.add_argument('--warmup', default=10, type=int)
+    argparser.add_argument('--agents', default=20, type=int)
+    argparser.add_argument('--num_map_layers', default=1, type=int)
+    argparser.add_argument('--pl2pl_radius', default=150.0, type=float)
+    argparser.add_argument('--pl2a_radius', default=50.0, type=float)
+    argparser.add_argument('--seed', default=0, type=int)
+    args = argparser.parse_args()
+
+    device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+    checkpoint = torch.load(args.ckpt, map_location='cpu')
+    hparams = dict(checkpoint['hyper_parameters'])
+    for key in ('num_map_layers', 'pl2pl_radius', 'pl2a_radius'):
+        if hparams.get(key) is None:
+            hparams[key] = getattr(args, key)
+    model = QCNet(**hparams)
+    model.load_state_dict(checkpoint['state_dict'], strict=False)
+    model = model.to(device).eval()
+    num_historical_steps = model.num_historical_steps
+
+    carla_map = load_carla_map(args)
+    start = time.perf_counter()
+    map_data = get_map_features(carla_map)
+    print('{}: {} polygons, {} points, extracted in {:.2f} s'.format(
+        args.town, map_data['map_polygon']['num_nodes'], map_data['map_point']['num_nodes'],
+        time.perf_counter() - start))
+
+    cache = MapEncodingCache(model, 'benchmark', cache_dir=tempfile.mkdtemp())
+    start = time.perf_counter()
+    cache.encodings(args.town, carla_map)
+    print('map encoding of the whole town computed in {:.2f} s'.format(time.perf_counter() - start))
+    map_data_device = {key: {k: v.to(device) if torch.is_tensor(v) else v for k, v in value.items()}
+                       for key, value in map_data.items()}
+    radius = 37.5 * math.sqrt(2) + model.pl2a_radius
+
+    rng = np.random.default_rng(args.seed)
+    timings = {'agent_only': [], 'map_encoder': [], 'map_cache': []}
+    for frame in range(args.warmup + args.frames):
+        agent = get_agent_features_from_array(*synthetic_scene(map_data, args.agents, num_historical_steps, rng),
+                                              num_historical_steps)
+        center = agent['position'][0, -1].tolist()
+        results = {
+            'agent_only': timed(lambda: predict(agent, model, num_historical_steps)),
+            'map_encoder': timed(lambda: predict(agent, model, num_historical_steps,
+                                                 map_data=crop_map_features(map_data_device, center, radius))),
+            'map_cache': timed(lambda: predict(agent, model, num_historical_steps,
+                                               map_data={'map_polygon': cache.crop(args.town, center, radius)})),
+        }
+        if frame >= args.warmup:
+            for key, value in results.items():
+                timings[key].append(value)
+
+    print('{:<12} {:>10} {:>10} {:>10}'.format('variant', 'mean ms', 'p50 ms', 'p95 ms'))
+    for key, values in timings.items():
+        print('{:<12} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+            key, np.mean(values), np.percentile(values, 50), np.percentile(values, 95)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+'''
+Map polygons of a CARLA town in the layout expected by QCNetMapEncoder, and a disk cache of their encodings.
+
+The polygon embeddings of QCNetMapEncoder only depend on the static map, so they are computed once per town
+and checkpoint and stored next to the weights. At inference time only the polygons around the ego vehicle are
+cropped from the cache and fed to the pl2a attention of the agent encoder.
+
+Lanes come from the OpenDRIVE topology of the town (carla.Map.get_topology), split into polygons of at most
+max_polygon_length meters, and crosswalks from carla.Map.get_crosswalks. Left and right follow the CARLA
+(driver) convention. Only input_dim == 2 is supported.
+'''
+import math
+import os
+from typing import Any, Dict
+
+import numpy as np
+import torch
+from torch_geometric.data import HeteroData
+from torch_geometric.utils import subgraph
+
+POLYGON_TYPES = ['VEHICLE', 'BIKE', 'BUS', 'PEDESTRIAN']
+POLYGON_IS_INTERSECTIONS = [True, False, None]
+POINT_TYPES = ['DASH_SOLID_YELLOW', 'DASH_SOLID_WHITE', 'DASHED_WHITE', 'DASHED_YELLOW',
+               'DOUBLE_SOLID_YELLOW', 'DOUBLE_SOLID_WHITE', 'DOUBLE_DASH_YELLOW', 'DOUBLE_DASH_WHITE',
+               'SOLID_YELLOW', 'SOLID_WHITE', 'SOLID_DASH_WHITE', 'SOLID_DASH_YELLOW', 'SOLID_BLUE',
+               'NONE', 'UNKNOWN', 'CROSSWALK', 'CENTERLINE']
+POINT_SIDES = ['LEFT', 'RIGHT', 'CENTER']
+POLYGON_TO_POLYGON_TYPES = ['NONE', 'PRED', 'SUCC', 'LEFT', 'RIGHT']
+
+# carla.LaneMarkingType names to the Argoverse marking names, the colour is appended
+MARKING_TYPES = {
+    'Broken': 'DASHED',
+    'Solid': 'SOLID',
+    'SolidSolid': 'DOUBLE_SOLID',
+    'SolidBroken': 'SOLID_DASH',
+    'BrokenSolid': 'DASH_SOLID',
+    'BrokenBroken': 'DOUBLE_DASH',
+}
+
+CACHE_DIR = './models/weights/QCNet/map_cache'
+
+
+def marking_point_type(marking) -> int:
+    '''
+    Index in POINT_TYPES of a carla.LaneMarking.
+    '''
+    marking_type = str(marking.type)
+    if marking_type == 'NONE':
+        return POINT_TYPES.index('NONE')
+    if marking_type not in MARKING_TYPES:
+        return POINT_TYPES.index('UNKNOWN')
+    color = {'Yellow': 'YELLOW', 'Blue': 'BLUE'}.get(str(marking.color), 'WHITE')
+    name = '{}_{}'.format(MARKING_TYPES[marking_type], color)
+    return POINT_TYPES.index(name) if name in POINT_TYPES else POINT_TYPES.index('UNKNOWN')
+
+
+def _location_key(waypoint):
+    location = waypoint.transform.location
+    return int(round(location.x)), int(round(location.y)), int(round(location.z))
+
+
+def _lane_polygons(carla_map, sampling_resolution: float, max_polygon_length: float):
+    '''
+    Split the driving lanes of the topology in polygons.
+
+    Returns:
+        polygons: list of (left, right, center, left_type, right_type, polygon_type, is_intersection)
+        edges: list of (src, dst, polygon to polygon type)
+    '''
+    polygons = []
+    edges = []
+    entries = {}
+    exits = []
+    lanes = {}
+    first_waypoints = []
+    step = max(1, int(round(max_polygon_length / sampling_resolution)))
+
+    for entry, exit in carla_map.get_topology():
+        waypoints = [entry] + entry.next_until_lane_end(sampling_resolution)
+        if len(waypoints) < 2:
+            waypoints.append(exit)
+
+        first_idx = len(polygons)
+        for start in range(0, len(waypoints) - 1, step):
+            chunk = waypoints[start:start + step + 1]
+            if len(chunk) < 2:
+                break
+            center = np.array([[wp.transform.location.x, wp.transform.location.y] for wp in chunk])
+            right_vector = np.array([[wp.transform.get_right_vector().x, wp.transform.get_right_vector().y]
+                                     for wp in chunk])
+            half_width = np.array([wp.lane_width / 2.0 for wp in chunk])[:, None]
+            polygons.append((center - right_vector * half_width,
+                             center + right_vector * half_width,
+                             center,
+                             marking_point_type(chunk[0].left_lane_marking),
+                             marking_point_type(chunk[0].right_lane_marking),
+                             POLYGON_TYPES.index('VEHICLE'),
+                             POLYGON_IS_INTERSECTIONS.index(bool(chunk[0].is_junction))))
+            idx = len(polygons) - 1
+            if idx > first_idx:
+                edges.append((idx - 1, idx, POLYGON_TO_POLYGON_TYPES.index('PRED')))
+                edges.append((idx, idx - 1, POLYGON_TO_POLYGON_TYPES.index('SUCC')))
+            s = [wp.s for wp in chunk]
+            lanes.setdefault((chunk[0].road_id, chunk[0].section_id, chunk[0].lane_id), []).append(
+                (min(s), max(s), idx))
+            first_waypoints.append((idx, chunk[0]))
+
+        if len(polygons) > first_idx:
+            entries.setdefault(_location_key(entry), []).append(first_idx)
+            exits.append((_location_key(exit), len(polygons) - 1))
+
+    # segments meet where the exit of one is the entry of the next
+    for key, last_idx in exits:
+        for next_idx in entries.get(key, []):
+            edges.append((last_idx, next_idx, POLYGON_TO_POLYGON_TYPES.index('PRED')))
+            edges.append((next_idx, last_idx, POLYGON_TO_POLYGON_TYPES.index('SUCC')))
+
+    def find(waypoint):
+        if waypoint is None or str(waypoint.lane_type) != 'Driving':
+            return None
+        for s_min, s_max, idx in lanes.get((waypoint.road_id, waypoint.section_id, waypoint.lane_id), []):
+            if s_min - sampling_resolution <= waypoint.s <= s_max + sampling_resolution:
+                return idx
+        return None
+
+    for idx, waypoint in first_waypoints:
+        for neighbor, side in ((waypoint.get_left_lane(), 'LEFT'), (waypoint.get_right_lane(), 'RIGHT')):
+            # only lanes going the same way
+            if neighbor is None or neighbor.lane_id * waypoint.lane_id <= 0:
+                continue
+            neighbor_idx = find(neighbor)
+            if neighbor_idx is not None:
+                edges.append((neighbor_idx, idx, POLYGON_TO_POLYGON_TYPES.index(side)))
+    return polygons, edges
+
+
+def _crosswalk_polygons(carla_map):
+    '''
+    Two polygons per crosswalk, one for each walking direction.
+    '''
+    locations = [(location.x, location.y) for location in carla_map.get_crosswalks()]
+    crosswalks = []
+    start = 0
+    # every crosswalk is a closed polygon, its first point is repeated at the end
+    for i in range(1, len(locations)):
+        if i > start and locations[i] == locations[start]:
+            crosswalks.append(np.array(locations[start:i]))
+            start = i + 1
+
+    polygons = []
+    crosswalk_type = POINT_TYPES.index('CROSSWALK')
+    for vertices in crosswalks:
+        if len(vertices) < 4:
+            continue
+        p0, p1, p2, p3 = vertices[:4]
+        # the walking direction goes along the long edges
+        if np.linalg.norm(p1 - p0) >= np.linalg.norm(p2 - p1):
+            edge1, edge2 = (p0, p1), (p3, p2)
+        else:
+            edge1, edge2 = (p1, p2), (p0, p3)
+        start_position = (edge1[0] + edge2[0]) / 2
+        end_position = (edge1[1] + edge2[1]) / 2
+        num_points = int(math.ceil(np.linalg.norm(end_position - start_position) / 2.0)) + 1
+        ratio = np.linspace(0.0, 1.0, num_points)[:, None]
+        edge1 = edge1[0] + ratio * (edge1[1] - edge1[0])
+        edge2 = edge2[0] + ratio * (edge2[1] - edge2[0])
+        center = (edge1 + edge2) / 2
+
+        direction = end_position - start_position
+        query = (edge1[0] + edge1[-1]) / 2 - start_position
+        # negative cross product: left of the direction in the left-handed CARLA frame
+        if direction[0] * query[1] - direction[1] * query[0] < 0:
+            left, right = edge1, edge2
+        else:
+            left, right = edge2, edge1
+        for l, r, c in ((left, right, center), (right[::-1], left[::-1], center[::-1])):
+            polygons.append((l, r, c, crosswalk_type, crosswalk_type, POLYGON_TYPES.index('PEDESTRIAN'),
+                             POLYGON_IS_INTERSECTIONS.index(None)))
+    return polygons
+
+
+def get_map_features(carla_map,
+                     sampling_resolution: float = 2.0,
+                     max_polygon_length: float = 20.0) -> Dict[Any, Dict[str, Any]]:
+    '''
+    Map polygons and points of a carla.Map, as the map_data of ArgoverseV2Dataset.get_map_features.
+
+    Args:
+        carla_map: carla.Map, from the world or built from an OpenDRIVE file
+        sampling_resolution: distance between two points of a lane, in meters
+        max_polygon_length: lanes are split in polygons of at most this length, in meters
+    '''
+    polygons, edges = _lane_polygons(carla_map, sampling_resolution, max_polygon_length)
+    polygons += _crosswalk_polygons(carla_map)
+    num_polygons = len(polygons)
+
+    polygon_position = np.zeros((num_polygons, 2), dtype=np.float32)
+    polygon_orientation = np.zeros(num_polygons, dtype=np.float32)
+    polygon_type = np.zeros(num_polygons, dtype=np.uint8)
+    polygon_is_intersection = np.zeros(num_polygons, dtype=np.uint8)
+    point_position, point_vector, point_type, point_side, num_points = [], [], [], [], []
+    for idx, (left, right, center, left_type, right_type, pl_type, is_intersection) in enumerate(polygons):
+        polygon_position[idx] = center[0]
+        polygon_orientation[idx] = math.atan2(center[1, 1] - center[0, 1], center[1, 0] - center[0, 0])
+        polygon_type[idx] = pl_type
+        polygon_is_intersection[idx] = is_intersection
+        point_position.append(np.concatenate([left[:-1], right[:-1], center[:-1]], axis=0))
+        point_vector.append(np.concatenate([left[1:] - left[:-1], right[1:] - right[:-1],
+                                            center[1:] - center[:-1]], axis=0))
+        count = len(center) - 1
+        point_type.append(np.repeat([left_type, right_type, POINT_TYPES.index('CENTERLINE')], count))
+        point_side.append(np.repeat([POINT_SIDES.index('LEFT'), POINT_SIDES.index('RIGHT'),
+                                     POINT_SIDES.index('CENTER')], count))
+        num_points.append(3 * count)
+
+    point_vector = np.concatenate(point_vector, axis=0) if point_vector else np.zeros((0, 2))
+    num_points = np.array(num_points, dtype=np.int64)
+    edges = np.array(edges, dtype=np.int64).reshape(-1, 3)
+
+    map_data = {
+        'map_polygon': {},
+        'map_point': {},
+        ('map_point', 'to', 'map_polygon'): {},
+        ('map_polygon', 'to', 'map_polygon'): {},
+    }
+    map_data['map_polygon']['num_nodes'] = num_polygons
+    map_data['map_polygon']['position'] = torch.from_numpy(polygon_position)
+    map_data['map_polygon']['orientation'] = torch.from_numpy(polygon_orientation)
+    map_data['map_polygon']['type'] = torch.from_numpy(polygon_type)
+    map_data['map_polygon']['is_intersection'] = torch.from_numpy(polygon_is_intersection)
+    map_data['map_point']['num_nodes'] = int(num_points.sum())
+    map_data['map_point']['position'] = torch.from_numpy(
+        np.concatenate(point_position, axis=0).astype(np.float32) if point_position else np.zeros((0, 2), np.float32))
+    map_data['map_point']['orientation'] = torch.from_numpy(
+        np.arctan2(point_vector[:, 1], point_vector[:, 0]).astype(np.float32))
+    map_data['map_point']['magnitude'] = torch.from_numpy(np.linalg.norm(point_vector, axis=-1).astype(np.float32))
+    map_data['map_point']['type'] = torch.from_numpy(
+        np.concatenate(point_type).astype(np.uint8) if point_type else np.zeros(0, np.uint8))
+    map_data['map_point']['side'] = torch.from_numpy(
+        np.concatenate(point_side).astype(np.uint8) if point_side else np.zeros(0, np.uint8))
+    map_data['map_point', 'to', 'map_polygon']['edge_index'] = torch.from_numpy(
+        np.stack([np.arange(num_points.sum()), np.repeat(np.arange(num_polygons), num_points)], axis=0))
+    map_data['map_polygon', 'to', 'map_polygon']['edge_index'] = torch.from_numpy(edges[:, :2].T.copy())
+    map_data['map_polygon', 'to', 'map_polygon']['type'] = torch.from_numpy(edges[:, 2].astype(np.uint8))
+    return map_data
+
+
+def crop_map_features(map_data: Dict[Any, Dict[str, Any]], center, radius: float) -> Dict[Any, Dict[str, Any]]:
+    '''
+    Polygons of map_data whose first centerline point is within radius of center, with their points and edges.
+    '''
+    polygon_position = map_data['map_polygon']['position']
+    polygon_mask = torch.norm(polygon_position - polygon_position.new_tensor(center), p=2, dim=-1) <= radius
+    pt2pl = map_data['map_point', 'to', 'map_polygon']['edge_index']
+    point_mask = polygon_mask[pt2pl[1]]
+    polygon_index = torch.cumsum(polygon_mask.long(), dim=0) - 1
+    num_points = int(point_mask.sum())
+
+    cropped = {
+        'map_polygon': {key: value[polygon_mask] for key, value in map_data['map_polygon'].items()
+                        if key != 'num_nodes'},
+        'map_point': {key: value[point_mask] for key, value in map_data['map_point'].items() if key != 'num_nodes'},
+        ('map_point', 'to', 'map_polygon'): {},
+        ('map_polygon', 'to', 'map_polygon'): {},
+    }
+    cropped['map_polygon']['num_nodes'] = int(polygon_mask.sum())
+    cropped['map_point']['num_nodes'] = num_points
+    cropped['map_point', 'to', 'map_polygon']['edge_index'] = torch.stack(
+        [torch.arange(num_points, device=pt2pl.device), polygon_index[pt2pl[1][point_mask]]], dim=0)
+    edge_index, edge_type = subgraph(subset=polygon_mask,
+                                     edge_index=map_data['map_polygon', 'to', 'map_polygon']['edge_index'],
+                                     edge_attr=map_data['map_polygon', 'to', 'map_polygon']['type'],
+                                     relabel_nodes=True, num_nodes=polygon_mask.size(0))
+    cropped['map_polygon', 'to', 'map_polygon']['edge_index'] = edge_index
+    cropped['map_polygon', 'to', 'map_polygon']['type'] = edge_type
+    return cropped
+
+
+class MapEncodingCache(object):
+    '''
+    QCNetMapEncoder polygon embeddings of every town, computed once per checkpoint and kept on disk and in memory.
+    '''
+
+    def __init__(self, model, checkpoint_name: str, cache_dir: str = CACHE_DIR, **map_kwargs) -> None:
+        self.model = model
+        self.checkpoint_name = checkpoint_name
+        self.cache_dir = cache_dir
+        self.map_kwargs = map_kwargs
+        self._towns = {}
+
+    def path(self, town: str) -> str:
+        return os.path.join(self.cache_dir, '{}_{}.pt'.format(town, self.checkpoint_name))
+
+    @torch.no_grad()
+    def encode(self, carla_map) -> Dict[str, torch.Tensor]:
+        device = next(self.model.parameters()).device
+        data = HeteroData(get_map_features(carla_map, **self.map_kwargs)).to(device)
+        # the map encoder repeats the polygon embeddings over the historical steps
+        x_pl = self.model.encoder.map_encoder(data)['x_pl'][:, 0]
+        return {
+            'position': data['map_polygon']['position'],
+            'orientation': data['map_polygon']['orientation'],
+            'x_pl': x_pl,
+        }
+
+    def encodings(self, town: str, carla_map=None) -> Dict[str, torch.Tensor]:
+        '''
+        Polygon positions, orientations and embeddings of a town, on the model device.
+        carla_map is only needed the first time a town is seen with this checkpoint.
+        '''
+        if town not in self._towns:
+            device = next(self.model.parameters()).device
+            path = self.path(town)
+            if os.path.isfile(path):
+                encodings = torch.load(path, map_location=device)
+            elif carla_map is None:
+                raise ValueError('no cached map encoding for {} and no map to compute it'.format(town))
+            else:
+                encodings = self.encode(carla_map)
+                os.makedirs(self.cache_dir, exist_ok=True)
+                torch.save({key: value.cpu() for key, value in encodings.items()}, path)
+            self._towns[town] = encodings
+        return self._towns[town]
+
+    def crop(self, town: str, center, radius: float, carla_map=None) -> Dict[str, Any]:
+        '''
+        map_polygon node store with the cached embeddings (x_pl) of the polygons within radius of center.
+        '''
+        encodings = self.encodings(town, carla_map)
+        position = encodings['position']
+        mask = torch.norm(position - position.new_tensor(center), p=2, dim=-1) <= radius
+        return {
+            'num_nodes': int(mask.sum()),
+            'position': position[mask],
+            'orientation': encodings['orientation'][mask],
+            'x_pl': encodings['x_pl'][mask],
+        }
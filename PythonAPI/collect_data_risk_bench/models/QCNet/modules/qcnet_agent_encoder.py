@@ -37,20 +37,20 @@ class QCNetAgentEncoder(nn.Module):
                  hidden_dim: int,
                  num_historical_steps: int,
                  time_span: Optional[int],
-                #  pl2a_radius: float,
                  a2a_radius: float,
                  num_freq_bands: int,
                  num_layers: int,
                  num_heads: int,
                  head_dim: int,
-                 dropout: float) -> None:
+                 dropout: float,
+                 pl2a_radius: Optional[float] = None) -> None:
         super(QCNetAgentEncoder, self).__init__()
         self.dataset = dataset
         self.input_dim = input_dim
         self.hidden_dim = hidden_dim
         self.num_historical_steps = num_historical_steps
         self.time_span = time_span if time_span is not None else num_historical_steps
-        # self.pl2a_radius = pl2a_radius
+        self.pl2a_radius = pl2a_radius
         self.a2a_radius = a2a_radius
         self.num_freq_bands = num_freq_bands
         self.num_layers = num_layers
@@ -61,7 +61,7 @@ class QCNetAgentEncoder(nn.Module):
         if dataset == 'argoverse_v2':
             input_dim_x_a = 4
             input_dim_r_t = 4
-            # input_dim_r_pl2a = 3
+            input_dim_r_pl2a = 3
             input_dim_r_a2a = 3
         else:
             raise ValueError('{} is not a valid dataset'.format(dataset))
@@ -72,33 +72,68 @@ class QCNetAgentEncoder(nn.Module):
             raise ValueError('{} is not a valid dataset'.format(dataset))
         self.x_a_emb = FourierEmbedding(input_dim=input_dim_x_a, hidden_dim=hidden_dim, num_freq_bands=num_freq_bands)
         self.r_t_emb = FourierEmbedding(input_dim=input_dim_r_t, hidden_dim=hidden_dim, num_freq_bands=num_freq_bands)
-        # self.r_pl2a_emb = FourierEmbedding(input_dim=input_dim_r_pl2a, hidden_dim=hidden_dim,
-        #                                    num_freq_bands=num_freq_bands)
+        if pl2a_radius is not None:
+            self.r_pl2a_emb = FourierEmbedding(input_dim=input_dim_r_pl2a, hidden_dim=hidden_dim,
+                                               num_freq_bands=num_freq_bands)
         self.r_a2a_emb = FourierEmbedding(input_dim=input_dim_r_a2a, hidden_dim=hidden_dim,
                                           num_freq_bands=num_freq_bands)
         self.t_attn_layers = nn.ModuleList(
             [AttentionLayer(hidden_dim=hidden_dim, num_heads=num_heads, head_dim=head_dim, dropout=dropout,
                             bipartite=False, has_pos_emb=True) for _ in range(num_layers)]
         )
-        # self.pl2a_attn_layers = nn.ModuleList(
-        #     [AttentionLayer(hidden_dim=hidden_dim, num_heads=num_heads, head_dim=head_dim, dropout=dropout,
-        #                     bipartite=True, has_pos_emb=True) for _ in range(num_layers)]
-        # )
+        if pl2a_radius is not None:
+            self.pl2a_attn_layers = nn.ModuleList(
+                [AttentionLayer(hidden_dim=hidden_dim, num_heads=num_heads, head_dim=head_dim, dropout=dropout,
+                                bipartite=True, has_pos_emb=True) for _ in range(num_layers)]
+            )
         self.a2a_attn_layers = nn.ModuleList(
             [AttentionLayer(hidden_dim=hidden_dim, num_heads=num_heads, head_dim=head_dim, dropout=dropout,
                             bipartite=False, has_pos_emb=True) for _ in range(num_layers)]
         )
         self.apply(weight_init)
 
-    def forward(self, data: HeteroData) -> Dict[str, torch.Tensor]:
+        # radius graph of the last single-scene inference, reused while the agent set does not change
+        self._a2a_cache = None
+
+    def _radius_graph_a2a(self, data: HeteroData, pos_s: torch.Tensor, batch_s: torch.Tensor) -> torch.Tensor:
+        if isinstance(data, Batch) or self.training or 'id' not in data['agent']:
+            self._a2a_cache = None
+            return radius_graph(x=pos_s[:, :2], r=self.a2a_radius, batch=batch_s, loop=False,
+                                max_num_neighbors=300)
+
+        # in closed loop the history slides by one step per frame: when the agents are the same, only the
+        # graph of the newest step has to be built, the others are the cached ones shifted back by one step
+        num_nodes = data['agent']['num_nodes']
+        agent_ids = tuple(data['agent']['id'])
+        pos_t = pos_s[:, :2].reshape(self.num_historical_steps, num_nodes, 2)
+        edge_index = None
+        if self._a2a_cache is not None and self._a2a_cache[0] == agent_ids:
+            _, cached_pos_t, cached_edge_index = self._a2a_cache
+            if torch.equal(cached_pos_t, pos_t):
+                edge_index = cached_edge_index
+            elif torch.equal(cached_pos_t[1:], pos_t[:-1]):
+                shifted = cached_edge_index[:, cached_edge_index[0] >= num_nodes] - num_nodes
+                newest = radius_graph(x=pos_t[-1], r=self.a2a_radius, loop=False, max_num_neighbors=300)
+                edge_index = torch.cat([shifted, newest + (self.num_historical_steps - 1) * num_nodes], dim=1)
+        if edge_index is None:
+            edge_index = radius_graph(x=pos_s[:, :2], r=self.a2a_radius, batch=batch_s, loop=False,
+                                      max_num_neighbors=300)
+        self._a2a_cache = (agent_ids, pos_t.clone(), edge_index)
+        return edge_index
+
+    def forward(self,
+                data: HeteroData,
+                map_enc: Optional[Mapping[str, torch.Tensor]] = None) -> Dict[str, torch.Tensor]:
+        use_map = map_enc is not None and self.pl2a_radius is not None
         mask = data['agent']['valid_mask'][:, :self.num_historical_steps].contiguous()
         pos_a = data['agent']['position'][:, :self.num_historical_steps, :self.input_dim].contiguous()
         motion_vector_a = torch.cat([pos_a.new_zeros(data['agent']['num_nodes'], 1, self.input_dim),
                                      pos_a[:, 1:] - pos_a[:, :-1]], dim=1)
         head_a = data['agent']['heading'][:, :self.num_historical_steps].contiguous()
         head_vector_a = torch.stack([head_a.cos(), head_a.sin()], dim=-1)
-        # pos_pl = data['map_polygon']['position'][:, :self.input_dim].contiguous()
-        # orient_pl = data['map_polygon']['orientation'].contiguous()
+        if use_map:
+            pos_pl = data['map_polygon']['position'][:, :self.input_dim].contiguous()
+            orient_pl = data['map_polygon']['orientation'].contiguous()
         if self.dataset == 'argoverse_v2':
             vel = data['agent']['velocity'][:, :self.num_historical_steps, :self.input_dim].contiguous()
             length = width = height = None
@@ -140,30 +175,34 @@ class QCNetAgentEncoder(nn.Module):
         head_s = head_a.transpose(0, 1).reshape(-1)
         head_vector_s = head_vector_a.transpose(0, 1).reshape(-1, 2)
         mask_s = mask.transpose(0, 1).reshape(-1)
-        # pos_pl = pos_pl.repeat(self.num_historical_steps, 1)
-        # orient_pl = orient_pl.repeat(self.num_historical_steps)
         if isinstance(data, Batch):
             batch_s = torch.cat([data['agent']['batch'] + data.num_graphs * t
                                  for t in range(self.num_historical_steps)], dim=0)
-            # batch_pl = torch.cat([data['map_polygon']['batch'] + data.num_graphs * t
-            #                       for t in range(self.num_historical_steps)], dim=0)
         else:
             batch_s = torch.arange(self.num_historical_steps,
                                    device=pos_a.device).repeat_interleave(data['agent']['num_nodes'])
-        #     batch_pl = torch.arange(self.num_historical_steps,
-        #                             device=pos_pl.device).repeat_interleave(data['map_polygon']['num_nodes'])
-        # edge_index_pl2a = radius(x=pos_s[:, :2], y=pos_pl[:, :2], r=self.pl2a_radius, batch_x=batch_s, batch_y=batch_pl,
-        #                          max_num_neighbors=300)
-        # edge_index_pl2a = edge_index_pl2a[:, mask_s[edge_index_pl2a[1]]]
-        # rel_pos_pl2a = pos_pl[edge_index_pl2a[0]] - pos_s[edge_index_pl2a[1]]
-        # rel_orient_pl2a = wrap_angle(orient_pl[edge_index_pl2a[0]] - head_s[edge_index_pl2a[1]])
-        # r_pl2a = torch.stack(
-        #     [torch.norm(rel_pos_pl2a[:, :2], p=2, dim=-1),
-        #      angle_between_2d_vectors(ctr_vector=head_vector_s[edge_index_pl2a[1]], nbr_vector=rel_pos_pl2a[:, :2]),
-        #      rel_orient_pl2a], dim=-1)
-        # r_pl2a = self.r_pl2a_emb(continuous_inputs=r_pl2a, categorical_embs=None)
-        edge_index_a2a = radius_graph(x=pos_s[:, :2], r=self.a2a_radius, batch=batch_s, loop=False,
-                                      max_num_neighbors=300)
+        if use_map:
+            pos_pl = pos_pl.repeat(self.num_historical_steps, 1)
+            orient_pl = orient_pl.repeat(self.num_historical_steps)
+            if isinstance(data, Batch):
+                batch_pl = torch.cat([data['map_polygon']['batch'] + data.num_graphs * t
+                                      for t in range(self.num_historical_steps)], dim=0)
+            else:
+                batch_pl = torch.arange(self.num_historical_steps,
+                                        device=pos_pl.device).repeat_interleave(data['map_polygon']['num_nodes'])
+            edge_index_pl2a = radius(x=pos_s[:, :2], y=pos_pl[:, :2], r=self.pl2a_radius, batch_x=batch_s,
+                                     batch_y=batch_pl, max_num_neighbors=300)
+            edge_index_pl2a = edge_index_pl2a[:, mask_s[edge_index_pl2a[1]]]
+            rel_pos_pl2a = pos_pl[edge_index_pl2a[0]] - pos_s[edge_index_pl2a[1]]
+            rel_orient_pl2a = wrap_angle(orient_pl[edge_index_pl2a[0]] - head_s[edge_index_pl2a[1]])
+            r_pl2a = torch.stack(
+                [torch.norm(rel_pos_pl2a[:, :2], p=2, dim=-1),
+                 angle_between_2d_vectors(ctr_vector=head_vector_s[edge_index_pl2a[1]],
+                                          nbr_vector=rel_pos_pl2a[:, :2]),
+                 rel_orient_pl2a], dim=-1)
+            r_pl2a = self.r_pl2a_emb(continuous_inputs=r_pl2a, categorical_embs=None)
+            x_pl = map_enc['x_pl'].transpose(0, 1).reshape(-1, self.hidden_dim)
+        edge_index_a2a = self._radius_graph_a2a(data, pos_s, batch_s)
         edge_index_a2a = subgraph(subset=mask_s, edge_index=edge_index_a2a)[0]
         rel_pos_a2a = pos_s[edge_index_a2a[0]] - pos_s[edge_index_a2a[1]]
         rel_head_a2a = wrap_angle(head_s[edge_index_a2a[0]] - head_s[edge_index_a2a[1]])
@@ -178,8 +217,8 @@ class QCNetAgentEncoder(nn.Module):
             x_a = self.t_attn_layers[i](x_a, r_t, edge_index_t)
             x_a = x_a.reshape(-1, self.num_historical_steps,
                               self.hidden_dim).transpose(0, 1).reshape(-1, self.hidden_dim)
-            # x_a = self.pl2a_attn_layers[i]((map_enc['x_pl'].transpose(0, 1).reshape(-1, self.hidden_dim), x_a), r_pl2a,
-            #                                edge_index_pl2a)
+            if use_map:
+                x_a = self.pl2a_attn_layers[i]((x_pl, x_a), r_pl2a, edge_index_pl2a)
             x_a = self.a2a_attn_layers[i](x_a, r_a2a, edge_index_a2a)
             x_a = x_a.reshape(self.num_historical_steps, -1, self.hidden_dim).transpose(0, 1)
 
@@ -28,47 +28,59 @@ class QCNetEncoder(nn.Module):
                  input_dim: int,
                  hidden_dim: int,
                  num_historical_steps: int,
-                #  pl2pl_radius: float,
                  time_span: Optional[int],
-                #  pl2a_radius: float,
                  a2a_radius: float,
                  num_freq_bands: int,
-                #  num_map_layers: int,
                  num_agent_layers: int,
                  num_heads: int,
                  head_dim: int,
-                 dropout: float) -> None:
+                 dropout: float,
+                 pl2pl_radius: Optional[float] = None,
+                 pl2a_radius: Optional[float] = None,
+                 num_map_layers: Optional[int] = None) -> None:
         super(QCNetEncoder, self).__init__()
-        # self.map_encoder = QCNetMapEncoder(
-        #     dataset=dataset,
-        #     input_dim=input_dim,
-        #     hidden_dim=hidden_dim,
-        #     num_historical_steps=num_historical_steps,
-        #     pl2pl_radius=pl2pl_radius,
-        #     num_freq_bands=num_freq_bands,
-        #     num_layers=num_map_layers,
-        #     num_heads=num_heads,
-        #     head_dim=head_dim,
-        #     dropout=dropout,
-        # )
+        self.num_historical_steps = num_historical_steps
+        # the map branch only exists for checkpoints trained with map polygons
+        if pl2pl_radius is not None and pl2a_radius is not None and num_map_layers is not None:
+            self.map_encoder = QCNetMapEncoder(
+                dataset=dataset,
+                input_dim=input_dim,
+                hidden_dim=hidden_dim,
+                num_historical_steps=num_historical_steps,
+                pl2pl_radius=pl2pl_radius,
+                num_freq_bands=num_freq_bands,
+                num_layers=num_map_layers,
+                num_heads=num_heads,
+                head_dim=head_dim,
+                dropout=dropout,
+            )
+        else:
+            self.map_encoder = None
+            pl2a_radius = None
         self.agent_encoder = QCNetAgentEncoder(
             dataset=dataset,
             input_dim=input_dim,
             hidden_dim=hidden_dim,
             num_historical_steps=num_historical_steps,
             time_span=time_span,
-            # pl2a_radius=pl2a_radius,
             a2a_radius=a2a_radius,
             num_freq_bands=num_freq_bands,
             num_layers=num_agent_layers,
             num_heads=num_heads,
             head_dim=head_dim,
             dropout=dropout,
+            pl2a_radius=pl2a_radius,
         )
 
     def forward(self, data: HeteroData) -> Dict[str, torch.Tensor]:
-        # map_enc = self.map_encoder(data)
-        # agent_enc = self.agent_encoder(data, map_enc)
-        # return {**map_enc, **agent_enc}
-        agent_enc = self.agent_encoder(data)
-        return {**agent_enc}
+        if self.map_encoder is None or 'map_polygon' not in data.node_types:
+            agent_enc = self.agent_encoder(data)
+            return {**agent_enc}
+        if 'x_pl' in data['map_polygon']:
+            # polygon embeddings precomputed once per town, see models.QCNet.map_cache
+            x_pl = data['map_polygon']['x_pl']
+            map_enc = {'x_pl': x_pl.unsqueeze(1).expand(-1, self.num_historical_steps, -1)}
+        else:
+            map_enc = self.map_encoder(data)
+        agent_enc = self.agent_encoder(data, map_enc)
+        return {**map_enc, **agent_enc}
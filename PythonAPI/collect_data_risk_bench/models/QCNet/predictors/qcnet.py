@@ -71,6 +71,9 @@ class QCNet(pl.LightningModule):
                  T_max: int,
                  submission_dir: str,
                  submission_file_name: str,
+                 num_map_layers: Optional[int] = None,
+                 pl2pl_radius: Optional[float] = None,
+                 pl2a_radius: Optional[float] = None,
                  **kwargs) -> None:
         super(QCNet, self).__init__()
         self.save_hyperparameters()
@@ -84,15 +87,15 @@ class QCNet(pl.LightningModule):
         self.num_modes = num_modes
         self.num_recurrent_steps = num_recurrent_steps
         self.num_freq_bands = num_freq_bands
-        # self.num_map_layers = num_map_layers
+        self.num_map_layers = num_map_layers
         self.num_agent_layers = num_agent_layers
         self.num_dec_layers = num_dec_layers
         self.num_heads = num_heads
         self.head_dim = head_dim
         self.dropout = dropout
-        # self.pl2pl_radius = pl2pl_radius
+        self.pl2pl_radius = pl2pl_radius
         self.time_span = time_span
-        # self.pl2a_radius = pl2a_radius
+        self.pl2a_radius = pl2a_radius
         self.a2a_radius = a2a_radius
         self.num_t2m_steps = num_t2m_steps
         # self.pl2m_radius = pl2m_radius
@@ -108,16 +111,16 @@ class QCNet(pl.LightningModule):
             input_dim=input_dim,
             hidden_dim=hidden_dim,
             num_historical_steps=num_historical_steps,
-            # pl2pl_radius=pl2pl_radius,
             time_span=time_span,
-            # pl2a_radius=pl2a_radius,
             a2a_radius=a2a_radius,
             num_freq_bands=num_freq_bands,
-            # num_map_layers=num_map_layers,
             num_agent_layers=num_agent_layers,
             num_heads=num_heads,
             head_dim=head_dim,
             dropout=dropout,
+            pl2pl_radius=pl2pl_radius,
+            pl2a_radius=pl2a_radius,
+            num_map_layers=num_map_layers,
         )
         self.decoder = QCNetDecoder(
             dataset=dataset,
@@ -393,15 +396,15 @@ class QCNet(pl.LightningModule):
         parser.add_argument('--num_modes', type=int, default=1)
         parser.add_argument('--num_recurrent_steps', type=int, required=True)
         parser.add_argument('--num_freq_bands', type=int, default=64)
-        # parser.add_argument('--num_map_layers', type=int, default=1)
+        parser.add_argument('--num_map_layers', type=int, default=None)
         parser.add_argument('--num_agent_layers', type=int, default=2)
         parser.add_argument('--num_dec_layers', type=int, default=2)
         parser.add_argument('--num_heads', type=int, default=8)
         parser.add_argument('--head_dim', type=int, default=16)
         parser.add_argument('--dropout', type=float, default=0.1)
-        # parser.add_argument('--pl2pl_radius', type=float, required=True)
+        parser.add_argument('--pl2pl_radius', type=float, default=None)
         parser.add_argument('--time_span', type=int, default=None)
-        # parser.add_argument('--pl2a_radius', type=float, required=True)
+        parser.add_argument('--pl2a_radius', type=float, default=None)
         parser.add_argument('--a2a_radius', type=float, required=True)
         parser.add_argument('--num_t2m_steps', type=int, default=None)
         # parser.add_argument('--pl2m_radius', type=float, required=True)
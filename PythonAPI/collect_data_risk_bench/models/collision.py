@@ -0,0 +1,44 @@
+"""
+Collision test between the predicted trajectories of the ego vehicle and of
+the other agents, shared by the trajectory prediction baselines (social gan, mantra).
+"""
+import numpy as np
+
+
+# length and width of the obstacles, in meters
+OBSTACLE_AREA = {
+    'static.prop.trafficcone01': [0.85, 0.85],
+    'static.prop.streetbarrier': [1.25, 0.375],
+    'static.prop.trafficwarning': [3, 2.33],
+}
+
+
+def unit(vector):
+    """Unit vectors along the last axis, nan for null vectors"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return vector / np.linalg.norm(vector, axis=-1, keepdims=True)
+
+
+def box_overlap(distance, other_dir, other_area, ego_dir, ego_area, area):
+    """
+    Vectorised form of the separating axis test of obstacle_collision in
+    models/KalmanFilter.py, the arrays broadcast together. A nan direction
+    (an agent standing still) never overlaps.
+    """
+    dx, dy = distance[..., 0], distance[..., 1]
+    o_cos, o_sin = other_dir[..., 0], other_dir[..., 1]
+    e_cos, e_sin = ego_dir[..., 0], ego_dir[..., 1]
+    o_x1, o_y1 = o_cos * other_area[0] / 2, o_sin * other_area[0] / 2
+    o_x2, o_y2 = o_sin * other_area[1] / 2, - o_cos * other_area[1] / 2
+    e_x1, e_y1 = e_cos * ego_area[0] / 2, e_sin * ego_area[0] / 2
+    e_x2, e_y2 = e_sin * ego_area[1] / 2, - e_cos * ego_area[1] / 2
+    with np.errstate(invalid='ignore'):
+        return (
+            (np.abs(dx * o_cos + dy * o_cos) <=
+             np.abs(e_x1 * o_cos + e_y1 * o_sin) + np.abs(e_x2 * o_cos + e_y2 * o_sin) + area[0] / 2) &
+            (np.abs(dx * o_sin - dy * o_cos) <=
+             np.abs(e_x1 * o_cos - e_y1 * o_cos) + np.abs(e_x2 * o_sin - e_y2 * o_cos) + area[1] / 2) &
+            (np.abs(dx * e_cos + dy * e_sin) <=
+             np.abs(o_x1 * e_cos + o_y1 * e_sin) + np.abs(o_x2 * e_cos + o_y2 * e_sin) + area[0] / 2) &
+            (np.abs(dx * e_sin - dy * e_cos) <=
+             np.abs(o_x1 * e_cos - o_y1 * e_cos) + np.abs(o_x2 * e_sin + o_y2 * e_cos) + area[1] / 2))
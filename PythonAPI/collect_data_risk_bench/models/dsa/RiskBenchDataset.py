@@ -1,10 +1,11 @@
+import io
 import os
 import numpy as np
 import json
 from PIL import Image
 
 import torch
-from torch.utils.data.dataset import Dataset
+from torch.utils.data.dataset import Dataset, IterableDataset
 import torchvision.transforms as transforms
 from torchvision.io import read_image
 
@@ -36,7 +37,11 @@ def parse_riskyid_frame(bbox_id,risky_id,label):
 
 class RiskBench_dataset(Dataset):
     # each RiskBench_dataset is a basic scenario
-    def __init__(self,root,s_type,s_id,object_num=20,frame_num=40,load_img_first=False,inference=False,raw_img=False,designate=None):
+    def __init__(self,root,s_type,s_id,object_num=20,frame_num=40,load_img_first=False,inference=False,raw_img=False,designate=None,catalog=None):
+        """
+            catalog: util.dataset_catalog.DatasetCatalog of root, to list the variants and their frames without
+                walking the directories
+        """
         self.label = True if s_type == "collision" else False
         self.raw_img = raw_img
         self.s_type = s_type
@@ -48,20 +53,30 @@ class RiskBench_dataset(Dataset):
         self.load_img_first = load_img_first
         self.risky_id = []
         path = os.path.join(root,s_type,s_id)
-        for variant in os.listdir(os.path.join(path,'variant_scenario')):
+        if catalog is not None:
+            variants = [(e["variant"],e) for e in catalog.episodes(scenario_type=s_type,basic_scenario=s_id)]
+        else:
+            variants = [(variant,None) for variant in os.listdir(os.path.join(path,'variant_scenario'))]
+        for variant,episode in variants:
             if designate is not None:
                 if variant != designate:
                     continue
             self.variant.append(variant)
             variant_path = os.path.join(path,'variant_scenario',variant)
-            rgb_files = sorted(os.listdir(os.path.join(variant_path,'rgb','front')))
-            rgb_files = [os.path.join(variant_path,'rgb','front',img) for img in rgb_files]
+            if episode is not None:
+                first, last = episode.frame_range('rgb/front') if 'rgb/front' in episode.modalities else (0, -1)
+                rgb_files = [episode.frame_path('rgb/front',frame) for frame in range(first,last+1)]
+                self.risky_id.append(episode['interactor_id'])
+                collision_frame = episode['collision_frame']
+            else:
+                rgb_files = sorted(os.listdir(os.path.join(variant_path,'rgb','front')))
+                rgb_files = [os.path.join(variant_path,'rgb','front',img) for img in rgb_files]
+                self.risky_id.append(read_json(os.path.join(variant_path,'actor_attribute.json'))['interactor_id'])
+                if self.label:
+                    collision_frame = read_json(os.path.join(variant_path,'collision_frame.json'))["frame"]
             bboxs = read_json(os.path.join(variant_path,'bbox.json'))
-            self.risky_id.append(read_json(os.path.join(variant_path,'actor_attribute.json'))['interactor_id'])
 
             if self.label:
-                collision_info = read_json(os.path.join(variant_path,'collision_frame.json'))
-                collision_frame = collision_info["frame"]
                 collision_index = int(collision_frame) - 1
             # Arrange rgb frames & bbox
             # Positive data
@@ -124,4 +139,181 @@ class RiskBench_dataset(Dataset):
         return {'img':imgs,'bbox':bbox,'bbox_id':bbox_id,'label':label,'s_type':self.s_type,'s_id':self.s_id,'variant':self.variant[index],'risky_id':risky_id_frame,'raw_img':raw_imgs}
 
     def __len__(self):
-        return len(self.img)
\ No newline at end of file
+        return len(self.img)
+
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+def normalize_frames(imgs):
+    """
+        (T, H, W, 3) uint8 RGB frames -> (T, 3, H, W) normalized float tensor, as transform does on PIL images
+    """
+    imgs = torch.from_numpy(np.ascontiguousarray(imgs)).permute(0,3,1,2).float().div_(255)
+    return (imgs - torch.from_numpy(MEAN)[:,None,None]) / torch.from_numpy(STD)[:,None,None]
+
+
+class HorizontalFlip():
+    """
+        Worker-side augmentation of the cached clips: flips every frame of a clip and its boxes with probability p.
+        The generator is created in the process that draws from it, seeded from the DataLoader worker seed, so that
+        forked workers do not share the draws of the parent.
+    """
+    def __init__(self,p=0.5,seed=None):
+        self.p = p
+        self.seed = seed
+        self.rng = None
+        self.pid = None
+
+    def generator(self):
+        if self.rng is None or self.pid != os.getpid():
+            info = torch.utils.data.get_worker_info()
+            entropy = [] if self.seed is None else [self.seed]
+            if info is not None:
+                entropy.append(info.seed)
+            self.rng = np.random.default_rng(entropy or None)
+            self.pid = os.getpid()
+        return self.rng
+
+    def __call__(self,imgs,bbox):
+        if self.generator().random() >= self.p:
+            return imgs,bbox
+        width = imgs.shape[2]
+        bbox = bbox.copy()
+        valid = bbox.any(-1)
+        bbox[...,[0,2]] = np.where(valid[...,None], width-bbox[...,[2,0]], 0)
+        return imgs[:,:,::-1],bbox
+
+
+class RiskBench_cached_dataset(Dataset):
+    """
+        RiskBench_dataset read from the shards of util.frame_cache instead of the JPEG frames.
+        Every matching episode of the cache is a sample, the clips and boxes are selected as in RiskBench_dataset.
+    """
+    def __init__(self,cache,s_type=None,s_id=None,object_num=20,frame_num=40,inference=False,raw_img=False,designate=None,augment=None):
+        """
+            cache: util.frame_cache.FrameCache, or the directory of the cache
+            augment: callable (imgs (T,H,W,3) uint8, bbox (T,object_num,4)) -> (imgs, bbox), run in the loader workers
+        """
+        if isinstance(cache,str):
+            from util.frame_cache import FrameCache
+            cache = FrameCache(cache)
+        self.cache = cache
+        self.raw_img = raw_img
+        self.augment = augment
+        self.samples = []
+        for episode in cache.select(s_type,s_id,designate):
+            entry = cache.episodes[episode]
+            label = entry["scenario_type"] == "collision"
+            length = entry["length"]
+            if not inference:
+                if label:
+                    collision_index = int(entry["collision_frame"]) - 1
+                    start, end = collision_index-int(frame_num*0.8)+1, collision_index-int(frame_num*0.8)+1+frame_num
+                    if start<0 or length < end:
+                        continue
+                else:
+                    start, end = 0, frame_num
+                    if length<frame_num:
+                        continue
+            else:
+                start, end = 0, length
+            _, boxes, ids = cache.frames(episode,start,end)
+            bbox, bbox_id = self.select_objects(boxes,ids,object_num)
+            self.samples.append((episode,start,end,label,bbox,bbox_id))
+
+    @staticmethod
+    def select_objects(boxes,ids,object_num):
+        """First object_num boxes of each frame above AREA_THRESHOLD, as RiskBench_dataset keeps them"""
+        bbox = np.zeros((len(boxes),object_num,4),dtype=np.float32)
+        bbox_id = np.zeros((len(boxes),object_num))-1
+        valid = ids >= 0
+        area = (boxes[...,2]-boxes[...,0])*(boxes[...,3]-boxes[...,1])
+        keep = valid & (area >= AREA_THRESHOLD)
+        for t in range(len(boxes)):
+            rows = np.flatnonzero(keep[t])[:object_num]
+            bbox[t,:len(rows)] = boxes[t,rows]
+            bbox_id[t,:len(rows)] = ids[t,rows]
+        return bbox, bbox_id
+
+    def __getitem__(self, index):
+        episode,start,end,label,bbox,bbox_id = self.samples[index]
+        entry = self.cache.episodes[episode]
+        raw_imgs, _, _ = self.cache.frames(episode,start,end)
+        if self.augment is not None:
+            raw_imgs, bbox = self.augment(raw_imgs,bbox)
+        imgs = normalize_frames(raw_imgs)
+        risky_id_frame = np.array(parse_riskyid_frame(bbox_id,entry["interactor_id"],label))
+        bbox, bbox_id, risky_id_frame = torch.from_numpy(bbox), torch.from_numpy(bbox_id), torch.from_numpy(risky_id_frame).type(torch.LongTensor)
+        label = torch.from_numpy(np.array([0,1] if label else [1,0]).astype(np.float32))
+        raw_imgs = [np.array(img) for img in raw_imgs] if self.raw_img else [0]
+        return {'img':imgs,'bbox':bbox,'bbox_id':bbox_id,'label':label,'s_type':entry["scenario_type"],'s_id':entry["basic_scenario"],'variant':entry["variant"],'risky_id':risky_id_frame,'raw_img':raw_imgs}
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class RiskBench_stream_dataset(IterableDataset):
+    """
+        RiskBench_dataset streamed from the shards of util.episode_archive, without extracting them.
+        Each DataLoader worker streams its own subset of the shards, the clips are selected as in RiskBench_dataset.
+    """
+    def __init__(self,shards,s_type=None,object_num=20,frame_num=40,raw_img=False,augment=None):
+        """
+            shards: paths of the tar shards
+            augment: callable (imgs (T,H,W,3) uint8, bbox (T,object_num,4)) -> (imgs, bbox)
+        """
+        self.shards = list(shards)
+        self.s_type = s_type
+        self.object_num = object_num
+        self.frame_num = frame_num
+        self.raw_img = raw_img
+        self.augment = augment
+
+    def sample(self,episode,files):
+        s_type, s_id, _, variant = episode.split('/')
+        label = s_type == "collision"
+        rgb_files = sorted(name for name in files if name.startswith('rgb/front/'))
+        if 'bbox.json' not in files or 'actor_attribute.json' not in files:
+            return None
+        if label:
+            collision_index = int(json.loads(files['collision_frame.json'])["frame"]) - 1
+            start, end = collision_index-int(self.frame_num*0.8)+1, collision_index-int(self.frame_num*0.8)+1+self.frame_num
+            if start<0 or len(rgb_files) < end:
+                return None
+        else:
+            start, end = 0, self.frame_num
+            if len(rgb_files)<self.frame_num:
+                return None
+        bboxs = list(json.loads(files['bbox.json']).values())[start:end]
+        boxes = np.zeros((len(bboxs),self.object_num,4),dtype=np.float32)
+        ids = np.zeros((len(bboxs),self.object_num))-1
+        for t,frame in enumerate(bboxs):
+            counter = 0
+            for obj_id,box in frame.items():
+                if counter == self.object_num:
+                    break
+                if (box[2] - box[0])*(box[3] - box[1]) < AREA_THRESHOLD:
+                    continue
+                boxes[t,counter] = box
+                ids[t,counter] = obj_id
+                counter += 1
+        raw_imgs = np.stack([np.asarray(Image.open(io.BytesIO(files[name])).convert('RGB')) for name in rgb_files[start:end]])
+        if self.augment is not None:
+            raw_imgs, boxes = self.augment(raw_imgs,boxes)
+        risky_id = json.loads(files['actor_attribute.json'])['interactor_id']
+        risky_id_frame = np.array(parse_riskyid_frame(ids,risky_id,label))
+        return {'img':normalize_frames(raw_imgs),'bbox':torch.from_numpy(boxes),'bbox_id':torch.from_numpy(ids),
+                'label':torch.from_numpy(np.array([0,1] if label else [1,0]).astype(np.float32)),
+                's_type':s_type,'s_id':s_id,'variant':variant,
+                'risky_id':torch.from_numpy(risky_id_frame).type(torch.LongTensor),
+                'raw_img':[np.array(img) for img in raw_imgs] if self.raw_img else [0]}
+
+    def __iter__(self):
+        from util.episode_archive import stream_episodes, worker_shards
+        for episode,files in stream_episodes(worker_shards(self.shards)):
+            if self.s_type is not None and not episode.startswith(self.s_type + '/'):
+                continue
+            sample = self.sample(episode,files)
+            if sample is not None:
+                yield sample
@@ -1,19 +1,9 @@
-import sys
-import cv2 as cv
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import os
-import json
 import math
 import torch
-import torch.utils.data as data
-import re
-from collections import defaultdict
-import argparse
-import torch.nn as nn
-from torch.utils.data import DataLoader
-from torch.autograd import Variable
+import torch.nn.functional as F
+from models.collision import OBSTACLE_AREA, box_overlap, unit
 
 
 # def parse_config():
@@ -34,386 +24,285 @@ from torch.autograd import Variable
 #     return parser.parse_args()
 
 
-class TrackDataset(data.Dataset):
+MODEL_PATH = "models/weights/mantra/model_controller"
+MEMORY_PAST_PATH = "models/weights/mantra/memory/memory_past.pt"
+MEMORY_FUT_PATH = "models/weights/mantra/memory/memory_fut.pt"
+
+PAST_LEN = 20
+FUTURE_LEN = 30
+
+
+def get_pasts(vehicle_list, past_len=PAST_LEN):
     """
-    Dataset class for KITTI.
-    The building class is merged into the background class
-    0:background 1:street 2:sidewalk, 3:building 4: vegetation ---> 0:background 1:street 2:sidewalk, 3: vegetation
+    Stack the last past_len positions of every agent of a frame.
+    Agents observed for fewer frames are padded with their closest observed position.
+    :param vehicle_list: list of DataFrames with columns FRAME, TRACK_ID, X, Y, one per agent
+    :return: track ids (N,), frames (past_len,) and positions (N, past_len, 2)
+    """
+    df = pd.concat(vehicle_list)
+    frames = df['FRAME'].to_numpy(dtype=np.int64)
+    track_ids, rows = np.unique(df['TRACK_ID'].to_numpy(dtype=np.int64), return_inverse=True)
+    last_frame = frames.max()
+    steps = past_len - 1 - (last_frame - frames)
+    keep = steps >= 0
+
+    pasts = np.zeros((len(track_ids), past_len, 2))
+    valid = np.zeros((len(track_ids), past_len), dtype=bool)
+    pasts[rows[keep], steps[keep]] = df[['X', 'Y']].to_numpy(dtype=np.float64)[keep]
+    valid[rows[keep], steps[keep]] = True
+
+    index = np.arange(past_len)
+    last_seen = np.maximum.accumulate(np.where(valid, index, -1), axis=1)
+    first_seen = np.where(valid.any(axis=1), valid.argmax(axis=1), 0)
+    source = np.where(last_seen < 0, first_seen[:, None], last_seen)
+    pasts = np.take_along_axis(pasts, source[:, :, None], axis=1)
+    return track_ids, np.arange(last_frame - past_len + 1, last_frame + 1), pasts
+
+
+class MantraEngine():
+    """
+    MANTRA memory network kept resident on the device together with its memory banks.
+    All the agents of a frame are encoded, matched against the memory and decoded in one batch.
+    The memory can optionally grow online, up to a capacity, evicting the oldest entries
+    ('fifo') or the least recently read ones ('lru').
     """
 
-    def __init__(self, train, name, weather_name, num_time, vehicle, f_frame, now_frame, pred_len):
-
-        self.pasts = []           # [len_past, 2]
-        self.presents = []        # position in complete scene
-        self.futures = []         # [len_future, 2]
-        points = np.vstack((vehicle['X'], vehicle['Y'])).T
-        temp_past = points[num_time:num_time + 20].copy()
-        origin = temp_past[-1]
-        temp_future = points[num_time + 20:num_time + 20 + pred_len].copy()
-        id = vehicle['TRACK_ID'].values[0]
-        temp_past = temp_past - origin
-        temp_future = temp_future - origin
+    def __init__(self, model_path=MODEL_PATH, memory_past_path=MEMORY_PAST_PATH, memory_fut_path=MEMORY_FUT_PATH,
+                 capacity=None, eviction='fifo', device=None):
+        if eviction not in ('fifo', 'lru'):
+            raise ValueError("eviction should be 'fifo' or 'lru', not {}".format(eviction))
+        if device is None:
+            device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        self.device = device
+        self.capacity = capacity
+        self.eviction = eviction
+
+        self.mem_n2n = torch.load(model_path, map_location=device)
+        self.mem_n2n.num_prediction = 1
+        self.mem_n2n.future_len = FUTURE_LEN
+        self.mem_n2n.past_len = PAST_LEN
+        self.mem_n2n.eval()
 
-        self.pasts = torch.FloatTensor(temp_past)
-        self.presents = torch.FloatTensor(origin)
-        self.track_id = id
-        self.now_frame = now_frame
+        self.memory_past = torch.load(memory_past_path, map_location=device)
+        self.memory_fut = torch.load(memory_fut_path, map_location=device)
+        self._step = 0
+        self._last_used = torch.zeros(len(self.memory_past), dtype=torch.long, device=device)
+        self._normalize_memory()
 
     def __len__(self):
-        return self.pasts.shape[0]
+        return self.memory_past.shape[0]
 
-    def __getitem__(self, idx):
-        return self.pasts[idx], self.futures[idx], self.presents[idx]
+    def _normalize_memory(self):
+        # the memory keys are normalized once, not at every query
+        self.memory_past_normalized = F.normalize(self.memory_past, p=2, dim=1)
 
+    def _to_tensor(self, array):
+        return torch.as_tensor(np.asarray(array), dtype=torch.float, device=self.device)
 
-class NoFutureDataset(data.Dataset):
-    def __init__(self, past):
-        self.pasts = past
+    def encode_past(self, past):
+        """
+        :param past: tensor (N, past_len, 2), relative to the present position
+        :return: tensor (N, dim_embedding_key)
+        """
+        story_embed = self.mem_n2n.relu(self.mem_n2n.conv_past(past.transpose(1, 2)))
+        _, state_past = self.mem_n2n.encoder_past(story_embed.transpose(1, 2))
+        return state_past.squeeze(0)
 
-    def __len__(self):
-        return self.pasts.shape[0]
-
-    def __getitem__(self, idx):
-        return self.pasts[idx]
-
-
-class Validator():
-    def __init__(self, vehicle_list, frame):
-        ################################
-        data_type =  "interactive"#config.type
-        self.load_memory = True #config.saved_memory
-        self.future_len = 30 #config.future_length
-        specific_frame = frame #config.frame
-        # data_path = config.data_path
-        ################################
-
-        self.pasts = []
-        self.presents = []
-        self.futures = []
-
-        data_val_list = []
-        all_txt_list = []
-
-        # for filename in sorted(os.listdir(data_path + '/bbox/front/')):
-        #     all_txt_list.append(
-        #         int(filename.split(".")[0]))
-        # bbox_time_list = np.array(all_txt_list)
-        # bbox_first_frame = np.min(bbox_time_list)
-
-        #first_frame = vehicle_list[0]['FRAME'].iloc[0]
-        for val_vehicle_num in range(len(vehicle_list)):
-            #for real_frame in range(1):
-            #if specific_frame - bbox_first_frame >= 20:
-            data_val_list.append(TrackDataset(train=False, name='scenario_name', weather_name='weather_type',
-                                                    num_time=0, vehicle=vehicle_list[val_vehicle_num], f_frame=0, now_frame=int(specific_frame - 20), pred_len=self.future_len))
-        #self.data_val = np.array(data_val_list)
-            
-        
-        self.data_val = data_val_list
-        val_pasts = []
-        for i in range(len(self.data_val)):  # i th file
-            val_pasts.append(
-                np.array(data_val_list[i].pasts[0] - data_val_list[i].pasts[0][-1]))
-        val_pasts = torch.FloatTensor(val_pasts)
-        self.batch_val = NoFutureDataset(
-            past=val_pasts)
-        self.val_loader = DataLoader(
-            self.batch_val, batch_size=1, num_workers=0, shuffle=False)
-        # print('dataset created')
-        # load model to evaluate
-
-        self.mem_n2n = torch.load("models/weights/mantra/model_controller")
+    def encode_future(self, future):
+        """
+        :param future: tensor (N, future_len, 2), relative to the present position
+        :return: tensor (N, dim_embedding_key)
+        """
+        future_embed = self.mem_n2n.relu(self.mem_n2n.conv_fut(future.transpose(1, 2)))
+        _, state_fut = self.mem_n2n.encoder_fut(future_embed.transpose(1, 2))
+        return state_fut.squeeze(0)
 
+    def read(self, state_past):
+        """
+        Index of the most similar memory key of every encoded past, by cosine similarity.
+        :param state_past: tensor (N, dim_embedding_key)
+        :return: tensor (N,)
+        """
+        weight_read = torch.matmul(F.normalize(state_past, p=2, dim=1), self.memory_past_normalized.t())
+        index = weight_read.argmax(dim=1)
+        self._step += 1
+        self._last_used[index] = self._step
+        return index
 
-        self.mem_n2n.num_prediction = 1
-        self.mem_n2n.future_len = 30 #config.future_length
-        self.mem_n2n.past_len = 20
-        self.EuclDistance = nn.PairwiseDistance(p=2)
-        if True: #config.cuda:
-            self.mem_n2n = self.mem_n2n.cuda()
-            self.mem_n2n.share_memory()
-        self.start_epoch = 0
-        # self.config = config
-
-    def test_model(self):
+    def decode(self, state_past, info_future):
         """
-        Memory selection and evaluation!
-        :return: None
+        :param state_past: tensor (N, dim_embedding_key)
+        :param info_future: tensor (N, dim_embedding_key), future keys read from the memory
+        :return: tensor (N, future_len, 2), relative to the present position
         """
-        self._memory_writing(True) #self.config.saved_memory)
-        all_prediction = self.evaluate(
-            self.val_loader).cpu()
-        offset = 0
-        df_list = []
-        for i in range(len(self.data_val)):
-            origin = self.data_val[i].presents
-            pasts = self.data_val[i].pasts
-            prediction = all_prediction[offset]
-            offset += 1
-
-            for t in range(self.future_len + 20):
-                if t < 20:
-                    x = float(pasts[t][0] + origin[0])
-                    y = float(pasts[t][1] + origin[1])
-                    lis = [self.data_val[i].now_frame +
-                           t, self.data_val[i].track_id, x, y]
-                    df_list.append(lis)
-                    # list = [str(self.data_val[i][j][k].now_frame + t), '\t', str(
-                    #    self.data_val[i][j][k].track_id), '\t', str(x), '\t', str(y), '\n']
-                    # f.writelines(list)
-                else:
-                    pred_x = float(
-                        prediction[0][t - 20][0] + origin[0])
-                    pred_y = float(
-                        prediction[0][t - 20][1] + origin[1])
-                    lis = [self.data_val[i].now_frame +
-                           t, self.data_val[i].track_id, pred_x, pred_y]
-                    df_list.append(lis)
-                    # list = [str(self.data_val[i][j][k].now_frame + t), '\t', str(
-                    #    self.data_val[i][j][k].track_id), '\t', str(pred_x), '\t', str(pred_y), '\n']
-                    # f.writelines(list)
-        df = pd.DataFrame(df_list, columns=['FRAME', 'TRACK_ID', 'X', 'Y'])
-        return df
-
-    def evaluate(self, loader):
+        input_dec = torch.cat((state_past, info_future), 1).unsqueeze(0)
+        zero_padding = torch.zeros_like(input_dec)
+        state_dec = zero_padding
+        present = torch.zeros(input_dec.shape[1], 2, device=self.device)
+        prediction = []
+        for _ in range(FUTURE_LEN):
+            output_decoder, state_dec = self.mem_n2n.decoder(input_dec, state_dec)
+            present = present + self.mem_n2n.FC_output(output_decoder).squeeze(0)
+            prediction.append(present)
+            input_dec = zero_padding
+        return torch.stack(prediction, 1)
+
+    @torch.no_grad()
+    def predict(self, pasts):
         """
-        Evaluate model. Future trajectories are predicted and
-        :param loader: data loader for testing data
-        :return: dictionary of performance metrics
+        :param pasts: array (N, past_len, 2) of absolute positions, the last one being the present
+        :return: array (N, future_len, 2) of absolute positions
         """
-        all_pred = torch.tensor([]).cuda()
-        with torch.no_grad():
-            for step, (past) in enumerate(loader):
-                past = Variable(past)
-                if True: # self.config.cuda:
-                    past = past.cuda()
-                pred = self.mem_n2n(past.unsqueeze(0))
-                all_pred = torch.cat((all_pred, pred), axis=0)
-        return all_pred
-
-    def _memory_writing(self, saved_memory):
+        pasts = np.asarray(pasts, dtype=np.float64)
+        if len(pasts) == 0 or len(self) == 0:
+            return np.zeros((len(pasts), FUTURE_LEN, 2))
+        origin = pasts[:, -1:]
+        state_past = self.encode_past(self._to_tensor(pasts - origin))
+        info_future = self.memory_fut[self.read(state_past)]
+        prediction = self.decode(state_past, info_future).cpu().numpy()
+        return prediction + origin
+
+    @torch.no_grad()
+    def write(self, pasts, futures, use_controller=True):
         """
-        writing in the memory with controller (loop over all train dataset)
-        :return: loss
+        Insert past-future pairs in the memory. With use_controller, only the pairs whose future
+        is badly predicted by the current memory are kept, as decided by the writing controller.
+        :param pasts: array (N, past_len, 2) of absolute positions, the last one being the present
+        :param futures: array (N, future_len, 2) of absolute positions
+        :return: number of pairs written
         """
-        if True: #self.config.saved_memory:
-            # print("memory_loading")
-            self.mem_n2n.memory_past = torch.load( 'models/weights/mantra/memory/memory_past.pt' ) 
-                # self.config.memories_path + 'memory_past.pt')
-            self.mem_n2n.memory_fut = torch.load( 'models/weights/mantra/memory/memory_fut.pt')
-
-
-def angle_vectors(v1, v2):
-    """ Returns angle between two vectors.  """
-    v1_u = v1 / np.linalg.norm(v1)
-    v2_u = v2 / np.linalg.norm(v2)
-    angle = np.arccos(np.clip(np.dot(v1_u, v2_u), -1.0, 1.0))
-    if math.isnan(angle):
-        return 0.0
-    else:
-        return angle
-
-
-def obstacle_collision(car_length, car_width, obs_length, obs_width, ego_x, ego_y, ego_x_next, ego_y_next, obs_x, obs_y, obs_yaw, vehicle_length, vehicle_width, specific_frame, pred_t, now_id):
-    center_distance_vector = [obs_x - ego_x, obs_y - ego_y]
-    ego_vector_square = math.sqrt(
-        (ego_x_next - ego_x)**2 + (ego_y_next - ego_y)**2)
-    ego_cos = (ego_x_next - ego_x) / ego_vector_square
-    ego_sin = (ego_y_next - ego_y) / ego_vector_square
-    ego_axisX_1 = ego_cos * car_length / 2
-    ego_axisY_1 = ego_sin * car_length / 2
-    ego_axisX_2 = ego_sin * car_width / 2
-    ego_axisY_2 = - ego_cos * car_width / 2
-    obs_yaw = (float(obs_yaw) + 90.0) * np.pi / 180
-    obs_rec = [obs_x, obs_y, obs_width, obs_length, obs_yaw]
-    obs_cos = math.cos(obs_yaw)
-    obs_sin = math.sin(obs_yaw)
-    obs_axisX_1 = obs_cos * obs_length / 2
-    obs_axisY_1 = obs_sin * obs_length / 2
-    obs_axisX_2 = obs_sin * obs_width / 2
-    obs_axisY_2 = - obs_cos * obs_width / 2
-    if abs(center_distance_vector[0] * obs_cos + center_distance_vector[1] * obs_cos) <=\
-            abs(ego_axisX_1 * obs_cos + ego_axisY_1 * obs_sin) + abs(ego_axisX_2 * obs_cos + ego_axisY_2 * obs_sin) + vehicle_length / 2 and \
-            abs(center_distance_vector[0] * obs_sin - center_distance_vector[1] * obs_cos) <=\
-            abs(ego_axisX_1 * obs_cos - ego_axisY_1 * obs_cos) + abs(ego_axisX_2 * obs_sin - ego_axisY_2 * obs_cos) + vehicle_width / 2 and \
-            abs(center_distance_vector[0] * ego_cos + center_distance_vector[1] * ego_sin) <=\
-            abs(obs_axisX_1 * ego_cos + obs_axisY_1 * ego_sin) + abs(obs_axisX_2 * ego_cos + obs_axisY_2 * ego_sin) + vehicle_length / 2 and \
-            abs(center_distance_vector[0] * ego_sin - center_distance_vector[1] * ego_cos) <=\
-            abs(obs_axisX_1 * ego_cos - obs_axisY_1 * ego_cos) + abs(obs_axisX_2 * ego_sin + obs_axisY_2 * ego_cos) + vehicle_width / 2:
-        return now_id
-
-
-def mantra_inference(vehicle_list, specific_frame, variant_ego_id, pedestrian_id_list, vehicle_id_list, obstacle_dict ):
+        pasts = np.asarray(pasts, dtype=np.float64)
+        if len(pasts) == 0:
+            return 0
+        origin = pasts[:, -1:]
+        future = self._to_tensor(np.asarray(futures, dtype=np.float64) - origin)
+        state_past = self.encode_past(self._to_tensor(pasts - origin))
+
+        if use_controller and len(self) > 0:
+            prediction = self.decode(state_past, self.memory_fut[self.read(state_past)])
+            distances = torch.norm(prediction - future, dim=2)
+            tolerance = (torch.sum(distances[:, :10] < 0.5, dim=1) + torch.sum(distances[:, 10:20] < 1.0, dim=1) +
+                         torch.sum(distances[:, 20:30] < 1.5, dim=1))
+            tolerance_rate = (tolerance.float() / 40).unsqueeze(1)
+            writing = torch.sigmoid(self.mem_n2n.linear_controller(tolerance_rate)).squeeze(1) > 0.5
+            state_past, future = state_past[writing], future[writing]
+            if len(state_past) == 0:
+                return 0
+
+        state_fut = self.encode_future(future)
+        self._step += 1
+        self.memory_past = torch.cat((self.memory_past, state_past), 0)
+        self.memory_fut = torch.cat((self.memory_fut, state_fut), 0)
+        self._last_used = torch.cat((self._last_used, torch.full((len(state_past),), self._step,
+                                                                 dtype=torch.long, device=self.device)))
+        self._evict()
+        self._normalize_memory()
+        return len(state_past)
+
+    def _evict(self):
+        if self.capacity is None or len(self) <= self.capacity:
+            return
+        if self.eviction == 'fifo':
+            keep = torch.arange(len(self) - self.capacity, len(self), device=self.device)
+        else:
+            # stable sort, so that the oldest entries go first among the ones read at the same step
+            order = torch.sort(self._last_used, stable=True)[1]
+            keep = torch.sort(order[len(self) - self.capacity:])[0]
+        self.memory_past = self.memory_past[keep]
+        self.memory_fut = self.memory_fut[keep]
+        self._last_used = self._last_used[keep]
+
+    def save(self, memory_past_path=MEMORY_PAST_PATH, memory_fut_path=MEMORY_FUT_PATH):
+        torch.save(self.memory_past, memory_past_path)
+        torch.save(self.memory_fut, memory_fut_path)
+
+
+_engine = None
+
+
+def get_engine():
+    """
+    MANTRA engine shared by all the calls of mantra_inference, built on first use.
+    """
+    global _engine
+    if _engine is None:
+        _engine = MantraEngine()
+    return _engine
+
+
+def mantra_inference(vehicle_list, specific_frame, variant_ego_id, pedestrian_id_list, vehicle_id_list, obstacle_dict, engine=None):
+    """
+    Ids of the actors whose predicted trajectory meets the one of the ego
+    vehicle, the earliest collisions first.
+    """
+    if engine is None:
+        engine = get_engine()
+    track_ids, _, pasts = get_pasts(vehicle_list)
+    if int(variant_ego_id) not in track_ids:
+        return []
+
+    # all the agents of the frame in one forward pass
+    prediction = engine.predict(pasts)
+    return find_risky_ids(track_ids, pasts, prediction, variant_ego_id, pedestrian_id_list, obstacle_dict)
+
+
+def find_risky_ids(track_ids, pasts, prediction, variant_ego_id, pedestrian_id_list, obstacle_dict):
+    """
+    Collision check between the predicted trajectory of the ego and the ones of the other agents.
+    :param track_ids: array (N,) of actor ids
+    :param pasts: array (N, past_len, 2), as returned by get_pasts
+    :param prediction: array (N, future_len, 2), as returned by MantraEngine.predict
+    :return: ids of the risky actors, the earliest collisions first
+    """
 
     vehicle_length = 4.7
     vehicle_width = 2
     pedestrian_length = 0.8
     pedestrian_width = 0.8
-    agent_area = [[vehicle_length, vehicle_width],
-                [pedestrian_length, pedestrian_width]]
-
-
-
+    agent_area = np.array([[vehicle_length, vehicle_width],
+                           [pedestrian_length, pedestrian_width]])
 
     #config
-    future_len = 30
-    #print(vehicle_list)
-
-    v = Validator(vehicle_list,  specific_frame )
-    #print("before ids:", len(vehicle_list), list(set(pd.concat(vehicle_list)['TRACK_ID'].values)))
-    # print('start evaluation')
-    temp_df = v.test_model()
-    
-    temp_df['FRAME'] = temp_df['FRAME'].astype("int")
-    temp_df['TRACK_ID'] = temp_df['TRACK_ID'].astype("int")
-    temp_df['X'] = temp_df['X'].astype("float")
-    temp_df['Y'] = temp_df['Y'].astype("float")
-    
-    #print("ids:", len(list(set(temp_df['TRACK_ID'].values))), list(set(temp_df['TRACK_ID'].values)))
-
-    vehicle_list = []
-    for track_id, remain_df in temp_df.groupby('TRACK_ID'):
-        vehicle_list.append(remain_df)
-
-    risky_vehicle_list = []
-    ego_prediction = np.zeros((future_len, 2))
-    for n in range(len(vehicle_list)):
-        vl = vehicle_list[n].to_numpy()
-        now_id = int(vl[0][1])
-        if int(now_id) == int(variant_ego_id):
-            ego_now_pos_x = vl[0][2]
-            ego_now_pos_y = vl[0][3]
-            for pred_t in range(future_len - 1):
-                real_pred_x = vl[pred_t + 20][2]
-                real_pred_x_next = vl[pred_t + 21][2]
-                real_pred_y = vl[pred_t + 20][3]
-                real_pred_y_next = vl[pred_t + 21][3]
-                ego_prediction[pred_t][0] = real_pred_x
-                ego_prediction[pred_t][1] = real_pred_y
-                if pred_t == int(future_len - 2):
-                    ego_prediction[pred_t +
-                                   1][0] = real_pred_x_next
-                    ego_prediction[pred_t +
-                                   1][1] = real_pred_y_next
-
-    agent_type = 0
-    for val_vehicle_num in range(len(vehicle_list)):
-        #ego, agent, other = 0, 0, 0
-        vl = vehicle_list[val_vehicle_num].to_numpy()
-        # vl : frame, id, x, y
-        #print(vl)
-        now_id = int(vl[0][1])
-        if int(now_id) in pedestrian_id_list:
-            agent_type = 1
-        elif int(now_id) in vehicle_id_list:
-            agent_type = 0
-        elif int(now_id) == int(variant_ego_id):
-            agent_type = 0
-
-        actor_pos_x = vl[0][2]
-        actor_pos_y = vl[0][3]
-        dist_x = actor_pos_x - ego_now_pos_x
-        dist_y = actor_pos_y - ego_now_pos_y
-        if abs(dist_x) > 37.5 or abs(dist_y) > 37.5:
+    future_len = prediction.shape[1]
+
+    ego_rows = np.flatnonzero(track_ids == int(variant_ego_id))
+    if len(ego_rows) == 0:
+        return []
+    ego = ego_rows[0]
+
+    # actors too far from the ego at the first observed frame are skipped
+    first_pos = pasts[:, 0]
+    in_range = np.all(np.abs(first_pos - first_pos[ego]) <= 37.5, axis=1)
+    in_range[ego] = False
+
+    ego_pred = prediction[ego]
+    ego_dir = unit(ego_pred[1:] - ego_pred[:-1])
+    # first predicted step at which every actor meets the ego, future_len if never
+    first_hit = np.full(len(track_ids), future_len)
+
+    is_obstacle = np.array([int(i) in obstacle_dict for i in track_ids], dtype=bool) & in_range
+    for obstacle_type, obs_area in OBSTACLE_AREA.items():
+        rows = np.flatnonzero(is_obstacle & np.array([obstacle_dict.get(int(i)) == obstacle_type
+                                                      for i in track_ids], dtype=bool))
+        if len(rows) == 0:
+            continue
+        distance = first_pos[rows][:, None] - ego_pred[None, :-1]
+        obs_dir = np.array([math.cos(math.pi / 2), math.sin(math.pi / 2)])
+        hit = box_overlap(distance, obs_dir, obs_area, ego_dir, agent_area[0], agent_area[0])
+        first_hit[rows] = np.where(hit.any(axis=1), hit.argmax(axis=1), future_len)
+
+    is_pedestrian = np.isin(track_ids, np.array(pedestrian_id_list, dtype=np.int64))
+    for agent_type in (0, 1):
+        rows = np.flatnonzero(in_range & ~is_obstacle & (is_pedestrian == bool(agent_type)))
+        if len(rows) == 0:
             continue
-        #print(str(int(now_id)), type(obstacle_id_list[0]), obstacle_id_list)
-        for pred_t in range(future_len - 1):
-            if int(now_id) == int(variant_ego_id):
-                continue
-            real_pred_x = vl[pred_t + 20][2]
-            real_pred_x_next = vl[pred_t + 21][2]
-            real_pred_y = vl[pred_t + 20][3]
-            real_pred_y_next = vl[pred_t + 21][3]
-            #print(now_id, obstacle_id_list)
-            
-            #if int(now_id) in obstacle_id_list:
-            if int(now_id) in list(obstacle_dict):
-                #print("obstacle")
-                #print("in")
-                # if vehicle_list[val_vehicle_num].OBJECT_TYPE[0] == 'static.prop.trafficcone01':
-                #     temp = obstacle_collision(vehicle_length, vehicle_width, 0.85, 0.85, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                #                                 pred_t + 1][0], ego_prediction[pred_t + 1][1], vl[0][2], vl[0][3], 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
-                # elif vehicle_list[val_vehicle_num].OBJECT_TYPE[0] == 'static.prop.streetbarrier':
-                #     temp = obstacle_collision(vehicle_length, vehicle_width, 1.25, 0.375, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                #                                 pred_t + 1][0], ego_prediction[pred_t + 1][1], vl[0][2], vl[0][3], 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
-                # elif vehicle_list[val_vehicle_num].OBJECT_TYPE[0] == 'static.prop.trafficwarning':
-                #     temp = obstacle_collision(vehicle_length, vehicle_width, 3, 2.33, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                #                                 pred_t + 1][0], ego_prediction[pred_t + 1][1], vl[0][2], vl[0][3], 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
-                if obstacle_dict[now_id] == 'static.prop.trafficcone01':
-                    #print("static.prop.trafficcone01")
-                    temp = obstacle_collision(vehicle_length, vehicle_width, 0.85, 0.85, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                                                pred_t + 1][0], ego_prediction[pred_t + 1][1], vl[0][2], vl[0][3], 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
-                elif obstacle_dict[now_id] == 'static.prop.streetbarrier':
-                    temp = obstacle_collision(vehicle_length, vehicle_width, 1.25, 0.375, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                                                pred_t + 1][0], ego_prediction[pred_t + 1][1], vl[0][2], vl[0][3], 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
-                elif obstacle_dict[now_id] == 'static.prop.trafficwarning':
-                    temp = obstacle_collision(vehicle_length, vehicle_width, 3, 2.33, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                                                pred_t + 1][0], ego_prediction[pred_t + 1][1], vl[0][2], vl[0][3], 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
-
-                if temp != None:
-                    risky_vehicle_list.append(temp)
-            else:
-
-            
-        
-                # 這邊是計算和其他車輛有沒有碰撞
-                center_distance_vector = [
-                    real_pred_x - ego_prediction[pred_t][0], real_pred_y - ego_prediction[pred_t][1]]
-                vehicle_vector_square = math.sqrt(
-                    (real_pred_x_next - real_pred_x)**2 + (real_pred_y_next - real_pred_y)**2)
-                vehicle_cos = (real_pred_x_next -
-                                real_pred_x) / vehicle_vector_square
-                vehicle_sin = (real_pred_y_next -
-                                real_pred_y) / vehicle_vector_square
-                vehicle_axisX_1 = vehicle_cos * \
-                    agent_area[agent_type][0] / 2
-                vehicle_axisY_1 = vehicle_sin * \
-                    agent_area[agent_type][0] / 2
-                vehicle_axisX_2 = vehicle_sin * \
-                    agent_area[agent_type][1] / 2
-                vehicle_axisY_2 = - vehicle_cos * \
-                    agent_area[agent_type][1] / 2
-                ego_vector_square = math.sqrt((ego_prediction[pred_t + 1][0] - ego_prediction[pred_t][0])**2 + (
-                    ego_prediction[pred_t + 1][1] - ego_prediction[pred_t][1])**2)
-                ego_cos = (
-                    ego_prediction[pred_t + 1][0] - ego_prediction[pred_t][0]) / ego_vector_square
-                ego_sin = (
-                    ego_prediction[pred_t + 1][1] - ego_prediction[pred_t][1]) / ego_vector_square
-                ego_axisX_1 = ego_cos * \
-                    agent_area[agent_type][0] / 2
-                ego_axisY_1 = ego_sin * \
-                    agent_area[agent_type][0] / 2
-                ego_axisX_2 = ego_sin * \
-                    agent_area[agent_type][1] / 2
-                ego_axisY_2 = - ego_cos * \
-                    agent_area[agent_type][1] / 2
-                if abs(center_distance_vector[0] * vehicle_cos + center_distance_vector[1] * vehicle_cos) <=\
-                        abs(ego_axisX_1 * vehicle_cos + ego_axisY_1 * vehicle_sin) + abs(ego_axisX_2 * vehicle_cos + ego_axisY_2 * vehicle_sin) + agent_area[agent_type][0] / 2 and \
-                        abs(center_distance_vector[0] * vehicle_sin - center_distance_vector[1] * vehicle_cos) <=\
-                        abs(ego_axisX_1 * vehicle_cos - ego_axisY_1 * vehicle_cos) + abs(ego_axisX_2 * vehicle_sin - ego_axisY_2 * vehicle_cos) + agent_area[agent_type][1] / 2 and \
-                        abs(center_distance_vector[0] * ego_cos + center_distance_vector[1] * ego_sin) <=\
-                        abs(vehicle_axisX_1 * ego_cos + vehicle_axisY_1 * ego_sin) + abs(vehicle_axisX_2 * ego_cos + vehicle_axisY_2 * ego_sin) + agent_area[agent_type][0] / 2 and \
-                        abs(center_distance_vector[0] * ego_sin - center_distance_vector[1] * ego_cos) <=\
-                        abs(vehicle_axisX_1 * ego_cos - vehicle_axisY_1 * ego_cos) + abs(vehicle_axisX_2 * ego_sin + vehicle_axisY_2 * ego_cos) + agent_area[agent_type][1] / 2:
-                    # risky_vehicle_list.append(
-                    #     [specific_frame, int(vl[0][1])])
-                    risky_vehicle_list.append(
-                        vl[0][1])
-
-
-    # file_d = {}
-    # for frame, id in risky_vehicle_list:
-    #     if frame in file_d:
-    #         if str(id) in file_d[frame]:
-    #             continue
-    #         else:
-    #             file_d[frame].append(str(id))
-    #     else:
-    #         file_d[frame] = [str(id)]
-    # if specific_frame in file_d:
-    #     risky_id = file_d[specific_frame]
-    # else:
-    #     risky_id = []
-    risky_vehicle_list = list(set(risky_vehicle_list))
-
-    return risky_vehicle_list
\ No newline at end of file
+        agent_pred = prediction[rows]
+        distance = agent_pred[:, :-1] - ego_pred[None, :-1]
+        agent_dir = unit(agent_pred[:, 1:] - agent_pred[:, :-1])
+        area = agent_area[agent_type]
+        hit = box_overlap(distance, agent_dir, area, ego_dir, area, area)
+        first_hit[rows] = np.where(hit.any(axis=1), hit.argmax(axis=1), future_len)
+
+    order = np.argsort(first_hit, kind='stable')
+    risky_vehicle_list = [int(track_ids[i]) for i in order if first_hit[i] < future_len]
+    return risky_vehicle_list
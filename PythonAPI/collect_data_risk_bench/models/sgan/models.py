@@ -17,11 +17,11 @@ def make_mlp(dim_list, activation='relu', batch_norm=True, dropout=0):
     return nn.Sequential(*layers)
 
 
-def get_noise(shape, noise_type):
+def get_noise(shape, noise_type, device='cuda'):
     if noise_type == 'gaussian':
-        return torch.randn(*shape).cuda()
+        return torch.randn(*shape).to(device)
     elif noise_type == 'uniform':
-        return torch.rand(*shape).sub_(0.5).mul_(2.0).cuda()
+        return torch.rand(*shape).sub_(0.5).mul_(2.0).to(device)
     raise ValueError('Unrecognized noise type "%s"' % noise_type)
 
 
@@ -45,10 +45,10 @@ class Encoder(nn.Module):
 
         self.spatial_embedding = nn.Linear(2, embedding_dim)
 
-    def init_hidden(self, batch):
+    def init_hidden(self, batch, device='cuda'):
         return (
-            torch.zeros(self.num_layers, batch, self.h_dim).cuda(),
-            torch.zeros(self.num_layers, batch, self.h_dim).cuda()
+            torch.zeros(self.num_layers, batch, self.h_dim, device=device),
+            torch.zeros(self.num_layers, batch, self.h_dim, device=device)
         )
 
     def forward(self, obs_traj):
@@ -64,7 +64,7 @@ class Encoder(nn.Module):
         obs_traj_embedding = obs_traj_embedding.view(
             -1, batch, self.embedding_dim
         )
-        state_tuple = self.init_hidden(batch)
+        state_tuple = self.init_hidden(batch, obs_traj.device)
         output, state = self.encoder(obs_traj_embedding, state_tuple)
         final_h = state[0]
         return final_h
@@ -466,7 +466,7 @@ class TrajectoryGenerator(nn.Module):
         if user_noise is not None:
             z_decoder = user_noise
         else:
-            z_decoder = get_noise(noise_shape, self.noise_type)
+            z_decoder = get_noise(noise_shape, self.noise_type, _input.device)
 
         if self.noise_mix_type == 'global':
             _list = []
@@ -527,8 +527,8 @@ class TrajectoryGenerator(nn.Module):
         decoder_h = torch.unsqueeze(decoder_h, 0)
 
         decoder_c = torch.zeros(
-            self.num_layers, batch, self.decoder_h_dim
-        ).cuda()
+            self.num_layers, batch, self.decoder_h_dim, device=decoder_h.device
+        )
 
         state_tuple = (decoder_h, decoder_c)
         last_pos = obs_traj[-1]
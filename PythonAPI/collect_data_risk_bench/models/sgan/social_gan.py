@@ -1,63 +1,14 @@
-import os
-import csv
-import json
-import argparse
-import sys
 import torch
 import numpy as np
 import math
 import pandas as pd
-from collections import defaultdict
-from attrdict import AttrDict
-from models.sgan.data.loader import data_loader
 from models.sgan.models import TrajectoryGenerator
-from models.sgan.losses import displacement_error, final_displacement_error
-from models.sgan.utils import relative_to_abs, get_dset_path
-
-
-
-def angle_vectors(v1, v2):
-    """ Returns angle between two vectors.  """
-    v1_u = v1 / np.linalg.norm(v1)
-    v2_u = v2 / np.linalg.norm(v2)
-    angle = np.arccos(np.clip(np.dot(v1_u, v2_u), -1.0, 1.0))
-    if math.isnan(angle):
-        return 0.0
-    else:
-        return angle
-
-
-def obstacle_collision(car_length, car_width, obs_length, obs_width, ego_x, ego_y, ego_x_next, ego_y_next, obs_x, obs_y, obs_yaw, vehicle_length, vehicle_width, specific_frame, pred_t, now_id):
-    center_distance_vector = [obs_x - ego_x, obs_y - ego_y]
-    ego_vector_square = math.sqrt(
-        (ego_x_next - ego_x)**2 + (ego_y_next - ego_y)**2)
-    ego_cos = (ego_x_next - ego_x) / ego_vector_square
-    ego_sin = (ego_y_next - ego_y) / ego_vector_square
-    ego_axisX_1 = ego_cos * car_length / 2
-    ego_axisY_1 = ego_sin * car_length / 2
-    ego_axisX_2 = ego_sin * car_width / 2
-    ego_axisY_2 = - ego_cos * car_width / 2
-    obs_yaw = (float(obs_yaw) + 90.0) * np.pi / 180
-    obs_rec = [obs_x, obs_y, obs_width, obs_length, obs_yaw]
-    obs_cos = math.cos(obs_yaw)
-    obs_sin = math.sin(obs_yaw)
-    obs_axisX_1 = obs_cos * obs_length / 2
-    obs_axisY_1 = obs_sin * obs_length / 2
-    obs_axisX_2 = obs_sin * obs_width / 2
-    obs_axisY_2 = - obs_cos * obs_width / 2
-    if abs(center_distance_vector[0] * obs_cos + center_distance_vector[1] * obs_cos) <=\
-            abs(ego_axisX_1 * obs_cos + ego_axisY_1 * obs_sin) + abs(ego_axisX_2 * obs_cos + ego_axisY_2 * obs_sin) + vehicle_length / 2 and \
-            abs(center_distance_vector[0] * obs_sin - center_distance_vector[1] * obs_cos) <=\
-            abs(ego_axisX_1 * obs_cos - ego_axisY_1 * obs_cos) + abs(ego_axisX_2 * obs_sin - ego_axisY_2 * obs_cos) + vehicle_width / 2 and \
-            abs(center_distance_vector[0] * ego_cos + center_distance_vector[1] * ego_sin) <=\
-            abs(obs_axisX_1 * ego_cos + obs_axisY_1 * ego_sin) + abs(obs_axisX_2 * ego_cos + obs_axisY_2 * ego_sin) + vehicle_length / 2 and \
-            abs(center_distance_vector[0] * ego_sin - center_distance_vector[1] * ego_cos) <=\
-            abs(obs_axisX_1 * ego_cos - obs_axisY_1 * ego_cos) + abs(obs_axisX_2 * ego_sin + obs_axisY_2 * ego_cos) + vehicle_width / 2:
-        #return [specific_frame, int(now_id)]
-        return now_id
+from models.sgan.utils import relative_to_abs
+from models.collision import OBSTACLE_AREA, box_overlap, unit
 
 
 def get_generator(checkpoint):
+    from attrdict import AttrDict
 
     args = AttrDict(checkpoint['args'])
     generator = TrajectoryGenerator(
@@ -98,309 +49,152 @@ def evaluate_helper(error, seq_start_end):
     return sum_
 
 
-def evaluate(args,  ego, traj_txt_list, generator, num_samples):
-    # data = []
-    # with open(txt_path) as f:
-    #     for line in f.readlines():
-    #         line = line.strip().split('\t')
-    #         line = [float(i) for i in line]
-    #         data.append(line)
-
-
-
-    data = []
-    #print(ego, traj_txt_list)
-    ego_np = np.array(ego)
-    # print(ego_np)
-    other_np = np.array(traj_txt_list)
-    # print(other_np)
-    #other_np = np.sort(other_np, order='name')
-    data = np.concatenate((ego_np, other_np))
-
-
-    #data = np.array(data)
-    frames = np.unique(data[:, 0]).tolist()
-    frames = [int(i) for i in frames]
-    #frames = frames.astype(np.int)
-    frames.sort()
-    frames = [str(i) for i in frames]
-    frame_data = []
-    ped_num = None
-    for frame in frames:
-        data_now = data[float(frame) == data[:, 0], :]
-        # print(data_now)
-        #data_now = data[data[:, 0] == frame, :]
-        if ped_num == None:
-            ped_num = data_now.shape[0]
-        if data_now.shape[0] == ped_num:
-            frame_data.append(data_now)
-
-    obs_traj = np.zeros((20, ped_num, 2))
-    obs_traj_rel = np.zeros((20, ped_num, 2))
-    seq_start_end = np.array([[0, ped_num]])
-    ped_list = np.zeros((20, ped_num))
-    for i, frame in enumerate(frame_data):
-        if i > 19:
-            break
-
-        frame_sort = frame[frame[:, 1].argsort()]
-        for j, ped in enumerate(frame_sort):
-            obs_traj[i, j] = np.array([ped[2], ped[3]])
-            ped_list[i, j] = ped[1]
-    obs_traj_rel[:, 1:] = \
-        obs_traj[:, 1:] - obs_traj[:, :-1]
-
-    obs_traj = torch.from_numpy(obs_traj).to(torch.float).cuda()
-    obs_traj_rel = torch.from_numpy(obs_traj_rel).to(torch.float).cuda()
-    seq_start_end = torch.from_numpy(seq_start_end).to(torch.int).cuda()
-
-    pred_traj_fake_rel = generator(
-        obs_traj, obs_traj_rel, seq_start_end
-    )
-    pred_traj_fake = relative_to_abs(
-        pred_traj_fake_rel, obs_traj[-1]
-    )
-    new_ped_list = np.sort(ped_list[0])
-    batch_num = 1
-    df_list = []
-    obs_traj_new = obs_traj.reshape(
-        20, batch_num, -1, 2).permute(1, 0, 2, 3)
-    pred_traj_fake_new = pred_traj_fake.reshape(
-        args.pred_len, batch_num, -1, 2).permute(1, 0, 2, 3)
-    traj_mix = torch.cat(
-        (obs_traj_new, pred_traj_fake_new), 1).detach().cpu().numpy()
-    for i, frame_now in enumerate(traj_mix[0]):
-        for j, actor in enumerate(frame_now):
-            df_list.append([i, int(new_ped_list[j]), actor[0], actor[1]])
-    df = pd.DataFrame(df_list, columns=['FRAME', 'TRACK_ID', 'X', 'Y'])
-
-    return df
-
-
-
-def socal_gan_inference(vehicle_list, specific_frame, variant_ego_id, pedestrian_id_list, vehicle_id_list , obstacle_dict, _args, generator):
-
-
-    future_len = 30 
+def get_history(df, obs_len=20):
+    """
+    Inputs:
+    - df: DataFrame with columns FRAME, TRACK_ID, OBJECT_TYPE, X, Y, ...
+    - obs_len: number of observed frames, the last one being the latest frame of df
+    Outputs:
+    - track_ids: array of shape (num_peds,), sorted
+    - history: array of shape (num_peds, obs_len, 2)
+    - valid: boolean array of shape (num_peds, obs_len), False where an agent is not observed
+    """
+    frames = df['FRAME'].to_numpy(dtype=np.int64)
+    track_ids, rows = np.unique(df['TRACK_ID'].to_numpy(dtype=np.int64), return_inverse=True)
+    steps = obs_len - 1 - (frames.max() - frames)
+    keep = steps >= 0
+
+    history = np.zeros((len(track_ids), obs_len, 2))
+    valid = np.zeros((len(track_ids), obs_len), dtype=bool)
+    history[rows[keep], steps[keep]] = df[['X', 'Y']].to_numpy(dtype=np.float64)[keep]
+    valid[rows[keep], steps[keep]] = True
+    return track_ids, history, valid
+
+
+def build_scene(history, valid):
+    """
+    Agents entering or leaving the scene are padded with their closest
+    observed position, so that they stand still while unobserved.
+    Inputs:
+    - history: array of shape (num_peds, obs_len, 2)
+    - valid: boolean array of shape (num_peds, obs_len)
+    Outputs:
+    - obs_traj: array of shape (obs_len, num_peds, 2)
+    - obs_traj_rel: array of shape (obs_len, num_peds, 2)
+    """
+    num_peds, obs_len = valid.shape
+    steps = np.arange(obs_len)
+    # index of the last observed step so far, then of the first one for the leading gap
+    last_seen = np.maximum.accumulate(np.where(valid, steps, -1), axis=1)
+    first_seen = np.where(valid.any(axis=1), valid.argmax(axis=1), 0)
+    source = np.where(last_seen < 0, first_seen[:, None], last_seen)
+    padded = np.take_along_axis(history, source[:, :, None], axis=1)
+
+    obs_traj = padded.transpose(1, 0, 2)
+    obs_traj_rel = np.zeros_like(obs_traj)
+    obs_traj_rel[1:] = obs_traj[1:] - obs_traj[:-1]
+    return obs_traj, obs_traj_rel
+
+
+@torch.no_grad()
+def sample_trajectories(generator, obs_traj, obs_traj_rel, num_samples=1):
+    """
+    Draw num_samples futures of the scene in one forward pass, every sample
+    being a separate sequence of the batch with its own noise.
+    Inputs:
+    - obs_traj: array of shape (obs_len, num_peds, 2)
+    - obs_traj_rel: array of shape (obs_len, num_peds, 2)
+    Outputs:
+    - pred_traj: array of shape (num_samples, num_peds, pred_len, 2)
+    """
+    device = next(generator.parameters()).device
+    obs_len, num_peds, _ = obs_traj.shape
+    obs_traj = torch.from_numpy(np.tile(obs_traj, (1, num_samples, 1))).to(device, torch.float)
+    obs_traj_rel = torch.from_numpy(np.tile(obs_traj_rel, (1, num_samples, 1))).to(device, torch.float)
+    starts = torch.arange(num_samples, device=device) * num_peds
+    seq_start_end = torch.stack([starts, starts + num_peds], dim=1)
+
+    pred_traj_fake_rel = generator(obs_traj, obs_traj_rel, seq_start_end)
+    pred_traj_fake = relative_to_abs(pred_traj_fake_rel, obs_traj[-1])
+    pred_len = pred_traj_fake.size(0)
+    return pred_traj_fake.reshape(pred_len, num_samples, num_peds, 2).permute(1, 2, 0, 3).cpu().numpy()
+
+
+def best_of_k(pred_traj, pred_traj_gt):
+    """
+    Inputs:
+    - pred_traj: array of shape (num_samples, num_peds, pred_len, 2)
+    - pred_traj_gt: array of shape (num_peds, pred_len, 2)
+    Outputs:
+    - array of shape (num_peds, pred_len, 2), the sample with the lowest ADE of every agent
+    """
+    ade = np.linalg.norm(pred_traj - pred_traj_gt[None], axis=-1).mean(axis=-1)
+    best = ade.argmin(axis=0)
+    return pred_traj[best, np.arange(pred_traj.shape[1])]
+
+
+def socal_gan_inference(vehicle_list, specific_frame, variant_ego_id, pedestrian_id_list, vehicle_id_list , obstacle_dict, _args, generator, num_samples=1):
+    """
+    Ids of the actors whose predicted trajectory meets the one of the ego
+    vehicle, the ones colliding in the most samples first.
+    """
+
+    future_len = 30
 
     # 設定車輛 行人 障礙物面積
-
     vehicle_length = 4.7
     vehicle_width = 2
     pedestrian_length = 0.8
     pedestrian_width = 0.8
-    agent_area = [[vehicle_length, vehicle_width],
-                  [pedestrian_length, pedestrian_width]]
-    trafficcone_width = 0.85
-    barrier_length = 1.25
-    barrier_width = 0.375
-    warning_length = 3
-    warning_width = 2.33
-    object_type_list = ['static.prop.trafficcone01',
-                        'static.prop.streetbarrier', 'static.prop.trafficwarning', 'vehicle']
-    object_area = [[trafficcone_width, trafficcone_width], [barrier_length, barrier_width], [
-        warning_length, warning_width], [vehicle_length, vehicle_width]]
-
-
-
-
+    agent_area = np.array([[vehicle_length, vehicle_width],
+                           [pedestrian_length, pedestrian_width]])
 
     df = pd.concat(vehicle_list)
-    traj_txt_list = []
-    ego_info = []
-    for index, row in df.iterrows():
-        if row[0] == 'FRAME' or row[2] == 'AGENT' or row[2].split('.')[0] == 'actor':
-            continue
-        if row[1] == variant_ego_id:
-            ego_info.append([row[0], row[1], row[3], row[4]])
-            continue
-        traj_row_list = []
-        traj_row_list.append(row[0])
-        traj_row_list.append(row[1])
-        traj_row_list.append(row[3])
-        traj_row_list.append(row[4])
-        traj_txt_list.append(traj_row_list)
-    #print("other:", obstacle_id_list)
-    #for i in range(len(traj_txt_list)):
-    #    for j in range(obstacle_id_list):
-    #        print(traj_txt_list[i, 1], obstacle_id_list[j])
+    object_type = df['OBJECT_TYPE'].astype(str)
+    df = df[(object_type != 'AGENT') & ~object_type.str.startswith('actor.')]
 
-
-
-    # f = open('./sgan/temp.txt', 'w')
-    # for ego_traj in ego_info:
-    #     ego_traj_str = str(ego_traj[0]) + '\t' + str(ego_traj[1]) + \
-    #         '\t' + str(ego_traj[2]) + '\t' + str(ego_traj[3]) + '\n'
-    #     f.write(ego_traj_str)
-    # for traj in traj_txt_list:
-    #     traj_str = str(traj[0]) + '\t' + str(traj[1]) + \
-    #         '\t' + str(traj[2]) + '\t' + str(traj[3]) + '\n'
-    #     f.write(traj_str)
-    # f.close()
+    track_ids, history, valid = get_history(df, obs_len=20)
+    ego_rows = np.flatnonzero(track_ids == int(variant_ego_id))
+    if len(ego_rows) == 0:
+        return []
+    ego = ego_rows[0]
 
     # social gan開始inference
-    
-    #checkpoint = torch.load("./social_gan/gan_test_with_model_all.pt")
-    #generator = get_generator(checkpoint)
-    #_args = AttrDict(checkpoint['args'])
-    #_args.dataset_name = "interactive" 
-    #_args.skip = 1
-    #_args.pred_len = 60 
-
-    #temp_df = evaluate(_args, './sgan/temp.txt', generator, 1 )
-    temp_df = evaluate(_args, ego_info, traj_txt_list, generator, 1)
-
-    temp_df['FRAME'] = temp_df['FRAME'].astype("int")
-    temp_df['TRACK_ID'] = temp_df['TRACK_ID'].astype("int")
-    temp_df['X'] = temp_df['X'].astype("float")
-    temp_df['Y'] = temp_df['Y'].astype("float")
-
-
-
-    # 計算碰撞與否
-
-    #print(list(obstacle_dict))
-    risky_vehicle_list = []
-    vehicle_list = []
-    for track_id, remain_df in temp_df.groupby('TRACK_ID'):
-        #print("ID:", track_id)
-        vehicle_list.append(remain_df)
-    ego_prediction = np.zeros((future_len, 2))
-    for n in range(len(vehicle_list)):
-        vl = vehicle_list[n].to_numpy()
-        now_id = vl[0][1]
-        if int(now_id) == int(variant_ego_id):
-            ego_now_pos_x = vl[0][2]
-            ego_now_pos_y = vl[0][3]
-            for pred_t in range(future_len - 1):
-                real_pred_x = vl[pred_t + 20][2]
-                real_pred_x_next = vl[pred_t + 21][2]
-                real_pred_y = vl[pred_t + 20][3]
-                real_pred_y_next = vl[pred_t + 21][3]
-                ego_prediction[pred_t][0] = real_pred_x
-                ego_prediction[pred_t][1] = real_pred_y
-                if pred_t == int(future_len - 2):
-                    ego_prediction[pred_t +
-                                   1][0] = real_pred_x_next
-                    ego_prediction[pred_t +
-                                   1][1] = real_pred_y_next
-    agent_type = 0
-    for val_vehicle_num in range(len(vehicle_list)):
-        #ego, agent, other = 0, 0, 0
-        vl = vehicle_list[val_vehicle_num].to_numpy()
-        # vl : frame, id, x, y
-        now_id = int(vl[0][1])
-        if int(now_id) in pedestrian_id_list:
-            agent_type = 1
-        elif int(now_id) in vehicle_id_list:
-            agent_type = 0
-        elif int(now_id) == int(variant_ego_id):
-            agent_type = 0
-
-        actor_pos_x = vl[0][2]
-        actor_pos_y = vl[0][3]
-        dist_x = actor_pos_x - ego_now_pos_x
-        dist_y = actor_pos_y - ego_now_pos_y
-        if abs(dist_x) > 37.5 or abs(dist_y) > 37.5:
+    obs_traj, obs_traj_rel = build_scene(history, valid)
+    pred_traj = sample_trajectories(generator, obs_traj, obs_traj_rel, num_samples)[:, :, :future_len]
+
+    # 計算碰撞與否, actors too far from the ego at the first observed frame are skipped
+    first_pos = obs_traj[0]
+    in_range = np.all(np.abs(first_pos - first_pos[ego]) <= 37.5, axis=1)
+    in_range[ego] = False
+
+    ego_pred = pred_traj[:, ego]
+    ego_dir = unit(ego_pred[:, 1:] - ego_pred[:, :-1])[:, None]
+    collisions = np.zeros(pred_traj.shape[:2], dtype=bool)
+
+    is_obstacle = np.array([int(i) in obstacle_dict for i in track_ids]) & in_range
+    for obstacle_type, obs_area in OBSTACLE_AREA.items():
+        rows = np.flatnonzero(is_obstacle & np.array([obstacle_dict.get(int(i)) == obstacle_type
+                                                      for i in track_ids]))
+        if len(rows) == 0:
             continue
-        for pred_t in range(future_len - 1):
-            if int(now_id) == int(variant_ego_id):
-                continue
-            real_pred_x = vl[pred_t + 20][2]
-            real_pred_x_next = vl[pred_t + 21][2]
-            real_pred_y = vl[pred_t + 20][3]
-            real_pred_y_next = vl[pred_t + 21][3]
-            #if str(now_id) in obstacle_id_list:
-            if int(now_id) in list(obstacle_dict):
-                #print("obstacle")
-                # if vehicle_list[val_vehicle_num].OBJECT_TYPE[0] == 'static.prop.trafficcone01':
-                #     temp = obstacle_collision(vehicle_length, vehicle_width, 0.85, 0.85, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                #                                 pred_t + 1][0], ego_prediction[pred_t + 1][1], actor_pos_x, actor_pos_y, 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
-                # elif vehicle_list[val_vehicle_num].OBJECT_TYPE[0] == 'static.prop.streetbarrier':
-                #     temp = obstacle_collision(vehicle_length, vehicle_width, 1.25, 0.375, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                #                                 pred_t + 1][0], ego_prediction[pred_t + 1][1], actor_pos_x, actor_pos_y, 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
-                # elif vehicle_list[val_vehicle_num].OBJECT_TYPE[0] == 'static.prop.trafficwarning':
-                #     temp = obstacle_collision(vehicle_length, vehicle_width, 3, 2.33, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                #                                 pred_t + 1][0], ego_prediction[pred_t + 1][1], actor_pos_x, actor_pos_y, 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
-                if obstacle_dict[now_id] == 'static.prop.trafficcone01':
-                    #print("static.prop.trafficcone01")
-                    temp = obstacle_collision(vehicle_length, vehicle_width, 0.85, 0.85, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                                                pred_t + 1][0], ego_prediction[pred_t + 1][1], vl[0][2], vl[0][3], 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
-                elif obstacle_dict[now_id] == 'static.prop.streetbarrier':
-                    temp = obstacle_collision(vehicle_length, vehicle_width, 1.25, 0.375, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                                                pred_t + 1][0], ego_prediction[pred_t + 1][1], vl[0][2], vl[0][3], 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
-                elif obstacle_dict[now_id] == 'static.prop.trafficwarning':
-                    temp = obstacle_collision(vehicle_length, vehicle_width, 3, 2.33, ego_prediction[pred_t][0], ego_prediction[pred_t][1], ego_prediction[
-                                                pred_t + 1][0], ego_prediction[pred_t + 1][1], vl[0][2], vl[0][3], 0.0, vehicle_length, vehicle_width, specific_frame, pred_t, now_id)
-
-                if temp != None:
-                    risky_vehicle_list.append(temp)
-            else:
-
-                # 這個環節是為了從ID中找出那個障礙物是哪一種類別(如柵欄或是交通錐)，要找這個是因為每個障礙物面積都不一樣，為了帶進函式obstacle_collision去計算是否碰撞
-                # 若即時拿obstacle資料，可以直接拿type是哪一種，跟object_type_list對照找出對應的面積
-            
-    
-                # 這邊是計算和其他車輛有沒有碰撞
-                center_distance_vector = [
-                    real_pred_x - ego_prediction[pred_t][0], real_pred_y - ego_prediction[pred_t][1]]
-                vehicle_vector_square = math.sqrt(
-                    (real_pred_x_next - real_pred_x)**2 + (real_pred_y_next - real_pred_y)**2)
-                vehicle_cos = (real_pred_x_next -
-                                real_pred_x) / vehicle_vector_square
-                vehicle_sin = (real_pred_y_next -
-                                real_pred_y) / vehicle_vector_square
-                vehicle_axisX_1 = vehicle_cos * \
-                    agent_area[agent_type][0] / 2
-                vehicle_axisY_1 = vehicle_sin * \
-                    agent_area[agent_type][0] / 2
-                vehicle_axisX_2 = vehicle_sin * \
-                    agent_area[agent_type][1] / 2
-                vehicle_axisY_2 = - vehicle_cos * \
-                    agent_area[agent_type][1] / 2
-                ego_vector_square = math.sqrt((ego_prediction[pred_t + 1][0] - ego_prediction[pred_t][0])**2 + (
-                    ego_prediction[pred_t + 1][1] - ego_prediction[pred_t][1])**2)
-                ego_cos = (
-                    ego_prediction[pred_t + 1][0] - ego_prediction[pred_t][0]) / ego_vector_square
-                ego_sin = (
-                    ego_prediction[pred_t + 1][1] - ego_prediction[pred_t][1]) / ego_vector_square
-                ego_axisX_1 = ego_cos * \
-                    agent_area[agent_type][0] / 2
-                ego_axisY_1 = ego_sin * \
-                    agent_area[agent_type][0] / 2
-                ego_axisX_2 = ego_sin * \
-                    agent_area[agent_type][1] / 2
-                ego_axisY_2 = - ego_cos * \
-                    agent_area[agent_type][1] / 2
-                if abs(center_distance_vector[0] * vehicle_cos + center_distance_vector[1] * vehicle_cos) <=\
-                        abs(ego_axisX_1 * vehicle_cos + ego_axisY_1 * vehicle_sin) + abs(ego_axisX_2 * vehicle_cos + ego_axisY_2 * vehicle_sin) + agent_area[agent_type][0] / 2 and \
-                        abs(center_distance_vector[0] * vehicle_sin - center_distance_vector[1] * vehicle_cos) <=\
-                        abs(ego_axisX_1 * vehicle_cos - ego_axisY_1 * vehicle_cos) + abs(ego_axisX_2 * vehicle_sin - ego_axisY_2 * vehicle_cos) + agent_area[agent_type][1] / 2 and \
-                        abs(center_distance_vector[0] * ego_cos + center_distance_vector[1] * ego_sin) <=\
-                        abs(vehicle_axisX_1 * ego_cos + vehicle_axisY_1 * ego_sin) + abs(vehicle_axisX_2 * ego_cos + vehicle_axisY_2 * ego_sin) + agent_area[agent_type][0] / 2 and \
-                        abs(center_distance_vector[0] * ego_sin - center_distance_vector[1] * ego_cos) <=\
-                        abs(vehicle_axisX_1 * ego_cos - vehicle_axisY_1 * ego_cos) + abs(vehicle_axisX_2 * ego_sin + vehicle_axisY_2 * ego_cos) + agent_area[agent_type][1] / 2:
-                    risky_vehicle_list.append(
-                        vl[0][1])
-
-    # # 這個環節是統整出當下有多少risky id，會給出一個list，可能有複數個
-    # file_d = {}
-    # for frame, id in risky_vehicle_list:
-    #     if frame in file_d:
-    #         if str(id) in file_d[frame]:
-    #             continue
-    #         else:
-    #             file_d[frame].append(str(id))
-    #     else:
-    #         file_d[frame] = [str(id)]
-    # if specific_frame in file_d:
-    #     risky_id = file_d[specific_frame]
-    # else:
-    #     risky_id = []
-    # # print(file_d)
-    
-    # print(' risky_id:',  risky_id)
-    risky_vehicle_list = list(set(risky_vehicle_list))
+        distance = first_pos[rows][None, :, None] - ego_pred[:, None, :-1]
+        obs_dir = np.array([math.cos(math.pi / 2), math.sin(math.pi / 2)])
+        collisions[:, rows] = box_overlap(distance, obs_dir, obs_area, ego_dir, agent_area[0],
+                                           agent_area[0]).any(axis=-1)
+
+    is_pedestrian = np.isin(track_ids, np.array(pedestrian_id_list, dtype=np.int64))
+    for agent_type in (0, 1):
+        rows = np.flatnonzero(in_range & ~is_obstacle & (is_pedestrian == bool(agent_type)))
+        if len(rows) == 0:
+            continue
+        agent_pred = pred_traj[:, rows]
+        distance = agent_pred[:, :, :-1] - ego_pred[:, None, :-1]
+        agent_dir = unit(agent_pred[:, :, 1:] - agent_pred[:, :, :-1])
+        area = agent_area[agent_type]
+        collisions[:, rows] = box_overlap(distance, agent_dir, area, ego_dir, area, area).any(axis=-1)
+
+    counts = collisions.sum(axis=0)
+    order = np.argsort(-counts, kind='stable')
+    risky_vehicle_list = [int(track_ids[i]) for i in order if counts[i] > 0]
     return risky_vehicle_list
-
-
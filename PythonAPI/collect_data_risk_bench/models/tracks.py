@@ -0,0 +1,33 @@
+"""
+Trajectory DataFrames given to the trajectory prediction baselines (kalman filter, mantra, social gan, QCNet)
+by Inference.run_inference.
+"""
+import pandas as pd
+
+TRAJECTORY_COLUMNS = ['FRAME', 'TRACK_ID', 'OBJECT_TYPE', 'X', 'Y', 'VELOCITY_X', 'VELOCITY_Y', 'YAW']
+
+
+def nearby_tracks(df_list, frame, ego_location, history=20, radius=37.5):
+    """
+        Args:
+            df_list: rows of TRAJECTORY_COLUMNS, as Inference.df_list collects them
+            frame: current frame, every track must have a row at it
+            ego_location: {"x": ..., "y": ...} of the ego at frame
+        Returns:
+            one DataFrame per track within radius of the ego on each axis at frame, with its rows of the last
+            history frames
+    """
+    vehicle_list = []
+    traj_df = pd.DataFrame(df_list, columns=TRAJECTORY_COLUMNS)
+
+    for _, remain_df in traj_df.groupby('TRACK_ID'): # actor id
+        remain_df = remain_df[remain_df.FRAME > (int(frame) - history)].reset_index(drop=True)
+
+        now_df = remain_df[remain_df.FRAME == int(frame)]
+        dist_x = float(now_df["X"].values[0]) - ego_location["x"]
+        dist_y = float(now_df["Y"].values[0]) - ego_location["y"]
+        remain_df["X"] = remain_df["X"].astype(float)
+        remain_df["Y"] = remain_df["Y"].astype(float)
+        if abs(dist_x) <= radius and abs(dist_y) <= radius:
+            vehicle_list.append(remain_df)
+    return vehicle_list
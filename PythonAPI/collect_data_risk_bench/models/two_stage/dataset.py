@@ -0,0 +1,72 @@
+import numpy as np
+import torch
+from torch.utils.data.dataset import Dataset
+
+from models.dsa.RiskBenchDataset import normalize_frames
+from util.frame_cache import FrameCache
+
+MIN_AREA = 100
+
+
+def build_trackers(boxes, ids, time_steps=5, num_box=25):
+    """
+        Inputs of testing() from the boxes of a clip, as Inference builds them: the objects of the last frame
+        above MIN_AREA, with their boxes in every frame of the clip.
+
+        Args:
+            boxes: (T, N, 4) x1, y1, x2, y2
+            ids: (T, N) track ids, -1 for the empty slots
+        Returns:
+            trackers (T, num_box, 4), tracking_id (M,)
+    """
+    area = (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+    valid = (ids >= 0) & (area >= MIN_AREA)
+    tracking_id = ids[-1][valid[-1]][:num_box]
+    trackers = np.zeros((time_steps, num_box, 4))
+    for t in range(time_steps):
+        frame_ids = np.where(valid[t], ids[t], -1)
+        for i, object_id in enumerate(tracking_id):
+            rows = np.flatnonzero(frame_ids == object_id)
+            if len(rows) != 0:
+                trackers[t, i] = boxes[t, rows[0]]
+    return trackers, tracking_id
+
+
+class TwoStage_cached_dataset(Dataset):
+    """
+        Clips of time_steps consecutive frames of the cached episodes (util.frame_cache), in the layout of testing().
+        The number of tracked objects varies between clips, load them with batch_size=1 as testing() runs per clip.
+    """
+
+    def __init__(self, cache, s_type=None, time_steps=5, num_box=25, stride=1, augment=None):
+        """
+            cache: util.frame_cache.FrameCache, or the directory of the cache
+            augment: callable (imgs (T,H,W,3) uint8, boxes (T,N,4)) -> (imgs, boxes), run in the loader workers
+        """
+        if isinstance(cache, str):
+            cache = FrameCache(cache)
+        self.cache = cache
+        self.time_steps = time_steps
+        self.num_box = num_box
+        self.augment = augment
+        self.samples = [(episode, start) for episode in cache.select(s_type)
+                        for start in range(0, cache.episodes[episode]["length"] - time_steps + 1, stride)]
+
+    def __getitem__(self, index):
+        episode, start = self.samples[index]
+        entry = self.cache.episodes[episode]
+        imgs, boxes, ids = self.cache.frames(episode, start, start + self.time_steps)
+        if self.augment is not None:
+            imgs, boxes = self.augment(imgs, boxes)
+        trackers, tracking_id = build_trackers(np.asarray(boxes), np.asarray(ids), self.time_steps, self.num_box)
+        interactor_id = entry["interactor_id"] if entry["interactor_id"] is not None else -1
+        return {'img': normalize_frames(imgs),
+                'trackers': torch.from_numpy(trackers.astype(np.float32)),
+                'tracking_id': torch.from_numpy(tracking_id.astype(np.int64)),
+                'label': torch.tensor([0.0, 1.0] if entry["scenario_type"] == "collision" else [1.0, 0.0]),
+                'risky_id': interactor_id,
+                's_type': entry["scenario_type"], 's_id': entry["basic_scenario"], 'variant': entry["variant"],
+                'start': start}
+
+    def __len__(self):
+        return len(self.samples)
@@ -0,0 +1,640 @@
+#!/usr/bin/env python
+
+"""
+Open-loop evaluation of the risk identification modes over recorded episodes.
+
+Every variant scenario found under the data root (<scenario_type>/<basic_scenario>/variant_scenario/<variant>)
+is replayed from its actors_data, rgb/front, bbox.json and actor_attribute.json, without any simulator.
+The frames of several episodes are ranked in the same batch, and the episodes are spread over a pool of
+worker processes, each one holding its own copy of the model.
+
+Run from PythonAPI/collect_data_risk_bench:
+
+    python open_loop_eval.py --data_root ./data_collection --mode MANTRA --workers 4 --batch_size 16
+
+The per-frame rankings are written to <out>/<mode>_frames.jsonl and the metrics against interactor_id
+to <out>/<mode>_metrics.json.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from util.dataset_catalog import DatasetCatalog, get_town
+
+TRAJECTORY_COLUMNS = ['FRAME', 'TRACK_ID', 'OBJECT_TYPE', 'X', 'Y', 'VELOCITY_X', 'VELOCITY_Y', 'YAW']
+
+# the instance segmentation, and so bbox.json, only keeps the lower 16 bits of the actor ids
+INSTANCE_ID_MODULO = 65536
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def same_actor(id_a, id_b):
+    return int(id_a) % INSTANCE_ID_MODULO == int(id_b) % INSTANCE_ID_MODULO
+
+
+def find_episodes(data_root, scenario_types):
+    """
+    Paths of all the recorded variant scenarios of the given types, in a stable order, from the dataset catalog.
+    """
+    with DatasetCatalog.open(data_root) as catalog:
+        episodes = catalog.episodes(scenario_type=list(scenario_types), modalities=["actors_data"])
+    order = {scenario_type: i for i, scenario_type in enumerate(scenario_types)}
+    episodes = [episode for episode in episodes if episode["ego_id"] is not None]
+    return [episode.abspath for episode in sorted(episodes, key=lambda e: (order[e["scenario_type"]], e["path"]))]
+
+
+class Episode():
+    """
+    A recorded variant scenario, read one frame at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        parts = os.path.normpath(path).split(os.sep)
+        self.scenario_type, self.basic_scenario, self.variant = parts[-4], parts[-3], parts[-1]
+        self.town = get_town(self.basic_scenario)
+
+        attribute = read_json(os.path.join(path, "actor_attribute.json"))
+        self.ego_id = int(attribute["ego_id"])
+        self.interactor_id = int(attribute.get("interactor_id", -1))
+        self.obstacles = {int(_id): value for _id, value in attribute.get("obstacle", {}).items()}
+
+        self.frames = sorted(name[:-5] for name in os.listdir(os.path.join(path, "actors_data"))
+                             if name.endswith(".json"))
+        self._bboxes = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def bbox(self, index):
+        """
+        Boxes of the frame, {instance id: [x1, y1, x2, y2]}. As in RiskBench_dataset,
+        the entries of bbox.json are taken in order, aligned with the frames.
+        """
+        if self._bboxes is None:
+            path = os.path.join(self.path, "bbox.json")
+            self._bboxes = list(read_json(path).values()) if os.path.isfile(path) else []
+        if index >= len(self._bboxes):
+            return {}
+        return {int(_id): box for _id, box in self._bboxes[index].items()}
+
+    def actors(self, index):
+        data = read_json(os.path.join(self.path, "actors_data", self.frames[index] + ".json"))
+        return {int(key) if key.isdigit() else key: value for key, value in data.items()}
+
+    def rgb_path(self, index):
+        return os.path.join(self.path, "rgb", "front", self.frames[index] + ".jpg")
+
+
+class Frame():
+    """
+    One frame of an episode, its files are only read when a mode asks for them.
+    """
+
+    def __init__(self, episode, index):
+        self.episode = episode
+        self.index = index
+        self.number = int(episode.frames[index])
+        self._actors = None
+        self._bbox = None
+
+    @property
+    def actors(self):
+        if self._actors is None:
+            self._actors = self.episode.actors(self.index)
+        return self._actors
+
+    @property
+    def bbox(self):
+        if self._bbox is None:
+            self._bbox = self.episode.bbox(self.index)
+        return self._bbox
+
+    @property
+    def rgb_path(self):
+        return self.episode.rgb_path(self.index)
+
+
+class RiskModel():
+    """
+    A mode ranks the actors of a frame from the most to the least risky.
+    The history a mode needs (trajectories, image clips) is kept in a per-episode state,
+    so that the frames of several episodes can be ranked together by rank_batch.
+    """
+    window = 1
+    threshold = None
+
+    def __init__(self, mode, threshold=None, seed=0):
+        self.mode = mode
+        if threshold is not None:
+            self.threshold = threshold
+
+    def new_state(self, episode):
+        return deque(maxlen=self.window)
+
+    def observe(self, state, frame):
+        state.append(self.features(frame))
+
+    def ready(self, state):
+        return len(state) == self.window
+
+    def features(self, frame):
+        return frame
+
+    def rank(self, state, frame):
+        raise NotImplementedError
+
+    def rank_batch(self, items):
+        """
+        items: list of (state, frame)
+        Returns:
+            list of (ranking, scores), ranking being the ids of the risky actors, most risky first,
+            and scores a dict {id: score} of all the scored actors (empty when the mode has no score)
+        """
+        return [self.rank(state, frame) for state, frame in items]
+
+
+class TrajectoryModel(RiskModel):
+    """
+    Kalman_Filter, Social-GAN and QCNet, fed with the same 20 frames trajectories as in closed loop.
+    """
+    window = 20
+
+    def __init__(self, mode, threshold=None, seed=0):
+        super(TrajectoryModel, self).__init__(mode, threshold, seed)
+        if mode == "Kalman_Filter":
+            from models.KalmanFilter import kf_inference
+            self.kf_inference = kf_inference
+        elif mode == "Social-GAN":
+            self._load_social_gan()
+        elif mode == "QCNet":
+            from models.QCNet.QCNet import QCNet_inference, get_map_cache
+            self.QCNet_inference = QCNet_inference
+            self.map_cache = get_map_cache('./models/weights/QCNet/epoch38.ckpt')
+
+    def _load_social_gan(self):
+        import torch
+        from attrdict import AttrDict
+        from models.sgan.models import TrajectoryGenerator
+        from models.sgan.social_gan import socal_gan_inference
+
+        self.socal_gan_inference = socal_gan_inference
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        checkpoint = torch.load("./models/weights/sgan/gan_test_with_model_all.pt", map_location=device)
+        args_sg = AttrDict(checkpoint['args'])
+        self.generator = TrajectoryGenerator(
+            obs_len=args_sg.obs_len,
+            pred_len=30,
+            embedding_dim=args_sg.embedding_dim,
+            encoder_h_dim=args_sg.encoder_h_dim_g,
+            decoder_h_dim=args_sg.decoder_h_dim_g,
+            mlp_dim=args_sg.mlp_dim,
+            num_layers=args_sg.num_layers,
+            noise_dim=args_sg.noise_dim,
+            noise_type=args_sg.noise_type,
+            noise_mix_type=args_sg.noise_mix_type,
+            pooling_type=args_sg.pooling_type,
+            pool_every_timestep=args_sg.pool_every_timestep,
+            dropout=args_sg.dropout,
+            bottleneck_dim=args_sg.bottleneck_dim,
+            neighborhood_size=args_sg.neighborhood_size,
+            grid_size=args_sg.grid_size,
+            batch_norm=args_sg.batch_norm)
+        self.generator.load_state_dict(checkpoint['g_state'])
+        self.generator.to(device)
+        self.generator.train()
+        self._args = AttrDict(checkpoint['args'])
+        self._args.dataset_name = "interactive"
+        self._args.skip = 1
+        self._args.pred_len = 30
+
+    def ready(self, state):
+        # closed loop starts predicting from the first frame, with a shorter history
+        return len(state) > 0
+
+    def features(self, frame):
+        """
+        Rows of the frame, labelled as in Inference.collect_actor_data
+        """
+        episode = frame.episode
+        actors = frame.actors
+        rows = []
+        for _id in actors.get("vehicles_ids", []):
+            actor = actors[_id]
+            if _id == episode.ego_id:
+                label = 'EGO'
+            elif _id == episode.interactor_id:
+                label = 'ACTOR'
+            else:
+                label = 'vehicle'
+            rows.append([frame.number, _id, label, actor["location"]["x"], actor["location"]["y"],
+                         actor["velocity"]["x"], actor["velocity"]["y"], actor["rotation"]["yaw"]])
+        for _id in actors.get("pedestrian_ids", []):
+            actor = actors[_id]
+            label = 'ACTOR' if _id == episode.interactor_id else 'pedestrian'
+            direction = actor["control"].get("direction", {}).get("y", 0.0)
+            rows.append([frame.number, _id, label, actor["location"]["x"], actor["location"]["y"],
+                         actor["velocity"]["x"], actor["velocity"]["y"], direction])
+        for _id in actors.get("obstacle_ids", []):
+            obstacle = episode.obstacles.get(_id)
+            if obstacle is None:
+                continue
+            rows.append([frame.number, _id, obstacle["type_id"], obstacle["location"]["x"],
+                         obstacle["location"]["y"], 0, 0, obstacle["rotation"]["yaw"]])
+        return rows
+
+    def vehicle_list(self, state, frame):
+        """
+        One DataFrame per track seen at the current frame within 37.5 m of the ego, as in Inference.run_inference
+        """
+        traj_df = pd.DataFrame([row for rows in state for row in rows], columns=TRAJECTORY_COLUMNS)
+        now = traj_df[traj_df.FRAME == frame.number]
+        ego = now[now.TRACK_ID == frame.episode.ego_id]
+        if len(ego) == 0:
+            return []
+        near = (np.abs(now.X - ego.X.iloc[0]) <= 37.5) & (np.abs(now.Y - ego.Y.iloc[0]) <= 37.5)
+        traj_df = traj_df[traj_df.TRACK_ID.isin(now.TRACK_ID[near])]
+        return [remain_df.reset_index(drop=True) for _, remain_df in traj_df.groupby('TRACK_ID')]
+
+    def id_lists(self, frame):
+        actors = frame.actors
+        obstacle_id_list = list(actors.get("obstacle_ids", []))
+        obstacle_dict = {_id: frame.episode.obstacles[_id]["type_id"]
+                         for _id in obstacle_id_list if _id in frame.episode.obstacles}
+        return list(actors.get("vehicles_ids", [])), list(actors.get("pedestrian_ids", [])), obstacle_id_list, obstacle_dict
+
+    def rank(self, state, frame):
+        vehicle_list = self.vehicle_list(state, frame)
+        if not vehicle_list:
+            return [], {}
+        episode = frame.episode
+        vehicle_id_list, pedestrian_id_list, obstacle_id_list, obstacle_dict = self.id_lists(frame)
+        if self.mode == "Kalman_Filter":
+            risky_ids = self.kf_inference(vehicle_list, frame.number, episode.ego_id, pedestrian_id_list,
+                                          vehicle_id_list, obstacle_id_list)
+        elif self.mode == "Social-GAN":
+            risky_ids = self.socal_gan_inference(vehicle_list, frame.number, episode.ego_id, pedestrian_id_list,
+                                                 vehicle_id_list, obstacle_dict, self._args, self.generator)
+        else:
+            # without a simulator, map-aware checkpoints need the town encoding to be cached already
+            town = episode.town
+            if self.map_cache is not None and (town is None or not os.path.isfile(self.map_cache.path(town))):
+                town = None
+            risky_ids = self.QCNet_inference(vehicle_list, frame.number, episode.ego_id, pedestrian_id_list,
+                                             vehicle_id_list, obstacle_dict, town=town)
+        return [int(_id) for _id in risky_ids], {}
+
+
+class MantraModel(TrajectoryModel):
+    """
+    MANTRA, the agents of all the frames of a batch are predicted in one forward pass.
+    """
+
+    def __init__(self, mode, threshold=None, seed=0):
+        super(MantraModel, self).__init__(mode, threshold, seed)
+        from models.mantra import mantra
+        self.mantra = mantra
+        self.engine = mantra.get_engine()
+
+    def rank_batch(self, items):
+        scenes = []
+        for state, frame in items:
+            vehicle_list = self.vehicle_list(state, frame)
+            if vehicle_list:
+                track_ids, _, pasts = self.mantra.get_pasts(vehicle_list)
+            else:
+                track_ids, pasts = np.zeros(0, dtype=np.int64), np.zeros((0, self.mantra.PAST_LEN, 2))
+            scenes.append((track_ids, pasts))
+
+        prediction = self.engine.predict(np.concatenate([pasts for _, pasts in scenes]))
+        splits = np.cumsum([len(track_ids) for track_ids, _ in scenes])[:-1]
+
+        results = []
+        for (state, frame), (track_ids, pasts), scene_prediction in zip(items, scenes, np.split(prediction, splits)):
+            _, pedestrian_id_list, _, obstacle_dict = self.id_lists(frame)
+            risky_ids = self.mantra.find_risky_ids(track_ids, pasts, scene_prediction, frame.episode.ego_id,
+                                                   pedestrian_id_list, obstacle_dict)
+            results.append((risky_ids, {}))
+        return results
+
+
+class VisionModel(RiskModel):
+    """
+    DSA, RRL, BP and BCP, fed with clips of the last 5 front images and their boxes.
+    """
+    window = 5
+    object_num = 20
+    area_threshold = 200
+
+    def __init__(self, mode, threshold=None, seed=0):
+        import torch
+        from torchvision import transforms
+        self.torch = torch
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.threshold = 0.9 if mode == "DSA" else 0.8
+        super(VisionModel, self).__init__(mode, threshold, seed)
+        self.camera_transforms = transforms.Compose([
+            transforms.ToTensor(),
+            transforms.Normalize(mean=[0.485, 0.456, 0.406],
+                                 std=[0.229, 0.224, 0.225]),
+        ])
+
+        if mode in ("DSA", "RRL"):
+            from models.dsa.DSA_RRL import Baseline_SA
+            from models.dsa.backbone import Riskbench_backbone
+            model_path = "./models/weights/dsa/8_27_3_46/best_model.pt" if mode == "DSA" else \
+                "./models/weights/dsa/9_12_0_56/best_model.pt"
+            backbone = Riskbench_backbone(8, self.object_num, intention=False)
+            self.dsa_model = Baseline_SA(backbone, 40, self.object_num, intention=False,
+                                         supervised=(mode == "RRL"), state=False)
+            self.dsa_model.load_state_dict(torch.load(model_path, map_location=self.device))
+            self.dsa_model.to(self.device)
+            self.dsa_model.eval()
+        else:
+            from models.two_stage.inference import testing
+            from models.two_stage.models import GCN as Model
+            self.BC_model = Model()
+            state_dict = torch.load("./models/weights/two_stage/weight.pth", map_location=self.device)
+            self.BC_model.load_state_dict({key[7:]: value for key, value in state_dict.items()})
+            self.BC_model = self.BC_model.to(self.device)
+            self.BC_model.train(False)
+            self.BC_testing = testing
+
+    def features(self, frame):
+        from PIL import Image
+        with Image.open(frame.rgb_path) as img:
+            rgb = self.camera_transforms(img.convert("RGB"))
+        ego_instance = frame.episode.ego_id % INSTANCE_ID_MODULO
+        boxes = {_id: box for _id, box in frame.bbox.items() if _id != ego_instance}
+        return rgb, boxes
+
+    def rank_batch(self, items):
+        if self.mode in ("DSA", "RRL"):
+            return self._rank_dsa(items)
+        return [self.rank(state, frame) for state, frame in items]
+
+    def _rank_dsa(self, items):
+        torch = self.torch
+        bbox = np.zeros((len(items), self.window, self.object_num, 4), dtype=np.float32)
+        bbox_id = np.full((len(items), self.object_num), -1, dtype=np.int64)
+        for b, (state, _) in enumerate(items):
+            for t, (_, boxes) in enumerate(state):
+                counter = 0
+                for _id, box in boxes.items():
+                    if counter == self.object_num:
+                        break
+                    if (box[2] - box[0]) * (box[3] - box[1]) < self.area_threshold:
+                        continue
+                    bbox[b, t, counter] = box
+                    if t == self.window - 1:
+                        bbox_id[b, counter] = _id
+                    counter += 1
+
+        imgs = torch.stack([torch.stack([rgb for rgb, _ in state]) for state, _ in items]).to(self.device)
+        with torch.no_grad():
+            _, all_alphas, _ = self.dsa_model(imgs, torch.from_numpy(bbox).to(self.device))
+        # attention of the objects at the last frame of every clip
+        alphas = all_alphas[:, -1].cpu().numpy()
+
+        results = []
+        for b in range(len(items)):
+            scores = {int(_id): round(float(score), 2) for _id, score in zip(bbox_id[b], alphas[b]) if _id != -1}
+            ranking = sorted((_id for _id, score in scores.items() if score >= self.threshold),
+                             key=lambda _id: -scores[_id])
+            results.append((ranking, scores))
+        return results
+
+    def rank(self, state, frame):
+        tracking_id = [_id for _id, box in state[-1][1].items()
+                       if (box[2] - box[0]) * (box[3] - box[1]) >= 100]
+        if not tracking_id:
+            return [], {}
+        trackers = np.zeros([self.window, 25, 4])
+        for t, (_, boxes) in enumerate(state):
+            for i, object_id in enumerate(tracking_id[:25]):
+                if object_id in boxes:
+                    trackers[t, i, :] = boxes[object_id]
+
+        with self.torch.no_grad():
+            single_result, two_result, two_score_dict, single_score_dict = self.BC_testing(
+                self.BC_model, [rgb for rgb, _ in state], trackers, tracking_id[:25], device=self.device)
+        if self.mode == "BCP":
+            return [int(_id) for _id in two_result], {int(k): float(v) for k, v in two_score_dict.items()}
+        return [int(_id) for _id in single_result], {int(k): float(v) for k, v in single_score_dict.items()}
+
+
+class RangeModel(RiskModel):
+    """
+    The closest visible actor, if within threshold meters of the ego.
+    """
+    threshold = 10
+
+    def rank(self, state, frame):
+        actors = frame.actors
+        visible = set(frame.bbox)
+        ego_id = frame.episode.ego_id
+        distances = {}
+        for key in ("obstacle_ids", "vehicles_ids", "pedestrian_ids"):
+            for _id in actors.get(key, []):
+                if _id != ego_id and _id in actors and _id % INSTANCE_ID_MODULO in visible:
+                    distances[_id] = actors[_id]["distance"]
+        ranking = sorted((_id for _id, distance in distances.items() if distance <= self.threshold),
+                         key=lambda _id: distances[_id])
+        return ranking, {_id: -distance for _id, distance in distances.items()}
+
+
+class RandomModel(RiskModel):
+    """
+    A random actor within 35 meters of the ego.
+    """
+
+    def __init__(self, mode, threshold=None, seed=0):
+        super(RandomModel, self).__init__(mode, threshold, seed)
+        self.random = random.Random(seed)
+
+    def rank(self, state, frame):
+        actors = frame.actors
+        all_ids = [_id for key in ("vehicles_ids", "pedestrian_ids", "obstacle_ids")
+                   for _id in actors.get(key, [])
+                   if _id != frame.episode.ego_id and _id in actors and actors[_id]["distance"] < 35]
+        if not all_ids:
+            return [], {}
+        return [self.random.choice(all_ids)], {}
+
+
+MODELS = {
+    "Kalman_Filter": TrajectoryModel,
+    "MANTRA": MantraModel,
+    "Social-GAN": TrajectoryModel,
+    "QCNet": TrajectoryModel,
+    "DSA": VisionModel,
+    "RRL": VisionModel,
+    "BP": VisionModel,
+    "BCP": VisionModel,
+    "Range": RangeModel,
+    "Random": RandomModel,
+}
+
+
+def build_model(mode, threshold=None, seed=0):
+    return MODELS[mode](mode, threshold, seed)
+
+
+def evaluate_episodes(model, paths, batch_size):
+    """
+    Rank every frame of the episodes, batch_size episodes advancing together.
+    Returns:
+        list of per-frame records
+    """
+    pending = deque(paths)
+    active = []
+    records = []
+    while pending or active:
+        while pending and len(active) < batch_size:
+            episode = Episode(pending.popleft())
+            if len(episode):
+                active.append([episode, model.new_state(episode), 0])
+
+        items = []
+        for entry in active:
+            episode, state, index = entry
+            frame = Frame(episode, index)
+            model.observe(state, frame)
+            entry[2] += 1
+            if model.ready(state):
+                items.append((state, frame))
+
+        if items:
+            for (_, frame), (ranking, scores) in zip(items, model.rank_batch(items)):
+                episode = frame.episode
+                records.append({"scenario_type": episode.scenario_type,
+                                "basic_scenario": episode.basic_scenario,
+                                "variant": episode.variant,
+                                "frame": frame.number,
+                                "interactor_id": episode.interactor_id,
+                                "ranking": ranking,
+                                "scores": {str(_id): score for _id, score in scores.items()}})
+
+        active = [entry for entry in active if entry[2] < len(entry[0])]
+    return records
+
+
+def compute_metrics(records, top_k=(1, 3)):
+    """
+    Frame-level metrics of the top-1 prediction against interactor_id.
+    Frames without interactor count as false positives when something is predicted.
+    """
+    tp, fp, fn, tn = 0, 0, 0, 0
+    hits = dict.fromkeys(top_k, 0)
+    positives = 0
+    for record in records:
+        gt = record["interactor_id"]
+        ranking = record["ranking"]
+        if gt != -1:
+            positives += 1
+            for k in top_k:
+                if any(same_actor(_id, gt) for _id in ranking[:k]):
+                    hits[k] += 1
+            if ranking and same_actor(ranking[0], gt):
+                tp += 1
+            else:
+                fn += 1
+                if ranking:
+                    fp += 1
+        elif ranking:
+            fp += 1
+        else:
+            tn += 1
+
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    metrics = {"frames": len(records), "positive_frames": positives,
+               "TP": tp, "FP": fp, "FN": fn, "TN": tn,
+               "precision": precision, "recall": recall,
+               "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0}
+    for k in top_k:
+        metrics["top%d_accuracy" % k] = hits[k] / positives if positives else 0.0
+    return metrics
+
+
+_worker_model = None
+_worker_batch_size = 1
+
+
+def _init_worker(mode, threshold, seed, batch_size):
+    global _worker_model, _worker_batch_size
+    # the rule based modes don't touch the GPU
+    if mode not in ("Range", "Random"):
+        import torch
+    if mode not in ("Range", "Random") and torch.cuda.is_available():
+        identity = multiprocessing.current_process()._identity
+        index = identity[0] - 1 if identity else 0
+        torch.cuda.set_device(index % torch.cuda.device_count())
+    _worker_model = build_model(mode, threshold, seed)
+    _worker_batch_size = batch_size
+
+
+def _evaluate_chunk(paths):
+    return evaluate_episodes(_worker_model, paths, _worker_batch_size)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--data_root', default='./data_collection')
+    argparser.add_argument('--scenario_type', nargs='+', default=['interactive', 'non-interactive', 'obstacle', 'collision'])
+    argparser.add_argument('--mode', required=True, choices=sorted(MODELS))
+    argparser.add_argument('--workers', default=1, type=int, help='number of worker processes, 0 to run in this process')
+    argparser.add_argument('--batch_size', default=8, type=int, help='number of episodes ranked together')
+    argparser.add_argument('--threshold', default=None, type=float, help='score threshold of DSA/RRL, distance of Range')
+    argparser.add_argument('--seed', default=0, type=int)
+    argparser.add_argument('--out', default='./open_loop_result')
+    args = argparser.parse_args()
+
+    episodes = find_episodes(args.data_root, args.scenario_type)
+    print("%d episodes found" % len(episodes))
+    os.makedirs(args.out, exist_ok=True)
+
+    start_time = time.time()
+    records = []
+    frames_path = os.path.join(args.out, "%s_frames.jsonl" % args.mode)
+    with open(frames_path, "w") as f:
+        if args.workers == 0:
+            _init_worker(args.mode, args.threshold, args.seed, args.batch_size)
+            results = [_evaluate_chunk(episodes)]
+        else:
+            chunks = [episodes[i:i + args.batch_size] for i in range(0, len(episodes), args.batch_size)]
+            pool = multiprocessing.get_context("spawn").Pool(
+                args.workers, initializer=_init_worker,
+                initargs=(args.mode, args.threshold, args.seed, args.batch_size))
+            results = pool.imap_unordered(_evaluate_chunk, chunks)
+        for chunk_records in results:
+            for record in chunk_records:
+                f.write(json.dumps(record) + "\n")
+            records += chunk_records
+            print("%d frames ranked in %.1f s" % (len(records), time.time() - start_time))
+        if args.workers != 0:
+            pool.close()
+            pool.join()
+
+    metrics = {"mode": args.mode, "all": compute_metrics(records)}
+    for scenario_type in sorted(set(record["scenario_type"] for record in records)):
+        metrics[scenario_type] = compute_metrics([r for r in records if r["scenario_type"] == scenario_type])
+    with open(os.path.join(args.out, "%s_metrics.json" % args.mode), "w") as f:
+        json.dump(metrics, f, indent=4)
+    print(json.dumps(metrics["all"], indent=4))
+
+
+if __name__ == '__main__':
+    main()
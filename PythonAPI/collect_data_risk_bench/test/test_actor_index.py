@@ -0,0 +1,119 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from util.actor_index import COLLISION, INSTANCE_ID_MODULO, UNKNOWN, ActorIndex, instance_ids
+
+
+class TestActorIndex(unittest.TestCase):
+    def check_consistent(self, index):
+        """Rows are dense, and every instance id maps to the row of its only actor or is a collision"""
+        ids = index.ids.tolist()
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(index.row_of_id, {actor_id: row for row, actor_id in enumerate(ids)})
+        sharing = {}
+        for actor_id in ids:
+            sharing.setdefault(actor_id % INSTANCE_ID_MODULO, []).append(actor_id)
+        self.assertEqual({key: sorted(value) for key, value in index.sharing.items()},
+                         {key: sorted(value) for key, value in sharing.items()})
+        for instance_id, actors in sharing.items():
+            expected = index.row_of_id[actors[0]] if len(actors) == 1 else COLLISION
+            self.assertEqual(index.instance_rows[instance_id], expected)
+        self.assertEqual(index.collisions, set(key for key, value in sharing.items() if len(value) > 1))
+        self.assertEqual(int(np.count_nonzero(index.instance_rows != UNKNOWN)), len(sharing))
+
+    def test_update(self):
+        index = ActorIndex(capacity=2)
+        added, removed = index.update([30, 10, 20])
+        self.assertEqual((added.tolist(), removed.tolist()), ([10, 20, 30], []))
+        self.assertEqual(index.ids.tolist(), [10, 20, 30])
+        self.assertIn(20, index)
+        self.check_consistent(index)
+
+        # the last row fills the hole of a despawned actor
+        added, removed = index.update([30, 20, 40, 20])
+        self.assertEqual((added.tolist(), removed.tolist()), ([40], [10]))
+        self.assertEqual(index.ids.tolist(), [30, 20, 40])
+        self.assertNotIn(10, index)
+        self.check_consistent(index)
+
+        added, removed = index.update([20, 40])
+        self.assertEqual((added.tolist(), removed.tolist()), ([], [30]))
+        self.assertEqual(index.ids.tolist(), [40, 20])
+        self.check_consistent(index)
+
+        index.update([])
+        self.assertEqual(len(index), 0)
+        self.check_consistent(index)
+
+    def test_random_updates(self):
+        rng = np.random.default_rng(0)
+        index = ActorIndex(capacity=4)
+        pool = np.concatenate([rng.integers(0, 1 << 20, 40), np.arange(5) * INSTANCE_ID_MODULO + 7])
+        for _ in range(200):
+            frame = rng.choice(pool, rng.integers(0, len(pool)), replace=False)
+            index.update(frame)
+            self.assertEqual(sorted(index.ids.tolist()), sorted(set(frame.tolist())))
+            self.check_consistent(index)
+
+    def test_collisions(self):
+        index = ActorIndex()
+        shared = [7, INSTANCE_ID_MODULO + 7, 3 * INSTANCE_ID_MODULO + 7]
+        index.update(shared[:2] + [8])
+        self.assertEqual(index.collisions, {7})
+        self.assertEqual(index.lookup([7, 8, 9]).tolist(), [COLLISION, index.row_of_id[8], UNKNOWN])
+        self.assertEqual(index.actor_ids([7, 8, 9]).tolist(), [COLLISION, 8, UNKNOWN])
+
+        index.update(shared + [8])
+        self.assertEqual(sorted(index.sharing[7]), shared)
+        # one actor left, the instance id is no longer a collision
+        index.update([shared[1], 8])
+        self.assertEqual(index.collisions, set())
+        self.assertEqual(index.lookup([7]).tolist(), [index.row_of_id[shared[1]]])
+        self.assertEqual(index.actor_ids(7).tolist(), shared[1])
+        self.check_consistent(index)
+
+    def test_rows(self):
+        index = ActorIndex()
+        colliding = [5, INSTANCE_ID_MODULO + 5]
+        index.update([100, 200] + colliding)
+        rows = index.rows([200, 100, colliding[1], colliding[0], 300, INSTANCE_ID_MODULO + 100])
+        expected = [index.row_of_id[200], index.row_of_id[100], index.row_of_id[colliding[1]],
+                    index.row_of_id[colliding[0]], UNKNOWN, UNKNOWN]
+        self.assertEqual(rows.tolist(), expected)
+        self.assertEqual(index.rows(np.array([[100], [200]])).shape, (2, 1))
+
+    def test_lookup_plane(self):
+        index = ActorIndex()
+        index.update([1, 2, INSTANCE_ID_MODULO + 2])
+        plane = np.array([[0, 1, 1], [2, 2, 3]], dtype=np.uint16)
+        rows = index.lookup(plane)
+        self.assertEqual(rows.shape, plane.shape)
+        self.assertEqual(rows.tolist(), [[UNKNOWN, 0, 0], [COLLISION, COLLISION, UNKNOWN]])
+
+    def test_resolve(self):
+        index = ActorIndex()
+        colliding = [2, INSTANCE_ID_MODULO + 2]
+        index.update([1, 70000] + colliding)
+        self.assertEqual(index.resolve(instance_ids([1, 70000])), {1, 70000})
+        self.assertEqual(index.resolve([2, 9]), set(colliding))
+        self.assertEqual(index.resolve(np.array([[1, 2], [2, 0]], dtype=np.uint16)), {1} | set(colliding))
+        self.assertEqual(index.resolve([]), set())
+
+    def test_reset(self):
+        index = ActorIndex()
+        index.update([1, 2, INSTANCE_ID_MODULO + 2])
+        index.reset()
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.collisions, set())
+        self.assertTrue((index.instance_rows == UNKNOWN).all())
+        index.update([3])
+        self.assertEqual(index.rows([3]).tolist(), [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+try:
+    import carla
+    from util.actor_state import (OBSTACLE, OTHER, PEDESTRIAN, TRAFFIC_LIGHT, VEHICLE, ActorStateCollector,
+                                  rotation_matrices)
+except ImportError:
+    carla = None
+
+
+class FakeActor():
+    """carla.Actor, also used as its own ActorSnapshot"""
+
+    def __init__(self, actor_id, type_id, location, rotation=(0.0, 0.0, 0.0), velocity=(0.0, 0.0, 0.0),
+                 extent=(2.0, 1.0, 0.75), box_location=(0.0, 0.0, 0.75), control=None):
+        self.id = actor_id
+        self.type_id = type_id
+        self.location = location
+        self.rotation = rotation
+        self.velocity = velocity
+        self.bounding_box = carla.BoundingBox(carla.Location(*box_location), carla.Vector3D(*extent))
+        self.control = control
+
+    def get_transform(self):
+        return carla.Transform(carla.Location(*self.location), carla.Rotation(*self.rotation))
+
+    def get_velocity(self):
+        return carla.Vector3D(*self.velocity)
+
+    def get_acceleration(self):
+        return carla.Vector3D(0.0, 0.5, 0.0)
+
+    def get_angular_velocity(self):
+        return carla.Vector3D(0.0, 0.0, 1.0)
+
+    def get_control(self):
+        return self.control
+
+
+class FakeTrafficLight(FakeActor):
+    def __init__(self, actor_id, location, state):
+        super().__init__(actor_id, 'traffic.traffic_light', location)
+        self.state = state
+        self.trigger_volume = carla.BoundingBox(carla.Location(1.0, 2.0, 0.0), carla.Vector3D(3.0, 1.5, 1.0))
+        self.trigger_volume.rotation = carla.Rotation(yaw=90.0)
+
+
+class FakeSnapshot():
+    def __init__(self, frame, actors):
+        self.frame = frame
+        self.actors = list(actors)
+
+    def __iter__(self):
+        return iter(self.actors)
+
+
+class FakeWorld():
+    def __init__(self, actors):
+        self.actors = {actor.id: actor for actor in actors}
+        self.requested = []
+
+    def get_snapshot(self):
+        return FakeSnapshot(10, self.actors.values())
+
+    def get_actors(self, actor_ids):
+        self.requested.append(list(actor_ids))
+        # the spectator has no handle
+        return [self.actors[actor_id] for actor_id in actor_ids if actor_id != 0]
+
+
+def vertices(bounding_box, transform):
+    corners = bounding_box.get_world_vertices(transform)
+    return np.array([[v.x, v.y, v.z] for v in corners])
+
+
+@unittest.skipIf(carla is None, "util.actor_state needs the carla package")
+class TestActorStateCollector(unittest.TestCase):
+    def setUp(self):
+        self.ego = FakeActor(1, 'vehicle.tesla.model3', (10.0, 5.0, 0.0), (1.0, 30.0, -2.0), (3.0, 4.0, 0.0),
+                             control=carla.VehicleControl(throttle=0.7, steer=-0.2, gear=2))
+        self.bike = FakeActor(2, 'vehicle.kawasaki.ninja', (20.0, 5.0, 0.0), (0.0, 90.0, 0.0),
+                              extent=(5.0, 5.0, 5.0), control=carla.VehicleControl(brake=1.0))
+        self.walker = FakeActor(3, 'walker.pedestrian.0001', (10.0, 45.0, 0.0), extent=(0.3, 0.3, 0.9),
+                                box_location=(0.0, 0.0, 0.0),
+                                control=carla.WalkerControl(carla.Vector3D(0.0, 1.0, 0.0), 1.4, False))
+        self.light = FakeTrafficLight(4, (30.0, 5.0, 0.0), carla.TrafficLightState.Green)
+        self.cone = FakeActor(5, 'static.prop.trafficcone01', (12.0, 5.0, 0.0), extent=(0.2, 0.2, 0.4))
+        self.spectator = FakeActor(0, 'spectator', (0.0, 0.0, 50.0))
+        self.world = FakeWorld([self.ego, self.bike, self.walker, self.light, self.cone, self.spectator])
+        self.collector = ActorStateCollector(self.world, ego_id=1)
+
+    def test_rotation_matrices(self):
+        rotations = np.array([[1.0, 30.0, -2.0], [-10.0, 200.0, 45.0]])
+        for rotation, matrix in zip(rotations, rotation_matrices(rotations)):
+            expected = np.array(carla.Transform(carla.Location(), carla.Rotation(*rotation)).get_matrix())
+            np.testing.assert_allclose(matrix, expected[:3, :3], atol=1e-6)
+
+    def test_collect(self):
+        frame = self.collector.collect(compass=1.5)
+        self.assertEqual(frame.frame, 10)
+        self.assertEqual(frame.ids.tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(frame.kinds.tolist(), [VEHICLE, VEHICLE, PEDESTRIAN, TRAFFIC_LIGHT, OBSTACLE])
+        self.assertEqual(self.collector.kinds[0], OTHER)
+        np.testing.assert_allclose(frame.distances, [0.0, 10.0, 40.0, 20.0, 2.0], atol=1e-6)
+        np.testing.assert_allclose(frame.speeds[:2], [5.0, 0.0])
+
+        # corners of the bounding boxes, as carla.BoundingBox.get_world_vertices
+        np.testing.assert_allclose(frame.corners[0], vertices(self.ego.bounding_box, self.ego.get_transform()), atol=1e-4)
+        np.testing.assert_allclose(frame.corners[2], vertices(self.walker.bounding_box, self.walker.get_transform()), atol=1e-4)
+        np.testing.assert_allclose(frame.corners[4], vertices(self.cone.bounding_box, self.cone.get_transform()), atol=1e-4)
+        # motorbikes get the extent of their mesh rather than the one of their blueprint
+        bike = carla.BoundingBox(carla.Location(0.0, 0.0, 0.75), carla.Vector3D(1.177870, 0.381839, 0.75))
+        np.testing.assert_allclose(frame.corners[1], vertices(bike, self.bike.get_transform()), atol=1e-4)
+
+    def test_to_dict(self):
+        data = self.collector.collect(compass=1.5).to_dict()
+        ego = data[1]
+        self.assertEqual(ego["location"], {"x": 10.0, "y": 5.0, "z": 0.0})
+        self.assertEqual(ego["rotation"], {"pitch": 1.0, "yaw": 30.0, "roll": -2.0})
+        self.assertEqual((ego["speed"], ego["compass"], ego["type"]), (5.0, 1.5, "vehicle"))
+        self.assertEqual(ego["acceleration"], {"x": 0.0, "y": 0.5, "z": 0.0})
+        self.assertAlmostEqual(ego["control"]["throttle"], 0.7, places=6)
+        self.assertEqual(ego["control"]["gear"], 2)
+        self.assertEqual(sorted(ego["cord_bounding_box"]), ["cord_%d" % i for i in range(8)])
+        np.testing.assert_allclose(ego["cord_bounding_box"]["cord_7"], vertices(self.ego.bounding_box, self.ego.get_transform())[7], atol=1e-4)
+
+        walker = data[3]
+        self.assertNotIn("rotation", walker)
+        self.assertNotIn("compass", walker)
+        self.assertEqual(walker["type"], "pedestrian")
+        self.assertEqual(walker["control"], {"direction": {"x": 0.0, "y": 1.0, "z": 0.0},
+                                             "speed": walker["control"]["speed"], "jump": False})
+        self.assertAlmostEqual(walker["control"]["speed"], 1.4, places=6)
+
+        light = data[4]
+        self.assertEqual(light["state"], int(carla.TrafficLightState.Green))
+        self.assertEqual(light["trigger_loc"], [1.0, 2.0, 0.0])
+        self.assertEqual(light["trigger_box"], [3.0, 1.5])
+        np.testing.assert_allclose(light["trigger_ori"], [0.0, 1.0, 0.0], atol=1e-6)
+        trigger = self.light.trigger_volume.get_world_vertices(carla.Transform())
+        np.testing.assert_allclose(light["tigger_cord_bounding_box"]["cord_0"],
+                                   [trigger[0].x, trigger[0].y, trigger[0].z], atol=1e-5)
+
+        self.assertEqual(data[5], {"distance": 2.0, "type": "obstacle"})
+        self.assertEqual((data["vehicles_ids"], data["pedestrian_ids"]), ([1, 2], [3]))
+        self.assertEqual((data["traffic_light_ids"], data["obstacle_ids"]), ([4], [5]))
+        self.assertNotIn(0, data)
+
+    def test_to_inference_dict(self):
+        data = self.collector.collect().to_inference_dict(radius=35)
+        self.assertEqual(data["all_ids"], [2, 5])
+        self.assertEqual(data["obstacle"][5]["type_id"], "static.prop.trafficcone01")
+        self.assertEqual(data["obstacle_ids"], [5])
+
+    def test_register_once(self):
+        self.collector.collect()
+        self.collector.collect()
+        self.assertEqual(self.world.requested, [[1, 2, 3, 4, 5, 0]])
+
+        self.ego.location = (11.0, 5.0, 0.0)
+        late = FakeActor(6, 'vehicle.audi.tt', (11.0, 25.0, 0.0))
+        late.control = carla.VehicleControl()
+        self.world.actors[6] = late
+        frame = self.collector.collect()
+        self.assertEqual(self.world.requested[1:], [[6]])
+        self.assertEqual(frame.ids.tolist(), [1, 2, 3, 4, 5, 6])
+        self.assertAlmostEqual(frame.entry(6)["distance"], 20.0)
+        np.testing.assert_allclose(frame.corners[0], vertices(self.ego.bounding_box, self.ego.get_transform()), atol=1e-4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from util.dataset_catalog import DatasetCatalog, add_saved_episode, describe_episode, get_town, split_of
+
+try:
+    from models.LBC.dataset import GAP, STEPS, CarlaDataset
+except ImportError:
+    CarlaDataset = None
+
+
+def make_episode(root, scenario_type, basic_scenario, variant, frames=5, seed=True, collision_frame=None):
+    """Minimal episode in the layout of Data_Collection.save_data"""
+    path = os.path.join(root, scenario_type, basic_scenario, "variant_scenario", variant)
+    for folder in ("actors_data", os.path.join("rgb", "front")):
+        os.makedirs(os.path.join(path, folder))
+    for frame in range(1, frames + 1):
+        with open(os.path.join(path, "actors_data", "%08d.json" % frame), "w") as f:
+            json.dump({}, f)
+        open(os.path.join(path, "rgb", "front", "%08d.jpg" % frame), "wb").close()
+    with zipfile.ZipFile(os.path.join(path, "lidar.zip"), "w") as archive:
+        archive.writestr("meta.json", "{}")
+        for frame in range(1, frames + 1):
+            archive.writestr("%08d" % frame, b"")
+    with open(os.path.join(path, "actor_attribute.json"), "w") as f:
+        json.dump({"ego_id": 7, "interactor_id": 9}, f)
+    if seed:
+        with open(os.path.join(path, "seed.txt"), "w") as f:
+            f.write("42\n")
+    if collision_frame is not None:
+        with open(os.path.join(path, "collision_frame.json"), "w") as f:
+            json.dump({"frame": collision_frame}, f)
+    return path
+
+
+class CatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.paths = [
+            make_episode(self.root, "interactive", "10_i-1_1_c_f_f_1_rl", "ClearNoon_high_"),
+            make_episode(self.root, "interactive", "5_i-1_0_m_l_f_1_0", "WetSunset_low_", frames=3, seed=False),
+            make_episode(self.root, "collision", "3_c-2_0_p_f_f_1_0", "ClearNoon_low_", collision_frame=4),
+            make_episode(self.root, "obstacle", "A1_t1-1_0_c_r_r_0_0", "CloudyNoon_mid_"),
+        ]
+
+
+class TestDescribe(CatalogTestCase):
+    def test_get_town(self):
+        self.assertEqual(get_town("10_i-1_1_c_f_f_1_rl"), "Town10HD")
+        self.assertEqual(get_town("5_i-1_0_m_l_f_1_0"), "Town05")
+        self.assertEqual(get_town("7_t1-1_0_c_r_r_0_0"), "Town07")
+        self.assertEqual(get_town("A1_t1-1_0_c_r_r_0_0"), "A1")
+        self.assertIsNone(get_town("x_unknown"))
+
+    def test_describe_episode(self):
+        record = describe_episode(self.paths[2], self.root)
+        self.assertEqual(record["path"], "collision/3_c-2_0_p_f_f_1_0/variant_scenario/ClearNoon_low_")
+        self.assertEqual((record["town"], record["weather"], record["random_actors"]), ("Town03", "ClearNoon", "low"))
+        self.assertEqual((record["random_seed"], record["ego_id"], record["interactor_id"]), (42, 7, 9))
+        self.assertEqual(record["collision_frame"], 4)
+        self.assertEqual((record["first_frame"], record["last_frame"], record["num_frames"]), (1, 5, 5))
+        modalities = {name: (location, container, frames) for name, location, container, frames in record["modalities"]}
+        self.assertEqual(modalities["rgb/front"], ("rgb/front/%08d.jpg", False, [1, 2, 3, 4, 5]))
+        self.assertEqual(modalities["lidar.zip"], ("lidar.zip", True, [1, 2, 3, 4, 5]))
+
+    def test_not_an_episode(self):
+        with self.assertRaises(ValueError):
+            describe_episode(os.path.join(self.root, "interactive"), self.root)
+
+
+class TestCatalog(CatalogTestCase):
+    def test_open_scans_once(self):
+        with DatasetCatalog.open(self.root) as catalog:
+            self.assertTrue(catalog.scanned)
+            self.assertEqual(len(catalog), 4)
+        # an episode added behind the catalog is only found by a full scan
+        make_episode(self.root, "obstacle", "A1_t1-1_0_c_r_r_0_0", "HardRainNoon_mid_")
+        with DatasetCatalog.open(self.root) as catalog:
+            self.assertEqual(len(catalog), 4)
+            self.assertEqual(catalog.scan(), 5)
+
+    def test_saved_episode_does_not_scan(self):
+        add_saved_episode(self.paths[0])
+        with DatasetCatalog(self.root) as catalog:
+            self.assertFalse(catalog.scanned)
+            self.assertEqual(len(catalog), 1)
+        # the first open of a catalog never scanned in full catalogs the whole tree
+        with DatasetCatalog.open(self.root) as catalog:
+            self.assertTrue(catalog.scanned)
+            self.assertEqual(sorted(catalog.paths()), sorted(self.paths))
+        path = make_episode(self.root, "collision", "3_c-2_0_p_f_f_1_0", "HardRainNoon_high_")
+        add_saved_episode(path)
+        with DatasetCatalog.open(self.root) as catalog:
+            self.assertEqual(len(catalog), 5)
+
+    def test_removed_episodes_are_pruned(self):
+        DatasetCatalog.open(self.root).close()
+        shutil.rmtree(self.paths[1])
+        with DatasetCatalog.open(self.root) as catalog:
+            self.assertEqual(len(catalog), 3)
+            self.assertNotIn(self.paths[1], catalog.paths())
+            self.assertEqual(catalog.episodes(has_seed=False), [])
+
+    def test_remove(self):
+        with DatasetCatalog.open(self.root) as catalog:
+            for episode in catalog.episodes(has_seed=False):
+                catalog.remove(episode["path"])
+            catalog.remove(self.paths[3])
+            self.assertEqual(sorted(catalog.paths()), sorted([self.paths[0], self.paths[2]]))
+
+    def test_filters(self):
+        with DatasetCatalog.open(self.root) as catalog:
+            self.assertEqual(catalog.paths(scenario_type="interactive"), sorted(self.paths[:2]))
+            self.assertEqual(catalog.paths(collision=True), [self.paths[2]])
+            self.assertEqual(catalog.paths(town=["Town05", "A1"]), sorted([self.paths[1], self.paths[3]]))
+            self.assertEqual(catalog.paths(min_frames=4, scenario_type=["interactive"]), [self.paths[0]])
+            self.assertEqual(len(catalog.paths(modalities=["rgb/front", "lidar.zip"])), 4)
+            self.assertEqual(catalog.paths(modalities=["depth/front"]), [])
+
+            episode = catalog.episodes(collision=True)[0]
+            self.assertEqual(episode.num_frames("rgb/front"), 5)
+            self.assertEqual(episode.frame_range("lidar.zip"), (1, 5))
+            self.assertEqual(episode.frame_path("rgb/front", 3), os.path.join(self.paths[2], "rgb/front/00000003.jpg"))
+            self.assertEqual(episode.frame_path("lidar.zip", 3), (os.path.join(self.paths[2], "lidar.zip"), "00000003"))
+
+            train = catalog.paths(split="train", val_fraction=0.5)
+            val = catalog.paths(split="val", val_fraction=0.5)
+            self.assertEqual(sorted(train + val), sorted(self.paths))
+            for path in train:
+                self.assertEqual(split_of(os.path.relpath(path, self.root).replace(os.sep, "/"), 0.5), "train")
+
+
+@unittest.skipIf(CarlaDataset is None, "the LBC dataset needs torch and its loaders")
+class TestLBCDataset(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        self.addCleanup(os.chdir, cwd)
+
+    def test_split_of_an_older_catalog(self):
+        frames = GAP * STEPS + 3
+        kept = make_episode(self.root, "interactive", "1_i-1_0_c_l_f_1_0", "ClearNoon_low_", frames=frames)
+        DatasetCatalog.open(self.root).close()
+        # saved after the catalog was scanned, and one removed since the split was saved
+        added = make_episode(self.root, "obstacle", "2_t1-1_0_c_r_r_0_0", "ClearNoon_mid_", frames=frames)
+        removed = self.paths[1]
+        shutil.rmtree(removed)
+        with open("train_val_dataset.pkl", "wb") as f:
+            pickle.dump({"train": [kept, added, removed], "val": []}, f)
+
+        dataset = CarlaDataset(self.root, is_train=True)
+        self.assertEqual(len(dataset.actors_data), 2 * (frames - GAP * STEPS))
+        self.assertEqual(sorted(set(os.path.dirname(path) for path in dataset.actor_attribute)), sorted([kept, added]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from util.depth_storage import CODE_MAX, FAR_PLANE, DepthEncoder, DepthReader, DepthWriter, code_to_meters
+
+
+def depth_image(code):
+    """BGRA image of the depth camera packing a 24-bit code"""
+    bgra = np.zeros(code.shape + (4,), dtype=np.uint8)
+    bgra[..., 2] = code & 0xFF
+    bgra[..., 1] = (code >> 8) & 0xFF
+    bgra[..., 0] = (code >> 16) & 0xFF
+    bgra[..., 3] = 255
+    return bgra
+
+
+def random_code(rng, max_depth=FAR_PLANE, shape=(48, 64)):
+    # smooth rows with jumps, as in a depth image
+    meters = np.cumsum(rng.normal(0.0, 0.5, shape), axis=1) + rng.uniform(0.0, max_depth, (shape[0], 1))
+    meters = np.clip(meters, 0.0, min(max_depth, FAR_PLANE))
+    return np.round(meters / FAR_PLANE * CODE_MAX).astype(np.uint32)
+
+
+class TestDepthEncoder(unittest.TestCase):
+    def check_round_trip(self, encoder, code):
+        decoded = encoder.decode(encoder.encode(depth_image(code)))
+        self.assertEqual(decoded.dtype, np.float32)
+        self.assertEqual(decoded.shape, code.shape)
+        expected = code.astype(np.float64) * (FAR_PLANE / CODE_MAX)
+        error = np.abs(decoded.astype(np.float64) - expected)
+        self.assertLessEqual(error.max(), encoder.tolerance)
+
+    def test_lossless(self):
+        rng = np.random.default_rng(0)
+        encoder = DepthEncoder()
+        code = random_code(rng)
+        code[0, :4] = [0, 1, CODE_MAX - 1, CODE_MAX]
+        self.check_round_trip(encoder, code)
+        decoded = encoder.decode(encoder.encode(depth_image(code)))
+        np.testing.assert_array_equal(decoded, code_to_meters(code))
+
+    def test_precision(self):
+        rng = np.random.default_rng(1)
+        for precision in (0.1, 0.01, 0.001):
+            encoder = DepthEncoder(precision)
+            for _ in range(4):
+                self.check_round_trip(encoder, random_code(rng, encoder.max_depth))
+
+    def test_saturation(self):
+        encoder = DepthEncoder(0.001)
+        code = np.full((2, 3), CODE_MAX, dtype=np.uint32)
+        decoded = encoder.decode(encoder.encode(depth_image(code)))
+        self.assertTrue(np.allclose(decoded, encoder.max_depth, atol=encoder.tolerance))
+
+
+class TestDepthContainer(unittest.TestCase):
+    def test_random_access(self):
+        rng = np.random.default_rng(2)
+        encoder = DepthEncoder(0.01)
+        codes = {frame: random_code(rng, encoder.max_depth) for frame in (3, 0, 7)}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "depth_front.zip")
+            with DepthWriter(path, encoder) as writer:
+                for frame, code in codes.items():
+                    writer.write(frame, depth_image(code))
+            with DepthReader(path) as reader:
+                self.assertEqual(reader.frames, [0, 3, 7])
+                self.assertEqual(len(reader), 3)
+                self.assertIn(7, reader)
+                self.assertNotIn(1, reader)
+                self.assertEqual(reader.encoder.precision, 0.01)
+                for frame in (7, 0, 3):
+                    expected = codes[frame] * (FAR_PLANE / CODE_MAX)
+                    self.assertLessEqual(np.abs(reader[frame] - expected).max(), reader.tolerance)
+
+
+if __name__ == '__main__':
+    unittest.main()
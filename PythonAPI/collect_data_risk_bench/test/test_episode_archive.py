@@ -0,0 +1,219 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from util import episode_archive
+from util.episode_archive import (INDEX_SUFFIX, ChecksumError, ShardReader, pack, plan_shards, stream_episodes,
+                                  stream_shard, verify_shard, write_shard)
+
+
+def make_episode(rng, root, scenario_type, basic_scenario, variant, frames=4):
+    """Episode with json, jpg and npy files, in the layout of Data_Collection.save_data"""
+    episode = "/".join((scenario_type, basic_scenario, "variant_scenario", variant))
+    path = os.path.join(root, episode)
+    for folder in ("actors_data", os.path.join("rgb", "front"), "topology"):
+        os.makedirs(os.path.join(path, folder))
+    for frame in range(1, frames + 1):
+        with open(os.path.join(path, "actors_data", "%08d.json" % frame), "w") as f:
+            json.dump({str(actor): [frame, actor] * 20 for actor in range(10)}, f)
+        with open(os.path.join(path, "rgb", "front", "%08d.jpg" % frame), "wb") as f:
+            f.write(rng.bytes(3000))
+        np.save(os.path.join(path, "topology", "%08d.npy" % frame), rng.normal(size=(50, 6)))
+    with open(os.path.join(path, "actor_attribute.json"), "w") as f:
+        json.dump({"ego_id": 1, "interactor_id": 9}, f)
+    return episode
+
+
+def read_tree(root, episode):
+    files = {}
+    for directory, _, names in os.walk(os.path.join(root, episode)):
+        for name in names:
+            with open(os.path.join(directory, name), "rb") as f:
+                files[os.path.relpath(os.path.join(directory, name), os.path.join(root, episode))] = f.read()
+    return files
+
+
+class Unseekable(io.RawIOBase):
+    """Pipe-like file object, only read() is available"""
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.file.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+class ArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.root = os.path.join(self.tmp_dir, "data_collection")
+        self.out = os.path.join(self.tmp_dir, "archives")
+        rng = np.random.default_rng(0)
+        self.episodes = [
+            make_episode(rng, self.root, "collision", "3_c-2_0_p_f_f_1_0", "ClearNoon_low_"),
+            make_episode(rng, self.root, "collision", "3_c-2_0_p_f_f_1_0", "WetNoon_high_", frames=6),
+            make_episode(rng, self.root, "interactive", "10_i-1_1_c_f_f_1_rl", "ClearSunset_mid_", frames=3),
+        ]
+
+    def pack(self, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return pack(self.root, self.out, **kwargs)
+
+    def corrupt(self, shard, name):
+        with ShardReader(shard) as reader:
+            offset = reader.members[name]["offset"]
+        with open(shard, "r+b") as f:
+            f.seek(offset + 10)
+            byte = f.read(1)
+            f.seek(offset + 10)
+            f.write(bytes([byte[0] ^ 0xff]))
+
+
+class TestPack(ArchiveTestCase):
+    def test_shards_and_index(self):
+        size = sum(len(data) for data in read_tree(self.root, self.episodes[0]).values())
+        shards = self.pack(shard_size=size + 1, workers=2)
+        # episodes are packed whole, in the order of the catalog
+        self.assertEqual([os.path.basename(shard) for shard in shards], ["shard_00000.tar", "shard_00001.tar",
+                                                                          "shard_00002.tar"])
+        self.assertEqual(plan_shards(self.root, self.episodes, size + 1), [[episode] for episode in self.episodes])
+        for shard, episode in zip(shards, self.episodes):
+            with open(shard + INDEX_SUFFIX) as f:
+                index = json.load(f)
+            self.assertEqual((index["shard"], index["episodes"]), (os.path.basename(shard), [episode]))
+            files = read_tree(self.root, episode)
+            self.assertEqual(sorted(index["members"]), sorted(episode + "/" + name for name in files))
+            for name, entry in index["members"].items():
+                self.assertEqual(entry["size"], len(files[name[len(episode) + 1:]]))
+                # the jpgs are stored as they are, the other files compressed
+                self.assertEqual(entry["codec"], "none" if name.endswith(".jpg") else episode_archive.default_codec())
+                if "/actors_data/" in name:
+                    self.assertLess(entry["stored"], entry["size"])
+
+    def test_basic_scenario_filter(self):
+        shards = self.pack(scenario_types=["collision"], basic_scenarios=["3_c-2_0_p_f_f_1_0"])
+        with ShardReader(shards[0]) as reader:
+            self.assertEqual(reader.episodes, self.episodes[:2])
+
+    def test_command_line(self):
+        subprocess.run([sys.executable, "-m", "util.episode_archive", "pack", "--root", self.root, "--out", self.out,
+                        "--scenario_type", "interactive", "--workers", "1"],
+                       cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir), check=True,
+                       stdout=subprocess.DEVNULL)
+        result = subprocess.run([sys.executable, "-m", "util.episode_archive", "verify",
+                                 os.path.join(self.out, "shard_00000.tar")],
+                                cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir), check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True)
+        self.assertIn("shard_00000.tar: 10 members verified", result.stdout)
+
+
+class TestShardReader(ArchiveTestCase):
+    def setUp(self):
+        super().setUp()
+        self.shard = os.path.join(self.tmp_dir, "shard.tar")
+        write_shard(self.root, self.episodes, self.shard, codec="zlib")
+
+    def check_members(self, reader):
+        self.assertEqual(reader.episodes, self.episodes)
+        for episode in self.episodes:
+            archived = reader.episode(episode)
+            for name, data in read_tree(self.root, episode).items():
+                self.assertEqual(archived.read(name), data, name)
+            self.assertEqual(archived.read_json("actor_attribute.json"), {"ego_id": 1, "interactor_id": 9})
+            self.assertTrue(archived.exists("rgb/front/00000001.jpg"))
+            self.assertFalse(archived.exists("rgb/front/00000099.jpg"))
+        self.assertEqual(reader.episode(self.episodes[1]).listdir("topology"),
+                         ["%08d.npy" % frame for frame in range(1, 7)])
+        self.assertEqual(reader.episode(self.episodes[2]).listdir(),
+                         ["actor_attribute.json", "actors_data", "rgb", "topology"])
+
+    def test_read(self):
+        with ShardReader(self.shard) as reader:
+            self.check_members(reader)
+
+    def test_read_without_index(self):
+        with ShardReader(self.shard) as reader:
+            index = reader.index
+        os.remove(self.shard + INDEX_SUFFIX)
+        with ShardReader(self.shard) as reader:
+            self.assertEqual(reader.index, index)
+            self.check_members(reader)
+
+    def test_corrupted_member(self):
+        name = self.episodes[1] + "/rgb/front/00000002.jpg"
+        self.assertEqual(verify_shard(self.shard), 42)
+        self.corrupt(self.shard, name)
+        with self.assertRaisesRegex(ChecksumError, "checksum mismatch of " + name):
+            verify_shard(self.shard)
+        with ShardReader(self.shard) as reader:
+            with self.assertRaises(ChecksumError):
+                reader.read(name)
+            # the other members are still readable
+            self.assertEqual(reader.episode(self.episodes[1]).read("rgb/front/00000001.jpg"),
+                             read_tree(self.root, self.episodes[1])[os.path.join("rgb", "front", "00000001.jpg")])
+        with ShardReader(self.shard, verify=False) as reader:
+            self.assertEqual(len(reader.read(name)), reader.members[name]["size"])
+
+    @unittest.skipIf(episode_archive.zstandard is None, "the zstd codec needs the zstandard package")
+    def test_zstd(self):
+        shard = os.path.join(self.tmp_dir, "zstd.tar")
+        write_shard(self.root, self.episodes, shard, codec="zstd")
+        with ShardReader(shard) as reader:
+            self.check_members(reader)
+
+
+class TestStreaming(ArchiveTestCase):
+    def test_stream_shard(self):
+        shard = os.path.join(self.tmp_dir, "shard.tar")
+        write_shard(self.root, self.episodes, shard)
+        with Unseekable(shard) as f:
+            members = dict(stream_shard(f))
+        with ShardReader(shard) as reader:
+            self.assertEqual(members, {name: reader.read(name) for name in reader.members})
+
+    def test_stream_episodes(self):
+        shards = [os.path.join(self.tmp_dir, "shard_%d.tar" % i) for i in range(2)]
+        write_shard(self.root, self.episodes[:2], shards[0])
+        write_shard(self.root, self.episodes[2:], shards[1])
+        streamed = list(stream_episodes(shards))
+        self.assertEqual([episode for episode, _ in streamed], self.episodes)
+        for episode, files in streamed:
+            self.assertEqual(files, {name.replace(os.sep, "/"): data
+                                     for name, data in read_tree(self.root, episode).items()})
+
+    def test_stream_corrupted_member(self):
+        shard = os.path.join(self.tmp_dir, "shard.tar")
+        write_shard(self.root, self.episodes, shard)
+        name = self.episodes[2] + "/rgb/front/00000003.jpg"
+        self.corrupt(shard, name)
+        streamed = []
+        with self.assertRaisesRegex(ChecksumError, name):
+            for episode, _ in stream_episodes([shard]):
+                streamed.append(episode)
+        # the episodes before the corrupted member were streamed
+        self.assertEqual(streamed, self.episodes[:2])
+        self.assertEqual(len(list(stream_episodes([shard], verify=False))), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
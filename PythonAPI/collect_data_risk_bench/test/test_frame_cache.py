@@ -0,0 +1,173 @@
+import contextlib
+import io
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from util.frame_cache import FrameCache, build_cache
+
+try:
+    import torch
+    from models.dsa.RiskBenchDataset import RiskBench_cached_dataset, RiskBench_dataset
+except ImportError:
+    torch = None
+
+WIDTH, HEIGHT = 48, 32
+
+
+def make_episode(root, rng, scenario_type, basic_scenario, variant, frames, collision_frame=None):
+    """Episode with JPEG front frames and a bbox.json, in the layout of Data_Collection.save_data"""
+    path = os.path.join(root, scenario_type, basic_scenario, "variant_scenario", variant)
+    os.makedirs(os.path.join(path, "rgb", "front"))
+    bboxes = {}
+    for frame in range(1, frames + 1):
+        pixels = rng.integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(os.path.join(path, "rgb", "front", "%08d.jpg" % frame))
+        objects = {}
+        for obj_id in rng.permutation(30)[:int(rng.integers(0, 8))]:
+            x, y = rng.uniform(0, 30), rng.uniform(0, 20)
+            w, h = rng.uniform(2, 30), rng.uniform(2, 20)
+            objects[str(obj_id)] = [x, y, x + w, y + h]
+        bboxes["%08d" % frame] = objects
+    with open(os.path.join(path, "bbox.json"), "w") as f:
+        json.dump(bboxes, f)
+    with open(os.path.join(path, "actor_attribute.json"), "w") as f:
+        json.dump({"ego_id": 1, "interactor_id": 3}, f)
+    if collision_frame is not None:
+        with open(os.path.join(path, "collision_frame.json"), "w") as f:
+            json.dump({"frame": collision_frame}, f)
+    return path
+
+
+class FrameCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.cache_dir = os.path.join(self.root, "cache")
+        rng = np.random.default_rng(0)
+        self.paths = [
+            make_episode(self.root, rng, "collision", "3_c-2_0_p_f_f_1_0", "ClearNoon_low_", 12, collision_frame=10),
+            make_episode(self.root, rng, "collision", "3_c-2_0_p_f_f_1_0", "WetNoon_high_", 7, collision_frame=3),
+            make_episode(self.root, rng, "interactive", "10_i-1_1_c_f_f_1_rl", "ClearSunset_mid_", 9),
+        ]
+
+    def build(self, **kwargs):
+        kwargs.setdefault("size", (WIDTH, HEIGHT))
+        with contextlib.redirect_stdout(io.StringIO()):
+            return build_cache(self.root, self.cache_dir, **kwargs)
+
+    def episode_entry(self, cache, path):
+        variant = os.path.basename(path)
+        return next(i for i, episode in enumerate(cache.episodes) if episode["variant"] == variant)
+
+
+class TestBuildCache(FrameCacheTestCase):
+    def test_shards(self):
+        index = self.build(shard_frames=20)
+        # episodes are packed in order and never split: 12 + 7 frames, then 9
+        self.assertEqual([(shard["name"], shard["frames"]) for shard in index["shards"]],
+                         [("shard_0000", 19), ("shard_0001", 9)])
+        rows = sorted((episode["shard"], episode["start"], episode["length"]) for episode in index["episodes"])
+        self.assertEqual(rows, [(0, 0, 12), (0, 12, 7), (1, 0, 9)])
+        with open(os.path.join(self.cache_dir, "index.json")) as f:
+            self.assertEqual(json.load(f), index)
+        images = np.load(os.path.join(self.cache_dir, "shard_0000", "images.npy"), mmap_mode="r")
+        self.assertEqual((images.dtype, images.shape), (np.uint8, (19, HEIGHT, WIDTH, 3)))
+
+    def test_read_back(self):
+        self.build(max_objects=5, shard_frames=10)
+        cache = FrameCache(self.cache_dir)
+        self.assertEqual((cache.width, cache.height, cache.max_objects), (WIDTH, HEIGHT, 5))
+        for path in self.paths:
+            episode = self.episode_entry(cache, path)
+            images, boxes, ids = cache.frames(episode)
+            for array in (images, boxes, ids):
+                self.assertIsInstance(array, np.memmap)
+            with open(os.path.join(path, "bbox.json")) as f:
+                bboxes = list(json.load(f).values())
+            self.assertEqual(len(images), len(bboxes))
+            for t, name in enumerate(sorted(os.listdir(os.path.join(path, "rgb", "front")))):
+                with Image.open(os.path.join(path, "rgb", "front", name)) as image:
+                    np.testing.assert_array_equal(images[t], np.asarray(image.convert("RGB")))
+                # the boxes keep the order of bbox.json, truncated to max_objects, the empty slots have id -1
+                objects = list(bboxes[t].items())[:5]
+                self.assertEqual(ids[t].tolist(), [int(obj_id) for obj_id, _ in objects] + [-1] * (5 - len(objects)))
+                expected = np.array([box for _, box in objects], dtype=np.float32).reshape(-1, 4)
+                np.testing.assert_allclose(boxes[t, :len(objects)], expected, rtol=1e-6)
+                np.testing.assert_array_equal(boxes[t, len(objects):], 0)
+
+        # a frame range is a view of the episode rows
+        episode = self.episode_entry(cache, self.paths[0])
+        images, _, ids = cache.frames(episode, 3, 100)
+        np.testing.assert_array_equal(images, cache.frames(episode)[0][3:])
+        self.assertEqual(len(ids), 9)
+
+    def test_resize(self):
+        self.build(size=(WIDTH * 2, HEIGHT // 2))
+        cache = FrameCache(self.cache_dir)
+        episode = self.episode_entry(cache, self.paths[2])
+        images, boxes, ids = cache.frames(episode)
+        self.assertEqual(images.shape[1:], (HEIGHT // 2, WIDTH * 2, 3))
+        with open(os.path.join(self.paths[2], "bbox.json")) as f:
+            bboxes = list(json.load(f).values())
+        for t, objects in enumerate(bboxes):
+            expected = np.array(list(objects.values()), dtype=np.float32).reshape(-1, 4) * [2.0, 0.5, 2.0, 0.5]
+            np.testing.assert_allclose(boxes[t, :len(objects)], expected, rtol=1e-6)
+
+    def test_select_and_pickle(self):
+        self.build()
+        cache = FrameCache(self.cache_dir)
+        self.assertEqual(len(cache.select("collision")), 2)
+        self.assertEqual(len(cache.select(basic_scenario="10_i-1_1_c_f_f_1_rl")), 1)
+        self.assertEqual(cache.select(variant="WetNoon_high_"), [self.episode_entry(cache, self.paths[1])])
+        # the maps are not pickled to the loader workers, they map the shards again
+        cache.frames(0)
+        copy = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(copy._shards, {})
+        np.testing.assert_array_equal(copy.frames(0)[0], cache.frames(0)[0])
+
+
+@unittest.skipIf(torch is None, "the cached dataset needs torch and torchvision")
+class TestCachedDataset(FrameCacheTestCase):
+    def assertSameSample(self, sample, expected):
+        self.assertEqual(sorted(sample), sorted(expected))
+        torch.testing.assert_close(sample["img"], expected["img"], rtol=0, atol=1e-5)
+        for key in ("bbox", "bbox_id", "label", "risky_id"):
+            self.assertEqual(sample[key].dtype, expected[key].dtype, key)
+            torch.testing.assert_close(sample[key], expected[key], rtol=0, atol=0, msg=key)
+        for key in ("s_type", "s_id", "variant"):
+            self.assertEqual(sample[key], expected[key])
+        for raw, expected_raw in zip(sample["raw_img"], expected["raw_img"]):
+            np.testing.assert_array_equal(raw, expected_raw)
+
+    def test_same_samples_as_the_jpeg_dataset(self):
+        self.build(shard_frames=10)
+        cache = FrameCache(self.cache_dir)
+        # the collision of WetNoon_high_ is too early for a clip of 5 frames, it is only an inference sample
+        for s_type, s_id, inference, count in (("collision", "3_c-2_0_p_f_f_1_0", False, 1),
+                                               ("interactive", "10_i-1_1_c_f_f_1_rl", False, 1),
+                                               ("collision", "3_c-2_0_p_f_f_1_0", True, 2)):
+            with self.subTest(s_type=s_type, inference=inference):
+                cached = RiskBench_cached_dataset(cache, s_type, s_id, object_num=4, frame_num=5,
+                                                  inference=inference, raw_img=True)
+                self.assertEqual(len(cached), count)
+                for i in range(len(cached)):
+                    sample = cached[i]
+                    # RiskBench_dataset also lists the variants it skips, it is read one variant at a time
+                    dataset = RiskBench_dataset(self.root, s_type, s_id, object_num=4, frame_num=5,
+                                                inference=inference, raw_img=True, designate=sample["variant"])
+                    self.assertEqual(len(dataset), 1)
+                    self.assertSameSample(sample, dataset[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+try:
+    import torch
+    from util import inference_server
+    from util.inference_server import InferenceClient, InferenceServer, ModelWorker, Request
+except ImportError:
+    torch = None
+
+
+class FakeConnection():
+    """Server side connection, collecting the responses"""
+
+    def __init__(self):
+        self.responses = {}
+        self.condition = threading.Condition()
+
+    def send(self, message):
+        with self.condition:
+            self.responses[message["id"]] = message
+            self.condition.notify_all()
+
+    def wait(self, count, timeout=5.0):
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.responses) >= count, timeout)
+        return self.responses
+
+
+class Forward():
+    """Batched model doubling its input, recording the batch sizes"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.sizes = []
+
+    def __call__(self, x, y):
+        self.sizes.append(len(x))
+        time.sleep(self.delay)
+        if np.any(x < 0):
+            raise ValueError("negative input")
+        return x * 2 + y
+
+
+@unittest.skipIf(torch is None, "the inference server needs torch")
+class TestModelWorker(unittest.TestCase):
+    def put(self, worker, connection, request_id, x):
+        worker.put(Request(connection, request_id, [np.asarray(x, dtype=np.float32), np.ones(len(x), np.float32)]))
+
+    def test_full_batch(self):
+        forward = Forward()
+        # the deadline is far away, a batch is run as soon as it is full
+        worker = ModelWorker("double", forward, True, max_batch=3, max_latency=10.0)
+        connection = FakeConnection()
+        for i in range(6):
+            self.put(worker, connection, i, [i, 10 * i])
+        responses = connection.wait(6)
+        self.assertEqual(forward.sizes, [6, 6])
+        for i in range(6):
+            np.testing.assert_array_equal(responses[i]["result"], [2 * i + 1, 20 * i + 1])
+        stats = worker.stats()
+        self.assertEqual((stats["requests"], stats["batches"], stats["mean_batch_size"]), (6, 2, 3.0))
+        self.assertEqual(stats["batch_size_histogram"], {3: 2})
+
+    def test_latency_deadline(self):
+        forward = Forward()
+        worker = ModelWorker("double", forward, True, max_batch=16, max_latency=0.05)
+        connection = FakeConnection()
+        start = time.perf_counter()
+        self.put(worker, connection, 0, [1.0])
+        self.put(worker, connection, 1, [2.0])
+        responses = connection.wait(2)
+        # the batch is not full, it runs when the oldest request has waited max_latency
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+        self.assertEqual(forward.sizes, [2])
+        np.testing.assert_array_equal(responses[1]["result"], [5.0])
+
+    def test_requests_queue_while_running(self):
+        forward = Forward(delay=0.1)
+        worker = ModelWorker("double", forward, True, max_batch=8, max_latency=0.0)
+        connection = FakeConnection()
+        self.put(worker, connection, 0, [0.0])
+        time.sleep(0.03)
+        for i in range(1, 5):
+            self.put(worker, connection, i, [float(i)])
+        connection.wait(5)
+        # the requests sent during the first forward pass go in the next batch
+        self.assertEqual(forward.sizes, [1, 4])
+        self.assertEqual(worker.stats()["max_queue_depth"], 0)
+
+    def test_shapes_and_errors(self):
+        forward = Forward()
+        worker = ModelWorker("double", forward, True, max_batch=4, max_latency=10.0)
+        connection = FakeConnection()
+        worker.put(Request(connection, 0, [np.ones((1, 2)), np.ones((1, 2))]))
+        worker.put(Request(connection, 1, [np.ones((1, 3)), np.ones((1, 3))]))
+        worker.put(Request(connection, 2, [np.ones((1, 2)), np.zeros((1, 2))]))
+        self.put(worker, connection, 3, [-1.0])
+        responses = connection.wait(4)
+        # inputs of different shapes go in separate forward passes, an error only fails its group
+        self.assertEqual(sorted(forward.sizes), [1, 1, 2])
+        np.testing.assert_array_equal(responses[2]["result"], [[2.0, 2.0]])
+        np.testing.assert_array_equal(responses[1]["result"], [[3.0, 3.0, 3.0]])
+        self.assertIn("negative input", responses[3]["error"])
+
+    def test_unbatched(self):
+        calls = []
+        worker = ModelWorker("clip", lambda *inputs: calls.append(inputs) or len(calls), False, max_batch=8,
+                             max_latency=10.0)
+        connection = FakeConnection()
+        for i in range(3):
+            worker.put(Request(connection, i, [np.arange(i + 1)]))
+        responses = connection.wait(3)
+        self.assertEqual([len(inputs[0]) for inputs in calls], [1, 2, 3])
+        self.assertEqual([responses[i]["result"] for i in range(3)], [1, 2, 3])
+
+
+@unittest.skipIf(torch is None, "the inference server needs torch")
+class TestInferenceClient(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.forward = Forward(delay=0.01)
+        patcher = mock.patch.dict(inference_server.MODELS, {"double": (lambda device: self.forward, True)})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.address = os.path.join(self.tmpdir, "server.sock")
+        self.server = InferenceServer(self.address, max_batch=8, max_latency=0.02, device=torch.device("cpu"))
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0,), daemon=True)
+        self.thread.start()
+        deadline = time.time() + 5.0
+        while not os.path.exists(self.address) and time.time() < deadline:
+            time.sleep(0.01)
+        self.addCleanup(self.stop)
+
+    def stop(self):
+        if self.thread.is_alive():
+            self.server.shutdown()
+            self.thread.join(5.0)
+
+    def client(self):
+        client = InferenceClient(self.address)
+        self.addCleanup(client.close)
+        return client
+
+    def test_calls_are_batched(self):
+        results = {}
+
+        def run(index):
+            model = self.client().model("double")
+            for step in range(5):
+                x = np.full((1, 3), index * 100 + step, dtype=np.float32)
+                results[index, step] = (x, model(x, np.zeros_like(x)))
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 20)
+        for x, result in results.values():
+            np.testing.assert_array_equal(result, x * 2)
+        stats = self.client().stats()["double"]
+        self.assertEqual(stats["requests"], 20)
+        # the requests of the workers share forward passes
+        self.assertLess(stats["batches"], 20)
+        self.assertEqual(sum(self.forward.sizes), 20)
+
+    def test_errors(self):
+        client = self.client()
+        with self.assertRaises(RuntimeError):
+            client.call("unknown", np.zeros(1))
+        with self.assertRaisesRegex(RuntimeError, "negative input"):
+            client.call("double", -np.ones(1), np.zeros(1))
+        # the connection is still usable
+        np.testing.assert_array_equal(client.call("double", np.ones(2), np.zeros(2)), [2.0, 2.0])
+
+    def test_shutdown(self):
+        self.client().call("double", np.ones(1), np.zeros(1))
+        self.stop()
+        self.assertFalse(self.thread.is_alive())
+        self.assertFalse(os.path.exists(self.address))
+
+if __name__ == '__main__':
+    unittest.main()
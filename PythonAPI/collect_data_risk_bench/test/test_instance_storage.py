@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from util.instance_storage import CAR, PEDESTRIAN, InstanceEncoder, InstanceReader, InstanceWriter, instance_planes
+
+
+def instance_image(classes, ids):
+    bgra = np.zeros(classes.shape + (4,), dtype=np.uint8)
+    bgra[..., 2] = classes
+    bgra[..., 1] = ids & 0xFF
+    bgra[..., 0] = ids >> 8
+    bgra[..., 3] = 255
+    return bgra
+
+
+def random_image(rng, shape=(40, 60)):
+    classes = np.full(shape, 7, dtype=np.uint8)
+    ids = np.zeros(shape, dtype=np.uint16)
+    for _ in range(6):
+        y, x = rng.integers(0, shape[0] - 8), rng.integers(0, shape[1] - 8)
+        h, w = rng.integers(1, 8, 2)
+        classes[y:y + h, x:x + w] = rng.choice([CAR, PEDESTRIAN])
+        ids[y:y + h, x:x + w] = rng.integers(1, 65536)
+    return instance_image(classes, ids)
+
+
+class TestInstanceEncoder(unittest.TestCase):
+    def test_round_trip(self):
+        rng = np.random.default_rng(0)
+        encoder = InstanceEncoder()
+        for _ in range(5):
+            bgra = random_image(rng)
+            classes, ids = encoder.decode(encoder.encode(bgra)).planes()
+            expected_classes, expected_ids = instance_planes(bgra)
+            np.testing.assert_array_equal(classes, expected_classes)
+            np.testing.assert_array_equal(ids, expected_ids)
+
+    def test_objects(self):
+        classes = np.zeros((10, 12), dtype=np.uint8)
+        ids = np.zeros((10, 12), dtype=np.uint16)
+        classes[2:5, 3:7] = CAR
+        ids[2:5, 3:7] = 40000
+        classes[8, 0] = PEDESTRIAN
+        ids[8, 0] = 12
+        encoder = InstanceEncoder()
+        frame = encoder.decode(encoder.encode(instance_image(classes, ids)))
+        found_ids, found_classes, counts, boxes = frame.objects((CAR, PEDESTRIAN))
+        objects = {int(i): (int(c), int(n), boxes[k].tolist()) for k, (i, c, n) in enumerate(zip(found_ids, found_classes, counts))}
+        self.assertEqual(objects, {40000: (CAR, 12, [3, 2, 6, 4]), 12: (PEDESTRIAN, 1, [0, 8, 0, 8])})
+        self.assertEqual(frame.objects((CAR, PEDESTRIAN), min_area=2)[0].tolist(), [40000])
+        self.assertEqual(int(frame.mask(CAR, 40000).sum()), 12)
+
+
+class TestInstanceContainer(unittest.TestCase):
+    def test_random_access(self):
+        rng = np.random.default_rng(1)
+        images = {frame: random_image(rng) for frame in (4, 1)}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "instance_front.zip")
+            with InstanceWriter(path) as writer:
+                for frame, bgra in images.items():
+                    writer.write(frame, bgra)
+            with InstanceReader(path) as reader:
+                self.assertEqual(reader.frames, [1, 4])
+                self.assertEqual(len(reader), 2)
+                self.assertIn(4, reader)
+                self.assertNotIn(2, reader)
+                for frame in (4, 1):
+                    np.testing.assert_array_equal(reader.planes(frame)[1], instance_planes(images[frame])[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
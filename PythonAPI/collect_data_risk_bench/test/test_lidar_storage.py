@@ -0,0 +1,111 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from util.lidar_storage import LidarEncoder, LidarReader, LidarWriter
+
+
+def random_sweep(rng, count=2000, extent=80.0):
+    points = np.empty((count, 4), dtype=np.float32)
+    points[:, :3] = rng.uniform(-extent, extent, (count, 3))
+    points[:, 3] = rng.uniform(0.0, 1.0, count)
+    return points
+
+
+class TestLidarEncoder(unittest.TestCase):
+    def test_round_trip(self):
+        rng = np.random.default_rng(0)
+        for resolution in (0.01, 0.001):
+            encoder = LidarEncoder(resolution=resolution)
+            points = random_sweep(rng, extent=min(80.0, encoder.extent))
+            decoded = encoder.decode(encoder.encode(points))
+            self.assertEqual(decoded.dtype, np.float32)
+            self.assertEqual(decoded.shape, points.shape)
+            self.assertLessEqual(np.abs(decoded[:, :3] - points[:, :3].astype(np.float64)).max(), encoder.tolerance)
+            self.assertLessEqual(np.abs(decoded[:, 3] - points[:, 3]).max(), 1.0 / 510 + 1e-6)
+
+    def test_empty_sweep(self):
+        encoder = LidarEncoder()
+        self.assertEqual(encoder.decode(encoder.encode(np.zeros((0, 4), dtype=np.float32))).shape, (0, 4))
+
+
+class TestLidarIngest(unittest.TestCase):
+    def test_roi_crop(self):
+        rng = np.random.default_rng(2)
+        points = random_sweep(rng, count=5000)
+        roi = (-10.0, 30.0, -5.0, 5.0, -2.0, 1.0)
+        encoder = LidarEncoder(roi=roi)
+        cropped = encoder.crop(points)
+        x, y, z = points[:, 0], points[:, 1], points[:, 2]
+        inside = (x >= -10) & (x <= 30) & (y >= -5) & (y <= 5) & (z >= -2) & (z <= 1)
+        np.testing.assert_array_equal(cropped, points[inside])
+        decoded = encoder.decode(encoder.encode(points))
+        self.assertEqual(len(decoded), inside.sum())
+        self.assertTrue(np.all(decoded[:, 0] >= roi[0] - encoder.tolerance))
+        self.assertTrue(np.all(decoded[:, 0] <= roi[1] + encoder.tolerance))
+
+    def test_out_of_grid_points_dropped(self):
+        encoder = LidarEncoder(resolution=0.001)
+        points = np.array([[1.0, 2.0, 0.5, 0.1], [encoder.extent + 1.0, 0.0, 0.0, 0.2]], dtype=np.float32)
+        np.testing.assert_array_equal(encoder.crop(points), points[:1])
+
+    def test_voxel_downsample(self):
+        encoder = LidarEncoder(voxel_size=1.0)
+        points = np.array([[0.2, 0.2, 0.2, 0.0], [0.8, 0.6, 0.4, 1.0],  # voxel (0, 0, 0)
+                           [1.5, 0.5, 0.5, 0.5],                          # voxel (1, 0, 0)
+                           [-0.5, -0.5, 0.5, 0.2], [-0.1, -0.9, 0.1, 0.4]],  # voxel (-1, -1, 0)
+                          dtype=np.float32)
+        downsampled = encoder.downsample(points)
+        self.assertEqual(downsampled.dtype, np.float32)
+        expected = np.array([[-0.3, -0.7, 0.3, 0.3], [0.5, 0.4, 0.3, 0.5], [1.5, 0.5, 0.5, 0.5]])
+        order = np.lexsort(downsampled[:, :3].T[::-1])
+        np.testing.assert_allclose(downsampled[order], expected, atol=1e-6)
+
+    def test_voxel_downsample_one_point_per_voxel(self):
+        rng = np.random.default_rng(3)
+        encoder = LidarEncoder(voxel_size=0.5)
+        points = random_sweep(rng, count=20000, extent=5.0)
+        downsampled = encoder.downsample(points)
+        voxels = np.floor(downsampled[:, :3] / 0.5).astype(np.int64)
+        self.assertEqual(len(np.unique(voxels, axis=0)), len(downsampled))
+        self.assertEqual(len(downsampled), len(np.unique(np.floor(points[:, :3] / 0.5), axis=0)))
+
+    def test_settings_saved_in_container(self):
+        rng = np.random.default_rng(4)
+        encoder = LidarEncoder(roi=(-20, 20, -20, 20, -3, 3), voxel_size=0.2, resolution=0.02)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "lidar.zip")
+            with LidarWriter(path, encoder) as writer:
+                writer.write(0, random_sweep(rng))
+            with LidarReader(path) as reader:
+                self.assertEqual(reader.encoder.to_dict(), encoder.to_dict())
+                self.assertTrue(np.all(np.abs(reader[0][:, :2]) <= 20 + reader.tolerance))
+
+
+class TestLidarContainer(unittest.TestCase):
+    def test_random_access(self):
+        rng = np.random.default_rng(1)
+        sweeps = {frame: random_sweep(rng, count=100 + frame) for frame in (5, 2, 9)}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "lidar.zip")
+            with LidarWriter(path, LidarEncoder(resolution=0.005)) as writer:
+                for frame, points in sweeps.items():
+                    writer.write(frame, points)
+            with LidarReader(path) as reader:
+                self.assertEqual(reader.frames, [2, 5, 9])
+                self.assertEqual(len(reader), 3)
+                self.assertIn(9, reader)
+                self.assertNotIn(3, reader)
+                self.assertEqual(reader.encoder.resolution, 0.005)
+                for frame in (9, 2, 5):
+                    self.assertEqual(len(reader[frame]), len(sweeps[frame]))
+                    self.assertLessEqual(np.abs(reader[frame][:, :3] - sweeps[frame][:, :3]).max(), reader.tolerance)
+
+
+if __name__ == '__main__':
+    unittest.main()
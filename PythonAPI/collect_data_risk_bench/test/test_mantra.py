@@ -0,0 +1,178 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+try:
+    import torch
+    import torch.nn.functional as F
+    from models.mantra import mantra
+    from models.mantra.models.model_encdec import model_encdec
+except ImportError:
+    torch = None
+
+DIM = 8
+MEMORY = 12
+
+
+def make_engine(capacity=None, eviction='fifo'):
+    """MantraEngine of a small untrained model and a random memory, on the CPU"""
+    torch.manual_seed(0)
+    settings = {"use_cuda": False, "dim_embedding_key": DIM, "past_len": mantra.PAST_LEN,
+                "future_len": mantra.FUTURE_LEN}
+    model = model_encdec(settings)
+    model.linear_controller = torch.nn.Linear(1, 1)
+    memory_past = torch.randn(MEMORY, DIM)
+    memory_fut = torch.randn(MEMORY, DIM)
+    with mock.patch.object(mantra.torch, "load", side_effect=[model, memory_past, memory_fut]):
+        return mantra.MantraEngine(capacity=capacity, eviction=eviction, device=torch.device("cpu"))
+
+
+def reference_predict(model, memory_past, memory_fut, past):
+    """Prediction of one agent, step by step as in model_controllerMem.forward"""
+    past = torch.as_tensor(past, dtype=torch.float).unsqueeze(0)
+    present = past[:, -1].unsqueeze(1)
+    past = past - present
+    story_embed = model.relu(model.conv_past(torch.transpose(past, 1, 2)))
+    _, state_past = model.encoder_past(torch.transpose(story_embed, 1, 2))
+    weight_read = torch.matmul(F.normalize(memory_past, p=2, dim=1),
+                               F.normalize(state_past.squeeze(0), p=2, dim=1).transpose(0, 1)).transpose(0, 1)
+    info_future = memory_fut[torch.sort(weight_read, descending=True)[1][:, 0]]
+    input_dec = torch.cat((state_past, info_future.unsqueeze(0)), 2)
+    zero_padding = torch.zeros(1, 1, DIM * 2)
+    state_dec = zero_padding
+    position = torch.zeros(1, 1, 2)
+    prediction = []
+    for _ in range(mantra.FUTURE_LEN):
+        output_decoder, state_dec = model.decoder(input_dec, state_dec)
+        position = position + model.FC_output(output_decoder).squeeze(0).unsqueeze(1)
+        prediction.append(position)
+        input_dec = zero_padding
+    return (torch.cat(prediction, 1) + present).squeeze(0).numpy()
+
+
+def trajectories(rng, count, length):
+    start = rng.uniform(-20, 20, (count, 1, 2))
+    velocity = rng.uniform(-1, 1, (count, 1, 2))
+    return start + velocity * np.arange(length)[None, :, None]
+
+
+@unittest.skipIf(torch is None, "MANTRA needs torch")
+class TestMantraEngine(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def test_predict_batch(self):
+        engine = make_engine()
+        pasts = trajectories(self.rng, 5, mantra.PAST_LEN)
+        prediction = engine.predict(pasts)
+        self.assertEqual(prediction.shape, (5, mantra.FUTURE_LEN, 2))
+        with torch.no_grad():
+            for past, predicted in zip(pasts, prediction):
+                expected = reference_predict(engine.mem_n2n, engine.memory_past, engine.memory_fut, past)
+                np.testing.assert_allclose(predicted, expected, atol=1e-4)
+
+    def test_predict_translation(self):
+        engine = make_engine()
+        pasts = trajectories(self.rng, 3, mantra.PAST_LEN)
+        np.testing.assert_allclose(engine.predict(pasts + [100.0, -50.0]), engine.predict(pasts) + [100.0, -50.0],
+                                   atol=1e-4)
+        self.assertEqual(engine.predict(np.zeros((0, mantra.PAST_LEN, 2))).shape, (0, mantra.FUTURE_LEN, 2))
+
+    def test_write(self):
+        engine = make_engine()
+        pasts = trajectories(self.rng, 4, mantra.PAST_LEN + mantra.FUTURE_LEN)
+        self.assertEqual(engine.write(pasts[:, :mantra.PAST_LEN], pasts[:, mantra.PAST_LEN:], use_controller=False), 4)
+        self.assertEqual(len(engine), MEMORY + 4)
+        self.assertEqual(engine.memory_fut.shape, (MEMORY + 4, DIM))
+        # the written pasts are read back as their own closest keys
+        with torch.no_grad():
+            origin = pasts[:, mantra.PAST_LEN - 1:mantra.PAST_LEN]
+            state_past = engine.encode_past(engine._to_tensor(pasts[:, :mantra.PAST_LEN] - origin))
+        self.assertEqual(engine.read(state_past).tolist(), [MEMORY, MEMORY + 1, MEMORY + 2, MEMORY + 3])
+
+    def test_write_controller(self):
+        engine = make_engine()
+        pasts = trajectories(self.rng, 3, mantra.PAST_LEN + mantra.FUTURE_LEN)
+        past, future = pasts[:, :mantra.PAST_LEN], pasts[:, mantra.PAST_LEN:]
+        with torch.no_grad():
+            engine.mem_n2n.linear_controller.weight.zero_()
+            engine.mem_n2n.linear_controller.bias.fill_(-10.0)
+        self.assertEqual(engine.write(past, future), 0)
+        self.assertEqual(len(engine), MEMORY)
+        with torch.no_grad():
+            engine.mem_n2n.linear_controller.bias.fill_(10.0)
+        self.assertEqual(engine.write(past, future), 3)
+        self.assertEqual(len(engine), MEMORY + 3)
+
+    def test_fifo_eviction(self):
+        engine = make_engine(capacity=MEMORY)
+        oldest = engine.memory_past.clone()
+        pasts = trajectories(self.rng, 3, mantra.PAST_LEN + mantra.FUTURE_LEN)
+        engine.write(pasts[:, :mantra.PAST_LEN], pasts[:, mantra.PAST_LEN:], use_controller=False)
+        self.assertEqual(len(engine), MEMORY)
+        self.assertTrue(torch.equal(engine.memory_past[:MEMORY - 3], oldest[3:]))
+
+    def test_lru_eviction(self):
+        engine = make_engine(capacity=MEMORY, eviction='lru')
+        keys = engine.memory_past.clone()
+        # entries 0 and 1 are read, the next oldest unread ones are evicted
+        engine.read(keys[[0, 1]])
+        pasts = trajectories(self.rng, 2, mantra.PAST_LEN + mantra.FUTURE_LEN)
+        engine.write(pasts[:, :mantra.PAST_LEN], pasts[:, mantra.PAST_LEN:], use_controller=False)
+        self.assertEqual(len(engine), MEMORY)
+        self.assertTrue(torch.equal(engine.memory_past[:MEMORY - 2], keys[[0, 1] + list(range(4, MEMORY))]))
+        with self.assertRaises(ValueError):
+            make_engine(eviction='random')
+
+
+class ConstantVelocityEngine():
+    """Engine extrapolating the last displacement of every past"""
+
+    def predict(self, pasts):
+        velocity = pasts[:, -1:] - pasts[:, -2:-1]
+        return pasts[:, -1:] + velocity * np.arange(1, 31)[None, :, None]
+
+
+def track(track_id, start, velocity, frames=range(81, 101)):
+    rows = [(frame, track_id, start[0] + velocity[0] * (frame - 100), start[1] + velocity[1] * (frame - 100))
+            for frame in frames]
+    return pd.DataFrame(rows, columns=['FRAME', 'TRACK_ID', 'X', 'Y'])
+
+
+@unittest.skipIf(torch is None, "MANTRA needs torch")
+class TestMantraInference(unittest.TestCase):
+    def test_get_pasts(self):
+        # the late track is padded with its first position
+        track_ids, frames, pasts = mantra.get_pasts([track(2, (5.0, 0.0), (1.0, 0.0), range(95, 101)),
+                                                     track(1, (0.0, 0.0), (0.0, 1.0))])
+        self.assertEqual(track_ids.tolist(), [1, 2])
+        self.assertEqual(frames.tolist(), list(range(81, 101)))
+        np.testing.assert_allclose(pasts[0, :, 1], np.arange(-19, 1))
+        np.testing.assert_allclose(pasts[1, :14, 0], 0.0)
+        np.testing.assert_allclose(pasts[1, 14:, 0], np.arange(0, 6))
+
+    def test_risky_ids(self):
+        vehicle_list = [
+            track(1, (0.0, 0.0), (0.5, 0.0)),      # ego
+            track(2, (16.0, 0.0), (-0.5, 0.0)),    # head-on vehicle
+            track(3, (8.0, 20.0), (0.0, 0.1)),     # pedestrian aside
+            track(4, (10.0, 0.0), (0.0, 0.0)),     # cone ahead, hit after the vehicle
+            track(5, (0.0, 10.0), (0.5, 0.0)),     # vehicle on a parallel lane
+            track(6, (40.0, 0.0), (-3.0, 0.0)),    # too far at the first observed frame
+        ]
+        obstacle_dict = {4: 'static.prop.trafficcone01'}
+        risky = mantra.mantra_inference(vehicle_list, 100, 1, [3], [2, 5, 6], obstacle_dict,
+                                        engine=ConstantVelocityEngine())
+        self.assertEqual(risky, [2, 4])
+        self.assertEqual(mantra.mantra_inference(vehicle_list[1:], 100, 1, [3], [2, 5, 6], obstacle_dict,
+                                                 engine=ConstantVelocityEngine()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
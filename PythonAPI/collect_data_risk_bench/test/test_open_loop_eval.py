@@ -0,0 +1,137 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import open_loop_eval
+from open_loop_eval import INSTANCE_ID_MODULO, RangeModel, RiskModel, compute_metrics, evaluate_episodes
+
+EGO_ID = 100
+INTERACTOR_ID = INSTANCE_ID_MODULO + 200
+
+
+def make_episode(root, scenario_type, variant, num_frames, interactor_id=INTERACTOR_ID):
+    """
+    A recorded variant scenario where the interactor gets closer by 2 m every frame, starting 20 m away,
+    and a parked vehicle stays 8 m away but is never visible.
+    """
+    path = os.path.join(root, scenario_type, "1_i-1_1_c_l_f_1_0", "variant_scenario", variant)
+    os.makedirs(os.path.join(path, "actors_data"))
+    with open(os.path.join(path, "actor_attribute.json"), "w") as f:
+        json.dump({"ego_id": EGO_ID, "interactor_id": interactor_id, "obstacle": {}}, f)
+    bboxes = {}
+    for index in range(num_frames):
+        frame = 50 + index
+        actors = {
+            str(EGO_ID): {"distance": 0.0},
+            str(INTERACTOR_ID): {"distance": 20.0 - 2 * index},
+            "300": {"distance": 8.0},
+            "vehicles_ids": [EGO_ID, INTERACTOR_ID, 300],
+            "pedestrian_ids": [],
+            "obstacle_ids": [],
+        }
+        with open(os.path.join(path, "actors_data", "%08d.json" % frame), "w") as f:
+            json.dump(actors, f)
+        bboxes["%08d" % frame] = {str(EGO_ID): [0, 0, 10, 10], str(INTERACTOR_ID % INSTANCE_ID_MODULO): [0, 0, 20, 20]}
+    with open(os.path.join(path, "bbox.json"), "w") as f:
+        json.dump(bboxes, f)
+    return path
+
+
+class RecordingModel(RiskModel):
+    """Ranks the actors by id, and records the frames of every batch"""
+    window = 2
+
+    def __init__(self):
+        super(RecordingModel, self).__init__("Recording")
+        self.batches = []
+
+    def rank_batch(self, items):
+        self.batches.append([(frame.episode.variant, frame.number, [f.number for f in state])
+                             for state, frame in items])
+        return [(sorted(frame.actors["vehicles_ids"])[1:], {}) for _, frame in items]
+
+
+class TestComputeMetrics(unittest.TestCase):
+    def test_counts(self):
+        records = [
+            {"interactor_id": 5, "ranking": [5, 7]},                       # TP
+            {"interactor_id": 5, "ranking": [INSTANCE_ID_MODULO + 5]},      # TP, same instance id
+            {"interactor_id": 5, "ranking": [7, 5]},                       # FN and FP, top-3 hit
+            {"interactor_id": 5, "ranking": []},                           # FN
+            {"interactor_id": -1, "ranking": [7]},                         # FP
+            {"interactor_id": -1, "ranking": []},                          # TN
+        ]
+        metrics = compute_metrics(records)
+        self.assertEqual((metrics["TP"], metrics["FP"], metrics["FN"], metrics["TN"]), (2, 2, 2, 1))
+        self.assertEqual((metrics["frames"], metrics["positive_frames"]), (6, 4))
+        self.assertAlmostEqual(metrics["precision"], 0.5)
+        self.assertAlmostEqual(metrics["recall"], 0.5)
+        self.assertAlmostEqual(metrics["f1"], 0.5)
+        self.assertAlmostEqual(metrics["top1_accuracy"], 0.5)
+        self.assertAlmostEqual(metrics["top3_accuracy"], 0.75)
+
+    def test_empty(self):
+        metrics = compute_metrics([])
+        self.assertEqual(metrics["frames"], 0)
+        self.assertEqual((metrics["precision"], metrics["recall"], metrics["f1"], metrics["top1_accuracy"]),
+                         (0.0, 0.0, 0.0, 0.0))
+        self.assertEqual(compute_metrics([{"interactor_id": -1, "ranking": []}], top_k=(2,))["top2_accuracy"], 0.0)
+
+
+class TestEvaluateEpisodes(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.paths = [make_episode(self.root, "interactive", "a", 4),
+                      make_episode(self.root, "interactive", "b", 2),
+                      make_episode(self.root, "obstacle", "c", 3, interactor_id=-1)]
+
+    def test_batches(self):
+        model = RecordingModel()
+        records = evaluate_episodes(model, self.paths, batch_size=2)
+
+        # the window of 2 frames skips the first frame of every episode
+        self.assertEqual([(r["variant"], r["frame"]) for r in records],
+                         [("a", 51), ("b", 51), ("a", 52), ("a", 53), ("c", 51), ("c", 52)])
+        # a finished episode leaves its place in the batch to the next one
+        self.assertEqual(model.batches, [[("a", 51, [50, 51]), ("b", 51, [50, 51])],
+                                         [("a", 52, [51, 52])],
+                                         [("a", 53, [52, 53]), ("c", 51, [50, 51])],
+                                         [("c", 52, [51, 52])]])
+        first = records[0]
+        self.assertEqual((first["scenario_type"], first["basic_scenario"]), ("interactive", "1_i-1_1_c_l_f_1_0"))
+        self.assertEqual((first["interactor_id"], first["ranking"]), (INTERACTOR_ID, [300, INTERACTOR_ID]))
+        self.assertEqual(records[-1]["interactor_id"], -1)
+
+    def test_batch_size_does_not_change_records(self):
+        records = evaluate_episodes(RecordingModel(), self.paths, batch_size=1)
+        batched = evaluate_episodes(RecordingModel(), self.paths, batch_size=3)
+        key = lambda r: (r["variant"], r["frame"])
+        self.assertEqual(sorted(records, key=key), sorted(batched, key=key))
+
+    def test_range_model(self):
+        records = evaluate_episodes(RangeModel("Range"), self.paths[:1], batch_size=1)
+        # the hidden vehicle is never ranked, the interactor only once within the threshold
+        self.assertEqual([r["ranking"] for r in records], [[], [], [], []])
+        records = evaluate_episodes(RangeModel("Range", threshold=17), self.paths[:1], batch_size=1)
+        self.assertEqual([r["ranking"] for r in records], [[], [], [INTERACTOR_ID], [INTERACTOR_ID]])
+        self.assertEqual(records[2]["scores"], {str(INTERACTOR_ID): -16.0})
+        metrics = compute_metrics(records)
+        self.assertEqual((metrics["TP"], metrics["FN"]), (2, 2))
+
+    def test_find_episodes(self):
+        with open(os.path.join(self.root, "interactive", "1_i-1_1_c_l_f_1_0", "variant_scenario", "b",
+                               "actor_attribute.json"), "w") as f:
+            json.dump({"interactor_id": 1}, f)
+        # episodes without ego are left out, the scenario types keep the given order
+        paths = open_loop_eval.find_episodes(self.root, ["obstacle", "interactive"])
+        self.assertEqual(paths, [os.path.abspath(self.paths[2]), os.path.abspath(self.paths[0])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+try:
+    import torch
+    from torch_geometric.data import HeteroData
+    from models.QCNet import QCNet
+    from models.QCNet.modules.qcnet_agent_encoder import QCNetAgentEncoder
+    from torch_cluster import radius_graph
+except ImportError:
+    torch = None
+
+NUM_HISTORICAL_STEPS = 20
+
+
+def loop_agent_features(df, num_historical_steps, dim=2):
+    """get_agent_features as it was before the vectorisation: one pass per track"""
+    agent_types = ['vehicle', 'pedestrian', 'obstacle']
+    agent_ids = list(df['TRACK_ID'].unique())
+    df = df.copy()
+    df.loc[df.OBJECT_TYPE == 'EGO', 'OBJECT_TYPE'] = 'vehicle'
+    for obstacle_type in QCNet.OBSTACLE_TYPES:
+        df.loc[df.OBJECT_TYPE == obstacle_type, 'OBJECT_TYPE'] = 'obstacle'
+    num_agents = len(agent_ids)
+
+    valid_mask = torch.zeros(num_agents, num_historical_steps, dtype=torch.bool)
+    predict_mask = torch.zeros(num_agents, num_historical_steps, dtype=torch.bool)
+    agent_id = [None] * num_agents
+    agent_type = torch.zeros(num_agents, dtype=torch.uint8)
+    position = torch.zeros(num_agents, num_historical_steps, dim, dtype=torch.float)
+    heading = torch.zeros(num_agents, num_historical_steps, dtype=torch.float)
+    velocity = torch.zeros(num_agents, num_historical_steps, dim, dtype=torch.float)
+
+    for track_id, track_df in df.groupby('TRACK_ID'):
+        agent_idx = agent_ids.index(track_id)
+        valid_mask[agent_idx, :] = True
+        valid_mask[agent_idx, 1:] = valid_mask[agent_idx, :-1] & valid_mask[agent_idx, 1:]
+        valid_mask[agent_idx, 0] = False
+        agent_id[agent_idx] = track_id
+        agent_type[agent_idx] = agent_types.index(track_df['OBJECT_TYPE'].values[0])
+        position[agent_idx, :, :2] = torch.from_numpy(np.stack([track_df['X'].values, track_df['Y'].values],
+                                                               axis=-1)).float()
+        heading[agent_idx, :] = torch.from_numpy(track_df['YAW'].values).float()
+        velocity[agent_idx, :, :2] = torch.from_numpy(np.stack([track_df['VELOCITY_X'].values,
+                                                               track_df['VELOCITY_Y'].values], axis=-1)).float()
+
+    return {'num_nodes': num_agents, 'valid_mask': valid_mask, 'predict_mask': predict_mask, 'id': agent_id,
+            'type': agent_type, 'position': position, 'heading': heading, 'velocity': velocity}
+
+
+def make_tracks(rng, object_types, frames=range(81, 101)):
+    dfs = []
+    for track_id, object_type in zip(rng.choice(100000, len(object_types), replace=False), object_types):
+        n = len(frames)
+        dfs.append(pd.DataFrame({
+            'FRAME': list(frames), 'TRACK_ID': str(track_id), 'OBJECT_TYPE': object_type,
+            'X': np.cumsum(rng.uniform(-1, 1, n)), 'Y': np.cumsum(rng.uniform(-1, 1, n)),
+            'VELOCITY_X': rng.uniform(-5, 5, n), 'VELOCITY_Y': rng.uniform(-5, 5, n),
+            'YAW': rng.uniform(-np.pi, np.pi, n)}))
+    # the rows of a frame are interleaved, as in the collected csv files
+    return pd.concat(dfs).sort_values('FRAME', kind='stable').reset_index(drop=True)
+
+
+@unittest.skipIf(torch is None, "QCNet needs torch, torch_geometric and torch_cluster")
+class TestAgentFeatures(unittest.TestCase):
+    def test_same_as_loop(self):
+        rng = np.random.default_rng(0)
+        df = make_tracks(rng, ['EGO', 'vehicle', 'pedestrian', 'static.prop.trafficcone01',
+                               'static.prop.streetbarrier', 'vehicle'])
+        expected = loop_agent_features(df, NUM_HISTORICAL_STEPS)
+        agent = QCNet.get_agent_features(df, NUM_HISTORICAL_STEPS)
+
+        self.assertEqual(agent['num_nodes'], expected['num_nodes'])
+        self.assertEqual(agent['id'], expected['id'])
+        for key in ('valid_mask', 'predict_mask', 'type', 'position', 'heading', 'velocity'):
+            self.assertEqual(agent[key].dtype, expected[key].dtype, key)
+            self.assertTrue(torch.equal(agent[key].cpu(), expected[key]), key)
+
+    def test_short_tracks(self):
+        rng = np.random.default_rng(1)
+        df = make_tracks(rng, ['EGO', 'vehicle'])
+        late = make_tracks(rng, ['pedestrian'], frames=range(95, 101))
+        agent_ids, history, valid, agent_type = QCNet.get_agent_history(pd.concat([df, late]), NUM_HISTORICAL_STEPS)
+        self.assertEqual(agent_type.tolist(), [0, 0, 1])
+        self.assertEqual(valid[2].tolist(), [False] * 14 + [True] * 6)
+        np.testing.assert_allclose(history[2, 14:, 0], late['X'].to_numpy(dtype=np.float32))
+        np.testing.assert_allclose(history[2, :14], 0.0)
+
+
+@unittest.skipIf(torch is None, "QCNet needs torch, torch_geometric and torch_cluster")
+class TestAgentRadiusGraph(unittest.TestCase):
+    def setUp(self):
+        self.encoder = QCNetAgentEncoder(dataset='argoverse_v2', input_dim=2, hidden_dim=8, num_historical_steps=5,
+                                         time_span=None, a2a_radius=4.0, num_freq_bands=4, num_layers=1,
+                                         num_heads=2, head_dim=4, dropout=0.0).eval()
+        self.rng = np.random.default_rng(0)
+
+    def graph(self, positions, ids):
+        """a2a graph of positions [N, T, 2], and the one built without the cache"""
+        num_nodes, steps = positions.shape[:2]
+        pos_s = torch.from_numpy(positions).float().transpose(0, 1).reshape(-1, 2)
+        batch_s = torch.arange(steps).repeat_interleave(num_nodes)
+        data = HeteroData({'agent': {'num_nodes': num_nodes, 'id': ids}})
+        edge_index = self.encoder._radius_graph_a2a(data, pos_s, batch_s)
+        expected = radius_graph(x=pos_s, r=self.encoder.a2a_radius, batch=batch_s, loop=False, max_num_neighbors=300)
+        return edge_index, expected
+
+    def assertSameEdges(self, edge_index, expected):
+        self.assertEqual(sorted(map(tuple, edge_index.t().tolist())), sorted(map(tuple, expected.t().tolist())))
+
+    def test_sliding_history(self):
+        track = self.rng.uniform(-6, 6, (8, 12, 2))
+        ids = [str(i) for i in range(8)]
+        for start in range(7):
+            edge_index, expected = self.graph(track[:, start:start + 5], ids)
+            self.assertSameEdges(edge_index, expected)
+        # the same scene again, and new agents
+        edge_index, expected = self.graph(track[:, 6:11], ids)
+        self.assertSameEdges(edge_index, expected)
+        edge_index, expected = self.graph(track[:7, 7:12], ids[:7])
+        self.assertSameEdges(edge_index, expected)
+
+    def test_training_skips_cache(self):
+        positions = self.rng.uniform(-6, 6, (4, 5, 2))
+        self.graph(positions, ['a', 'b', 'c', 'd'])
+        self.assertIsNotNone(self.encoder._a2a_cache)
+        self.encoder.train()
+        edge_index, expected = self.graph(positions, ['a', 'b', 'c', 'd'])
+        self.assertIsNone(self.encoder._a2a_cache)
+        self.assertSameEdges(edge_index, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
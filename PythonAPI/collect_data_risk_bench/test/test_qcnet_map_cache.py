@@ -0,0 +1,162 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+try:
+    import carla
+    import torch
+    from torch_geometric.data import HeteroData
+    from models.QCNet.QCNet import get_agent_features_from_array
+    from models.QCNet.map_cache import MapEncodingCache, crop_map_features, get_map_features
+    from models.QCNet.modules.qcnet_encoder import QCNetEncoder
+except ImportError:
+    torch = None
+
+NUM_HISTORICAL_STEPS = 5
+PL2A_RADIUS = 20.0
+
+# a straight 300 m road with two driving lanes each way
+XODR = '''<?xml version="1.0" standalone="yes"?>
+<OpenDRIVE>
+  <header revMajor="1" revMinor="4" name="straight" version="1"/>
+  <road name="straight" length="300.0" id="0" junction="-1">
+    <link/>
+    <planView>
+      <geometry s="0.0" x="0.0" y="0.0" hdg="0.0" length="300.0"><line/></geometry>
+    </planView>
+    <lanes>
+      <laneSection s="0.0">
+        <left>
+          <lane id="2" type="driving" level="false"><link/><width sOffset="0.0" a="3.5" b="0" c="0" d="0"/>
+            <roadMark sOffset="0" type="solid" color="standard" width="0.15"/></lane>
+          <lane id="1" type="driving" level="false"><link/><width sOffset="0.0" a="3.5" b="0" c="0" d="0"/>
+            <roadMark sOffset="0" type="broken" color="standard" width="0.15"/></lane>
+        </left>
+        <center><lane id="0" type="none" level="false">
+          <roadMark sOffset="0" type="solid solid" color="yellow" width="0.15"/></lane></center>
+        <right>
+          <lane id="-1" type="driving" level="false"><link/><width sOffset="0.0" a="3.5" b="0" c="0" d="0"/>
+            <roadMark sOffset="0" type="broken" color="standard" width="0.15"/></lane>
+          <lane id="-2" type="driving" level="false"><link/><width sOffset="0.0" a="3.5" b="0" c="0" d="0"/>
+            <roadMark sOffset="0" type="solid" color="standard" width="0.15"/></lane>
+        </right>
+      </laneSection>
+    </lanes>
+  </road>
+</OpenDRIVE>
+'''
+
+
+class MapModel(torch.nn.Module if torch is not None else object):
+    """The part of predictors.QCNet used by MapEncodingCache"""
+
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.encoder = QCNetEncoder(dataset='argoverse_v2', input_dim=2, hidden_dim=16,
+                                    num_historical_steps=NUM_HISTORICAL_STEPS, time_span=None, a2a_radius=50.0,
+                                    num_freq_bands=4, num_agent_layers=1, num_heads=2, head_dim=8, dropout=0.0,
+                                    pl2pl_radius=30.0, pl2a_radius=PL2A_RADIUS, num_map_layers=1)
+        self.eval()
+
+
+def make_agents(center, num_agents=4):
+    """Agents driving along the road, their last position within 10 m of center along it"""
+    rng = np.random.default_rng(0)
+    t = np.arange(NUM_HISTORICAL_STEPS) - (NUM_HISTORICAL_STEPS - 1)
+    history = np.zeros((num_agents, NUM_HISTORICAL_STEPS, 5), dtype=np.float32)
+    history[..., 0] = center[0] + rng.uniform(-10, 10, (num_agents, 1)) + t
+    history[..., 1] = center[1] + rng.choice([-5.25, -1.75, 1.75, 5.25], (num_agents, 1))
+    history[..., 2] = 10.0
+    valid = np.ones((num_agents, NUM_HISTORICAL_STEPS), dtype=bool)
+    return get_agent_features_from_array([str(i) for i in range(num_agents)], history, valid,
+                                         np.zeros(num_agents, dtype=np.uint8), NUM_HISTORICAL_STEPS)
+
+
+@unittest.skipIf(torch is None, "the map cache needs carla, torch, torch_geometric and torch_cluster")
+class TestMapEncodingCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.carla_map = carla.Map('straight', XODR)
+        self.map_data = get_map_features(self.carla_map)
+        self.model = MapModel()
+
+    def test_map_features(self):
+        polygon = self.map_data['map_polygon']
+        self.assertGreater(polygon['num_nodes'], 0)
+        self.assertEqual(polygon['position'].shape, (polygon['num_nodes'], 2))
+        pt2pl = self.map_data['map_point', 'to', 'map_polygon']['edge_index']
+        self.assertEqual(pt2pl.shape, (2, self.map_data['map_point']['num_nodes']))
+        self.assertEqual(int(pt2pl[1].max()), polygon['num_nodes'] - 1)
+        pl2pl = self.map_data['map_polygon', 'to', 'map_polygon']['edge_index']
+        self.assertTrue(bool((pl2pl < polygon['num_nodes']).all()))
+        # the lanes are split in polygons of at most 20 m
+        point = self.map_data['map_point']
+        center = point['side'] == 2
+        length = torch.zeros(polygon['num_nodes']).index_add_(0, pt2pl[1][center], point['magnitude'][center])
+        self.assertTrue(bool((length <= 20.0 + 1e-3).all()))
+        lanes = sum(entry.transform.location.distance(exit.transform.location)
+                    for entry, exit in self.carla_map.get_topology())
+        self.assertAlmostEqual(float(length.sum()), lanes, delta=1.0)
+
+    def test_cached_encodings(self):
+        cache = MapEncodingCache(self.model, 'test', cache_dir=self.cache_dir)
+        encodings = cache.encodings('straight', self.carla_map)
+        with torch.no_grad():
+            expected = self.model.encoder.map_encoder(HeteroData(self.map_data))['x_pl'][:, 0]
+        self.assertTrue(torch.allclose(encodings['x_pl'], expected, atol=1e-5))
+        self.assertEqual(os.listdir(self.cache_dir), ['straight_test.pt'])
+
+        # another process reads the file without the map
+        reloaded = MapEncodingCache(self.model, 'test', cache_dir=self.cache_dir).encodings('straight')
+        for key, value in encodings.items():
+            self.assertTrue(torch.equal(reloaded[key], value), key)
+        with self.assertRaises(ValueError):
+            MapEncodingCache(self.model, 'other', cache_dir=self.cache_dir).encodings('straight')
+
+    def test_crop_matches_uncached(self):
+        cache = MapEncodingCache(self.model, 'test', cache_dir=self.cache_dir)
+        center = [150.0, 0.0]
+        agent = make_agents(center)
+        # every polygon within pl2a_radius of an agent is kept by the crop
+        radius = 10.0 * np.sqrt(2) + 5.25 + PL2A_RADIUS
+        cropped = cache.crop('straight', center, radius, self.carla_map)
+        self.assertLess(cropped['num_nodes'], self.map_data['map_polygon']['num_nodes'])
+
+        with torch.no_grad():
+            uncached = self.model.encoder(HeteroData({'agent': agent, **self.map_data}))
+            cached = self.model.encoder(HeteroData({'agent': agent, 'map_polygon': cropped}))
+        self.assertTrue(torch.allclose(cached['x_a'], uncached['x_a'], atol=1e-4))
+
+        # the map makes a difference
+        with torch.no_grad():
+            agent_only = self.model.encoder(HeteroData({'agent': agent}))
+        self.assertFalse(torch.allclose(agent_only['x_a'], uncached['x_a'], atol=1e-4))
+
+    def test_crop_map_features(self):
+        center = [150.0, 0.0]
+        cropped = crop_map_features(self.map_data, center, 40.0)
+        keep = torch.norm(self.map_data['map_polygon']['position'] - torch.tensor(center), dim=-1) <= 40.0
+        self.assertEqual(cropped['map_polygon']['num_nodes'], int(keep.sum()))
+        self.assertTrue(torch.equal(cropped['map_polygon']['position'], self.map_data['map_polygon']['position'][keep]))
+        pt2pl = self.map_data['map_point', 'to', 'map_polygon']['edge_index']
+        points = keep[pt2pl[1]]
+        self.assertTrue(torch.equal(cropped['map_point']['position'], self.map_data['map_point']['position'][points]))
+        # point to polygon edges are relabelled to the kept polygons
+        relabel = torch.cumsum(keep.long(), dim=0) - 1
+        self.assertTrue(torch.equal(cropped['map_point', 'to', 'map_polygon']['edge_index'][1],
+                                    relabel[pt2pl[1][points]]))
+        edges = self.map_data['map_polygon', 'to', 'map_polygon']['edge_index']
+        inside = keep[edges[0]] & keep[edges[1]]
+        self.assertTrue(torch.equal(cropped['map_polygon', 'to', 'map_polygon']['edge_index'], relabel[edges[:, inside]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,331 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from util import replay
+
+replay.install_carla_api()
+
+from util.actor_state import ActorStateCollector
+from util.depth_storage import DepthWriter
+from util.instance_storage import InstanceReader, InstanceWriter
+from util.lidar_storage import LidarReader, LidarWriter
+from util.topology_storage import TopologyWriter
+
+try:
+    from util.data_collection import Data_Collection
+except ImportError:
+    Data_Collection = None
+
+FRAMES = 6
+EGO, PEDESTRIAN, TRAFFIC_LIGHT, OBSTACLE = 100, 200, 300, 400
+HEIGHT, WIDTH = 24, 32
+
+
+def xyz(values):
+    return {"x": float(values[0]), "y": float(values[1]), "z": float(values[2])}
+
+
+def instance_frame(frame):
+    image = np.zeros((HEIGHT, WIDTH, 4), np.uint8)
+    image[..., 3] = 255
+    image[4:12, 4:16] = (0, 100, 14, 255)
+    image[4:8, 20:24 + frame] = (1, 200, 4, 255)
+    return image
+
+
+def depth_frame(rng):
+    code = rng.integers(0, 2 ** 20, (HEIGHT, WIDTH))
+    return np.stack([code >> 16, (code >> 8) & 255, code & 255, np.full_like(code, 255)], axis=-1).astype(np.uint8)
+
+
+def lane(road, lane_id, y):
+    xs = np.arange(0, 40, 2.0)
+    center = np.array([[xs[k], y, 0, xs[k + 1], y, 0] for k in range(len(xs) - 1)])
+    left, right = center.copy(), center.copy()
+    left[:, [1, 4]] += 1.75
+    right[:, [1, 4]] -= 1.75
+    return [left, right, center, None, False, False, (road, lane_id)]
+
+
+def make_episode(path, compact=False):
+    """
+        Synthetic episode in the layout of Data_Collection.save_data: an ego vehicle driving along x, a pedestrian
+        crossing, a traffic light and a cone, with instance and depth frames of two views and a LiDAR sweep.
+        Returns the recorded actors_data and sensor frames.
+    """
+    rng = np.random.default_rng(0)
+    for folder in ("actors_data", "sensor_data"):
+        os.makedirs(os.path.join(path, folder))
+    trigger = {"cord_%d" % i: [30.0 + i, 2.0, 0.0] for i in range(8)}
+    attributes = {
+        "vehicle": {str(EGO): {"type_id": "vehicle.tesla.model3", "semantic_tags": [10],
+                               "attributes": {"role_name": "hero"},
+                               "bounding_box": {"extent": xyz([2.4, 1.0, 0.8]), "location": xyz([0, 0, 0.8])}}},
+        "pedestrian": {str(PEDESTRIAN): {"type_id": "walker.pedestrian.0001", "semantic_tags": [4], "attributes": {},
+                                         "bounding_box": {"extent": xyz([0.3, 0.3, 0.9]), "location": xyz([0, 0, 0])}}},
+        "traffic_light": {str(TRAFFIC_LIGHT): {"type_id": "traffic.traffic_light", "semantic_tags": [18],
+                                               "location": xyz([30, 5, 0]),
+                                               "rotation": {"pitch": 0.0, "yaw": 90.0, "roll": 0.0},
+                                               "bounding_box": {"extent": xyz([0.5, 0.5, 3]), "location": xyz([0, 0, 3])}}},
+        "obstacle": {str(OBSTACLE): {"type_id": "static.prop.trafficcone01", "semantic_tags": [20], "attributes": {},
+                                     "location": xyz([20, -3, 0]), "rotation": {"pitch": 0.0, "yaw": 0.0, "roll": 0.0},
+                                     "bounding_box": {"extent": xyz([0.2, 0.2, 0.4]), "location": xyz([0, 0, 0.4]),
+                                                      "rotation": {"pitch": 0.0, "yaw": 0.0, "roll": 0.0}}}},
+        "ego_id": EGO, "interactor_id": PEDESTRIAN}
+    with open(os.path.join(path, "actor_attribute.json"), "w") as f:
+        json.dump(attributes, f)
+    with open(os.path.join(path, "static_data.json"), "w") as f:
+        json.dump({"0": {"cord_bounding_box": {"cord_%d" % i: [1.0 * i, 0.0, 0.0] for i in range(8)}, "type": "Car"},
+                   "num_of_id": 1}, f)
+    with open(os.path.join(path, "collision_frame.json"), "w") as f:
+        json.dump({"frame": 4, "id": PEDESTRIAN, "type": "pedestrian"}, f)
+    with open(os.path.join(path, "seed.txt"), "w") as f:
+        f.write("7\n")
+
+    actors, images, depths, sweeps = [], [], [], []
+    for frame in range(FRAMES):
+        record = {
+            str(EGO): {"location": xyz([frame * 1.0, 0, 0]), "rotation": {"pitch": 0.0, "yaw": 0.0, "roll": 0.0},
+                       "velocity": xyz([20, 0, 0]), "acceleration": xyz([0, 0, 0]), "angular_velocity": xyz([0, 0, 0]),
+                       "control": {"throttle": 0.5, "steer": 0.1 * frame, "brake": 0.0, "hand_brake": False,
+                                   "reverse": False, "manual_gear_shift": False, "gear": 1},
+                       "compass": 90.0, "type": "vehicle"},
+            str(PEDESTRIAN): {"location": xyz([15, -5 + 0.5 * frame, 0.9]), "velocity": xyz([0, 4, 0]),
+                              "acceleration": xyz([0, 0, 0]), "angular_velocity": xyz([0, 0, 0]),
+                              "control": {"direction": {"x": 0.0, "y": 1.0, "z": 0.0}, "speed": 1.4, "jump": False},
+                              "type": "pedestrian"},
+            str(TRAFFIC_LIGHT): {"state": frame % 3, "location": xyz([30, 5, 0]), "type": "traffic_light",
+                                 "tigger_cord_bounding_box": trigger, "trigger_loc": [30.0, 2.0, 0.0],
+                                 "trigger_ori": [0.0, 1.0, 0.0], "trigger_box": [2.0, 1.0]},
+            str(OBSTACLE): {"distance": 20.0, "type": "obstacle"},
+            "obstacle_ids": [OBSTACLE], "traffic_light_ids": [TRAFFIC_LIGHT], "vehicles_ids": [EGO],
+            "pedestrian_ids": [PEDESTRIAN]}
+        with open(os.path.join(path, "actors_data", "%08d.json" % frame), "w") as f:
+            json.dump(record, f)
+        actors.append(record)
+
+        extrinsic = np.identity(4)
+        extrinsic[0, 3] = frame + 1.5
+        extrinsic[2, 3] = 2.0
+        np.save(os.path.join(path, "sensor_data", "%08d.npy" % frame),
+                np.array({"front": {"extrinsic": extrinsic.tolist()}, "top": {"extrinsic": extrinsic.tolist()}},
+                         dtype=object))
+        images.append(instance_frame(frame))
+        depths.append(depth_frame(rng))
+        sweep = np.concatenate([rng.normal(size=(200, 3)) * 10, rng.uniform(size=(200, 1))], axis=1)
+        sweeps.append(sweep.astype(np.float32))
+
+    if compact:
+        for view in ("front", "top"):
+            with InstanceWriter(os.path.join(path, "instance_%s.zip" % view)) as writer:
+                for frame in range(FRAMES):
+                    writer.write(frame, images[frame])
+        with DepthWriter(os.path.join(path, "depth_front.zip")) as writer:
+            for frame in range(FRAMES):
+                writer.write(frame, depths[frame])
+        with LidarWriter(os.path.join(path, "lidar.zip")) as writer:
+            for frame in range(FRAMES):
+                writer.write(frame, sweeps[frame])
+    else:
+        from PIL import Image
+        folders = [("instance_segmentation", "front", images), ("instance_segmentation", "top", images),
+                   ("depth", "front", depths)]
+        for folder, view, frames in folders:
+            os.makedirs(os.path.join(path, folder, view))
+            for frame in range(FRAMES):
+                # saved as carla.Image.save_to_disk does, RGBA from the BGRA raw data
+                Image.fromarray(frames[frame][..., [2, 1, 0, 3]]).save(
+                    os.path.join(path, folder, view, "%08d.png" % frame))
+        os.makedirs(os.path.join(path, "lidar"))
+        for frame in range(FRAMES):
+            np.save(os.path.join(path, "lidar", "%08d.npy" % frame), sweeps[frame])
+
+    with TopologyWriter(os.path.join(path, "topology.npz")) as writer:
+        for frame in range(FRAMES):
+            writer.write(frame, [lane(1, -1, 0), lane(1, 1, 3.5), lane(2, -1, 10)])
+    return actors, images, depths, sweeps
+
+
+class ReplayTestCase(unittest.TestCase):
+    compact = False
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = os.path.join(self.root, "interactive", "10_i-1_1_c_f_f_1_rl", "variant_scenario", "ClearNoon_high_")
+        self.actors, self.images, self.depths, self.sweeps = make_episode(self.path, self.compact)
+
+
+class TestReplayWorld(ReplayTestCase):
+    def setUp(self):
+        super().setUp()
+        self.world = replay.ReplayWorld(self.path)
+        self.addCleanup(self.world.close)
+
+    def test_tick(self):
+        frames = []
+        while not self.world.finished:
+            frames.append(self.world.tick())
+        self.assertEqual(frames, list(range(FRAMES)))
+        with self.assertRaises(StopIteration):
+            self.world.tick()
+        self.assertEqual(self.world.get_actor(EGO).get_location().x, FRAMES - 1.0)
+
+    def test_sensor_callbacks(self):
+        received = {"instance": [], "depth": [], "lidar": [], "imu": []}
+        sensors = {}
+        for modality, view in (("instance", "top"), ("depth", "front"), ("lidar", "lidar"), ("imu", "ego")):
+            sensors[modality] = self.world.spawn_sensor(modality, view)
+            sensors[modality].listen(received[modality].append)
+        snapshots = []
+        self.world.on_tick(snapshots.append)
+
+        self.world.tick()
+        self.world.tick()
+        sensors["depth"].stop()
+        self.world.tick()
+
+        self.assertEqual([image.frame for image in received["instance"]], [0, 1, 2])
+        self.assertEqual([image.frame for image in received["depth"]], [0, 1])
+        self.assertEqual([snapshot.frame for snapshot in snapshots], [0, 1, 2])
+        for image in received["instance"]:
+            np.testing.assert_array_equal(image.array, self.images[image.frame])
+            self.assertEqual((image.height, image.width), (HEIGHT, WIDTH))
+            self.assertEqual(image.transform.location.x, image.frame + 1.5)
+        for image in received["depth"]:
+            np.testing.assert_array_equal(image.array, self.depths[image.frame])
+        for sweep in received["lidar"]:
+            points = np.frombuffer(sweep.raw_data, dtype=np.float32).reshape(-1, 4)
+            np.testing.assert_array_equal(points, self.sweeps[sweep.frame])
+        self.assertAlmostEqual(np.degrees(received["imu"][0].compass), 90.0)
+
+    def test_get_snapshot(self):
+        self.world.tick()
+        self.world.tick()
+        snapshot = self.world.get_snapshot()
+        self.assertEqual(snapshot.frame, 1)
+        self.assertEqual(sorted(actor.id for actor in snapshot), [EGO, PEDESTRIAN, TRAFFIC_LIGHT, OBSTACLE])
+        self.assertTrue(snapshot.has_actor(PEDESTRIAN))
+        self.assertFalse(snapshot.has_actor(999))
+        location = snapshot.find(PEDESTRIAN).get_transform().location
+        self.assertEqual((location.x, location.y, location.z), (15.0, -4.5, 0.9))
+        self.assertEqual(snapshot.find(EGO).get_velocity().x, 20.0)
+        self.assertEqual(snapshot.find(OBSTACLE).get_transform().location.x, 20.0)
+
+    def test_actor_state_collector(self):
+        collector = ActorStateCollector(self.world, EGO)
+        for frame in range(FRAMES):
+            self.world.tick()
+            data = collector.collect(compass=90.0).to_dict()
+            recorded = self.actors[frame]
+            for actor_id in (EGO, PEDESTRIAN):
+                for key in ("location", "velocity", "acceleration", "angular_velocity", "control"):
+                    self.assertEqual(data[actor_id][key], recorded[str(actor_id)][key], (frame, actor_id, key))
+            self.assertEqual(data[EGO]["compass"], 90.0)
+            self.assertAlmostEqual(data[PEDESTRIAN]["distance"], np.linalg.norm([15.0 - frame, -5 + 0.5 * frame, 0.9]))
+            self.assertAlmostEqual(data[OBSTACLE]["distance"],
+                                   np.linalg.norm([20.0 - frame, -3.0, 0.0]))
+            self.assertEqual(data[TRAFFIC_LIGHT]["state"], recorded[str(TRAFFIC_LIGHT)]["state"])
+            self.assertEqual(data[TRAFFIC_LIGHT]["tigger_cord_bounding_box"],
+                             recorded[str(TRAFFIC_LIGHT)]["tigger_cord_bounding_box"])
+            for key in ("obstacle_ids", "traffic_light_ids", "vehicles_ids", "pedestrian_ids"):
+                self.assertEqual(data[key], recorded[key])
+
+    def test_spawn_actor(self):
+        with self.assertRaises(RuntimeError) as context:
+            self.world.spawn_actor("vehicle.tesla.model3", replay.Transform())
+        self.assertIn("vehicle.tesla.model3", str(context.exception))
+        self.assertIn("spawn_sensor", str(context.exception))
+
+
+@unittest.skipIf(Data_Collection is None, "Data_Collection needs carla and cv2")
+class TestReplayCollection(ReplayTestCase):
+    """Data_Collection writes the replayed episode, which is replayed in turn"""
+
+    def collect(self, data_collection=None):
+        out = os.path.join(os.path.dirname(self.path), "ClearNoon_replayed")
+        count, _ = replay.replay_collection(self.path, out, data_collection, verbose=False)
+        self.assertEqual(count, FRAMES)
+        return out
+
+    def check_replayed(self, out, depth_tolerance=0, lidar_tolerance=0):
+        for frame in range(FRAMES):
+            with open(os.path.join(out, "actors_data", "%08d.json" % frame)) as f:
+                record = json.load(f)
+            for actor_id in (str(EGO), str(PEDESTRIAN)):
+                for key in ("location", "velocity", "control"):
+                    self.assertEqual(record[actor_id][key], self.actors[frame][actor_id][key])
+            self.assertEqual(record["obstacle_ids"], [OBSTACLE])
+
+        with open(os.path.join(out, "collision_frame.json")) as f:
+            self.assertEqual(json.load(f)["frame"], 4)
+        episode = replay.ReplayEpisode(out)
+        self.addCleanup(episode.close)
+        self.assertEqual(episode.attributes["interactor_id"], PEDESTRIAN)
+        for frame in range(FRAMES):
+            for view in ("front", "top"):
+                np.testing.assert_array_equal(episode.bgra("instance", view, frame), self.images[frame])
+            depth = episode.bgra("depth", "front", frame).astype(np.int64)
+            code = (depth[..., 0] << 16) + (depth[..., 1] << 8) + depth[..., 2]
+            expected = self.depths[frame].astype(np.int64)
+            expected = (expected[..., 0] << 16) + (expected[..., 1] << 8) + expected[..., 2]
+            self.assertLessEqual(np.abs(code - expected).max(), depth_tolerance)
+            points = episode.lidar(frame)
+            self.assertEqual(points.shape, self.sweeps[frame].shape)
+            self.assertLessEqual(np.abs(points - self.sweeps[frame]).max(), lidar_tolerance)
+
+        # the replayed copy replays as the original
+        game_world = replay.ReplayGameWorld(out)
+        self.addCleanup(game_world.destroy)
+        self.assertEqual(list(game_world.frames()), list(range(FRAMES)))
+        self.assertTrue(game_world.collision_sensor.collision)
+        np.testing.assert_array_equal(game_world.camera_manager.ss_top.array, self.images[-1])
+
+    def test_per_frame_files(self):
+        out = self.collect()
+        self.assertTrue(os.path.isfile(os.path.join(out, "instance_segmentation", "front", "%08d.png" % 0)))
+        self.assertFalse(os.path.exists(os.path.join(out, "lidar.zip")))
+        self.check_replayed(out)
+
+    def test_compact_storage(self):
+        data_collection = Data_Collection()
+        data_collection.use_compact_storage()
+        out = self.collect(data_collection)
+        self.assertFalse(os.path.exists(os.path.join(out, "instance_segmentation")))
+        with InstanceReader(os.path.join(out, "instance_front.zip")) as reader:
+            self.assertEqual(reader.frames, list(range(FRAMES)))
+        with LidarReader(os.path.join(out, "lidar.zip")) as reader:
+            lidar_tolerance = reader.tolerance
+        # the depth code is lossless, the sweeps quantised
+        self.check_replayed(out, depth_tolerance=0, lidar_tolerance=lidar_tolerance)
+
+
+class TestCompactReplayWorld(TestReplayWorld):
+    """Same replay from an episode saved with --compact_storage"""
+    compact = True
+
+    def test_sensor_callbacks(self):
+        sensor = self.world.spawn_sensor("instance", "front")
+        lidar = self.world.spawn_sensor("lidar", "lidar")
+        received, sweeps = [], []
+        sensor.listen(received.append)
+        lidar.listen(sweeps.append)
+        while not self.world.finished:
+            self.world.tick()
+        self.assertEqual([image.frame for image in received], list(range(FRAMES)))
+        for image in received:
+            np.testing.assert_array_equal(image.array, self.images[image.frame])
+        for sweep in sweeps:
+            self.assertEqual(sweep.array.shape, self.sweeps[sweep.frame].shape)
+
+
+if __name__ == '__main__':
+    unittest.main()
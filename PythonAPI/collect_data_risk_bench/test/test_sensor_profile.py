@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from util.sensor_profile import SENSORS, SensorProfile, SensorSchedule
+
+try:
+    from util.data_collection import Data_Collection
+except ImportError:
+    Data_Collection = None
+
+
+class TestSensorSchedule(unittest.TestCase):
+    def test_every_tick(self):
+        schedule = SensorSchedule()
+        self.assertFalse(schedule.due(None))
+        self.assertTrue(all(schedule.due(tick) for tick in range(100)))
+
+    def test_period_and_window(self):
+        schedule = SensorSchedule(period=3, window=(5, 15))
+        # the period counts from the start of the window, its end is excluded
+        self.assertEqual([tick for tick in range(30) if schedule.due(tick)], [5, 8, 11, 14])
+        self.assertFalse(schedule.due(None))
+
+    def test_open_window(self):
+        schedule = SensorSchedule(period=4, window=(2, None))
+        self.assertEqual([tick for tick in range(20) if schedule.due(tick)], [2, 6, 10, 14, 18])
+        self.assertTrue(schedule.due(10 ** 6 + 2))
+
+    def test_disabled(self):
+        schedule = SensorSchedule(enabled=False)
+        self.assertFalse(any(schedule.due(tick) for tick in range(10)))
+
+    def test_empty_window(self):
+        self.assertFalse(any(SensorSchedule(window=(4, 4)).due(tick) for tick in range(10)))
+
+    def test_invalid(self):
+        for kwargs in ({"period": 0}, {"window": (-1, None)}, {"window": (5, 4)}):
+            with self.assertRaises(ValueError):
+                SensorSchedule(**kwargs)
+
+    def test_round_trip(self):
+        schedule = SensorSchedule(period=2, window=[1, 9])
+        again = SensorSchedule(**schedule.to_dict())
+        self.assertEqual(again.to_dict(), {"enabled": True, "period": 2, "window": [1, 9]})
+        self.assertEqual([again.due(tick) for tick in range(12)], [schedule.due(tick) for tick in range(12)])
+
+
+class TestSensorProfile(unittest.TestCase):
+    def test_due_sensors(self):
+        profile = SensorProfile.from_dict({"lidar": {"period": 2}, "depth_front": {"enabled": False},
+                                           "ss_top": {"window": [1, 3]}})
+        self.assertEqual(profile.due_sensors(None), [])
+        self.assertEqual(profile.due_sensors(0), ["rgb_front", "ss_front", "lidar"])
+        self.assertEqual(profile.due_sensors(1), ["ss_top", "rgb_front", "ss_front"])
+        self.assertEqual(profile.due_sensors(3), ["rgb_front", "ss_front"])
+        self.assertFalse(profile.enabled("depth_front"))
+
+    def test_default(self):
+        profile = SensorProfile()
+        self.assertEqual(profile.due_sensors(7), list(SENSORS))
+        self.assertEqual(SensorProfile.from_dict(profile.to_dict()).to_dict(), profile.to_dict())
+
+    def test_unknown_sensor(self):
+        with self.assertRaises(ValueError):
+            SensorProfile.from_dict({"rgb_back": {"period": 2}})
+
+
+class Measurement():
+    def __init__(self, frame):
+        self.frame = frame
+
+
+@unittest.skipIf(Data_Collection is None, "Data_Collection needs carla and cv2")
+class TestWaitMeasurement(unittest.TestCase):
+    def setUp(self):
+        self.data_collection = Data_Collection()
+        self.data_collection.sensor_timeout = 0.05
+
+    def test_waits_for_the_frame(self):
+        measurements = iter([None, Measurement(9), Measurement(9), Measurement(10)])
+        measurement = self.data_collection.wait_measurement("lidar", 10, lambda: next(measurements))
+        self.assertEqual(measurement.frame, 10)
+
+    def test_timeout(self):
+        start = time.monotonic()
+        with self.assertRaisesRegex(RuntimeError, "no rgb_front measurement of frame 10 .* frame 9"):
+            self.data_collection.wait_measurement("rgb_front", 10, lambda: Measurement(9))
+        self.assertLess(time.monotonic() - start, 1.0)
+
+    def test_sensors_not_due_are_not_waited(self):
+        data_collection = self.data_collection
+        data_collection.sensor_profile = SensorProfile.from_dict({name: {"period": 2} for name in SENSORS})
+        data_collection.set_start_frame(100)
+        # the camera manager drops the measurements of the odd ticks, the imu keeps up
+        camera_manager = types.SimpleNamespace(**{name: Measurement(100) for name in SENSORS})
+        world = types.SimpleNamespace(camera_manager=camera_manager,
+                                      imu_sensor=types.SimpleNamespace(frame=101, compass=1.5))
+        data_collection.collect_camera_data = lambda world: {}
+        data_collection.collect_actor_data = lambda world: types.SimpleNamespace(entry=lambda _id: {})
+        data_collection.collect_topology = lambda world: []
+        data_collection.ego_id = 1
+
+        data_collection.collect_sensor(101, world)
+        self.assertEqual([len(data_collection.sensor_list(name)) for name in SENSORS], [0] * len(SENSORS))
+        self.assertEqual((data_collection.frame_list, data_collection.compass), ([101], 1.5))
+
+        world.imu_sensor.frame = 102
+        with self.assertRaisesRegex(RuntimeError, "no ss_top measurement of frame 102"):
+            data_collection.collect_sensor(102, world)
+        for name in SENSORS:
+            setattr(camera_manager, name, Measurement(102))
+        data_collection.collect_sensor(102, world)
+        self.assertEqual([len(data_collection.sensor_list(name)) for name in SENSORS], [1] * len(SENSORS))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+try:
+    import torch
+    from models.sgan import social_gan
+    from models.sgan.models import TrajectoryGenerator
+except ImportError:
+    torch = None
+
+OBS_LEN = 20
+PRED_LEN = 30
+
+
+def make_generator(noise_dim=(0, )):
+    """Small untrained Social GAN generator pooling the hidden states of every sequence"""
+    torch.manual_seed(0)
+    generator = TrajectoryGenerator(obs_len=OBS_LEN, pred_len=PRED_LEN, embedding_dim=8, encoder_h_dim=8,
+                                    decoder_h_dim=16, mlp_dim=16, noise_dim=noise_dim, noise_type='gaussian',
+                                    noise_mix_type='global', pooling_type='pool_net', bottleneck_dim=8,
+                                    batch_norm=False)
+    generator.eval()
+    return generator
+
+
+def track(track_id, start, velocity, frames=range(81, 101), object_type='vehicle.audi.tt'):
+    rows = [(frame, track_id, object_type, start[0] + velocity[0] * (frame - 100),
+             start[1] + velocity[1] * (frame - 100)) for frame in frames]
+    return pd.DataFrame(rows, columns=['FRAME', 'TRACK_ID', 'OBJECT_TYPE', 'X', 'Y'])
+
+
+class ConstantVelocityGenerator(torch.nn.Module if torch is not None else object):
+    """Generator repeating the last displacement of every agent"""
+
+    def __init__(self):
+        super().__init__()
+        self.weight = torch.nn.Parameter(torch.zeros(1))
+
+    def forward(self, obs_traj, obs_traj_rel, seq_start_end):
+        return obs_traj_rel[-1:].repeat(PRED_LEN, 1, 1)
+
+
+@unittest.skipIf(torch is None, "Social GAN needs torch")
+class TestSceneBuilding(unittest.TestCase):
+    def test_get_history(self):
+        df = pd.concat([track(7, (0.0, 0.0), (1.0, 0.0), range(95, 101)),
+                        track(3, (0.0, 5.0), (0.0, 1.0), range(60, 101))])
+        track_ids, history, valid = social_gan.get_history(df, obs_len=OBS_LEN)
+        self.assertEqual(track_ids.tolist(), [3, 7])
+        self.assertEqual(history.shape, (2, OBS_LEN, 2))
+        # frames older than the observation window are dropped
+        self.assertTrue(valid[0].all())
+        np.testing.assert_allclose(history[0, :, 1], 5.0 + np.arange(-19, 1))
+        self.assertEqual(valid[1].tolist(), [False] * 14 + [True] * 6)
+        np.testing.assert_allclose(history[1, 14:, 0], np.arange(-5, 1))
+
+    def test_build_scene(self):
+        valid = np.ones((3, 6), dtype=bool)
+        valid[0, :2] = False   # entering the scene
+        valid[1, 4:] = False   # leaving it
+        valid[2, 2:4] = False  # hidden for a while
+        history = np.arange(3 * 6 * 2, dtype=np.float64).reshape(3, 6, 2)
+        history[~valid] = np.nan
+
+        obs_traj, obs_traj_rel = social_gan.build_scene(history, valid)
+        self.assertEqual(obs_traj.shape, (6, 3, 2))
+        self.assertFalse(np.isnan(obs_traj).any())
+        expected = history.copy()
+        expected[0, :2] = history[0, 2]
+        expected[1, 4:] = history[1, 3]
+        expected[2, 2:4] = history[2, 1]
+        np.testing.assert_allclose(obs_traj, expected.transpose(1, 0, 2))
+        np.testing.assert_allclose(obs_traj_rel[0], 0.0)
+        np.testing.assert_allclose(obs_traj_rel[1:], np.diff(obs_traj, axis=0))
+        # unobserved agents stand still
+        np.testing.assert_allclose(obs_traj_rel[:2, 0], 0.0)
+        np.testing.assert_allclose(obs_traj_rel[4:, 1], 0.0)
+
+    def test_best_of_k(self):
+        gt = np.zeros((2, 4, 2))
+        pred_traj = np.stack([np.full((2, 4, 2), 1.0), np.full((2, 4, 2), 0.5)])
+        pred_traj[0, 1] = 0.1
+        best = social_gan.best_of_k(pred_traj, gt)
+        np.testing.assert_allclose(best[0], 0.5)
+        np.testing.assert_allclose(best[1], 0.1)
+
+
+@unittest.skipIf(torch is None, "Social GAN needs torch")
+class TestSampleTrajectories(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        history = np.cumsum(rng.uniform(-1, 1, (4, OBS_LEN, 2)), axis=1)
+        self.obs_traj, self.obs_traj_rel = social_gan.build_scene(history, np.ones((4, OBS_LEN), dtype=bool))
+
+    def single_scene(self, generator, user_noise=None):
+        """Prediction of the scene alone, the agents being one sequence"""
+        obs_traj = torch.from_numpy(self.obs_traj).float()
+        obs_traj_rel = torch.from_numpy(self.obs_traj_rel).float()
+        with torch.no_grad():
+            pred_rel = generator(obs_traj, obs_traj_rel, torch.tensor([[0, 4]]), user_noise=user_noise)
+            return social_gan.relative_to_abs(pred_rel, obs_traj[-1]).permute(1, 0, 2).numpy()
+
+    def test_samples_are_separate_sequences(self):
+        generator = make_generator()
+        pred_traj = social_gan.sample_trajectories(generator, self.obs_traj, self.obs_traj_rel, num_samples=3)
+        self.assertEqual(pred_traj.shape, (3, 4, PRED_LEN, 2))
+        # without noise, pooling over the batch does not mix the samples
+        expected = self.single_scene(generator)
+        for sample in pred_traj:
+            np.testing.assert_allclose(sample, expected, atol=1e-5)
+
+    def test_noise_per_sample(self):
+        generator = make_generator(noise_dim=(4, ))
+        torch.manual_seed(1)
+        pred_traj = social_gan.sample_trajectories(generator, self.obs_traj, self.obs_traj_rel, num_samples=3)
+        torch.manual_seed(1)
+        noise = torch.randn(3, 4)
+        for sample, user_noise in zip(pred_traj, noise):
+            np.testing.assert_allclose(sample, self.single_scene(generator, user_noise[None]), atol=1e-5)
+        self.assertFalse(np.allclose(pred_traj[0], pred_traj[1]))
+
+
+@unittest.skipIf(torch is None, "Social GAN needs torch")
+class TestSocialGanInference(unittest.TestCase):
+    def test_risky_ids(self):
+        vehicle_list = [
+            track(1, (0.0, 0.0), (0.5, 0.0)),                    # ego
+            track(2, (16.0, 0.0), (-0.5, 0.0)),                  # head-on vehicle
+            track(3, (8.0, 20.0), (0.0, 0.1), object_type='walker.pedestrian.0001'),
+            track(4, (10.0, 0.0), (0.0, 0.0), object_type='static.prop.trafficcone01'),
+            track(5, (0.0, 10.0), (0.5, 0.0)),                   # vehicle on a parallel lane
+            track(6, (40.0, 0.0), (-3.0, 0.0)),                  # too far at the first observed frame
+            track(9, (2.0, 0.0), (0.0, 0.0), object_type='AGENT'),
+        ]
+        obstacle_dict = {4: 'static.prop.trafficcone01'}
+        risky = social_gan.socal_gan_inference(vehicle_list, 100, 1, [3], [2, 5, 6], obstacle_dict, None,
+                                               ConstantVelocityGenerator(), num_samples=2)
+        self.assertEqual(risky, [2, 4])
+        self.assertEqual(social_gan.socal_gan_inference(vehicle_list[1:], 100, 1, [3], [2, 5, 6], obstacle_dict,
+                                                        None, ConstantVelocityGenerator()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
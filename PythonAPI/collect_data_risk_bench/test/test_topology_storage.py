@@ -0,0 +1,160 @@
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from util.topology_storage import TopologyReader, TopologyWriter
+
+try:
+    from util.data_collection import Data_Collection
+except ImportError:
+    Data_Collection = None
+
+
+def random_lanes(rng, count):
+    """Lanes in the layout of Data_Collection.collect_topology"""
+    lanes = []
+    for i in range(count):
+        center = rng.uniform(-100.0, 100.0, (int(rng.integers(2, 20)), 6))
+        lanes.append([center + 1.75, center - 1.75, center, [None, "left", "right"][i % 3], bool(i % 4 == 0),
+                      bool(i % 5 == 0), (i // 2, 1 if i % 2 else -1)])
+    return lanes
+
+
+def random_frames(rng, lanes, num_frames=30, per_frame=12):
+    """Frames sharing most of their lanes with the previous one, as around a moving ego"""
+    return [[lanes[i] for i in range(start % 8, start % 8 + per_frame)] for start in range(num_frames)]
+
+
+class TestTopologyStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, "topology.npz")
+        self.rng = np.random.default_rng(0)
+
+    def assertSameLanes(self, lanes, expected):
+        self.assertEqual(len(lanes), len(expected))
+        for lane, reference in zip(lanes, expected):
+            for coords, reference_coords in zip(lane[:3], reference[:3]):
+                np.testing.assert_array_equal(coords, np.asarray(reference_coords, dtype=np.float32))
+            self.assertEqual(lane[3:], list(reference[3:]))
+
+    def test_round_trip(self):
+        lanes = random_lanes(self.rng, 20)
+        frames = random_frames(self.rng, lanes)
+        with TopologyWriter(self.path) as writer:
+            for frame, frame_lanes in enumerate(frames):
+                writer.write(frame, frame_lanes)
+            writer.write(len(frames), None)
+            writer.write(len(frames) + 1, [])
+
+        reader = TopologyReader(self.path)
+        self.assertEqual(len(reader), len(frames) + 2)
+        # every distinct lane is stored once
+        distinct = len({id(lane) for frame_lanes in frames for lane in frame_lanes})
+        self.assertEqual(len(reader.road_id), distinct)
+        self.assertEqual(len(reader.lane_offsets), distinct + 1)
+        for frame, frame_lanes in enumerate(frames):
+            self.assertSameLanes(reader[frame], frame_lanes)
+        self.assertIsNone(reader[len(frames)])
+        self.assertEqual(reader[len(frames) + 1], [])
+        self.assertNotIn(len(frames) + 2, reader)
+
+    def test_same_coordinates_other_attributes(self):
+        lane = random_lanes(self.rng, 1)[0]
+        junction = lane[:5] + [not lane[5]] + lane[6:]
+        with TopologyWriter(self.path) as writer:
+            writer.write(0, [lane, junction, lane])
+        reader = TopologyReader(self.path)
+        self.assertEqual(reader.lane_ids(0).tolist(), [0, 1, 0])
+        self.assertSameLanes(reader[0], [lane, junction, lane])
+
+    def test_empty_episode(self):
+        with TopologyWriter(self.path):
+            pass
+        reader = TopologyReader(self.path)
+        self.assertEqual(len(reader), 0)
+        self.assertEqual(reader.coords.shape, (0, 3, 6))
+
+    def test_memory_mapped(self):
+        lanes = random_lanes(self.rng, 6)
+        with TopologyWriter(self.path) as writer:
+            writer.write(10, lanes)
+        reader = TopologyReader(self.path)
+        for name in ("coords", "lane_offsets", "road_id", "frame_lanes", "frame_offsets"):
+            self.assertIsInstance(getattr(reader, name), np.memmap, name)
+        # the lanes of a frame are views of the mapped file, not copies
+        coords = reader.lane_coords(int(reader.lane_ids(10)[3]))
+        self.assertIsInstance(coords, np.memmap)
+        self.assertFalse(coords.flags.writeable)
+        self.assertTrue(np.shares_memory(coords, reader.coords))
+        with np.load(self.path) as data:
+            for name in data.files:
+                np.testing.assert_array_equal(getattr(reader, name), data[name])
+
+    def test_compressed_or_object_members(self):
+        np.savez_compressed(self.path, coords=np.zeros((4, 3, 6), dtype=np.float32))
+        with self.assertRaisesRegex(ValueError, "compressed"):
+            TopologyReader(self.path)
+        np.savez(self.path, lanes=np.array([[1, 2], None], dtype=object))
+        with self.assertRaisesRegex(ValueError, "objects"):
+            TopologyReader(self.path)
+
+    def test_local_header_extra_field(self):
+        lanes = random_lanes(self.rng, 4)
+        with TopologyWriter(self.path) as writer:
+            writer.write(0, lanes)
+        # a member whose local header carries an extra field the central directory does not have
+        copy = os.path.join(self.tmp_dir, "copy.npz")
+        with zipfile.ZipFile(self.path) as source, zipfile.ZipFile(copy, "w") as target:
+            for info in source.infolist():
+                data = source.read(info)
+                info.extra = b"\xfe\xca\x04\x00abcd"
+                target.writestr(info, data)
+        self.assertSameLanes(TopologyReader(copy)[0], lanes)
+
+
+@unittest.skipIf(Data_Collection is None, "Data_Collection needs carla and cv2")
+class TestSaveTopology(unittest.TestCase):
+    def test_same_frames_as_per_frame_files(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        rng = np.random.default_rng(1)
+        frames = random_frames(rng, random_lanes(rng, 16), num_frames=12, per_frame=6)
+        frames[4] = None
+        frame_list = list(range(100, 112))
+        data_collection = Data_Collection()
+        with contextlib.redirect_stdout(io.StringIO()):
+            # ragged_topology, the default, and the per-frame .npy files written before it
+            data_collection.save_topology(frame_list, frames, tmp_dir, 102, 110)
+            data_collection.save_np_data(frame_list, frames, tmp_dir, 102, 110, "topology")
+
+        reader = TopologyReader(os.path.join(tmp_dir, "topology.npz"))
+        files = sorted(os.listdir(os.path.join(tmp_dir, "topology")))
+        self.assertEqual(files, ["%08d.npy" % frame for frame in range(8)])
+        self.assertEqual(reader.frames.tolist(), list(range(8)))
+        for frame in range(8):
+            legacy = np.load(os.path.join(tmp_dir, "topology", "%08d.npy" % frame), allow_pickle=True)
+            lanes = reader[frame]
+            if frame == 2:
+                self.assertIsNone(lanes)
+                self.assertIsNone(legacy.item())
+                continue
+            self.assertEqual(len(lanes), len(legacy))
+            for lane, legacy_lane in zip(lanes, legacy):
+                for coords, legacy_coords in zip(lane[:3], legacy_lane[:3]):
+                    np.testing.assert_array_equal(coords, legacy_coords.astype(np.float32))
+                self.assertEqual(lane[3:], list(legacy_lane[3:]))
+
+
+if __name__ == '__main__':
+    unittest.main()
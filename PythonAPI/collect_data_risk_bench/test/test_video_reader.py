@@ -0,0 +1,151 @@
+import functools
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "vis_tools"))
+
+try:
+    import cv2
+    import video_reader as video_reader_module
+    from video_reader import video_reader
+except ImportError:
+    cv2 = None
+
+FRAMES = 40
+
+
+def write_video(path, frames=FRAMES):
+    """MJPG video whose frame i is a solid color, 6 * i blue and 255 - 6 * i green"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 20, (64, 48))
+    for i in range(frames):
+        writer.write(np.full((48, 64, 3), (6 * i, 255 - 6 * i, 100), np.uint8))
+    writer.release()
+
+
+def frame_index(frame):
+    # the frames are RGB, both channels are read to average out the JPEG error
+    return int(round((frame[..., 2].mean() + 255 - frame[..., 1].mean()) / 12))
+
+
+class SeekingCapture():
+    """cv2.VideoCapture recording the frames it seeks to, its reads wait for the gate to be open"""
+
+    def __init__(self, video_capture, seeks, gate, path):
+        self.capture = video_capture(path)
+        self.seeks = seeks
+        self.gate = gate
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.seeks.append(int(value))
+        return self.capture.set(prop, value)
+
+    def read(self):
+        self.gate.wait()
+        return self.capture.read()
+
+    def __getattr__(self, name):
+        return getattr(self.capture, name)
+
+
+@unittest.skipIf(cv2 is None, "the video reader needs cv2")
+class TestVideoReader(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, "video.avi")
+        write_video(self.path)
+        self.seeks = []
+        self.gate = threading.Event()
+        self.gate.set()
+        patcher = mock.patch.object(video_reader_module.cv2, "VideoCapture",
+                                    functools.partial(SeekingCapture, cv2.VideoCapture, self.seeks, self.gate))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reader(self, **kwargs):
+        reader = video_reader(self.path, **kwargs)
+        self.addCleanup(reader.close)
+        return reader
+
+    def test_frame_order(self):
+        reader = self.reader(cache_size=8, look_ahead=4)
+        self.assertEqual((reader.frame_count, reader.width, reader.height), (FRAMES, 64, 48))
+        frames = [reader.wait(frame_no, timeout=5.0) for frame_no in range(FRAMES)]
+        self.assertEqual([frame_index(frame) for frame in frames], list(range(FRAMES)))
+        self.assertEqual(frames[0].shape, (48, 64, 3))
+        # played forward, the video is decoded once without seeking
+        self.assertEqual(self.seeks, [])
+        self.assertLessEqual(len(reader.cache), 8)
+
+    def test_look_ahead(self):
+        reader = self.reader(look_ahead=6)
+        reader.wait(10, timeout=5.0)
+        with reader.condition:
+            reader.condition.wait_for(lambda: 16 in reader.cache, 5.0)
+            # the decoder stops look_ahead frames after the requested one
+            self.assertEqual(max(reader.cache), 16)
+        for frame_no in range(10, 17):
+            self.assertEqual(frame_index(reader.get(frame_no)), frame_no)
+
+    def test_seek(self):
+        reader = self.reader(cache_size=8, look_ahead=2, seek_distance=5)
+        self.assertEqual(frame_index(reader.wait(0, timeout=5.0)), 0)
+        # a few frames ahead are reached by grabbing, farther ones and earlier ones by seeking
+        self.assertEqual(frame_index(reader.wait(6, timeout=5.0)), 6)
+        self.assertEqual(self.seeks, [])
+        self.assertEqual(frame_index(reader.wait(30, timeout=5.0)), 30)
+        self.assertEqual(self.seeks, [30])
+        self.assertEqual(frame_index(reader.wait(3, timeout=5.0)), 3)
+        self.assertEqual(self.seeks, [30, 3])
+        # out of range requests are clamped to the video
+        self.assertEqual(frame_index(reader.wait(FRAMES - 1, timeout=5.0)), FRAMES - 1)
+        reader.get(FRAMES + 10)
+        self.assertEqual(reader.target, FRAMES - 1)
+
+    def test_get_does_not_block(self):
+        reader = self.reader()
+        frame = reader.get(20)
+        if frame is None:
+            frame = reader.wait(20, timeout=5.0)
+        self.assertEqual(frame_index(frame), 20)
+
+    def test_close(self):
+        reader = video_reader(self.path, look_ahead=4)
+        reader.wait(0, timeout=5.0)
+        reader.close()
+        self.assertFalse(reader.thread.is_alive())
+        self.assertFalse(reader.vc.isOpened())
+
+    def test_close_wakes_waiters(self):
+        # the decoder is stuck in its first read, the waiter blocks until the reader closes
+        self.gate.clear()
+        reader = video_reader(self.path)
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(reader.wait(5, timeout=10.0)))
+        waiter.start()
+        waiter.join(0.1)
+        self.assertTrue(waiter.is_alive())
+
+        closer = threading.Thread(target=reader.close)
+        closer.start()
+        waiter.join(5.0)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(results, [None])
+        # close waits for the decoder to finish its read before releasing the capture
+        self.assertTrue(closer.is_alive())
+        self.gate.set()
+        closer.join(5.0)
+        self.assertFalse(reader.thread.is_alive())
+        self.assertFalse(reader.vc.isOpened())
+
+
+if __name__ == '__main__':
+    unittest.main()
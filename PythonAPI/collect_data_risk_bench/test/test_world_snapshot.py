@@ -0,0 +1,170 @@
+import os
+import sys
+import types
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+try:
+    import carla
+    from agents.navigation.behavior_agent import BehaviorAgent
+    from agents.tools.misc import is_within_distance
+    from agents.tools.world_snapshot import OTHER, TRAFFIC_LIGHT, VEHICLE, WALKER, WorldSnapshotCache
+except ImportError:
+    carla = None
+
+
+class FakeActor():
+    def __init__(self, actor_id, type_id, location, rotation=(0.0, 0.0, 0.0), velocity=(0.0, 0.0, 0.0),
+                 extent=(2.0, 1.0, 0.75)):
+        self.id = actor_id
+        self.type_id = type_id
+        self.location = location
+        self.rotation = rotation
+        self.velocity = velocity
+        self.bounding_box = carla.BoundingBox(carla.Location(), carla.Vector3D(*extent))
+
+    def get_transform(self):
+        return carla.Transform(carla.Location(*self.location), carla.Rotation(*self.rotation))
+
+    def get_velocity(self):
+        return carla.Vector3D(*self.velocity)
+
+
+class FakeSnapshot():
+    """carla.WorldSnapshot of the actors, whose ActorSnapshots share the getters of carla.Actor"""
+
+    def __init__(self, frame, actors):
+        self.frame = frame
+        self.actors = list(actors)
+
+    def __iter__(self):
+        return iter(self.actors)
+
+
+class FakeWorld():
+    def __init__(self, actors):
+        self.frame = 0
+        self.actors = {actor.id: actor for actor in actors}
+        self.get_actors_calls = 0
+
+    def tick(self):
+        self.frame += 1
+
+    def get_snapshot(self):
+        return FakeSnapshot(self.frame, self.actors.values())
+
+    def get_actors(self, actor_ids):
+        self.get_actors_calls += 1
+        # the spectator has no handle
+        return [self.actors[actor_id] for actor_id in actor_ids if actor_id != 0]
+
+
+def make_world():
+    return FakeWorld([
+        FakeActor(1, 'vehicle.tesla.model3', (0.0, 0.0, 0.0), velocity=(10.0, 0.0, 0.0)),
+        FakeActor(2, 'vehicle.audi.tt', (15.0, 1.0, 0.5), (2.0, 30.0, -1.5), (0.0, 5.0, 0.0)),
+        FakeActor(3, 'walker.pedestrian.0001', (5.0, -4.0, 0.0), extent=(0.3, 0.3, 0.9)),
+        FakeActor(4, 'traffic.traffic_light', (30.0, 5.0, 0.0)),
+        FakeActor(5, 'vehicle.nissan.micra', (-60.0, 0.0, 0.0), (0.0, 180.0, 0.0)),
+        FakeActor(0, 'spectator', (0.0, 0.0, 50.0)),
+    ])
+
+
+@unittest.skipIf(carla is None, "the agents need the carla package")
+class TestWorldSnapshotCache(unittest.TestCase):
+    def setUp(self):
+        self.world = make_world()
+        self.cache = WorldSnapshotCache(self.world)
+        self.cache.update()
+
+    def test_update(self):
+        cache = self.cache
+        self.assertEqual(cache.frame, 0)
+        self.assertEqual(cache.ids.tolist(), [1, 2, 3, 4, 5, 0])
+        self.assertEqual(cache.kinds.tolist(), [VEHICLE, VEHICLE, WALKER, TRAFFIC_LIGHT, VEHICLE, OTHER])
+        row = cache.row(2)
+        np.testing.assert_allclose(cache.locations[row], (15.0, 1.0, 0.5))
+        np.testing.assert_allclose(cache.rotations[row], (2.0, 30.0, -1.5))
+        self.assertAlmostEqual(cache.yaws[row], 30.0)
+        self.assertAlmostEqual(cache.speed(cache.row(1)), 36.0)
+        np.testing.assert_allclose(cache.extents[cache.row(3)], (0.3, 0.3, 0.9))
+        np.testing.assert_allclose(cache.extents[cache.row(4)], (0.0, 0.0, 0.0))
+        self.assertIs(cache.actor(row), self.world.actors[2])
+        self.assertIsNone(cache.actor(cache.row(0)))
+
+    def test_refresh_on_spawn_and_destroy(self):
+        self.assertEqual(self.world.get_actors_calls, 1)
+        # the same frame is not read twice, moving actors are read without fetching them again
+        self.world.actors[1].location = (3.0, 0.0, 0.0)
+        self.cache.update()
+        np.testing.assert_allclose(self.cache.locations[self.cache.row(1)], (0.0, 0.0, 0.0))
+        for _ in range(3):
+            self.world.tick()
+            self.cache.update()
+        np.testing.assert_allclose(self.cache.locations[self.cache.row(1)], (3.0, 0.0, 0.0))
+        self.assertEqual(self.world.get_actors_calls, 1)
+
+        del self.world.actors[3]
+        self.world.actors[6] = FakeActor(6, 'walker.pedestrian.0002', (8.0, 2.0, 0.0))
+        self.world.tick()
+        self.cache.update()
+        self.assertEqual(self.world.get_actors_calls, 2)
+        self.assertIsNone(self.cache.row(3))
+        self.assertNotIn(3, self.cache._kinds)
+        self.assertEqual(self.cache.kinds[self.cache.row(6)], WALKER)
+        self.assertEqual(self.cache.rows_of_kind(WALKER).tolist(), [self.cache.row(6)])
+
+        del self.world.actors[2]
+        self.world.tick()
+        self.cache.update()
+        self.assertEqual(self.world.get_actors_calls, 2)
+        self.assertEqual(self.cache.ids.tolist(), [1, 4, 5, 0, 6])
+        self.assertEqual(self.cache.rows_of_kind(VEHICLE).tolist(), [0, 2])
+
+    def test_transform(self):
+        actor = self.world.actors[2]
+        transform = self.cache.transform(self.cache.row(2))
+        self.assertAlmostEqual(transform.rotation.pitch, 2.0, places=5)
+        self.assertAlmostEqual(transform.rotation.roll, -1.5, places=5)
+        expected = actor.bounding_box.get_world_vertices(actor.get_transform())
+        vertices = actor.bounding_box.get_world_vertices(transform)
+        for vertex, expected_vertex in zip(vertices, expected):
+            self.assertAlmostEqual(vertex.distance(expected_vertex), 0.0, places=4)
+
+    def test_query_radius(self):
+        cache = self.cache
+        center = carla.Location(0.0, 0.0, 0.0)
+        self.assertEqual(cache.ids[cache.query_radius(center, 20.0)].tolist(), [1, 3, 2])
+        self.assertEqual(cache.ids[cache.query_radius(center, 20.0, kind=VEHICLE, exclude_id=1)].tolist(), [2])
+        self.assertEqual(cache.ids[cache.query_radius(center, 100.0, kind=VEHICLE)].tolist(), [1, 2, 5])
+        self.assertEqual(cache.query_radius(carla.Location(500.0, 500.0, 0.0), 50.0).tolist(), [])
+
+    def test_query_cone(self):
+        cache = self.cache
+        reference = carla.Transform(carla.Location(0.0, 0.0, 0.0), carla.Rotation(yaw=10.0))
+        rows = np.arange(len(cache.ids))
+        for angle_interval in (None, [0, 90], [90, 180]):
+            inside = cache.query_cone(rows, reference, 20.0, angle_interval)
+            expected = [is_within_distance(cache.transform(row), reference, 20.0, angle_interval) for row in rows]
+            self.assertEqual(inside.tolist(), expected, angle_interval)
+
+
+@unittest.skipIf(carla is None, "the agents need the carla package")
+class TestActorSpeed(unittest.TestCase):
+    def test_fallback(self):
+        world = make_world()
+        cache = WorldSnapshotCache(world)
+        cache.update()
+        agent = types.SimpleNamespace(_perception=cache)
+
+        self.assertAlmostEqual(BehaviorAgent._actor_speed(agent, world.actors[1]), 36.0)
+        # a vehicle spawned since the last update is read from the simulator
+        spawned = FakeActor(7, 'vehicle.audi.a2', (1.0, 1.0, 0.0), velocity=(0.0, 0.0, 2.0))
+        self.assertAlmostEqual(BehaviorAgent._actor_speed(agent, spawned), 7.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
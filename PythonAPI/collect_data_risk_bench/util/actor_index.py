@@ -0,0 +1,157 @@
+"""
+    Per-episode index of the actors: full CARLA actor ids <-> 16-bit instance segmentation ids <-> dense rows.
+
+    The instance segmentation only keeps actor id % 65536 (see util/instance_storage.py). The index is updated
+    incrementally with the ids of every frame: spawned actors are appended, despawned ones are swapped out, so
+    the live actors always fill the rows [0, len). A table of 65536 entries maps every instance id to the row
+    of its actor, and the instance ids shared by several live actors are marked as collisions. Instance ids
+    coming from the segmentation (ids of InstanceFrame.objects, a whole id plane) are then resolved by array
+    indexing.
+"""
+import numpy as np
+
+INSTANCE_ID_MODULO = 65536
+# entries of the instance id table that are not a row
+UNKNOWN = -1
+COLLISION = -2
+
+
+def instance_ids(actor_ids):
+    """16-bit instance segmentation ids of full actor ids"""
+    return np.asarray(actor_ids, dtype=np.int64) % INSTANCE_ID_MODULO
+
+
+class ActorIndex():
+    """
+        Live actors of an episode, in dense rows.
+    """
+
+    def __init__(self, capacity=256):
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self.count = 0
+        self.row_of_id = {}
+        # row of the actor of each instance id, UNKNOWN or COLLISION
+        self.instance_rows = np.full(INSTANCE_ID_MODULO, UNKNOWN, dtype=np.int64)
+        # full ids of the live actors of each instance id in use
+        self.sharing = {}
+        self.collisions = set()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, actor_id):
+        return int(actor_id) in self.row_of_id
+
+    @property
+    def ids(self):
+        """Full id of the actor of each row"""
+        return self._ids[:self.count]
+
+    def reset(self):
+        for instance_id in self.sharing:
+            self.instance_rows[instance_id] = UNKNOWN
+        self.count = 0
+        self.row_of_id.clear()
+        self.sharing.clear()
+        self.collisions.clear()
+
+    def update(self, actor_ids):
+        """
+            Makes the index hold exactly the actors of actor_ids, the ids of one frame.
+
+            Returns:
+                ids of the spawned and of the despawned actors since the last update
+        """
+        actor_ids = np.unique(np.asarray(actor_ids, dtype=np.int64))
+        current = self.ids
+        removed = np.setdiff1d(current, actor_ids, assume_unique=True)
+        added = np.setdiff1d(actor_ids, current, assume_unique=True)
+        self.remove(removed)
+        self.add(added)
+        return added, removed
+
+    def add(self, actor_ids):
+        for actor_id in np.asarray(actor_ids, dtype=np.int64).tolist():
+            if actor_id in self.row_of_id:
+                continue
+            if self.count == len(self._ids):
+                self._ids = np.concatenate([self._ids, np.empty(len(self._ids), dtype=np.int64)])
+            row = self.count
+            self._ids[row] = actor_id
+            self.row_of_id[actor_id] = row
+            self.count += 1
+            instance_id = actor_id % INSTANCE_ID_MODULO
+            self.sharing.setdefault(instance_id, []).append(actor_id)
+            self._refresh(instance_id)
+
+    def remove(self, actor_ids):
+        for actor_id in np.asarray(actor_ids, dtype=np.int64).tolist():
+            row = self.row_of_id.pop(actor_id, None)
+            if row is None:
+                continue
+            # the last row fills the hole
+            last = self.count - 1
+            if row != last:
+                moved = int(self._ids[last])
+                self._ids[row] = moved
+                self.row_of_id[moved] = row
+                self._refresh(moved % INSTANCE_ID_MODULO)
+            self.count -= 1
+            instance_id = actor_id % INSTANCE_ID_MODULO
+            self.sharing[instance_id].remove(actor_id)
+            self._refresh(instance_id)
+
+    def _refresh(self, instance_id):
+        actors = self.sharing.get(instance_id)
+        if not actors:
+            self.sharing.pop(instance_id, None)
+            self.instance_rows[instance_id] = UNKNOWN
+            self.collisions.discard(instance_id)
+        elif len(actors) == 1:
+            self.instance_rows[instance_id] = self.row_of_id[actors[0]]
+            self.collisions.discard(instance_id)
+        else:
+            self.instance_rows[instance_id] = COLLISION
+            self.collisions.add(instance_id)
+
+    def rows(self, actor_ids):
+        """
+            Rows of full actor ids, UNKNOWN for the actors not in the index
+        """
+        actor_ids = np.asarray(actor_ids, dtype=np.int64)
+        rows = self.instance_rows[actor_ids % INSTANCE_ID_MODULO]
+        found = rows >= 0
+        found[found] = self._ids[rows[found]] == actor_ids[found]
+        result = np.where(found, rows, UNKNOWN)
+        # the few ids of colliding instance ids go through the dict
+        for i in np.flatnonzero(rows == COLLISION).tolist():
+            result.flat[i] = self.row_of_id.get(int(actor_ids.flat[i]), UNKNOWN)
+        return result
+
+    def lookup(self, instance_ids):
+        """
+            Args:
+                instance_ids: array of any shape of 16-bit instance ids, e.g. an id plane of
+                    util.instance_storage.instance_planes
+            Returns:
+                array of the same shape of rows, UNKNOWN or COLLISION
+        """
+        return self.instance_rows[np.asarray(instance_ids, dtype=np.int64)]
+
+    def actor_ids(self, instance_ids):
+        """
+            Full actor ids of instance ids, UNKNOWN and COLLISION where there is not exactly one live actor
+        """
+        rows = self.lookup(instance_ids)
+        return np.where(rows >= 0, self._ids[np.maximum(rows, 0)], rows)
+
+    def resolve(self, instance_ids):
+        """
+            Set of the full ids of the live actors of instance ids, every actor of a colliding instance id included
+        """
+        instance_ids = np.asarray(instance_ids, dtype=np.int64).ravel()
+        rows = self.lookup(instance_ids)
+        resolved = set(self._ids[rows[rows >= 0]].tolist())
+        for instance_id in np.unique(instance_ids[rows == COLLISION]).tolist():
+            resolved.update(self.sharing[instance_id])
+        return resolved
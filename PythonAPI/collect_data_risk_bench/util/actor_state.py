@@ -0,0 +1,348 @@
+import fnmatch
+import numpy as np
+import carla
+
+VEHICLE = 0
+PEDESTRIAN = 1
+TRAFFIC_LIGHT = 2
+OBSTACLE = 3
+OTHER = 4
+
+KIND_FILTERS = [(VEHICLE, "*vehicle*"), (PEDESTRIAN, "*pedestrian*"),
+                (TRAFFIC_LIGHT, "*traffic_light*"), (OBSTACLE, "*static.prop*")]
+
+BIKE_BLUEPRINT = ["vehicle.bh.crossbike", "vehicle.diamondback.century", "vehicle.gazelle.omafiets"]
+MOTOR_BLUEPRINT = ["vehicle.harley-davidson.low_rider", "vehicle.kawasaki.ninja", "vehicle.yamaha.yzf", "vehicle.vespa.zx125"]
+
+# corner signs in the order used by carla.BoundingBox.get_world_vertices
+CORNER_SIGNS = np.array([[-1, -1, -1], [-1, -1, 1], [-1, 1, -1], [-1, 1, 1],
+                         [1, -1, -1], [1, -1, 1], [1, 1, -1], [1, 1, 1]], dtype=np.float64)
+
+
+def actor_kind(type_id):
+    for kind, pattern in KIND_FILTERS:
+        if fnmatch.fnmatchcase(type_id, pattern):
+            return kind
+    return OTHER
+
+
+def rotation_matrices(rotations):
+    """
+        Args:
+            rotations: (N, 3) array of pitch, yaw, roll in degrees
+        Returns:
+            (N, 3, 3) rotation matrices, same convention as carla.Rotation
+    """
+    pitch, yaw, roll = np.radians(rotations).T
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+    cr, sr = np.cos(roll), np.sin(roll)
+
+    mat = np.empty((len(rotations), 3, 3))
+    mat[:, 0, 0] = cp * cy
+    mat[:, 0, 1] = cy * sp * sr - sy * cr
+    mat[:, 0, 2] = -cy * sp * cr - sy * sr
+    mat[:, 1, 0] = cp * sy
+    mat[:, 1, 1] = sy * sp * sr + cy * cr
+    mat[:, 1, 2] = -sy * sp * cr + cy * sr
+    mat[:, 2, 0] = sp
+    mat[:, 2, 1] = -cp * sr
+    mat[:, 2, 2] = cp * cr
+    return mat
+
+
+def local_vertices(extent, location=(0., 0., 0.), rotation=(0., 0., 0.)):
+    """
+        8 corners of a bounding box in the actor frame, as (8, 3) array
+    """
+    corners = CORNER_SIGNS * np.asarray(extent, dtype=np.float64)
+    mat = rotation_matrices(np.asarray([rotation], dtype=np.float64))[0]
+    return corners @ mat.T + np.asarray(location, dtype=np.float64)
+
+
+def world_vertices(local, locations, rotations):
+    """
+        Batched version of carla.BoundingBox.get_world_vertices
+        Args:
+            local: (N, 8, 3) corners in the actor frame
+            locations: (N, 3) actor locations
+            rotations: (N, 3) actor pitch, yaw, roll
+        Returns:
+            (N, 8, 3) corners in world space
+    """
+    mat = rotation_matrices(rotations)
+    return np.einsum('nij,nkj->nki', mat, local) + locations[:, None, :]
+
+
+def _xyz(values):
+    return {"x": float(values[0]), "y": float(values[1]), "z": float(values[2])}
+
+
+def _box(corners):
+    return {"cord_" + str(i): [float(c[0]), float(c[1]), float(c[2])] for i, c in enumerate(corners)}
+
+
+class ActorFrame():
+    """
+        Columnar record of the state of all the actors in one frame.
+        Every array has one row per actor, in the order of `ids`.
+    """
+
+    def __init__(self, frame, ego_id, ids, kinds, type_ids, locations, rotations, velocities,
+                 accelerations, angular_velocities, corners, controls, statics, compass=0):
+        self.frame = frame
+        self.ego_id = ego_id
+        self.compass = compass
+        self.ids = ids
+        self.kinds = kinds
+        self.type_ids = type_ids
+        self.locations = locations
+        self.rotations = rotations
+        self.velocities = velocities
+        self.accelerations = accelerations
+        self.angular_velocities = angular_velocities
+        self.corners = corners
+        self.controls = controls
+        self.statics = statics
+
+        ego_rows = np.flatnonzero(ids == ego_id)
+        if len(ego_rows):
+            self.distances = np.linalg.norm(locations - locations[ego_rows[0]], axis=1)
+        else:
+            self.distances = np.full(len(ids), np.inf)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def speeds(self):
+        return np.linalg.norm(self.velocities, axis=1)
+
+    def rows(self, kind):
+        return np.flatnonzero(self.kinds == kind)
+
+    def _moving_actor_dict(self, row):
+        _id = int(self.ids[row])
+        entry = {}
+        entry["location"] = _xyz(self.locations[row])
+        if self.kinds[row] == VEHICLE:
+            pitch, yaw, roll = self.rotations[row]
+            entry["rotation"] = {"pitch": float(pitch), "yaw": float(yaw), "roll": float(roll)}
+        entry["distance"] = float(self.distances[row])
+        entry["acceleration"] = _xyz(self.accelerations[row])
+        entry["velocity"] = _xyz(self.velocities[row])
+        if self.kinds[row] == VEHICLE:
+            entry["speed"] = float(np.linalg.norm(self.velocities[row]))
+        entry["angular_velocity"] = _xyz(self.angular_velocities[row])
+        entry["control"] = self.controls.get(_id, {})
+        if _id == self.ego_id:
+            entry["compass"] = self.compass
+        entry["cord_bounding_box"] = _box(self.corners[row])
+        entry["type"] = "vehicle" if self.kinds[row] == VEHICLE else "pedestrian"
+        return entry
+
+    def entry(self, actor_id):
+        """
+            Compatibility view of a single vehicle or pedestrian
+        """
+        row = np.flatnonzero(self.ids == actor_id)[0]
+        return self._moving_actor_dict(row)
+
+    def to_dict(self):
+        """
+            Compatibility view with the layout of Data_Collection.collect_actor_data
+        """
+        data = {}
+        for row in self.rows(VEHICLE):
+            data[int(self.ids[row])] = self._moving_actor_dict(row)
+        for row in self.rows(PEDESTRIAN):
+            data[int(self.ids[row])] = self._moving_actor_dict(row)
+
+        for row in self.rows(TRAFFIC_LIGHT):
+            _id = int(self.ids[row])
+            static = self.statics[_id]
+            data[_id] = {}
+            data[_id]["state"] = self.controls.get(_id, 0)
+            data[_id]["location"] = _xyz(self.locations[row])
+            data[_id]["distance"] = float(self.distances[row])
+            data[_id]["type"] = "traffic_light"
+            data[_id]["tigger_cord_bounding_box"] = static["trigger_cord_bounding_box"]
+            data[_id]["trigger_loc"] = static["trigger_loc"]
+            data[_id]["trigger_ori"] = static["trigger_ori"]
+            data[_id]["trigger_box"] = static["trigger_box"]
+
+        for row in self.rows(OBSTACLE):
+            _id = int(self.ids[row])
+            data[_id] = {}
+            data[_id]["distance"] = float(self.distances[row])
+            data[_id]["type"] = "obstacle"
+
+        data["obstacle_ids"] = self.ids[self.rows(OBSTACLE)].tolist()
+        data["traffic_light_ids"] = self.ids[self.rows(TRAFFIC_LIGHT)].tolist()
+        data["vehicles_ids"] = self.ids[self.rows(VEHICLE)].tolist()
+        data["pedestrian_ids"] = self.ids[self.rows(PEDESTRIAN)].tolist()
+        return data
+
+    def to_inference_dict(self, radius=35):
+        """
+            Compatibility view with the layout of Inference.collect_actor_data
+        """
+        data = {}
+        for row in self.rows(VEHICLE):
+            data[int(self.ids[row])] = self._moving_actor_dict(row)
+        for row in self.rows(PEDESTRIAN):
+            data[int(self.ids[row])] = self._moving_actor_dict(row)
+
+        data["obstacle"] = {}
+        for row in self.rows(OBSTACLE):
+            _id = int(self.ids[row])
+            data["obstacle"][_id] = {}
+            data["obstacle"][_id]["distance"] = float(self.distances[row])
+            data["obstacle"][_id]["type_id"] = self.type_ids[row]
+            data["obstacle"][_id]["type"] = "obstacle"
+            data["obstacle"][_id]["cord_bounding_box"] = _box(self.corners[row])
+
+        near = self.distances < radius
+        all_ids = []
+        for kind in (VEHICLE, PEDESTRIAN, OBSTACLE):
+            rows = self.rows(kind)
+            rows = rows[near[rows]]
+            if kind == VEHICLE:
+                rows = rows[self.ids[rows] != self.ego_id]
+            all_ids += self.ids[rows].tolist()
+
+        data["obstacle_ids"] = self.ids[self.rows(OBSTACLE)].tolist()
+        data["vehicles_ids"] = self.ids[self.rows(VEHICLE)].tolist()
+        data["pedestrian_ids"] = self.ids[self.rows(PEDESTRIAN)].tolist()
+        data["all_ids"] = all_ids
+        return data
+
+
+class ActorStateCollector():
+    """
+        Collects the state of all the actors from a single world snapshot.
+        Type, blueprint and bounding box of each actor are fetched from the
+        server only once, the first time the actor is seen in the episode.
+    """
+
+    def __init__(self, world, ego_id=None):
+        """
+            Args:
+                world: carla.World, or any object with get_snapshot() and get_actors(ids)
+                ego_id: id of the ego vehicle, used for distances
+        """
+        self.world = world
+        self.ego_id = ego_id
+        self.actors = {}
+        self.kinds = {}
+        self.type_ids = {}
+        self.local_corners = {}
+        self.statics = {}
+
+    def reset(self):
+        self.actors.clear()
+        self.kinds.clear()
+        self.type_ids.clear()
+        self.local_corners.clear()
+        self.statics.clear()
+
+    def _register(self, actor_ids):
+        for actor in self.world.get_actors(actor_ids):
+            _id = actor.id
+            type_id = actor.type_id
+            kind = actor_kind(type_id)
+            self.actors[_id] = actor
+            self.kinds[_id] = kind
+            self.type_ids[_id] = type_id
+
+            if kind == TRAFFIC_LIGHT:
+                trigger = actor.trigger_volume
+                verts = trigger.get_world_vertices(carla.Transform())
+                ori = trigger.rotation.get_forward_vector()
+                self.statics[_id] = {
+                    "trigger_cord_bounding_box": _box([[v.x, v.y, v.z] for v in verts]),
+                    "trigger_loc": [trigger.location.x, trigger.location.y, trigger.location.z],
+                    "trigger_ori": [ori.x, ori.y, ori.z],
+                    "trigger_box": [trigger.extent.x, trigger.extent.y]}
+                self.local_corners[_id] = np.zeros((8, 3))
+                continue
+
+            bbox = actor.bounding_box
+            extent = [bbox.extent.x, bbox.extent.y, bbox.extent.z]
+            location = [bbox.location.x, bbox.location.y, bbox.location.z]
+            if type_id in MOTOR_BLUEPRINT:
+                extent = [1.177870, 0.381839, 0.75]
+                location = [0, 0, extent[2]]
+            elif type_id in BIKE_BLUEPRINT:
+                extent = [0.821422, 0.186258, 0.9]
+                location = [0, 0, extent[2]]
+            rotation = [bbox.rotation.pitch, bbox.rotation.yaw, bbox.rotation.roll]
+            self.local_corners[_id] = local_vertices(extent, location, rotation)
+
+        # actors that could not be resolved are kept out of the frame records
+        for _id in actor_ids:
+            self.kinds.setdefault(_id, OTHER)
+
+    def _controls(self, ids, kinds):
+        controls = {}
+        for _id, kind in zip(ids.tolist(), kinds.tolist()):
+            actor = self.actors.get(_id)
+            if kind == VEHICLE:
+                c = actor.get_control()
+                controls[_id] = {
+                    "throttle": c.throttle,
+                    "steer": c.steer,
+                    "brake": c.brake,
+                    "hand_brake": c.hand_brake,
+                    "reverse": c.reverse,
+                    "manual_gear_shift": c.manual_gear_shift,
+                    "gear": c.gear
+                }
+            elif kind == PEDESTRIAN:
+                c = actor.get_control()
+                controls[_id] = {"direction": {"x": c.direction.x, "y": c.direction.y, "z": c.direction.z},
+                                 "speed": c.speed, "jump": c.jump}
+            elif kind == TRAFFIC_LIGHT:
+                controls[_id] = int(actor.state)
+        return controls
+
+    def collect(self, snapshot=None, compass=0):
+        """
+            Args:
+                snapshot: carla.WorldSnapshot, the current one is requested if not given
+                compass: compass of the ego vehicle, stored with the frame
+            Returns:
+                ActorFrame
+        """
+        if snapshot is None:
+            snapshot = self.world.get_snapshot()
+
+        actor_snapshots = list(snapshot)
+        new_ids = [a.id for a in actor_snapshots if a.id not in self.kinds]
+        if new_ids:
+            self._register(new_ids)
+
+        actor_snapshots = [a for a in actor_snapshots if self.kinds[a.id] != OTHER]
+        n = len(actor_snapshots)
+        ids = np.empty(n, dtype=np.int64)
+        state = np.empty((n, 5, 3))
+        for row, a in enumerate(actor_snapshots):
+            t = a.get_transform()
+            v = a.get_velocity()
+            acc = a.get_acceleration()
+            w = a.get_angular_velocity()
+            ids[row] = a.id
+            state[row] = ((t.location.x, t.location.y, t.location.z),
+                          (t.rotation.pitch, t.rotation.yaw, t.rotation.roll),
+                          (v.x, v.y, v.z), (acc.x, acc.y, acc.z), (w.x, w.y, w.z))
+
+        kinds = np.array([self.kinds[_id] for _id in ids.tolist()], dtype=np.int8)
+        type_ids = [self.type_ids[_id] for _id in ids.tolist()]
+        locations = state[:, 0]
+        rotations = state[:, 1]
+        local = np.array([self.local_corners[_id] for _id in ids.tolist()]).reshape(n, 8, 3)
+        corners = world_vertices(local, locations, rotations)
+
+        return ActorFrame(snapshot.frame, self.ego_id, ids, kinds, type_ids, locations, rotations,
+                          state[:, 2], state[:, 3], state[:, 4], corners,
+                          self._controls(ids, kinds), self.statics, compass)
@@ -0,0 +1,506 @@
+"""
+    Micro-benchmarks of the Python hot paths of data collection and inference, on seeded synthetic data.
+
+    Every case builds its inputs (actors, maps, frames) from a seeded generator, so it runs without a CARLA server
+    or a GPU. A case whose modules can not be imported here (carla, cv2, pandas, pygame, ujson) is skipped, with the
+    reason in the results. Each case is timed over --repeat calls after a warm-up call; its peak traced memory is
+    measured on one more call, under tracemalloc.
+
+    Run from PythonAPI/collect_data_risk_bench:
+
+        python -m util.benchmark --save --baseline ./benchmark_baseline.json     # record the baseline
+        python -m util.benchmark --baseline ./benchmark_baseline.json            # compare against it
+        python -m util.benchmark --cases bev.* kf.* --repeat 50 --out run.json
+
+    A case regresses when its median time (or peak memory) exceeds the baseline one by more than the threshold,
+    the comparison then exits with status 1.
+"""
+import argparse
+import contextlib
+import fnmatch
+import io
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+import types
+
+import numpy as np
+
+FORMAT_VERSION = 1
+SEED = 0
+CASES = {}
+
+
+def case(name):
+    """
+        Registers a case. The decorated function gets (rng, tmp_dir) and returns the callable to time.
+    """
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+# -- bird's eye view ------------------------------------------------------------
+
+def synthetic_birdview_producer(rng, map_size=400.0, target_size=256, pixels_per_meter=5):
+    """
+        BirdViewProducer on a random map of map_size meters, without the map images of bird_eye_view/maps.
+    """
+    from bird_eye_view.BirdViewProducer import BirdViewProducer
+    from bird_eye_view.Mask import MapBoundaries, MapMaskGenerator, PixelDimensions, square_fitting_rect_at_any_rotation
+
+    masks_generator = MapMaskGenerator.__new__(MapMaskGenerator)
+    masks_generator.Town = "Synthetic"
+    masks_generator.pixels_per_meter = pixels_per_meter
+    masks_generator.rendering_window = None
+    masks_generator._map_boundaries = MapBoundaries(min_x=0.0, min_y=0.0, max_x=map_size, max_y=map_size)
+    masks_generator._mask_size = masks_generator.calculate_mask_size()
+
+    producer = BirdViewProducer.__new__(BirdViewProducer)
+    producer.target_size = PixelDimensions(width=target_size, height=target_size)
+    producer._pixels_per_meter = pixels_per_meter
+    rendering_square_size = round(square_fitting_rect_at_any_rotation(producer.target_size))
+    producer.rendering_area = PixelDimensions(width=rendering_square_size, height=rendering_square_size)
+    producer.masks_generator = masks_generator
+    shape = (masks_generator._mask_size.height, masks_generator._mask_size.width)
+    producer.full_road_cache = (rng.random(shape) < 0.3).astype(np.uint8)
+    producer.full_lanes_cache = (rng.random(shape) < 0.05).astype(np.uint8)
+    return producer
+
+
+def synthetic_bboxes(rng, center, count, length=4.7, width=2.0, radius=35.0):
+    """
+        count boxes around center, each one a list of 4 Loc corners as Inference gives them to produce().
+    """
+    from bird_eye_view.Mask import Loc
+
+    bboxes = []
+    for _ in range(count):
+        x, y = center[0] + rng.uniform(-radius, radius), center[1] + rng.uniform(-radius, radius)
+        yaw = rng.uniform(-np.pi, np.pi)
+        forward = np.array([np.cos(yaw), np.sin(yaw)]) * length / 2
+        side = np.array([-np.sin(yaw), np.cos(yaw)]) * width / 2
+        corners = [forward + side, forward - side, -forward - side, -forward + side]
+        bboxes.append([Loc(x=float(x + cx), y=float(y + cy)) for cx, cy in corners])
+    return bboxes
+
+
+@case("bev.location_to_pixel")
+def bev_location_to_pixel(rng, tmp_dir):
+    from bird_eye_view.Mask import Loc, RenderingWindow
+
+    producer = synthetic_birdview_producer(rng)
+    masks_generator = producer.masks_generator
+    masks_generator.enable_local_rendering_mode(RenderingWindow(origin=Loc(x=200.0, y=200.0),
+                                                                area=producer.rendering_area))
+    locations = [Loc(x=float(x), y=float(y)) for x, y in rng.uniform(160.0, 240.0, size=(1000, 2))]
+
+    def run():
+        for loc in locations:
+            masks_generator.location_to_pixel(loc)
+    return run
+
+
+@case("bev.draw_bbox_mask")
+def bev_draw_bbox_mask(rng, tmp_dir):
+    from bird_eye_view.Mask import Loc, RenderingWindow
+
+    producer = synthetic_birdview_producer(rng)
+    masks_generator = producer.masks_generator
+    masks_generator.enable_local_rendering_mode(RenderingWindow(origin=Loc(x=200.0, y=200.0),
+                                                                area=producer.rendering_area))
+    bboxes = synthetic_bboxes(rng, (200.0, 200.0), 60)
+
+    def run():
+        masks_generator.draw_bbox_mask(bboxes, fill_flag=True)
+        masks_generator.draw_bbox_mask(bboxes, fill_flag=False)
+    return run
+
+
+@case("bev.produce")
+def bev_produce(rng, tmp_dir):
+    from bird_eye_view.Mask import Loc
+
+    producer = synthetic_birdview_producer(rng)
+    ego = Loc(x=200.0, y=200.0)
+    agent = synthetic_bboxes(rng, ego, 1, radius=0.0)
+    vehicles = synthetic_bboxes(rng, ego, 40)
+    pedestrians = synthetic_bboxes(rng, ego, 15, length=0.8, width=0.8)
+    obstacles = synthetic_bboxes(rng, ego, 5, length=1.0, width=1.0)
+
+    def run():
+        producer.produce(ego, yaw=30.0, agent_bbox_list=agent,
+                         vehicle_bbox_list=vehicles, pedestrians_bbox_list=pedestrians,
+                         obstacle_bbox_list=obstacles)
+    return run
+
+
+# -- trajectories ---------------------------------------------------------------
+
+def synthetic_df_list(rng, num_vehicles=40, num_pedestrians=10, num_obstacles=5, num_frames=200, ego_id=1):
+    """
+        Rows of Inference.df_list for actors driving straight around the ego, one row per actor and frame.
+    """
+    ids = np.arange(ego_id, ego_id + num_vehicles + num_pedestrians + num_obstacles)
+    labels = (["EGO"] + ["vehicle"] * (num_vehicles - 1) + ["pedestrian"] * num_pedestrians
+              + ["static.prop.trafficcone01"] * num_obstacles)
+    start = rng.uniform(-30.0, 30.0, size=(len(ids), 2))
+    velocity = rng.uniform(-8.0, 8.0, size=(len(ids), 2))
+    velocity[num_vehicles:] *= 0.2
+    velocity[num_vehicles + num_pedestrians:] = 0.0
+    yaw = np.degrees(np.arctan2(velocity[:, 1], velocity[:, 0]))
+    rows = []
+    for frame in range(1, num_frames + 1):
+        location = start + velocity * 0.05 * frame
+        for i, _id in enumerate(ids):
+            rows.append([frame, int(_id), labels[i], str(location[i, 0]), str(location[i, 1]),
+                         float(velocity[i, 0]), float(velocity[i, 1]), float(yaw[i])])
+    ego_location = {"x": float(start[0, 0] + velocity[0, 0] * 0.05 * num_frames),
+                    "y": float(start[0, 1] + velocity[0, 1] * 0.05 * num_frames)}
+    return rows, ego_location, ids, num_frames
+
+
+@case("inference.nearby_tracks")
+def inference_nearby_tracks(rng, tmp_dir):
+    from models.tracks import nearby_tracks
+
+    df_list, ego_location, _, frame = synthetic_df_list(rng)
+    nearby_tracks(df_list, frame, ego_location)
+
+    def run():
+        nearby_tracks(df_list, frame, ego_location)
+    return run
+
+
+@case("kf.inference")
+def kf_inference_case(rng, tmp_dir):
+    from models.KalmanFilter import kf_inference
+    from models.tracks import nearby_tracks
+
+    df_list, ego_location, ids, frame = synthetic_df_list(rng, num_vehicles=20, num_pedestrians=5, num_obstacles=0)
+    vehicle_list = nearby_tracks(df_list, frame, ego_location)
+    vehicle_ids = [int(_id) for _id in ids[:20]]
+    pedestrian_ids = [int(_id) for _id in ids[20:]]
+
+    def run():
+        kf_inference(vehicle_list, frame, int(ids[0]), pedestrian_ids, vehicle_ids, [])
+    return run
+
+
+@case("kf.obstacle_collision")
+def kf_obstacle_collision(rng, tmp_dir):
+    from models.KalmanFilter import obstacle_collision
+
+    ego = rng.uniform(-10.0, 10.0, size=(1000, 4))
+    obstacles = rng.uniform(-10.0, 10.0, size=(1000, 3))
+
+    def run():
+        for (ego_x, ego_y, ego_x_next, ego_y_next), (obs_x, obs_y, obs_yaw) in zip(ego.tolist(), obstacles.tolist()):
+            obstacle_collision(4.7, 2, 0.85, 0.85, ego_x, ego_y, ego_x_next, ego_y_next, obs_x, obs_y, obs_yaw,
+                               4.7, 2, 0, 0, 0)
+    return run
+
+
+# -- data collection ------------------------------------------------------------
+
+def synthetic_town(rng, num_roads=16, lanes_per_road=2, road_length=400.0, spacing=2.0):
+    """
+        Stand-in of the client objects collect_topology uses: a grid of straight roads with waypoints every spacing
+        meters, a few of them in junctions or with landmarks.
+    """
+    def landmarks(distance, stop_at_junction):
+        return []
+
+    def traffic_light(distance, stop_at_junction):
+        return [None]
+
+    waypoints = []
+    for road in range(num_roads):
+        horizontal = road % 2 == 0
+        offset = (road // 2) * road_length / (num_roads // 2)
+        for lane in range(1, lanes_per_road + 1):
+            for lane_id in (lane, -lane):
+                for s in np.arange(0.0, road_length, spacing):
+                    along = s if lane_id > 0 else road_length - s
+                    across = offset + lane_id * 3.5 + float(rng.normal(0.0, 0.05))
+                    x, y = (along, across) if horizontal else (across, along)
+                    yaw = (0.0 if lane_id > 0 else 180.0) + (0.0 if horizontal else 90.0) + float(rng.normal(0.0, 0.5))
+                    location = types.SimpleNamespace(x=float(x), y=float(y), z=0.0)
+                    waypoints.append(types.SimpleNamespace(
+                        transform=types.SimpleNamespace(location=location, rotation=types.SimpleNamespace(yaw=yaw)),
+                        road_id=road, lane_id=lane_id, lane_width=3.5, is_junction=bool(rng.random() < 0.05),
+                        get_landmarks=traffic_light if rng.random() < 0.02 else landmarks))
+    ego = waypoints[len(waypoints) // 2]
+
+    town_map = types.SimpleNamespace(get_waypoint=lambda location: ego,
+                                     generate_waypoints=lambda distance: waypoints)
+    return types.SimpleNamespace(world=types.SimpleNamespace(get_map=lambda: town_map),
+                                 player=types.SimpleNamespace(get_location=lambda: ego.transform.location),
+                                 abandon_scenario=False)
+
+
+def synthetic_data_collection():
+    from util.data_collection import Data_Collection
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Data_Collection()
+
+
+@case("collection.collect_topology")
+def collection_collect_topology(rng, tmp_dir):
+    data_collection = synthetic_data_collection()
+    world = synthetic_town(rng)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not data_collection.collect_topology(world):
+            raise RuntimeError("collect_topology found no lane in the synthetic town")
+
+    def run():
+        data_collection.collect_topology(world)
+    return run
+
+
+def synthetic_actor_data(rng, num_actors=60):
+    """
+        A frame of actors_data, as Data_Collection.save_json_data writes it.
+    """
+    data = {}
+    for _id in rng.choice(100000, size=num_actors, replace=False).tolist():
+        data[_id] = {
+            "type_id": "vehicle.tesla.model3",
+            "location": dict(zip("xyz", rng.uniform(-200.0, 200.0, size=3).tolist())),
+            "rotation": dict(zip("xyz", rng.uniform(-180.0, 180.0, size=3).tolist())),
+            "velocity": dict(zip("xyz", rng.uniform(-10.0, 10.0, size=3).tolist())),
+            "acceleration": dict(zip("xyz", rng.uniform(-3.0, 3.0, size=3).tolist())),
+            "speed": float(rng.uniform(0.0, 15.0)),
+            "cord_bounding_box": {"cord_%d" % i: rng.uniform(-200.0, 200.0, size=3).tolist() for i in range(8)},
+        }
+    return data
+
+
+def synthetic_camera_data(rng):
+    """
+        A frame of sensor data, as Data_Collection.collect_camera_data gives it to save_np_data.
+    """
+    return {view: {"extrinsic": rng.normal(size=(4, 4)).tolist(), "intrinsic": np.identity(3),
+                   "loc": rng.normal(size=3), "w2c": rng.normal(size=(4, 4))} for view in ("front", "top")}
+
+
+@case("collection.save_json_data")
+def collection_save_json_data(rng, tmp_dir):
+    data_collection = synthetic_data_collection()
+    data_list = [synthetic_actor_data(rng) for _ in range(20)]
+    frame_list = list(range(len(data_list)))
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            data_collection.save_json_data(frame_list, data_list, tmp_dir, 0, len(frame_list), "actors_data")
+    return run
+
+
+@case("collection.save_np_data")
+def collection_save_np_data(rng, tmp_dir):
+    data_collection = synthetic_data_collection()
+    data_list = [synthetic_camera_data(rng) for _ in range(20)]
+    frame_list = list(range(len(data_list)))
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            data_collection.save_np_data(frame_list, data_list, tmp_dir, 0, len(frame_list), "sensor_data")
+    return run
+
+
+@case("collection.save_topology")
+def collection_save_topology(rng, tmp_dir):
+    from util.topology_storage import TopologyWriter
+
+    lanes = []
+    for lane in range(40):
+        segments = rng.uniform(-50.0, 50.0, size=(18, 6))
+        lanes.append([segments + 1.75, segments - 1.75, segments, None, bool(lane % 7 == 0), bool(lane % 5 == 0),
+                      (lane // 2, 1 if lane % 2 else -1)])
+    # most lanes stay from a frame to the next, as around a moving ego
+    frames = [[lanes[i] for i in range(start % 10, start % 10 + 30)] for start in range(100)]
+    path = os.path.join(tmp_dir, "topology.npz")
+
+    def run():
+        with TopologyWriter(path) as writer:
+            for frame, frame_lanes in enumerate(frames):
+                writer.write(frame, frame_lanes)
+    return run
+
+
+def synthetic_instance_mask(rng, height=256, width=640, num_objects=40):
+    """
+        A (H, W, 4) BGRA instance segmentation image of road and sky, with num_objects boxes of actors and
+        obstacles.
+    """
+    tags = np.full((height, width), 7, dtype=np.uint8)  # road
+    tags[:height // 3] = 11  # sky
+    ids = np.zeros((height, width), dtype=np.uint16)
+    for i in range(num_objects):
+        x, y = int(rng.integers(0, width - 60)), int(rng.integers(height // 3, height - 30))
+        w, h = int(rng.integers(8, 60)), int(rng.integers(8, 30))
+        tags[y:y + h, x:x + w] = rng.choice([14, 15, 16, 12, 18, 19, 21])
+        ids[y:y + h, x:x + w] = i + 1
+    mask = np.zeros((height, width, 4), dtype=np.uint8)
+    mask[..., 2] = tags
+    mask[..., 1] = ids & 0xff
+    mask[..., 0] = ids >> 8
+    mask[..., 3] = 255
+    return mask
+
+
+@case("instance.analyse_objects")
+def instance_analyse_objects(rng, tmp_dir):
+    from util.instance_storage import InstanceEncoder
+
+    # the instance codec pass under Inference.get_ids, without the rest of data_generator
+    encoder = InstanceEncoder()
+    mask = synthetic_instance_mask(rng)
+
+    def run():
+        frame = encoder.analyse(mask)
+        frame.objects([21], 400)
+        frame.objects([14, 15, 16, 12, 18, 19], 400)
+    return run
+
+
+@case("inference.get_ids")
+def inference_get_ids(rng, tmp_dir):
+    from data_generator import Inference
+    from util.instance_storage import InstanceEncoder
+
+    # Inference.__init__ loads the risk models, get_ids only needs the codec and the scenario type
+    inference = Inference.__new__(Inference)
+    inference.instance_encoder = InstanceEncoder()
+    inference.scenario_type = "obstacle"
+    mask = synthetic_instance_mask(rng)
+
+    def run():
+        inference.get_ids(mask)
+    return run
+
+
+# -- runner ---------------------------------------------------------------------
+
+def measure(fn, repeat):
+    fn()  # warm-up
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000.0)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    times = np.array(times)
+    return {"repeat": repeat, "mean_ms": float(times.mean()), "median_ms": float(np.median(times)),
+            "p95_ms": float(np.percentile(times, 95)), "min_ms": float(times.min()),
+            "peak_kb": peak / 1024.0}
+
+
+def run_case(name, repeat, seed=SEED):
+    """
+        Returns:
+            the measures of the case, or {"skipped": reason} when it can not run here
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            fn = CASES[name](np.random.default_rng(seed), tmp_dir)
+        except ImportError as e:
+            return {"skipped": "%s: %s" % (type(e).__name__, e)}
+        return measure(fn, repeat)
+
+
+def select_cases(patterns=None):
+    if not patterns:
+        return list(CASES)
+    return [name for name in CASES if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)]
+
+
+def run(patterns=None, repeat=20, seed=SEED, verbose=True):
+    results = {"version": FORMAT_VERSION, "seed": seed, "python": platform.python_version(),
+               "numpy": np.__version__, "machine": platform.machine(), "processor": platform.processor(),
+               "cases": {}}
+    for name in select_cases(patterns):
+        result = run_case(name, repeat, seed)
+        results["cases"][name] = result
+        if verbose:
+            if "skipped" in result:
+                print("%-32s skipped (%s)" % (name, result["skipped"]))
+            else:
+                print("%-32s median %9.3f ms  p95 %9.3f ms  peak %9.1f KB"
+                      % (name, result["median_ms"], result["p95_ms"], result["peak_kb"]))
+    return results
+
+
+def compare(results, baseline, threshold=0.2, memory_threshold=0.2, verbose=True):
+    """
+        Returns:
+            names of the cases slower (or using more memory) than in the baseline beyond the thresholds
+    """
+    regressions = []
+    for name, result in results["cases"].items():
+        reference = baseline["cases"].get(name)
+        if reference is None or "skipped" in result or "skipped" in reference:
+            continue
+        time_ratio = result["median_ms"] / max(reference["median_ms"], 1e-9)
+        memory_ratio = result["peak_kb"] / max(reference["peak_kb"], 1e-9)
+        regressed = time_ratio > 1.0 + threshold or memory_ratio > 1.0 + memory_threshold
+        if regressed:
+            regressions.append(name)
+        if verbose:
+            print("%-32s time x%.2f  memory x%.2f%s"
+                  % (name, time_ratio, memory_ratio, "  REGRESSION" if regressed else ""))
+    return regressions
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--cases', nargs='*', default=None, help='patterns of the cases to run, all by default')
+    argparser.add_argument('--list', action='store_true', help='list the cases and exit')
+    argparser.add_argument('--repeat', default=20, type=int, help='timed calls per case')
+    argparser.add_argument('--seed', default=SEED, type=int)
+    argparser.add_argument('--out', default=None, help='write the results to this json file')
+    argparser.add_argument('--baseline', default=None, help='json file of the baseline')
+    argparser.add_argument('--save', action='store_true', help='write the results as the baseline')
+    argparser.add_argument('--threshold', default=0.2, type=float, help='allowed relative slowdown of the median')
+    argparser.add_argument('--memory_threshold', default=0.2, type=float, help='allowed relative peak memory growth')
+    args = argparser.parse_args()
+
+    if args.list:
+        print("\n".join(select_cases(args.cases)))
+        return 0
+
+    results = run(args.cases, args.repeat, args.seed)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=4)
+    if args.baseline is None:
+        return 0
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+        print("baseline written to %s" % args.baseline)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+    if regressions:
+        print("%d regressions: %s" % (len(regressions), ", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,12 +1,21 @@
 import json
+import logging
 import numpy as np
 import carla 
 from carla import ColorConverter as cc
-import math
 import os
 from multiprocessing import Process
+import sqlite3
 import time
 import cv2
+from util.actor_state import ActorFrame, ActorStateCollector
+from util.dataset_catalog import add_saved_episode
+from util.depth_storage import DepthEncoder, DepthWriter
+from util.instance_storage import InstanceEncoder, InstanceWriter
+from util.lidar_storage import LidarEncoder, LidarWriter
+from util import profiling
+from util.sensor_profile import SensorProfile
+from util.topology_storage import TopologyWriter
 
 class Data_Collection():
     def __init__(self) -> None:
@@ -32,6 +41,35 @@ class Data_Collection():
         self.static_dict = {}
         self.compass = 0
         self.actor_attri_dict = {}
+        self.actor_state_collector = None
+        # the sensor frames are saved in the files the dataset loaders read (float32 .npy sweeps, CARLA-packed
+        # PNGs) unless use_compact_storage() selects the per-episode containers
+        self.lidar_encoder = None
+        self.depth_encoder = None
+        self.instance_encoder = None
+        # lanes are deduplicated into <path>/topology.npz, False to save one object-dtype .npy per frame
+        self.ragged_topology = True
+        # saved episodes are added to the catalog of the dataset, <dataset root>/catalog.sqlite
+        self.catalog = True
+        # sensors collected on each tick since the trigger, the profile of the CameraManager of the world
+        self.sensor_profile = SensorProfile()
+        self.start_frame = None
+        # seconds collect_sensor waits for a measurement of the frame, a sensor that stopped listening fails the tick
+        self.sensor_timeout = 10.0
+
+    def use_compact_storage(self, lidar=True, depth=True, instance=True):
+        """
+            Saves the sensor frames into per-episode containers, read back by util.replay and the readers of
+            util.lidar_storage, util.depth_storage and util.instance_storage, instead of one file per frame.
+
+            Args:
+                lidar: sweeps quantised into <path>/lidar.zip, a LidarEncoder for other ingest settings
+                depth: frames decoded to meters into <path>/depth_<view>.zip, a DepthEncoder for other settings
+                instance: frames run-length encoded into <path>/instance_<view>.zip
+        """
+        self.lidar_encoder = (lidar if isinstance(lidar, LidarEncoder) else LidarEncoder()) if lidar else None
+        self.depth_encoder = (depth if isinstance(depth, DepthEncoder) else DepthEncoder()) if depth else None
+        self.instance_encoder = InstanceEncoder() if instance else None
 
     def set_attribute(self, scenario_type, scenario_id, weather, actor, random_seed, map):
         self.scenario_type = scenario_type
@@ -44,6 +82,16 @@ class Data_Collection():
     def set_start_frame(self, frame):
         self.start_frame = frame
 
+    def sensor_tick(self, frame):
+        """Ticks from the trigger to frame, None before the trigger"""
+        if self.start_frame is None or frame is None:
+            return None
+        return frame - self.start_frame
+
+    def sensor_list(self, name):
+        """List of the collected measurements of a sensor of util.sensor_profile.SENSORS"""
+        return getattr(self, "sensor_lidar" if name == "lidar" else name)
+
     def set_end_frame(self, frame):
         self.end_frame = frame
 
@@ -56,52 +104,48 @@ class Data_Collection():
     def set_gt_interactor(self, id):
         self.gt_interactor = id
 
-    def collect_sensor(self, frame, world):
-
-        while True:
-            if world.camera_manager.ss_top.frame == frame:
-
-                self.ss_top.append(world.camera_manager.ss_top)
-                break
-        while True:
-            if world.camera_manager.rgb_front.frame == frame:
-                self.rgb_front.append(world.camera_manager.rgb_front)
-                break
+    def wait_measurement(self, name, frame, measurement):
+        """
+            Busy-waits for the measurement of frame, the sensor callbacks run on the threads of the CARLA client.
 
+            Args:
+                measurement: returns the last measurement of the sensor, None before the first one
+            Raises:
+                RuntimeError: after sensor_timeout seconds without it
+        """
+        deadline = time.monotonic() + self.sensor_timeout
         while True:
-            if world.camera_manager.ss_front.frame == frame:
-                self.ss_front.append(world.camera_manager.ss_front)
-                break
+            current = measurement()
+            if current is not None and current.frame == frame:
+                return current
+            if time.monotonic() > deadline:
+                raise RuntimeError("no %s measurement of frame %d after %.1f s, last one of frame %s"
+                                   % (name, frame, self.sensor_timeout, getattr(current, "frame", None)))
 
-        # depth
-        while True:
-            if world.camera_manager.depth_front.frame == frame:
-                self.depth_front.append(world.camera_manager.depth_front)
-                break
+    def collect_sensor(self, frame, world):
 
-        while True:
-            if world.camera_manager.lidar.frame == frame:
-                self.sensor_lidar.append(world.camera_manager.lidar)
-                break
+        profiling.begin("sensor_wait")
+        try:
+            # CameraManager only keeps the measurements of the sensors due on this tick
+            for name in self.sensor_profile.due_sensors(self.sensor_tick(frame)):
+                measurement = self.wait_measurement(name, frame, lambda: getattr(world.camera_manager, name))
+                self.sensor_list(name).append(measurement)
 
-        while True:
-            if world.imu_sensor.frame == frame:
-                self.compass = world.imu_sensor.compass
-                break
+            self.wait_measurement("imu", frame, lambda: world.imu_sensor)
+            self.compass = world.imu_sensor.compass
+        finally:
+            profiling.end("sensor_wait")
 
         # store all actor
         self.frame_list.append(frame)
 
         self.sensor_data_list.append(self.collect_camera_data(world))
 
-        data = self.collect_actor_data(world)
-
-
-        self.data_list.append(data)
-        
-
+        actor_frame = self.collect_actor_data(world)
 
-        self.ego_list.append(data[self.ego_id])
+        # columnar records are turned into dicts only when they are saved
+        self.data_list.append(actor_frame)
+        self.ego_list.append(actor_frame.entry(self.ego_id))
         self.topology_list.append(self.collect_topology(world))
 
     def collect_actor_attr(self, world):
@@ -249,6 +293,7 @@ class Data_Collection():
                                  "ego_id": world.player.id,
                                  "interactor_id": self.gt_interactor}
 
+    @profiling.profiled("collect_topology")
     def collect_topology(self, get_world):
         town_map = get_world.world.get_map()
         try:
@@ -444,200 +489,13 @@ class Data_Collection():
 
         self.static_dict = data
 
+    @profiling.profiled("collect_actor_data")
     def collect_actor_data(self, world):
+        # state of every actor from one snapshot, static attributes are cached per episode
+        if self.actor_state_collector is None or self.actor_state_collector.ego_id != self.ego_id:
+            self.actor_state_collector = ActorStateCollector(world.world, self.ego_id)
 
-        vehicles_id_list = []
-        bike_blueprint = ["vehicle.bh.crossbike","vehicle.diamondback.century","vehicle.gazelle.omafiets"]
-        motor_blueprint = ["vehicle.harley-davidson.low_rider","vehicle.kawasaki.ninja","vehicle.yamaha.yzf","vehicle.vespa.zx125"]
-        
-        def get_xyz(method, rotation=False):
-
-            if rotation:
-                roll = method.roll
-                pitch = method.pitch
-                yaw = method.yaw
-                return {"pitch": pitch, "yaw": yaw, "roll": roll}
-
-            else:
-                x = method.x
-                y = method.y
-                z = method.z
-
-                # return x, y, z
-                return {"x": x, "y": y, "z": z}
-
-        ego_loc = world.player.get_location()
-        data = {}
-
-        vehicles = world.world.get_actors().filter("*vehicle*")
-        for actor in vehicles:
-
-            _id = actor.id
-            actor_loc = actor.get_location()
-            location = get_xyz(actor_loc)
-            rotation = get_xyz(actor.get_transform().rotation, True)
-
-            cord_bounding_box = {}
-            bbox = actor.bounding_box
-            if actor.type_id in motor_blueprint:
-                bbox.extent.x = 1.177870
-                bbox.extent.y = 0.381839
-                bbox.extent.z = 0.75
-                bbox.location = carla.Location(0, 0, bbox.extent.z)
-            elif actor.type_id in bike_blueprint:
-                bbox.extent.x = 0.821422
-                bbox.extent.y = 0.186258
-                bbox.extent.z = 0.9
-                bbox.location = carla.Location(0, 0, bbox.extent.z)
-                
-            verts = [v for v in bbox.get_world_vertices(
-                actor.get_transform())]
-            counter = 0
-            for loc in verts:
-                cord_bounding_box["cord_"+str(counter)] = [loc.x, loc.y, loc.z]
-                counter += 1
-
-            distance = ego_loc.distance(actor_loc)
-
-            
-            vehicles_id_list.append(_id)
-
-            acceleration = get_xyz(actor.get_acceleration())
-            velocity = get_xyz(actor.get_velocity())
-            angular_velocity = get_xyz(actor.get_angular_velocity())
-
-            v = actor.get_velocity()
-
-            speed = math.sqrt(v.x**2 + v.y**2 + v.z**2)
-
-            vehicle_control = actor.get_control()
-            control = {
-                "throttle": vehicle_control.throttle,
-                "steer": vehicle_control.steer,
-                "brake": vehicle_control.brake,
-                "hand_brake": vehicle_control.hand_brake,
-                "reverse": vehicle_control.reverse,
-                "manual_gear_shift": vehicle_control.manual_gear_shift,
-                "gear": vehicle_control.gear
-            }
-
-            data[_id] = {}
-            data[_id]["location"] = location
-            data[_id]["rotation"] = rotation
-            data[_id]["distance"] = distance
-            data[_id]["acceleration"] = acceleration
-            data[_id]["velocity"] = velocity
-            data[_id]["speed"] = speed
-            data[_id]["angular_velocity"] = angular_velocity
-            data[_id]["control"] = control
-            if _id == self.ego_id:
-                data[_id]["compass"] = self.compass
-            data[_id]["cord_bounding_box"] = cord_bounding_box
-            data[_id]["type"] = "vehicle"
-
-        pedestrian_id_list = []
-
-        walkers = world.world.get_actors().filter("*pedestrian*")
-        for actor in walkers:
-
-            _id = actor.id
-
-            actor_loc = actor.get_location()
-            location = get_xyz(actor_loc)
-            rotation = get_xyz(actor.get_transform().rotation, True)
-
-            cord_bounding_box = {}
-            bbox = actor.bounding_box
-            verts = [v for v in bbox.get_world_vertices(
-                actor.get_transform())]
-            counter = 0
-            for loc in verts:
-                cord_bounding_box["cord_"+str(counter)] = [loc.x, loc.y, loc.z]
-                counter += 1
-
-            distance = ego_loc.distance(actor_loc)
-
-            
-            pedestrian_id_list.append(_id)
-
-            acceleration = get_xyz(actor.get_acceleration())
-            velocity = get_xyz(actor.get_velocity())
-            angular_velocity = get_xyz(actor.get_angular_velocity())
-
-            walker_control = actor.get_control()
-            control = {"direction": get_xyz(walker_control.direction),
-                       "speed": walker_control.speed, "jump": walker_control.jump}
-
-            data[_id] = {}
-            data[_id]["location"] = location
-            data[_id]["distance"] = distance
-            data[_id]["acceleration"] = acceleration
-            data[_id]["velocity"] = velocity
-            data[_id]["angular_velocity"] = angular_velocity
-            data[_id]["control"] = control
-
-            data[_id]["cord_bounding_box"] = cord_bounding_box
-            data[_id]["type"] = 'pedestrian'
-
-        traffic_id_list = []
-
-        lights = world.world.get_actors().filter("*traffic_light*")
-        for actor in lights:
-
-            _id = actor.id
-
-            traffic_light_state = int(actor.state)  # traffic light state
-            actor_loc = actor.get_location()
-            distance = ego_loc.distance(actor_loc)
-
-            
-            traffic_id_list.append(_id)
-
-            data[_id] = {}
-            data[_id]["state"] = traffic_light_state
-            actor_loc = actor.get_location()
-            location = get_xyz(actor_loc)
-            data[_id]["location"] = location
-            data[_id]["distance"] = distance
-            data[_id]["type"] = "traffic_light"
-
-            trigger = actor.trigger_volume
-            verts = [v for v in trigger.get_world_vertices(carla.Transform())]
-
-            counter = 0
-            for loc in verts:
-                cord_bounding_box["cord_"+str(counter)] = [loc.x, loc.y, loc.z]
-                counter += 1
-            data[_id]["tigger_cord_bounding_box"] = cord_bounding_box
-            box = trigger.extent
-            loc = trigger.location
-            ori = trigger.rotation.get_forward_vector()
-            data[_id]["trigger_loc"] = [loc.x, loc.y, loc.z]
-            data[_id]["trigger_ori"] = [ori.x, ori.y, ori.z]
-            data[_id]["trigger_box"] = [box.x, box.y]
-
-        obstacle_id_list = []
-
-        obstacle = world.world.get_actors().filter("*static.prop*")
-        for actor in obstacle:
-
-            _id = actor.id
-
-            actor_loc = actor.get_location()
-            distance = ego_loc.distance(actor_loc)
-
-            obstacle_id_list.append(_id)
-
-            data[_id] = {}
-            data[_id]["distance"] = distance
-            data[_id]["type"] = "obstacle"
-
-        data["obstacle_ids"] = obstacle_id_list
-        data["traffic_light_ids"] = traffic_id_list
-        data["vehicles_ids"] = vehicles_id_list
-        data["pedestrian_ids"] = pedestrian_id_list
-
-        return data # , obstacle_id_list, traffic_id_list, pedestrian_id_list
+        return self.actor_state_collector.collect(compass=self.compass)
 
     def _get_forward_speed(self, transform, velocity):
         """ Convert the vehicle transform directly to forward speed """
@@ -660,16 +518,19 @@ class Data_Collection():
         intrinsic[0, 0] = intrinsic[1, 1] = 640 / (
             2.0 * np.tan(120 * np.pi / 360.0)
         )
-        # sensor_location
-        data["front"] = {}
-        data["front"]["extrinsic"] = world.camera_manager.sensor_rgb_front.get_transform(
-        ).get_matrix()  # camera 2 world
-        data["front"]["intrinsic"] = intrinsic
-        sensor = world.camera_manager.sensor_rgb_front
-        data["front"]["loc"] = np.array(
-            [sensor.get_location().x, sensor.get_location().y, sensor.get_location().z])
-        data["front"]["w2c"] = np.array(
-            world.camera_manager.sensor_rgb_front.get_transform().get_inverse_matrix())
+        # sensor_location, the front sensors share their transform
+        camera_manager = world.camera_manager
+        sensor = next((sensor for sensor in (camera_manager.sensor_rgb_front, camera_manager.sensor_ss_front,
+                                             camera_manager.sensor_depth_front) if sensor is not None), None)
+        if sensor is not None:
+            data["front"] = {}
+            data["front"]["extrinsic"] = sensor.get_transform(
+            ).get_matrix()  # camera 2 world
+            data["front"]["intrinsic"] = intrinsic
+            data["front"]["loc"] = np.array(
+                [sensor.get_location().x, sensor.get_location().y, sensor.get_location().z])
+            data["front"]["w2c"] = np.array(
+                sensor.get_transform().get_inverse_matrix())
         
         intrinsic = np.identity(3)
         intrinsic[0, 2] = 512 / 2.0
@@ -678,15 +539,16 @@ class Data_Collection():
             2.0 * np.tan(50 * np.pi / 360.0)
         )
 
-        data["top"] = {}
-        data["top"]["extrinsic"] = world.camera_manager.sensor_ss_top.get_transform(
-        ).get_matrix()
-        data["top"]["intrinsic"] = intrinsic
-        sensor = world.camera_manager.sensor_ss_top
-        data["top"]["loc"] = np.array(
-            [sensor.get_location().x, sensor.get_location().y, sensor.get_location().z])
-        data["top"]["w2c"] = np.array(
-            world.camera_manager.sensor_ss_top.get_transform().get_inverse_matrix())
+        sensor = camera_manager.sensor_ss_top
+        if sensor is not None:
+            data["top"] = {}
+            data["top"]["extrinsic"] = sensor.get_transform(
+            ).get_matrix()
+            data["top"]["intrinsic"] = intrinsic
+            data["top"]["loc"] = np.array(
+                [sensor.get_location().x, sensor.get_location().y, sensor.get_location().z])
+            data["top"]["w2c"] = np.array(
+                sensor.get_transform().get_inverse_matrix())
 
         return data
 
@@ -702,6 +564,8 @@ class Data_Collection():
             if (frame >= start_frame) and (frame < end_frame):
                 frame = frame - start_frame
                 counter += 1
+                if isinstance(data, ActorFrame):
+                    data = data.to_dict()
                 actors_data_file = stored_path + ("/%08d.json" % frame)
                 f = open(actors_data_file, "w")
                 json.dump(data, f, indent=4)
@@ -729,6 +593,17 @@ class Data_Collection():
 
         print(folder_name + " save finished. Total: ", counter)
 
+    def save_topology(self, frame_list, data_list, path, start_frame, end_frame):
+
+        counter = 0
+        with TopologyWriter(os.path.join(path, "topology.npz")) as writer:
+            for frame, data in zip(frame_list, data_list):
+                if (frame >= start_frame) and (frame < end_frame):
+                    counter += 1
+                    writer.write(frame - start_frame, data)
+
+        print("topology save finished. Total: %d, distinct lanes: %d" % (counter, len(writer.coords)))
+
     def save_img(self, img_list, sensor, path, start_frame, end_frame, view='top'):
 
         sensors = [
@@ -752,25 +627,43 @@ class Data_Collection():
 
         modality = sensors[sensor][0].split('.')[-1]
         counter = 0
+        lidar_writer = None
+        if 'lidar' in view and self.lidar_encoder is not None:
+            lidar_writer = LidarWriter('%s/lidar.zip' % path, self.lidar_encoder)
+        depth_writer = None
+        if 'depth' in modality and self.depth_encoder is not None:
+            depth_writer = DepthWriter('%s/depth_%s.zip' % (path, view), self.depth_encoder)
+        instance_writer = None
+        if 'instance' in modality and self.instance_encoder is not None:
+            instance_writer = InstanceWriter('%s/instance_%s.zip' % (path, view), self.instance_encoder)
         for img in img_list:
             if (img.frame >= start_frame) and (img.frame < end_frame):
 
                 counter += 1
                 frame = img.frame - start_frame
 
-                if 'seg' in modality:
+                if instance_writer is not None:
+                    array = np.frombuffer(img.raw_data, dtype=np.dtype("uint8"))
+                    instance_writer.write(frame, np.reshape(array, (img.height, img.width, 4)))
+                elif 'seg' in modality:
                     img.save_to_disk(
                         '%s/%s/%s/%08d' % (path, modality, view, frame), cc.Raw)
+                elif depth_writer is not None:
+                    array = np.frombuffer(img.raw_data, dtype=np.dtype("uint8"))
+                    depth_writer.write(frame, np.reshape(array, (img.height, img.width, 4)))
                 elif 'depth' in modality:
                     img.save_to_disk(
                         '%s/%s/%s/%08d' % (path, modality, view, frame), cc.Raw)#cc.Depth)  # cc.LogarithmicDepth
                 elif 'lidar' in view:
                     points = np.frombuffer(img.raw_data, dtype=np.dtype('f4'))
                     points = np.reshape(points, (int(points.shape[0] / 4), 4))
-                    if not os.path.exists('%s/%s/' % (path, view)):
-                        os.makedirs('%s/%s/' % (path, view))
-                    np.save('%s/%s/%08d.npy' %
-                            (path, view, frame), points, allow_pickle=True)
+                    if lidar_writer is not None:
+                        lidar_writer.write(frame, points)
+                    else:
+                        if not os.path.exists('%s/%s/' % (path, view)):
+                            os.makedirs('%s/%s/' % (path, view))
+                        np.save('%s/%s/%08d.npy' %
+                                (path, view, frame), points, allow_pickle=True)
                 else:
                     img.convert(cc.Raw)
                     array = np.frombuffer(
@@ -783,23 +676,25 @@ class Data_Collection():
                     cv2.imwrite('%s/%s/%s/%08d.jpg' % (path, modality,
                                 view, frame), array, [cv2.IMWRITE_JPEG_QUALITY, 95])
 
+        if lidar_writer is not None:
+            lidar_writer.close()
+        if depth_writer is not None:
+            depth_writer.close()
+        if instance_writer is not None:
+            instance_writer.close()
+
         print("%s %s save finished. Total: %d" %
               (sensors[sensor][2], view, counter))
 
     def save_data(self, path):
 
-        t_ss_top = Process(target=self.save_img, args=(self.ss_top, 10, path,
-                                                       self.start_frame, self.end_frame, 'top'))
+        # (sensor, index in the sensor list of save_img, view), the sensors disabled by the profile are not saved
+        sensor_views = [("ss_top", 10, 'top'), ("rgb_front", 0, 'front'), ("ss_front", 10, 'front'),
+                        ("depth_front", 1, 'front'), ("lidar", 6, 'lidar')]
+        processes = [Process(target=self.save_img, args=(self.sensor_list(name), index, path,
+                                                         self.start_frame, self.end_frame, view))
+                     for name, index, view in sensor_views if self.sensor_profile.enabled(name)]
 
-        t_rgb_front = Process(target=self.save_img, args=(self.rgb_front, 0, path,
-                              self.start_frame, self.end_frame, 'front'))
-        t_ss_front = Process(target=self.save_img, args=(
-            self.ss_front, 10, path, self.start_frame, self.end_frame, 'front'))
-        
-        t_depth_front = Process(target=self.save_img, args=(self.depth_front, 1, path,
-                                self.start_frame, self.end_frame, 'front'))
-        t_lidar = Process(target=self.save_img, args=(self.sensor_lidar, 6,
-                          path, self.start_frame, self.end_frame, 'lidar'))
         t_actors_data = Process(target=self.save_json_data, args=(
             self.frame_list, self.data_list, path, self.start_frame, self.end_frame, "actors_data"))
         t_sensor_data = Process(target=self.save_np_data, args=(
@@ -807,30 +702,21 @@ class Data_Collection():
         t_ego_data = Process(target=self.save_json_data, args=(
             self.frame_list, self.ego_list, path, self.start_frame, self.end_frame, "ego_data"))
 
-        t_topology = Process(target=self.save_np_data, args=(
-            self.frame_list, self.topology_list, path, self.start_frame, self.end_frame, "topology"))
+        if self.ragged_topology:
+            t_topology = Process(target=self.save_topology, args=(
+                self.frame_list, self.topology_list, path, self.start_frame, self.end_frame))
+        else:
+            t_topology = Process(target=self.save_np_data, args=(
+                self.frame_list, self.topology_list, path, self.start_frame, self.end_frame, "topology"))
+        processes += [t_actors_data, t_sensor_data, t_ego_data, t_topology]
 
         start_time = time.time()
 
-        t_ss_top.start()
-        t_rgb_front.start()
-        t_ss_front.start()
-        t_depth_front.start()
-        t_lidar.start()
-        t_actors_data.start()
-        t_sensor_data.start()
-        t_ego_data.start()
-        t_topology.start()
+        for process in processes:
+            process.start()
         # ------------------------------ #
-        t_ss_top.join()
-        t_rgb_front.join()
-        t_ss_front.join()
-        t_depth_front.join()
-        t_lidar.join()
-        t_actors_data.join()
-        t_sensor_data.join()
-        t_ego_data.join()
-        t_topology.join()
+        for process in processes:
+            process.join()
 
         with open(f"{path}/static_data.json", "w") as f:
             json.dump(self.static_dict, f, indent=4)
@@ -846,6 +732,13 @@ class Data_Collection():
             f.write(
                 f"{self.scenario_type}#{self.scenario_id}#{self.map}#{self.weather}#{self.actor}#{self.seed}\n")
 
+        if self.catalog:
+            try:
+                add_saved_episode(path)
+            except (OSError, ValueError, sqlite3.Error):
+                # the episode is on disk, it is cataloged by the next `python -m util.dataset_catalog scan`
+                logging.exception("adding %s to the dataset catalog failed", path)
+
         end_time = time.time()
 
         print('ALL save done in %s ' % (end_time-start_time))
@@ -863,4 +756,5 @@ class Data_Collection():
         self.actor_attri_dict = {}
         self.frame_list = []
         self.static_dict = {}
-        self.topology_list = []
\ No newline at end of file
+        self.topology_list = []
+        self.actor_state_collector = None
\ No newline at end of file
@@ -0,0 +1,436 @@
+"""
+    SQLite catalog of the recorded episodes of a dataset (data_collection/<type>/<basic>/variant_scenario/<variant>).
+
+    Data_Collection.save_data adds every saved episode to <root>/catalog.sqlite, so that the tools listing,
+    filtering or splitting the episodes query the catalog instead of walking the tree and reading per-episode
+    files. An existing dataset is cataloged once with:
+
+        python -m util.dataset_catalog --root ./data_collection scan
+
+    and queried with e.g.:
+
+        python -m util.dataset_catalog --root ./data_collection list --scenario_type collision --town Town05
+
+    Tables:
+        episodes: one row per episode, path relative to the root, town, weather, random actors, seed, ego and
+            interactor ids, collision frame, frame range of actors_data
+        modalities: one row per modality of an episode, where its frames are stored (a per-frame file pattern or
+            a per-episode container) and the number and range of its frames
+        meta: "scanned", time of the last full scan of the tree; the catalog is scanned on open until it has one
+
+    Opening a scanned catalog forgets the episodes whose folder was removed since (see DatasetCatalog.prune), the
+    episodes copied into the tree by hand are only cataloged by the next scan.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+import zipfile
+
+CATALOG_NAME = "catalog.sqlite"
+SCENARIO_TYPES = ("interactive", "non-interactive", "obstacle", "collision")
+FRAME_FILE = re.compile(r"^(\d{8})\.(\w+)$")
+FRAME_MEMBER = re.compile(r"^(\d{8})$")
+CONTAINERS = (".zip", ".npz")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS episodes (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    scenario_type TEXT NOT NULL,
+    basic_scenario TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    town TEXT,
+    weather TEXT,
+    random_actors TEXT,
+    random_seed INTEGER,
+    ego_id INTEGER,
+    interactor_id INTEGER,
+    collision_frame INTEGER,
+    first_frame INTEGER,
+    last_frame INTEGER,
+    num_frames INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS episodes_scenario ON episodes (scenario_type, basic_scenario);
+CREATE INDEX IF NOT EXISTS episodes_town ON episodes (town, weather);
+CREATE TABLE IF NOT EXISTS modalities (
+    episode_id INTEGER NOT NULL REFERENCES episodes (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    location TEXT NOT NULL,
+    container INTEGER NOT NULL,
+    num_frames INTEGER NOT NULL,
+    first_frame INTEGER,
+    last_frame INTEGER,
+    PRIMARY KEY (episode_id, name)
+);
+CREATE INDEX IF NOT EXISTS modalities_name ON modalities (name);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def get_town(basic_scenario):
+    """Town of a basic scenario from its prefix: A*/B* maps, 10 for Town10HD, a digit d for Town0d"""
+    town_id = basic_scenario.split("_")[0]
+    if town_id[:1] in ("A", "B"):
+        return town_id
+    if town_id[:2] == "10":
+        return "Town10HD"
+    if town_id[:1].isdigit():
+        return "Town0%s" % town_id[0]
+    return None
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _frame_modalities(path, relative=""):
+    """
+        Directories of per-frame files and per-episode containers under path, two levels deep.
+    """
+    modalities = []
+    frames, extension = [], None
+    with os.scandir(os.path.join(path, relative)) as entries:
+        for entry in entries:
+            name = os.path.join(relative, entry.name)
+            if entry.is_dir():
+                if relative.count(os.sep) < 1:
+                    modalities += _frame_modalities(path, name)
+            elif entry.name.endswith(CONTAINERS):
+                try:
+                    with zipfile.ZipFile(entry.path) as archive:
+                        members = archive.namelist()
+                except (OSError, zipfile.BadZipFile):
+                    continue
+                container_frames = sorted(int(member) for member in members if FRAME_MEMBER.match(member))
+                modalities.append((name, name, True, container_frames))
+            else:
+                match = FRAME_FILE.match(entry.name)
+                if match:
+                    frames.append(int(match.group(1)))
+                    extension = match.group(2)
+    if frames:
+        modalities.append((relative, os.path.join(relative, "%08d." + extension), False, sorted(frames)))
+    return modalities
+
+
+def describe_episode(path, root):
+    """
+        Catalog record of the episode saved at path, read from its files.
+
+        Returns:
+            dict of the columns of episodes, and "modalities", a list of (name, location, container, frames)
+    """
+    relative = os.path.relpath(path, root)
+    parts = os.path.normpath(relative).split(os.sep)
+    if len(parts) != 4 or parts[2] != "variant_scenario":
+        raise ValueError("%s is not <type>/<basic>/variant_scenario/<variant> under %s" % (path, root))
+    scenario_type, basic_scenario, _, variant = parts
+    variant_parts = variant.split("_")
+
+    attribute = _read_json(os.path.join(path, "actor_attribute.json")) or {}
+    collision = _read_json(os.path.join(path, "collision_frame.json")) or {}
+    random_seed = None
+    try:
+        with open(os.path.join(path, "seed.txt")) as f:
+            random_seed = int(f.readline())
+    except (OSError, ValueError):
+        pass
+
+    # modalities are named after their folder (rgb/front) or their container (lidar.zip)
+    modalities = [(name.replace(os.sep, "/"), location.replace(os.sep, "/"), container, frames)
+                  for name, location, container, frames in _frame_modalities(path)]
+    actors_frames = next((frames for name, _, _, frames in modalities if name == "actors_data"), [])
+    return {
+        "path": "/".join(parts),
+        "scenario_type": scenario_type,
+        "basic_scenario": basic_scenario,
+        "variant": variant,
+        "town": get_town(basic_scenario),
+        "weather": variant_parts[0],
+        "random_actors": variant_parts[1] if len(variant_parts) > 1 else None,
+        "random_seed": random_seed,
+        "ego_id": attribute.get("ego_id"),
+        "interactor_id": attribute.get("interactor_id"),
+        "collision_frame": collision.get("frame"),
+        "first_frame": actors_frames[0] if actors_frames else None,
+        "last_frame": actors_frames[-1] if actors_frames else None,
+        "num_frames": len(actors_frames),
+        "modalities": modalities,
+    }
+
+
+def split_of(path, val_fraction, seed=0):
+    """
+        Deterministic split of an episode, from the hash of its path: "train" or "val".
+    """
+    digest = hashlib.sha1(("%d:%s" % (seed, path)).encode()).digest()
+    return "val" if int.from_bytes(digest[:8], "big") / 2.0 ** 64 < val_fraction else "train"
+
+
+class Episode(dict):
+    """
+        Row of the episodes table, with the modalities of the episode.
+    """
+
+    def __init__(self, root, row, modalities):
+        super().__init__(row)
+        self.root = root
+        self.modalities = modalities
+
+    @property
+    def abspath(self):
+        return os.path.join(self.root, self["path"])
+
+    @property
+    def collision(self):
+        return self["collision_frame"] is not None
+
+    def frame_path(self, modality, frame):
+        """
+            Path of the file of a frame, or (container path, member name) for the modalities stored in containers.
+        """
+        location, container = self.modalities[modality][:2]
+        if container:
+            return os.path.join(self.abspath, location), "%08d" % frame
+        return os.path.join(self.abspath, location % frame)
+
+    def num_frames(self, modality):
+        return self.modalities[modality][2]
+
+    def frame_range(self, modality):
+        """First and last frames of a modality, with gaps when num_frames is below last - first + 1"""
+        return self.modalities[modality][3:5]
+
+
+class DatasetCatalog():
+    """
+        Catalog of the episodes recorded under root, stored in <root>/catalog.sqlite.
+    """
+
+    def __init__(self, root, path=None, timeout=60.0):
+        self.root = root
+        self.path = path or os.path.join(root, CATALOG_NAME)
+        # several collection processes may save episodes at the same time, sqlite serializes their writes
+        self.conn = sqlite3.connect(self.path, timeout=timeout)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(SCHEMA)
+
+    @classmethod
+    def open(cls, root, scan=True):
+        """
+            Catalog of root, scanning the tree once if it has never been scanned in full, pruning the episodes
+            removed from the tree otherwise.
+        """
+        catalog = cls(root)
+        if scan:
+            if catalog.scanned:
+                catalog.prune()
+            else:
+                catalog.scan()
+        return catalog
+
+    @property
+    def scanned(self):
+        """True once scan() has cataloged the whole tree, the episodes saved before are then in the catalog"""
+        return self.conn.execute("SELECT 1 FROM meta WHERE key = 'scanned'").fetchone() is not None
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM episodes").fetchone()[0]
+
+    def add(self, record):
+        """
+            Adds or replaces the episode of a record given by describe_episode.
+        """
+        record = dict(record)
+        modalities = record.pop("modalities")
+        record["updated"] = time.time()
+        columns = ", ".join(record)
+        with self.conn:
+            self.conn.execute("DELETE FROM episodes WHERE path = ?", (record["path"],))
+            cursor = self.conn.execute("INSERT INTO episodes (%s) VALUES (%s)" % (columns, ", ".join("?" * len(record))),
+                                       tuple(record.values()))
+            self.conn.executemany(
+                "INSERT INTO modalities VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(cursor.lastrowid, name, location, int(container), len(frames),
+                  frames[0] if frames else None, frames[-1] if frames else None)
+                 for name, location, container, frames in modalities])
+        return cursor.lastrowid
+
+    def add_episode(self, path):
+        return self.add(describe_episode(path, self.root))
+
+    def remove(self, path):
+        with self.conn:
+            self.conn.execute("DELETE FROM episodes WHERE path = ?", (os.path.relpath(path, self.root)
+                                                                      if os.path.isabs(path) else path,))
+
+    def prune(self):
+        """
+            Forgets the episodes whose folder is not in the tree anymore, one stat per episode.
+
+            Returns:
+                paths of the forgotten episodes
+        """
+        stale = [row[0] for row in self.conn.execute("SELECT path FROM episodes")
+                 if not os.path.isdir(os.path.join(self.root, row[0]))]
+        if stale:
+            with self.conn:
+                self.conn.executemany("DELETE FROM episodes WHERE path = ?", [(path,) for path in stale])
+        return stale
+
+    def scan(self, scenario_types=SCENARIO_TYPES, verbose=False):
+        """
+            Catalogs every episode of the tree, and forgets the episodes which are not in the tree anymore.
+        """
+        seen = set()
+        for scenario_type in scenario_types:
+            type_path = os.path.join(self.root, scenario_type)
+            if not os.path.isdir(type_path):
+                continue
+            for basic_scenario in sorted(os.listdir(type_path)):
+                variant_root = os.path.join(type_path, basic_scenario, "variant_scenario")
+                if not os.path.isdir(variant_root):
+                    continue
+                for variant in sorted(os.listdir(variant_root)):
+                    path = os.path.join(variant_root, variant)
+                    if os.path.isdir(path):
+                        record = describe_episode(path, self.root)
+                        self.add(record)
+                        seen.add(record["path"])
+                        if verbose:
+                            print(record["path"])
+        stale = [row[0] for row in self.conn.execute("SELECT path FROM episodes")
+                 if row[0] not in seen and row[0].split("/")[0] in scenario_types]
+        for path in stale:
+            self.remove(path)
+        if tuple(scenario_types) == SCENARIO_TYPES:
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('scanned', ?)", (str(time.time()),))
+        return len(seen)
+
+    def episodes(self, scenario_type=None, basic_scenario=None, variant=None, town=None, weather=None,
+                 random_actors=None, collision=None, has_seed=None, modalities=(), min_frames=None, split=None,
+                 val_fraction=0.2, seed=0):
+        """
+            Episodes matching all the given filters, ordered by path.
+
+            Args:
+                scenario_type, basic_scenario, variant, town, weather, random_actors: a value or a list of values
+                collision: True for the episodes with a collision frame, False for those without
+                has_seed: True for the episodes with a seed.txt, False for those without
+                modalities: names of the modalities the episodes must have, e.g. ["rgb/front", "actors_data"]
+                min_frames: smallest number of frames of actors_data
+                split: "train" or "val", from split_of(path, val_fraction, seed)
+            Returns:
+                list of Episode
+        """
+        conditions, values = [], []
+        for column, value in (("scenario_type", scenario_type), ("basic_scenario", basic_scenario),
+                              ("variant", variant), ("town", town), ("weather", weather),
+                              ("random_actors", random_actors)):
+            if value is None:
+                continue
+            value = [value] if isinstance(value, str) else list(value)
+            conditions.append("%s IN (%s)" % (column, ", ".join("?" * len(value))))
+            values += value
+        if collision is not None:
+            conditions.append("collision_frame IS %s NULL" % ("NOT" if collision else ""))
+        if has_seed is not None:
+            conditions.append("random_seed IS %s NULL" % ("NOT" if has_seed else ""))
+        if min_frames is not None:
+            conditions.append("num_frames >= ?")
+            values.append(min_frames)
+        for name in modalities:
+            conditions.append("EXISTS (SELECT 1 FROM modalities m WHERE m.episode_id = e.id AND m.name = ?)")
+            values.append(name)
+        query = "SELECT * FROM episodes e"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        rows = self.conn.execute(query + " ORDER BY path", values).fetchall()
+        if split is not None:
+            rows = [row for row in rows if split_of(row["path"], val_fraction, seed) == split]
+
+        modalities_of = {}
+        if rows:
+            ids = [row["id"] for row in rows]
+            # one query for the modalities of all the episodes, chunked below the sqlite variable limit
+            for start in range(0, len(ids), 900):
+                chunk = ids[start:start + 900]
+                for m in self.conn.execute("SELECT * FROM modalities WHERE episode_id IN (%s)"
+                                           % ", ".join("?" * len(chunk)), chunk):
+                    modalities_of.setdefault(m["episode_id"], {})[m["name"]] = (
+                        m["location"], bool(m["container"]), m["num_frames"], m["first_frame"], m["last_frame"])
+        return [Episode(self.root, row, modalities_of.get(row["id"], {})) for row in rows]
+
+    def paths(self, **filters):
+        """Absolute paths of the episodes matching the filters of episodes()"""
+        return [episode.abspath for episode in self.episodes(**filters)]
+
+
+def add_saved_episode(path):
+    """
+        Adds an episode saved by Data_Collection to the catalog of its dataset, the root being 4 levels above it.
+        The tree is not scanned here: a catalog which was never scanned in full is scanned by its next open().
+    """
+    root = os.path.normpath(os.path.join(path, os.pardir, os.pardir, os.pardir, os.pardir))
+    with DatasetCatalog(root) as catalog:
+        catalog.add_episode(path)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--root', default='./data_collection', help='root of the dataset')
+    subparsers = argparser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('scan', help='catalog every episode of the tree')
+    query = subparsers.add_parser('list', help='list the episodes matching the filters')
+    query.add_argument('--scenario_type', nargs='*')
+    query.add_argument('--basic_scenario', nargs='*')
+    query.add_argument('--town', nargs='*')
+    query.add_argument('--weather', nargs='*')
+    query.add_argument('--collision', choices=['yes', 'no'])
+    query.add_argument('--modality', nargs='*', default=[])
+    query.add_argument('--min_frames', type=int)
+    query.add_argument('--split', choices=['train', 'val'])
+    query.add_argument('--val_fraction', type=float, default=0.2)
+    args = argparser.parse_args()
+
+    if args.command == 'scan':
+        start = time.time()
+        with DatasetCatalog(args.root) as catalog:
+            count = catalog.scan(verbose=True)
+        print("%d episodes cataloged in %.1f s" % (count, time.time() - start))
+        return
+
+    with DatasetCatalog.open(args.root) as catalog:
+        collision = None if args.collision is None else args.collision == 'yes'
+        for episode in catalog.episodes(scenario_type=args.scenario_type, basic_scenario=args.basic_scenario,
+                                        town=args.town, weather=args.weather, collision=collision,
+                                        modalities=args.modality, min_frames=args.min_frames, split=args.split,
+                                        val_fraction=args.val_fraction):
+            print(episode["path"], episode["town"], episode["num_frames"])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+    Single-channel storage of the depth camera frames of an episode.
+
+    The depth camera packs the normalized depth in the R, G and B channels of its images
+    (depth = (R + G * 256 + B * 256 * 256) / (256 ** 3 - 1) * 1000 m). The packing is decoded once at
+    ingest, then every frame is stored as one deflated member of a per-episode zip container, either:
+        - losslessly, as the 24-bit depth code (precision=None), 1000 / (256 ** 3 - 1) m steps
+        - as a 16-bit multiple of `precision` meters, depths beyond 65535 * precision being saturated
+    Rows are delta coded before compression, the depth being smooth along the image rows.
+"""
+import numpy as np
+
+from util.frame_container import FrameReader, FrameWriter
+
+FORMAT_VERSION = 1
+FAR_PLANE = 1000.0
+CODE_MAX = 256 ** 3 - 1
+UINT16_MAX = np.iinfo(np.uint16).max
+
+
+def depth_code(bgra):
+    """
+        Args:
+            bgra: (H, W, 4) uint8 image of the depth camera, as in carla.Image.raw_data
+        Returns:
+            (H, W) uint32 24-bit depth code
+    """
+    bgra = np.asarray(bgra, dtype=np.uint8)
+    return bgra[..., 2].astype(np.uint32) | (bgra[..., 1].astype(np.uint32) << 8) | (bgra[..., 0].astype(np.uint32) << 16)
+
+
+def code_to_meters(code):
+    return (code.astype(np.float64) * (FAR_PLANE / CODE_MAX)).astype(np.float32)
+
+
+class DepthEncoder():
+    """
+        Depth representation, shared by the writer and the reader.
+    """
+
+    def __init__(self, precision=None):
+        """
+            Args:
+                precision: step of the 16-bit depth in meters, None to keep the 24-bit depth code
+        """
+        self.precision = precision
+
+    @property
+    def lossless(self):
+        return self.precision is None
+
+    @property
+    def tolerance(self):
+        """Maximum error on depths below max_depth, in meters, float32 rounding included"""
+        step = FAR_PLANE / CODE_MAX if self.lossless else self.precision
+        return step / 2.0 + self.max_depth * np.finfo(np.float32).eps
+
+    @property
+    def max_depth(self):
+        return FAR_PLANE if self.lossless else UINT16_MAX * self.precision
+
+    def to_dict(self):
+        return {"version": FORMAT_VERSION, "precision": self.precision}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["precision"])
+
+    def encode(self, bgra):
+        """
+            Returns:
+                bytes of the frame: height and width, then the delta coded rows
+        """
+        code = depth_code(bgra)
+        height, width = code.shape
+        if self.lossless:
+            values = code.astype(np.int32)
+        else:
+            meters = code.astype(np.float64) * (FAR_PLANE / CODE_MAX)
+            values = np.minimum(np.round(meters / self.precision), UINT16_MAX).astype(np.uint16)
+        values = np.diff(values, axis=1, prepend=np.zeros((height, 1), dtype=values.dtype))
+        if self.lossless:
+            # the differences of the 24-bit codes fit in 25 bits, the bytes are stored plane by plane
+            planes = values.view(np.uint8).reshape(height, width, 4)
+            data = np.ascontiguousarray(planes.transpose(2, 0, 1)).tobytes()
+        else:
+            data = values.tobytes()
+        return np.array([height, width], dtype=np.uint32).tobytes() + data
+
+    def decode(self, data):
+        """
+            Returns:
+                (H, W) float32 depth in meters
+        """
+        height, width = np.frombuffer(data, dtype=np.uint32, count=2)
+        if self.lossless:
+            planes = np.frombuffer(data, dtype=np.uint8, offset=8).reshape(4, height, width)
+            values = np.ascontiguousarray(planes.transpose(1, 2, 0)).view(np.int32)[..., 0]
+            return code_to_meters(np.cumsum(values, axis=1, dtype=np.int32))
+        values = np.frombuffer(data, dtype=np.uint16, offset=8).reshape(height, width)
+        # uint16 wrap-around of the differences is undone by the same wrap-around
+        return (np.cumsum(values, axis=1, dtype=np.uint16) * np.float64(self.precision)).astype(np.float32)
+
+
+class DepthWriter(FrameWriter):
+    """
+        Per-episode container of the encoded frames, one zip member per frame.
+    """
+    encoder_class = DepthEncoder
+
+
+class DepthReader(FrameReader):
+    """
+        Random access to the frames of a container written by DepthWriter, in meters.
+    """
+    encoder_class = DepthEncoder
+
+    @property
+    def tolerance(self):
+        return self.encoder.tolerance
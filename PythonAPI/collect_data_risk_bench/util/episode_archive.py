@@ -0,0 +1,344 @@
+"""
+    Sharded archives of recorded episodes, read in place without extraction.
+
+    Episodes (<type>/<basic>/variant_scenario/<variant> under the dataset root) are packed whole into tar shards of
+    about shard_size bytes, one shard per worker process at a time. Every file is a tar member of its own,
+    compressed on its own (zstd when the zstandard package is installed, zlib otherwise, stored as is for the
+    already compressed jpg/png/zip/npz files), so that:
+        - a shard can be streamed sequentially (tarfile 'r|'), e.g. from a pipe or an object store
+        - with the index written next to the shard (<shard>.index.json), any member is read with one seek
+    The codec, raw size and BLAKE2b checksum of every member are kept in its PAX header and in the index, and
+    are verified on read.
+
+    Run from PythonAPI/collect_data_risk_bench:
+
+        python -m util.episode_archive pack --root ./data_collection --out ./archives --shard_size 1G
+        python -m util.episode_archive verify ./archives/*.tar
+
+    PythonAPI/examples/zip_data.sh packs the variants of one basic scenario this way.
+"""
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import tarfile
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from util.dataset_catalog import DatasetCatalog
+
+FORMAT_VERSION = 1
+STORED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".zip", ".npz", ".mp4", ".gz")
+INDEX_SUFFIX = ".index.json"
+PAX_CODEC = "RB.codec"
+PAX_SIZE = "RB.size"
+PAX_CHECKSUM = "RB.blake2b"
+
+
+class ChecksumError(IOError):
+    pass
+
+
+def checksum(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def default_codec():
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def compress(data, codec, level):
+    if codec == "none":
+        return data
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    raise ValueError("unknown codec %s" % codec)
+
+
+def decompress(data, codec):
+    if codec == "none":
+        return data
+    if codec == "zstd":
+        if zstandard is None:
+            raise ImportError("the zstandard package is needed to read zstd members")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    raise ValueError("unknown codec %s" % codec)
+
+
+def parse_size(size):
+    """'512M', '1G' or a number of bytes"""
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    size = str(size).strip().upper()
+    if size[-1:] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def _episode_files(root, episode):
+    files = []
+    for directory, _, names in os.walk(os.path.join(root, episode)):
+        for name in names:
+            path = os.path.join(directory, name)
+            files.append(os.path.relpath(path, root).replace(os.sep, "/"))
+    return sorted(files)
+
+
+def plan_shards(root, episodes, shard_size):
+    """
+        Episodes packed in order into shards of about shard_size bytes of raw files, an episode is never split.
+    """
+    shards, current, size = [], [], 0
+    for episode in episodes:
+        episode_size = sum(os.path.getsize(os.path.join(root, f)) for f in _episode_files(root, episode))
+        if current and size + episode_size > shard_size:
+            shards.append(current)
+            current, size = [], 0
+        current.append(episode)
+        size += episode_size
+    if current:
+        shards.append(current)
+    return shards
+
+
+def write_shard(root, episodes, path, codec=None, level=3):
+    """
+        Writes the episodes in the tar shard at path and its index next to it.
+
+        Returns:
+            the index of the shard
+    """
+    codec = codec or default_codec()
+    members = {}
+    with tarfile.open(path, "w", format=tarfile.PAX_FORMAT) as tar:
+        for episode in episodes:
+            for name in _episode_files(root, episode):
+                with open(os.path.join(root, name), "rb") as f:
+                    raw = f.read()
+                member_codec = "none" if name.lower().endswith(STORED_EXTENSIONS) else codec
+                data = compress(raw, member_codec, level)
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(os.path.getmtime(os.path.join(root, name)))
+                info.pax_headers = {PAX_CODEC: member_codec, PAX_SIZE: str(len(raw)), PAX_CHECKSUM: checksum(raw)}
+                tar.addfile(info, io.BytesIO(data))
+                members[name] = {"codec": member_codec, "size": len(raw), "stored": len(data),
+                                 "checksum": info.pax_headers[PAX_CHECKSUM]}
+
+    # the data offsets are only known once the headers are written, they are read back from the shard
+    with tarfile.open(path, "r") as tar:
+        for info in tar:
+            members[info.name]["offset"] = info.offset_data
+    index = {"version": FORMAT_VERSION, "shard": os.path.basename(path), "episodes": list(episodes),
+             "members": members}
+    with open(path + INDEX_SUFFIX, "w") as f:
+        json.dump(index, f)
+    return index
+
+
+def _write_shard_job(job):
+    root, episodes, path, codec, level = job
+    start = time.time()
+    index = write_shard(root, episodes, path, codec, level)
+    return path, len(index["episodes"]), os.path.getsize(path), time.time() - start
+
+
+def pack(root, out_dir, shard_size=1 << 30, scenario_types=None, codec=None, level=3, workers=None,
+         basic_scenarios=None):
+    """
+        Packs the cataloged episodes of root into out_dir/shard_%05d.tar, the shards being written in parallel.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    with DatasetCatalog.open(root) as catalog:
+        episodes = [episode["path"] for episode in catalog.episodes(scenario_type=scenario_types,
+                                                                     basic_scenario=basic_scenarios)]
+    shards = plan_shards(root, episodes, shard_size)
+    jobs = [(root, shard, os.path.join(out_dir, "shard_%05d.tar" % i), codec, level) for i, shard in enumerate(shards)]
+    workers = min(workers or os.cpu_count(), len(jobs)) or 1
+    with multiprocessing.Pool(workers) as pool:
+        for path, count, size, duration in pool.imap_unordered(_write_shard_job, jobs):
+            print("%s: %d episodes, %.1f MB, %.1f s" % (path, count, size / 1e6, duration))
+    return [job[2] for job in jobs]
+
+
+class ShardReader():
+    """
+        Random access to the members of a shard, through its index.
+    """
+
+    def __init__(self, path, verify=True):
+        self.path = path
+        self.verify = verify
+        if os.path.isfile(path + INDEX_SUFFIX):
+            with open(path + INDEX_SUFFIX) as f:
+                self.index = json.load(f)
+        else:
+            self.index = self._scan_index()
+        self.members = self.index["members"]
+        self.episodes = self.index["episodes"]
+        self.file = open(path, "rb")
+
+    def _scan_index(self):
+        members, episodes = {}, []
+        with tarfile.open(self.path, "r") as tar:
+            for info in tar:
+                members[info.name] = {"codec": info.pax_headers.get(PAX_CODEC, "none"),
+                                      "size": int(info.pax_headers.get(PAX_SIZE, info.size)),
+                                      "stored": info.size, "checksum": info.pax_headers.get(PAX_CHECKSUM),
+                                      "offset": info.offset_data}
+                episode = "/".join(info.name.split("/")[:4])
+                if not episodes or episodes[-1] != episode:
+                    episodes.append(episode)
+        return {"version": FORMAT_VERSION, "shard": os.path.basename(self.path), "episodes": episodes,
+                "members": members}
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def read(self, name):
+        """Raw bytes of a member, its checksum verified"""
+        entry = self.members[name]
+        # pread does not move the shared offset of the file, a reader can be used by several threads or forks
+        data = decompress(os.pread(self.file.fileno(), entry["stored"], entry["offset"]), entry["codec"])
+        if self.verify and entry.get("checksum") and checksum(data) != entry["checksum"]:
+            raise ChecksumError("%s: checksum mismatch of %s" % (self.path, name))
+        return data
+
+    def read_json(self, name):
+        return json.loads(self.read(name))
+
+    def listdir(self, directory):
+        """Names of the members right under directory"""
+        prefix = directory.rstrip("/") + "/"
+        return sorted({name[len(prefix):].split("/")[0] for name in self.members if name.startswith(prefix)})
+
+    def episode(self, episode):
+        return ArchivedEpisode(self, episode)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArchivedEpisode():
+    """
+        Files of one episode of a shard, named relative to the episode directory.
+    """
+
+    def __init__(self, reader, path):
+        self.reader = reader
+        self.path = path
+
+    def read(self, name):
+        return self.reader.read(self.path + "/" + name)
+
+    def read_json(self, name):
+        return self.reader.read_json(self.path + "/" + name)
+
+    def exists(self, name):
+        return (self.path + "/" + name) in self.reader
+
+    def listdir(self, directory=""):
+        return self.reader.listdir(self.path + "/" + directory if directory else self.path)
+
+
+def stream_shard(fileobj, verify=True):
+    """
+        Members of a shard read sequentially from a file object, which needs not be seekable.
+
+        Yields:
+            (name, bytes) of every member, its checksum verified
+    """
+    with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+        for info in tar:
+            if not info.isfile():
+                continue
+            data = decompress(tar.extractfile(info).read(), info.pax_headers.get(PAX_CODEC, "none"))
+            expected = info.pax_headers.get(PAX_CHECKSUM)
+            if verify and expected and checksum(data) != expected:
+                raise ChecksumError("checksum mismatch of %s" % info.name)
+            yield info.name, data
+
+
+def stream_episodes(shards, verify=True):
+    """
+        Episodes of the shards, in order, each one as (episode path, {name relative to the episode: bytes}).
+        Only one episode is held in memory at a time.
+    """
+    for shard in shards:
+        current, files = None, {}
+        with open(shard, "rb") as f:
+            for name, data in stream_shard(f, verify):
+                parts = name.split("/")
+                episode = "/".join(parts[:4])
+                if episode != current:
+                    if current is not None:
+                        yield current, files
+                    current, files = episode, {}
+                files["/".join(parts[4:])] = data
+        if current is not None:
+            yield current, files
+
+
+def worker_shards(shards):
+    """
+        Shards of the current DataLoader worker, every worker streaming its own subset of the shards.
+    """
+    try:
+        from torch.utils.data import get_worker_info
+    except ImportError:
+        return list(shards)
+    info = get_worker_info()
+    if info is None:
+        return list(shards)
+    return list(shards)[info.id::info.num_workers]
+
+
+def verify_shard(path):
+    with ShardReader(path) as reader:
+        for name in reader.members:
+            reader.read(name)
+        return len(reader.members)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = argparser.add_subparsers(dest='command', required=True)
+    pack_parser = subparsers.add_parser('pack', help='pack the episodes of a dataset into shards')
+    pack_parser.add_argument('--root', default='./data_collection', help='root of the dataset')
+    pack_parser.add_argument('--out', default='./archives', help='directory of the shards')
+    pack_parser.add_argument('--shard_size', default='1G', help='raw size of the episodes of a shard, e.g. 512M')
+    pack_parser.add_argument('--scenario_type', nargs='*', default=None)
+    pack_parser.add_argument('--basic_scenario', nargs='*', default=None)
+    pack_parser.add_argument('--codec', default=None, choices=['zstd', 'zlib', 'none'])
+    pack_parser.add_argument('--level', default=3, type=int)
+    pack_parser.add_argument('--workers', default=None, type=int, help='processes, all the cores by default')
+    verify_parser = subparsers.add_parser('verify', help='check the checksums of every member of the shards')
+    verify_parser.add_argument('shards', nargs='+')
+    args = argparser.parse_args()
+
+    if args.command == 'pack':
+        pack(args.root, args.out, parse_size(args.shard_size), args.scenario_type, args.codec, args.level, args.workers,
+             args.basic_scenario)
+    else:
+        for shard in args.shards:
+            print("%s: %d members verified" % (shard, verify_shard(shard)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+    Pre-decoded frame cache of the recorded episodes, for the training of the vision risk models (DSA/RRL, two-stage).
+
+    The front RGB frames of every episode are decoded and resized once, then written with the object boxes and
+    track ids of bbox.json into shards of memory-mappable arrays:
+
+        <cache>/index.json            settings of the cache and the episodes, with their shard and frame rows
+        <cache>/shard_%04d/images.npy (N, H, W, 3) uint8 RGB frames
+        <cache>/shard_%04d/boxes.npy  (N, max_objects, 4) float32 x1, y1, x2, y2 boxes, in the resized frames
+        <cache>/shard_%04d/ids.npy    (N, max_objects) int64 track ids, -1 for the empty slots
+
+    The boxes of a frame keep the order of bbox.json, the datasets filter and truncate them as they did on the JPEGs.
+    Built once from PythonAPI/collect_data_risk_bench with:
+
+        python -m util.frame_cache --root ./data_collection --cache ./frame_cache --scenario_type collision interactive
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from util.dataset_catalog import DatasetCatalog
+
+FORMAT_VERSION = 1
+INDEX_NAME = "index.json"
+ARRAYS = ("images", "boxes", "ids")
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+class _ShardWriter():
+    """
+        Arrays of one shard, written through np.lib.format.open_memmap as the frames come.
+    """
+
+    def __init__(self, path, frames, height, width, max_objects):
+        os.makedirs(path, exist_ok=True)
+        open_memmap = np.lib.format.open_memmap
+        self.images = open_memmap(os.path.join(path, "images.npy"), "w+", np.uint8, (frames, height, width, 3))
+        self.boxes = open_memmap(os.path.join(path, "boxes.npy"), "w+", np.float32, (frames, max_objects, 4))
+        self.ids = open_memmap(os.path.join(path, "ids.npy"), "w+", np.int64, (frames, max_objects))
+        self.ids[:] = -1
+
+    def close(self):
+        for array in (self.images, self.boxes, self.ids):
+            array.flush()
+
+
+def _episode_frames(episode):
+    """
+        Paths of the front frames of an episode and their bbox.json entries, aligned as in RiskBench_dataset.
+    """
+    first, last = episode.frame_range("rgb/front")
+    paths = [episode.frame_path("rgb/front", frame) for frame in range(first, last + 1)]
+    paths = [path for path in paths if os.path.isfile(path)]
+    bbox_path = os.path.join(episode.abspath, "bbox.json")
+    bboxes = list(read_json(bbox_path).values()) if os.path.isfile(bbox_path) else []
+    return paths, bboxes
+
+
+def build_cache(root, cache_dir, scenario_types=None, size=(640, 256), max_objects=64, shard_frames=2048,
+                verbose=True):
+    """
+        Decodes the front frames of the cataloged episodes into the shards of cache_dir.
+
+        Args:
+            size: (width, height) of the cached frames
+            max_objects: largest number of boxes kept per frame
+            shard_frames: largest number of frames per shard, an episode is never split between shards
+    """
+    from PIL import Image
+
+    width, height = size
+    with DatasetCatalog.open(root) as catalog:
+        episodes = [episode for episode in catalog.episodes(scenario_type=scenario_types, modalities=["rgb/front"])]
+
+    index = {"version": FORMAT_VERSION, "size": [width, height], "max_objects": max_objects, "shards": [],
+             "episodes": []}
+    plans = [(episode, *_episode_frames(episode)) for episode in episodes]
+
+    # episodes are packed in order into shards of at most shard_frames frames
+    shards, current, count = [], [], 0
+    for plan in plans:
+        if current and count + len(plan[1]) > shard_frames:
+            shards.append((current, count))
+            current, count = [], 0
+        current.append(plan)
+        count += len(plan[1])
+    if current:
+        shards.append((current, count))
+
+    start_time = time.time()
+    for shard_index, (shard_plans, frames) in enumerate(shards):
+        name = "shard_%04d" % shard_index
+        writer = _ShardWriter(os.path.join(cache_dir, name), frames, height, width, max_objects)
+        row = 0
+        for episode, paths, bboxes in shard_plans:
+            start = row
+            for i, path in enumerate(paths):
+                with Image.open(path) as image:
+                    image = image.convert("RGB")
+                    scale = np.array([width / image.width, height / image.height] * 2, dtype=np.float32)
+                    if image.size != (width, height):
+                        image = image.resize((width, height), Image.BILINEAR)
+                    writer.images[row] = np.asarray(image)
+                objects = list(bboxes[i].items())[:max_objects] if i < len(bboxes) else []
+                for slot, (obj_id, box) in enumerate(objects):
+                    writer.boxes[row, slot] = np.asarray(box, dtype=np.float32) * scale
+                    writer.ids[row, slot] = int(obj_id)
+                row += 1
+            index["episodes"].append({"scenario_type": episode["scenario_type"],
+                                      "basic_scenario": episode["basic_scenario"],
+                                      "variant": episode["variant"],
+                                      "interactor_id": episode["interactor_id"],
+                                      "collision_frame": episode["collision_frame"],
+                                      "shard": shard_index, "start": start, "length": row - start})
+        writer.close()
+        index["shards"].append({"name": name, "frames": frames})
+        if verbose:
+            print("%s: %d episodes, %d frames, %.1f s" % (name, len(shard_plans), frames, time.time() - start_time))
+
+    with open(os.path.join(cache_dir, INDEX_NAME), "w") as f:
+        json.dump(index, f, indent=4)
+    return index
+
+
+class FrameCache():
+    """
+        Read side of a cache built by build_cache, the shards are memory mapped.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index = read_json(os.path.join(cache_dir, INDEX_NAME))
+        self.width, self.height = self.index["size"]
+        self.max_objects = self.index["max_objects"]
+        self.episodes = self.index["episodes"]
+        self._shards = {}
+
+    def shard(self, shard):
+        """images, boxes and ids arrays of a shard, mapped on first use (after the fork of the loader workers)"""
+        if shard not in self._shards:
+            path = os.path.join(self.cache_dir, self.index["shards"][shard]["name"])
+            self._shards[shard] = tuple(np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in ARRAYS)
+        return self._shards[shard]
+
+    def __getstate__(self):
+        # the maps are not sent to the loader workers, each one maps the shards itself
+        state = dict(self.__dict__)
+        state["_shards"] = {}
+        return state
+
+    def select(self, scenario_type=None, basic_scenario=None, variant=None):
+        """Indices of the episodes matching the filters"""
+        return [i for i, episode in enumerate(self.episodes)
+                if (scenario_type is None or episode["scenario_type"] == scenario_type)
+                and (basic_scenario is None or episode["basic_scenario"] == basic_scenario)
+                and (variant is None or episode["variant"] == variant)]
+
+    def frames(self, episode, start=0, end=None):
+        """
+            Args:
+                episode: index of the episode
+                start, end: frame range, relative to the first frame of the episode
+            Returns:
+                views of the (T, H, W, 3) images, (T, max_objects, 4) boxes and (T, max_objects) ids
+        """
+        entry = self.episodes[episode]
+        end = entry["length"] if end is None else min(end, entry["length"])
+        rows = slice(entry["start"] + start, entry["start"] + end)
+        return tuple(array[rows] for array in self.shard(entry["shard"]))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--root', default='./data_collection', help='root of the dataset')
+    argparser.add_argument('--cache', default='./frame_cache', help='directory of the cache')
+    argparser.add_argument('--scenario_type', nargs='*', default=None)
+    argparser.add_argument('--width', default=640, type=int)
+    argparser.add_argument('--height', default=256, type=int)
+    argparser.add_argument('--max_objects', default=64, type=int)
+    argparser.add_argument('--shard_frames', default=2048, type=int)
+    args = argparser.parse_args()
+
+    build_cache(args.root, args.cache, args.scenario_type, (args.width, args.height), args.max_objects,
+                args.shard_frames)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+    Per-episode zip container of encoded frames, shared by the LiDAR, depth and instance segmentation storages.
+
+    The container holds a meta.json member, the settings of the encoder (encoder.to_dict()), and one deflated
+    member per frame named after the frame number, so that any frame can be read back on its own. A storage
+    subclasses FrameWriter and FrameReader with its encoder class, the encoder supplies encode(data) -> bytes,
+    decode(bytes), to_dict() and from_dict(dict).
+"""
+import json
+import zipfile
+
+META = "meta.json"
+
+
+def member_name(frame):
+    return "%08d" % frame
+
+
+class FrameWriter():
+    """
+        Per-episode container of the encoded frames, one zip member per frame.
+    """
+    encoder_class = None
+
+    def __init__(self, path, encoder=None, compresslevel=6):
+        """
+            Args:
+                path: path of the zip container
+                encoder: instance of encoder_class, the default one if None
+                compresslevel: deflate level of the members
+        """
+        self.encoder = encoder or self.encoder_class()
+        self.zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+        self.zip.writestr(META, json.dumps(self.encoder.to_dict()))
+
+    def write(self, frame, data):
+        self.zip.writestr(member_name(frame), self.encoder.encode(data))
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameReader():
+    """
+        Random access to the frames of a container written by the FrameWriter of the same encoder_class.
+    """
+    encoder_class = None
+
+    def __init__(self, path):
+        self.zip = zipfile.ZipFile(path, "r")
+        self.encoder = self.encoder_class.from_dict(json.loads(self.zip.read(META)))
+        self.frames = sorted(int(name) for name in self.zip.namelist() if name != META)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, frame):
+        return member_name(frame) in self.zip.NameToInfo
+
+    def __getitem__(self, frame):
+        return self.encoder.decode(self.zip.read(member_name(frame)))
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,374 @@
+"""
+    Local inference service shared by several data_generator.py --inference workers.
+
+    Each model is loaded once by the server. The requests of all the workers are queued per model
+    and coalesced into dynamic batches: a batch is run as soon as it is full or when its oldest
+    request has waited max_latency seconds. Workers talk to the server over a Unix socket with
+    InferenceClient, arrays being sent as numpy.
+
+    Run from PythonAPI/collect_data_risk_bench, before starting the workers:
+
+        python -m util.inference_server --socket /tmp/risk_bench.sock --max_batch 16 --max_latency 0.005
+"""
+import argparse
+import collections
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from util import profiling
+
+AUTHKEY = b'risk_bench'
+
+
+def _lbc_loader(checkpoint):
+    def load(device):
+        import torch
+        from models.LBC.map_model import MapModel
+        net = MapModel.load_from_checkpoint(checkpoint)
+        net.to(device)
+        net.eval()
+
+        def forward(topdown, target_xy):
+            """
+                Args:
+                    topdown: (B, 256, 256) semantic classes, as given by BirdViewProducer.as_ss
+                    target_xy: (B, 2) target point in the birdview
+                Returns:
+                    (B, K + 1, 2) the K predicted points in [-1, 1], then steer and desired speed
+            """
+            topdown = torch.from_numpy(topdown).to(device).long()
+            topdown = torch.nn.functional.one_hot(topdown, 7).permute(0, 3, 1, 2).float()
+            points_pred = net.forward(topdown, torch.from_numpy(target_xy).to(device).float())
+            control = net.controller(points_pred)
+            return torch.cat([points_pred, control[:, None]], dim=1).cpu().numpy()
+        return forward
+    return load
+
+
+def _dsa_loader(model_path, supervised):
+    def load(device):
+        import torch
+        from models.dsa.DSA_RRL import Baseline_SA
+        from models.dsa.backbone import Riskbench_backbone
+        object_num = 20
+        backbone = Riskbench_backbone(8, object_num, intention=False)
+        model = Baseline_SA(backbone, 40, object_num, intention=False, supervised=supervised, state=False)
+        model.load_state_dict(torch.load(model_path, map_location=device))
+        model.to(device)
+        model.eval()
+
+        def forward(imgs, bbox):
+            """
+                Args:
+                    imgs: (B, T, 3, H, W) normalized front images
+                    bbox: (B, T, 20, 4) object boxes
+                Returns:
+                    (B, T, 20) attention of the objects
+            """
+            _, all_alphas, _ = model(torch.from_numpy(imgs).to(device), torch.from_numpy(bbox).to(device))
+            return all_alphas.cpu().numpy()
+        return forward
+    return load
+
+
+def _two_stage_loader(device):
+    import torch
+    from models.two_stage.inference import testing
+    from models.two_stage.models import GCN as Model
+    model = Model()
+    state_dict = torch.load("./models/weights/two_stage/weight.pth", map_location=device)
+    model.load_state_dict({key[7:]: value for key, value in state_dict.items()})
+    model = model.to(device)
+    model.train(False)
+
+    def forward(imgs, trackers, tracking_id):
+        """
+            Unbatched, the intervention loop of testing() runs per clip.
+            Args:
+                imgs: (5, 3, H, W) normalized front images
+                trackers: (5, 25, 4) object boxes
+                tracking_id: (N,) ids of the tracked objects
+        """
+        test_imgs = [img for img in torch.from_numpy(imgs)]
+        return testing(model, test_imgs, trackers, tracking_id, device=device)
+    return forward
+
+
+# name: (loader, batched). Batched models get every input with a leading batch dimension.
+MODELS = {
+    "LBC_interactive": (_lbc_loader("./models/weights/LBC/interactive.ckpt"), True),
+    "LBC_obstacle": (_lbc_loader("./models/weights/LBC/obstacle.ckpt"), True),
+    "DSA": (_dsa_loader("./models/weights/dsa/8_27_3_46/best_model.pt", False), True),
+    "RRL": (_dsa_loader("./models/weights/dsa/9_12_0_56/best_model.pt", True), True),
+    "two_stage": (_two_stage_loader, False),
+}
+
+
+class Request():
+    def __init__(self, connection, request_id, inputs):
+        self.connection = connection
+        self.request_id = request_id
+        self.inputs = inputs
+        self.arrival = time.perf_counter()
+
+
+class _Connection():
+    """
+        Server side of a worker connection, responses of several batcher threads are serialized here.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        with self.lock:
+            try:
+                self.conn.send(message)
+            except (OSError, EOFError):
+                pass
+
+
+class ModelWorker():
+    """
+        Queue and batcher thread of one model.
+    """
+
+    def __init__(self, name, forward, batched, max_batch, max_latency):
+        self.name = name
+        self.forward = forward
+        self.batched = batched
+        self.max_batch = max_batch if batched else 1
+        self.max_latency = max_latency
+        self.queue = queue.Queue()
+        self.span_name = "model." + name
+
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.latency = 0.0
+        self.max_queue_depth = 0
+        self.batch_sizes = collections.Counter()
+        self.queue_depths = collections.Counter()
+
+        self.thread = threading.Thread(target=self._run, name="batcher-" + name, daemon=True)
+        self.thread.start()
+
+    def put(self, request):
+        self.queue.put(request)
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = batch[0].arrival + self.max_latency
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                batch.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            depth = self.queue.qsize()
+            # requests of different shapes (e.g. clips of different lengths) go in separate forward passes
+            groups = collections.OrderedDict()
+            for request in batch:
+                key = tuple(np.shape(x) for x in request.inputs) if self.batched else id(request)
+                groups.setdefault(key, []).append(request)
+            for group in groups.values():
+                self._run_group(group)
+
+            now = time.perf_counter()
+            with self.lock:
+                self.requests += len(batch)
+                self.batches += 1
+                self.batch_sizes[len(batch)] += 1
+                self.queue_depths[depth] += 1
+                self.max_queue_depth = max(self.max_queue_depth, depth)
+                self.latency += sum(now - request.arrival for request in batch)
+
+    def _run_group(self, group):
+        import torch
+        try:
+            with torch.no_grad(), profiling.span(self.span_name):
+                if self.batched:
+                    inputs = [np.concatenate([request.inputs[i] for request in group])
+                              for i in range(len(group[0].inputs))]
+                    outputs = self.forward(*inputs)
+                    sizes = np.cumsum([len(request.inputs[0]) for request in group])[:-1]
+                    results = np.split(outputs, sizes)
+                else:
+                    results = [self.forward(*group[0].inputs)]
+        except Exception as error:
+            for request in group:
+                request.connection.send({"id": request.request_id, "error": repr(error)})
+            return
+        for request, result in zip(group, results):
+            request.connection.send({"id": request.request_id, "result": result})
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests,
+                    "batches": self.batches,
+                    "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+                    "mean_latency_ms": 1000.0 * self.latency / self.requests if self.requests else 0.0,
+                    "queue_depth": self.queue.qsize(),
+                    "max_queue_depth": self.max_queue_depth,
+                    "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                    "queue_depth_histogram": dict(sorted(self.queue_depths.items()))}
+
+
+class InferenceServer():
+    """
+        Unix socket server, models are loaded on their first request.
+    """
+
+    def __init__(self, address, max_batch=16, max_latency=0.005, device=None):
+        import torch
+        self.address = address
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.device = device or torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        self.workers = {}
+        self.workers_lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def worker(self, name):
+        with self.workers_lock:
+            if name not in self.workers:
+                loader, batched = MODELS[name]
+                print("loading %s" % name)
+                self.workers[name] = ModelWorker(name, loader(self.device), batched, self.max_batch, self.max_latency)
+            return self.workers[name]
+
+    def stats(self):
+        with self.workers_lock:
+            workers = list(self.workers.values())
+        return {worker.name: worker.stats() for worker in workers}
+
+    def _serve_connection(self, conn):
+        connection = _Connection(conn)
+        while True:
+            try:
+                message = conn.recv()
+            except (OSError, EOFError):
+                break
+            if message.get("op") == "stats":
+                connection.send({"id": message["id"], "result": self.stats()})
+                continue
+            try:
+                worker = self.worker(message["model"])
+            except Exception as error:
+                connection.send({"id": message["id"], "error": repr(error)})
+                continue
+            worker.put(Request(connection, message["id"], message["inputs"]))
+        conn.close()
+
+    def _report(self, interval):
+        while True:
+            time.sleep(interval)
+            for name, stats in self.stats().items():
+                print("%s: %d requests, mean batch %.2f, queue depth %d (max %d), batch sizes %s" % (
+                    name, stats["requests"], stats["mean_batch_size"], stats["queue_depth"],
+                    stats["max_queue_depth"], stats["batch_size_histogram"]))
+
+    def serve_forever(self, report_interval=30.0):
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        listener = Listener(self.address, family='AF_UNIX', authkey=AUTHKEY)
+        if report_interval:
+            threading.Thread(target=self._report, args=(report_interval,), daemon=True).start()
+        print("inference server listening on %s" % self.address)
+        try:
+            while True:
+                conn = listener.accept()
+                if self.stopped.is_set():
+                    conn.close()
+                    break
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+
+    def shutdown(self):
+        """
+            Stop serve_forever, the connection wakes up the blocked accept.
+        """
+        self.stopped.set()
+        Client(self.address, family='AF_UNIX', authkey=AUTHKEY).close()
+
+
+class InferenceClient():
+    """
+        Client stub used by Inference. A call blocks until the batch holding the request is done.
+    """
+
+    def __init__(self, address):
+        self.conn = Client(address, family='AF_UNIX', authkey=AUTHKEY)
+        self.lock = threading.Lock()
+        self.next_id = 0
+
+    def _call(self, message):
+        with self.lock:
+            message["id"] = self.next_id
+            self.next_id += 1
+            self.conn.send(message)
+            response = self.conn.recv()
+        if "error" in response:
+            raise RuntimeError("inference server: " + response["error"])
+        return response["result"]
+
+    def call(self, model, *inputs):
+        return self._call({"model": model, "inputs": [np.ascontiguousarray(x) for x in inputs]})
+
+    def stats(self):
+        return self._call({"op": "stats"})
+
+    def model(self, name):
+        return RemoteModel(self, name)
+
+    def close(self):
+        self.conn.close()
+
+
+class RemoteModel():
+    """
+        Callable proxy of a model of the server.
+    """
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __call__(self, *inputs):
+        return self.client.call(self.name, *inputs)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('--socket', default='/tmp/risk_bench.sock', help='path of the Unix socket')
+    argparser.add_argument('--max_batch', default=16, type=int, help='maximum number of requests per batch')
+    argparser.add_argument('--max_latency', default=0.005, type=float,
+                           help='maximum time a request waits for its batch to fill, in seconds')
+    argparser.add_argument('--preload', nargs='*', default=[], choices=sorted(MODELS), help='models to load at start')
+    argparser.add_argument('--report_interval', default=30.0, type=float, help='seconds between two stats reports')
+    argparser.add_argument('--profile', default=None, help='directory of the Chrome trace of the forward passes')
+    args = argparser.parse_args()
+
+    if args.profile:
+        profiling.enable(args.profile, "inference_server")
+
+    server = InferenceServer(args.socket, args.max_batch, args.max_latency)
+    for name in args.preload:
+        server.worker(name)
+    server.serve_forever(args.report_interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+    Compact storage of the instance segmentation frames of an episode.
+
+    CARLA packs the semantic tag in the R channel of the instance segmentation images and the object id
+    (actor id % 65536) in the G and B channels (id = G + B * 256). At ingest, every frame is reduced to a
+    palette of its (tag, id) pairs and the rows are run-length encoded on the palette indices. The pixel
+    count and the bounding box of every instance are computed at the same time and stored with the frame,
+    so that downstream tools read ids and boxes without decoding the masks.
+
+    Frames are written as deflated members of a per-episode zip container, any frame can be read on its own.
+"""
+import numpy as np
+
+from util.frame_container import FrameReader, FrameWriter
+
+FORMAT_VERSION = 1
+# CARLA semantic tags of the actors
+PEDESTRIAN, RIDER, CAR, TRUCK, BUS, TRAIN, MOTORCYCLE, BICYCLE, STATIC, DYNAMIC = range(12, 22)
+ACTOR_CLASSES = (PEDESTRIAN, RIDER, CAR, TRUCK, BUS, TRAIN, MOTORCYCLE, BICYCLE)
+OBSTACLE_CLASSES = (STATIC, DYNAMIC)
+
+
+def instance_planes(bgra):
+    """
+        Args:
+            bgra: (H, W, 4) uint8 instance segmentation image, as in carla.Image.raw_data
+        Returns:
+            (H, W) uint8 semantic tags and (H, W) uint16 object ids
+    """
+    bgra = np.asarray(bgra, dtype=np.uint8)
+    return bgra[..., 2].copy(), bgra[..., 1].astype(np.uint16) | (bgra[..., 0].astype(np.uint16) << 8)
+
+
+class InstanceFrame():
+    """
+        Decoded frame: palette of the (tag, id) pairs, with the pixel count and the box of each pair.
+    """
+
+    def __init__(self, height, width, palette, counts, boxes, run_index, run_length):
+        self.height = height
+        self.width = width
+        self.palette = palette
+        self.counts = counts
+        self.boxes = boxes
+        self.run_index = run_index
+        self.run_length = run_length
+
+    @property
+    def classes(self):
+        """Semantic tag of each palette entry"""
+        return (self.palette >> 16).astype(np.uint8)
+
+    @property
+    def ids(self):
+        """Object id of each palette entry"""
+        return (self.palette & 0xFFFF).astype(np.uint16)
+
+    def index_plane(self):
+        return np.repeat(self.run_index, self.run_length).reshape(self.height, self.width)
+
+    def planes(self):
+        """
+            Returns:
+                (H, W) uint8 semantic tags and (H, W) uint16 object ids
+        """
+        index = self.index_plane()
+        return self.classes[index], self.ids[index]
+
+    def mask(self, class_id, instance_id):
+        """(H, W) bool mask of one instance"""
+        hits = np.flatnonzero(self.palette == (int(class_id) << 16 | int(instance_id)))
+        if len(hits) == 0:
+            return np.zeros((self.height, self.width), dtype=bool)
+        return self.index_plane() == hits[0]
+
+    def objects(self, classes=None, min_area=0):
+        """
+            Args:
+                classes: semantic tags to keep, None for every tag
+                min_area: smallest pixel count of the kept instances
+            Returns:
+                ids (N,), classes (N,), pixel counts (N,) and boxes (N, 4) as x1, y1, x2, y2 (inclusive)
+        """
+        keep = self.counts >= min_area
+        if classes is not None:
+            keep &= np.isin(self.classes, list(classes))
+        return self.ids[keep], self.classes[keep], self.counts[keep], self.boxes[keep]
+
+
+class InstanceEncoder():
+    """
+        Palette and run-length codec of the instance segmentation frames.
+    """
+
+    def to_dict(self):
+        return {"version": FORMAT_VERSION}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls()
+
+    def analyse(self, bgra):
+        """
+            Returns:
+                InstanceFrame of the image
+        """
+        classes, ids = instance_planes(bgra)
+        height, width = classes.shape
+        keys = (classes.astype(np.uint32) << 16 | ids).ravel()
+
+        # a run starts at every change of value and at every row, each run then lies on a single row
+        starts = np.flatnonzero(np.diff(keys, prepend=keys[0] + 1))
+        starts = np.union1d(starts, np.arange(0, keys.size, width))
+        run_length = np.diff(np.append(starts, keys.size))
+        palette, run_index = np.unique(keys[starts], return_inverse=True)
+        run_index = run_index.ravel()
+
+        rows = starts // width
+        first = starts % width
+        last = first + run_length - 1
+        counts = np.bincount(run_index, weights=run_length, minlength=len(palette)).astype(np.uint32)
+        boxes = np.empty((len(palette), 4), dtype=np.int64)
+        boxes[:, :2] = np.iinfo(np.int64).max
+        boxes[:, 2:] = -1
+        np.minimum.at(boxes[:, 0], run_index, first)
+        np.minimum.at(boxes[:, 1], run_index, rows)
+        np.maximum.at(boxes[:, 2], run_index, last)
+        np.maximum.at(boxes[:, 3], run_index, rows)
+        index_type = np.uint8 if len(palette) <= 256 else np.uint16
+        return InstanceFrame(height, width, palette.astype(np.uint32), counts, boxes.astype(np.uint16),
+                             run_index.astype(index_type), run_length.astype(np.uint16))
+
+    def encode(self, bgra):
+        """
+            Returns:
+                bytes of the frame: header, palette, pixel counts, boxes, then the runs
+        """
+        frame = self.analyse(bgra)
+        header = np.array([frame.height, frame.width, len(frame.palette), len(frame.run_index)], dtype=np.uint32)
+        return b"".join([header.tobytes(), frame.palette.tobytes(), frame.counts.tobytes(), frame.boxes.tobytes(),
+                         frame.run_index.tobytes(), frame.run_length.tobytes()])
+
+    def decode(self, data):
+        height, width, entries, runs = (int(v) for v in np.frombuffer(data, dtype=np.uint32, count=4))
+        offset = 16
+        palette = np.frombuffer(data, dtype=np.uint32, count=entries, offset=offset)
+        offset += 4 * entries
+        counts = np.frombuffer(data, dtype=np.uint32, count=entries, offset=offset)
+        offset += 4 * entries
+        boxes = np.frombuffer(data, dtype=np.uint16, count=4 * entries, offset=offset).reshape(entries, 4)
+        offset += 8 * entries
+        index_type = np.uint8 if entries <= 256 else np.uint16
+        run_index = np.frombuffer(data, dtype=index_type, count=runs, offset=offset)
+        offset += run_index.nbytes
+        run_length = np.frombuffer(data, dtype=np.uint16, count=runs, offset=offset)
+        return InstanceFrame(height, width, palette, counts, boxes, run_index, run_length)
+
+
+class InstanceWriter(FrameWriter):
+    """
+        Per-episode container of the encoded frames, one zip member per frame.
+    """
+    encoder_class = InstanceEncoder
+
+
+class InstanceReader(FrameReader):
+    """
+        Random access to the frames of a container written by InstanceWriter.
+    """
+    encoder_class = InstanceEncoder
+
+    def __getitem__(self, frame):
+        """InstanceFrame of the frame, the masks are only expanded by its planes() or mask()"""
+        return super().__getitem__(frame)
+
+    def planes(self, frame):
+        return self[frame].planes()
+
+    def objects(self, frame, classes=None, min_area=0):
+        return self[frame].objects(classes, min_area)
@@ -0,0 +1,123 @@
+"""
+    Compact storage of the LiDAR sweeps of an episode.
+
+    At ingest, a sweep can be cropped to a region of interest and voxel downsampled. Coordinates are
+    then quantised to a fixed-point grid of `resolution` meters (int16) and the intensity to 8 bits,
+    each column is delta coded and the sweep is written as one deflated member of a per-episode zip
+    container, so that any frame can be read back on its own.
+
+    Decoded coordinates are within LidarEncoder.tolerance (resolution / 2, plus float32 rounding) of the
+    stored points, the voxel centroids when downsampling. Intensities are within 1 / 510.
+"""
+import numpy as np
+
+from util.frame_container import FrameReader, FrameWriter
+
+FORMAT_VERSION = 1
+INT16_MAX = np.iinfo(np.int16).max
+
+
+class LidarEncoder():
+    """
+        Ingest settings of the LiDAR sweeps, shared by the writer and the reader.
+    """
+
+    def __init__(self, roi=None, voxel_size=None, resolution=0.01):
+        """
+            Args:
+                roi: (x_min, x_max, y_min, y_max, z_min, z_max) in the sensor frame, None to keep every point
+                voxel_size: side of the downsampling voxels in meters, None to keep every point
+                resolution: step of the fixed-point grid of the coordinates, in meters
+        """
+        self.roi = None if roi is None else tuple(float(v) for v in roi)
+        self.voxel_size = voxel_size
+        self.resolution = resolution
+
+    @property
+    def tolerance(self):
+        """Maximum error on each coordinate, in meters, float32 rounding included"""
+        return self.resolution / 2.0 + self.extent * np.finfo(np.float32).eps
+
+    @property
+    def extent(self):
+        """Largest absolute coordinate representable on the grid"""
+        return INT16_MAX * self.resolution
+
+    def to_dict(self):
+        return {"version": FORMAT_VERSION, "roi": self.roi, "voxel_size": self.voxel_size,
+                "resolution": self.resolution}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["roi"], data["voxel_size"], data["resolution"])
+
+    def crop(self, points):
+        """Points of the region of interest, and within the range of the grid"""
+        xyz = points[:, :3]
+        keep = np.all(np.abs(xyz) < self.extent, axis=1)
+        if self.roi is not None:
+            x_min, x_max, y_min, y_max, z_min, z_max = self.roi
+            keep &= (xyz[:, 0] >= x_min) & (xyz[:, 0] <= x_max)
+            keep &= (xyz[:, 1] >= y_min) & (xyz[:, 1] <= y_max)
+            keep &= (xyz[:, 2] >= z_min) & (xyz[:, 2] <= z_max)
+        return points[keep]
+
+    def downsample(self, points):
+        """One point per voxel, the centroid of the points falling in it"""
+        if self.voxel_size is None or len(points) == 0:
+            return points
+        # the voxel indices are packed in one int64 key, much faster to sort than rows
+        offset = int(np.ceil(self.extent / self.voxel_size)) + 1
+        size = 2 * offset + 1
+        voxels = np.floor(points[:, :3] / self.voxel_size).astype(np.int64) + offset
+        keys = (voxels[:, 0] * size + voxels[:, 1]) * size + voxels[:, 2]
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        sums = np.stack([np.bincount(inverse, weights=column, minlength=len(counts)) for column in points.T], axis=1)
+        return (sums / counts[:, None]).astype(np.float32)
+
+    def encode(self, points):
+        """
+            Args:
+                points: (N, 4) float32 array of x, y, z, intensity, as given by carla.LidarMeasurement
+            Returns:
+                bytes of the quantised and delta coded sweep
+        """
+        points = self.downsample(self.crop(np.asarray(points, dtype=np.float32)))
+        xyz = np.round(points[:, :3].T / self.resolution).astype(np.int16)
+        intensity = np.round(np.clip(points[:, 3], 0.0, 1.0) * 255).astype(np.uint8)
+        # consecutive points of a sweep are close, their differences deflate much better
+        xyz = np.diff(xyz, axis=1, prepend=np.zeros((3, 1), dtype=np.int16))
+        intensity = np.diff(intensity, prepend=np.zeros(1, dtype=np.uint8))
+        return xyz.tobytes() + intensity.tobytes()
+
+    def decode(self, data):
+        """
+            Returns:
+                (N, 4) float32 array of x, y, z, intensity
+        """
+        count = len(data) // 7
+        xyz = np.frombuffer(data, dtype=np.int16, count=3 * count).reshape(3, count)
+        intensity = np.frombuffer(data, dtype=np.uint8, offset=6 * count, count=count)
+        points = np.empty((count, 4), dtype=np.float32)
+        # the int16 / uint8 wrap-around of the differences is undone by the same wrap-around here
+        points[:, :3] = np.cumsum(xyz, axis=1, dtype=np.int16).T * np.float32(self.resolution)
+        points[:, 3] = np.cumsum(intensity, dtype=np.uint8) / np.float32(255)
+        return points
+
+
+class LidarWriter(FrameWriter):
+    """
+        Per-episode container of the encoded sweeps, one zip member per frame.
+    """
+    encoder_class = LidarEncoder
+
+
+class LidarReader(FrameReader):
+    """
+        Random access to the sweeps of a container written by LidarWriter.
+    """
+    encoder_class = LidarEncoder
+
+    @property
+    def tolerance(self):
+        return self.encoder.tolerance
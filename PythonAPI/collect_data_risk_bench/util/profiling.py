@@ -0,0 +1,308 @@
+"""
+    Lightweight spans timing the phases of every tick (world.tick, sensor waits, actor data, BEV rendering,
+    model inference, control, rendering, video writes), exported as a Chrome trace and a CSV summary.
+
+    Profiling is off by default: span() then returns a shared no-op context manager and the decorated functions
+    only check a flag, so the instrumentation can stay in the loops. Once enabled (data_generator.py --profile DIR,
+    util/inference_server.py --profile DIR), each process writes at exit:
+
+        DIR/<process>_<pid>.trace.json    Chrome trace events, open with chrome://tracing or https://ui.perfetto.dev
+        DIR/<process>_<pid>.summary.csv   per phase: count, total, mean and percentile latencies over the frames
+
+    The spans of a phase are summed per frame before the percentiles are taken, a phase run twice in a tick counts
+    once; the spans before the frame of a tick is known (clock_wait, world.tick) are counted one by one. The cost of
+    a span is calibrated when profiling is enabled, the share of the recorded time spent in the profiler itself is
+    printed and kept in the otherData of the trace (a few spans of ~2 us per tick of 50 ms, well below 1%). The
+    traces of several processes (e.g. workers and the inference server) share the same monotonic clock and are
+    merged with:
+
+        python -m util.profiling merge DIR
+        python -m util.profiling overhead
+"""
+import argparse
+import atexit
+import csv
+import functools
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+TRACE_SUFFIX = ".trace.json"
+SUMMARY_SUFFIX = ".summary.csv"
+PERCENTILES = (50, 90, 99)
+SUMMARY_FIELDS = ["process", "pid", "phase", "count", "frames", "total_ms", "mean_ms"] + \
+                 ["p%d_ms" % p for p in PERCENTILES] + ["max_ms"]
+
+
+class _NullSpan():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span():
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        self.profiler.events.append((self.name, self.start, end - self.start, self.profiler.frame,
+                                     threading.get_ident()))
+        return False
+
+
+class Profiler():
+    """
+        Spans of one process. Events are (name, start ns, duration ns, frame, thread), appended from any thread.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.out_dir = None
+        self.process_name = None
+        self.frame = None
+        self.events = []
+        self.open = {}
+        self.span_cost_ns = 0.0
+        self.dumped = 0
+
+    def enable(self, out_dir, process_name="main"):
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.process_name = process_name
+        self.span_cost_ns = self.calibrate()
+        self.enabled = True
+        atexit.register(self.dump)
+
+    def calibrate(self, count=20000):
+        """Mean cost of an enabled span, in ns"""
+        events, self.events = self.events, []
+        start = time.perf_counter_ns()
+        for _ in range(count):
+            with _Span(self, "calibration"):
+                pass
+        cost = (time.perf_counter_ns() - start) / count
+        self.events = events
+        return cost
+
+    def span(self, name):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def begin(self, name):
+        """Opens a span closed by end(name), for the long blocks a with statement would have to re-indent"""
+        if self.enabled:
+            self.open[name] = time.perf_counter_ns()
+
+    def end(self, name):
+        if self.enabled:
+            start = self.open.pop(name, None)
+            if start is not None:
+                self.events.append((name, start, time.perf_counter_ns() - start, self.frame, threading.get_ident()))
+
+    def tick(self, frame=None):
+        """Closes the previous tick span and opens the next one"""
+        if self.enabled:
+            self.end("tick")
+            self.frame = frame
+            self.begin("tick")
+
+    def set_frame(self, frame):
+        self.frame = frame
+
+    def trace(self):
+        pid = os.getpid()
+        threads = {}
+        events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": self.process_name}}]
+        for name, start, duration, frame, thread in list(self.events):
+            tid = threads.setdefault(thread, len(threads))
+            event = {"name": name, "cat": self.process_name, "ph": "X", "ts": start / 1000.0,
+                     "dur": duration / 1000.0, "pid": pid, "tid": tid}
+            if frame is not None:
+                event["args"] = {"frame": frame}
+            events.append(event)
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"process": self.process_name, "pid": pid, "span_cost_ns": self.span_cost_ns,
+                              "overhead": self.overhead()}}
+
+    def overhead(self):
+        """Share of the recorded wall time spent recording the spans"""
+        events = list(self.events)
+        if not events:
+            return 0.0
+        wall = max(start + duration for _, start, duration, _, _ in events) - min(start for _, start, _, _, _ in events)
+        return len(events) * self.span_cost_ns / wall if wall else 0.0
+
+    def dump(self):
+        # written again at exit only if spans were recorded since
+        if not self.enabled or len(self.events) == self.dumped:
+            return None
+        self.dumped = len(self.events)
+        prefix = os.path.join(self.out_dir, "%s_%d" % (self.process_name, os.getpid()))
+        trace = self.trace()
+        with open(prefix + TRACE_SUFFIX, "w") as f:
+            json.dump(trace, f)
+        write_summary(prefix + SUMMARY_SUFFIX, summarize(trace["traceEvents"]))
+        print("profile written to %s%s (%d spans, overhead %.3f%%)"
+              % (prefix, TRACE_SUFFIX, len(self.events), 100.0 * trace["otherData"]["overhead"]))
+        return prefix
+
+
+def summarize(events):
+    """
+        Rows of the CSV summary from Chrome trace events, the durations of a phase summed per frame.
+    """
+    names = {event["pid"]: event["args"]["name"] for event in events if event.get("ph") == "M"}
+    phases = {}
+    for event in events:
+        if event.get("ph") != "X":
+            continue
+        frame = event.get("args", {}).get("frame")
+        per_frame = phases.setdefault((event["pid"], event["name"]), {})
+        # spans outside of a frame are kept apart
+        key = frame if frame is not None else ("span", len(per_frame))
+        per_frame[key] = per_frame.get(key, 0.0) + event["dur"] / 1000.0
+    rows = []
+    for (pid, name), per_frame in sorted(phases.items(), key=lambda item: (str(names.get(item[0][0])), item[0])):
+        durations = np.array(list(per_frame.values()))
+        row = {"process": names.get(pid, ""), "pid": pid, "phase": name, "count": len(durations),
+               "frames": sum(1 for key in per_frame if not isinstance(key, tuple)),
+               "total_ms": durations.sum(), "mean_ms": durations.mean(), "max_ms": durations.max()}
+        for p, value in zip(PERCENTILES, np.percentile(durations, PERCENTILES)):
+            row["p%d_ms" % p] = value
+        rows.append(row)
+    return rows
+
+
+def write_summary(path, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({key: "%.3f" % value if isinstance(value, float) else value for key, value in row.items()})
+
+
+def merge(profile_dir, out_name="merged"):
+    """
+        Merges the traces of the processes of profile_dir into <out_name>.trace.json and <out_name>.summary.csv.
+    """
+    events = []
+    for path in sorted(glob.glob(os.path.join(profile_dir, "*" + TRACE_SUFFIX))):
+        if os.path.basename(path) == out_name + TRACE_SUFFIX:
+            continue
+        with open(path) as f:
+            events.extend(json.load(f)["traceEvents"])
+    prefix = os.path.join(profile_dir, out_name)
+    with open(prefix + TRACE_SUFFIX, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    rows = summarize(events)
+    write_summary(prefix + SUMMARY_SUFFIX, rows)
+    return rows
+
+
+def measure_overhead(count=200000):
+    """
+        Returns:
+            mean cost of a span in ns, disabled and enabled
+    """
+    profiler = Profiler()
+    start = time.perf_counter_ns()
+    for _ in range(count):
+        with profiler.span("overhead"):
+            pass
+    disabled = (time.perf_counter_ns() - start) / count
+    profiler.enabled = True
+    start = time.perf_counter_ns()
+    for _ in range(count):
+        with profiler.span("overhead"):
+            pass
+    enabled = (time.perf_counter_ns() - start) / count
+    return disabled, enabled
+
+
+# profiler of the process, used through the functions below
+profiler = Profiler()
+
+
+def enable(out_dir, process_name="main"):
+    profiler.enable(out_dir, process_name)
+
+
+def span(name):
+    return profiler.span(name)
+
+
+def begin(name):
+    profiler.begin(name)
+
+
+def end(name):
+    profiler.end(name)
+
+
+def tick(frame=None):
+    profiler.tick(frame)
+
+
+def set_frame(frame):
+    profiler.set_frame(frame)
+
+
+def dump():
+    return profiler.dump()
+
+
+def profiled(name):
+    """
+        Decorator timing every call of a function as a span.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with _Span(profiler, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = argparser.add_subparsers(dest='command', required=True)
+    merge_parser = subparsers.add_parser('merge', help='merge the traces of the processes of a profile directory')
+    merge_parser.add_argument('profile_dir')
+    merge_parser.add_argument('--name', default='merged', help='name of the merged trace and summary')
+    subparsers.add_parser('overhead', help='measure the cost of a span, disabled and enabled')
+    args = argparser.parse_args()
+
+    if args.command == 'merge':
+        for row in merge(args.profile_dir, args.name):
+            print("%-12s %-24s frames %6d  mean %8.3f ms  p50 %8.3f ms  p99 %8.3f ms"
+                  % (row["process"], row["phase"], row["frames"], row["mean_ms"], row["p50_ms"], row["p99_ms"]))
+    else:
+        disabled, enabled = measure_overhead()
+        print("span cost: %.0f ns disabled, %.0f ns enabled" % (disabled, enabled))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1152 @@
+"""
+    Simulator-free replay of a recorded episode, behind the subset of the carla client API used by
+    Data_Collection, Inference and util.actor_state.
+
+    The world is fed from the files of a variant (<type>/<basic>/variant_scenario/<variant>):
+        actors_data/%08d.json           transforms, velocities, accelerations and controls of the actors
+        actor_attribute.json            type ids, bounding boxes and static transforms (traffic lights, obstacles)
+        static_data.json                parked vehicles returned by get_level_bbs
+        sensor_data/%08d.npy            camera transforms
+        rgb/front/%08d.jpg, instance_segmentation/<view>/%08d.png, depth/<view>/%08d.png, lidar/%08d.npy
+        (or instance_<view>.zip, depth_<view>.zip, lidar.zip with --compact_storage)    sensor frames
+        topology.npz (or topology/)     lanes, rebuilt into the waypoints of the map
+        collision_frame.json            collision reported by the collision sensor
+
+    Every ReplayWorld.tick() moves to the next recorded frame and runs the listen() callbacks of the sensors and
+    the on_tick() callbacks, as the synchronous mode of the simulator does. Sensor frames are decoded on first
+    access of their data. The replay is open loop: the controls applied to the actors are kept in
+    ReplayWorld.applied_controls but the actors follow the recording, which makes every run deterministic.
+    For the same reason no actor can be spawned: ReplayWorld.spawn_actor raises a RuntimeError, the sensors
+    with a recording (rgb, instance, depth, lidar and imu) are attached with ReplayWorld.spawn_sensor instead.
+
+    When the carla package is not installed, install_carla_api() registers this module's types as `carla`, so
+    that util.data_collection and util.actor_state import. Run from PythonAPI/collect_data_risk_bench:
+
+        python -m util.replay tick --episode ./data_collection/interactive/10_i-1_1_c_f_f_1_rl/variant_scenario/ClearNoon_high_
+        python -m util.replay collect --episode <variant> --out /tmp/replayed
+"""
+import argparse
+import fnmatch
+import json
+import math
+import os
+import sys
+import time
+import types
+
+import numpy as np
+
+FIXED_DELTA_SECONDS = 0.05
+SENSOR_TYPES = {
+    "rgb": "sensor.camera.rgb",
+    "instance": "sensor.camera.instance_segmentation",
+    "depth": "sensor.camera.depth",
+    "lidar": "sensor.lidar.ray_cast",
+}
+# folders of the frames saved one PNG per frame, when the episode has no container of the modality
+PNG_FOLDERS = {
+    "instance": "instance_segmentation",
+    "depth": "depth",
+}
+
+
+# -- carla types ----------------------------------------------------------------
+
+class Vector3D():
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = float(x)
+        self.y = float(y)
+        self.z = float(z)
+
+    def length(self):
+        return math.sqrt(self.x ** 2 + self.y ** 2 + self.z ** 2)
+
+    def __repr__(self):
+        return "%s(x=%.6f, y=%.6f, z=%.6f)" % (type(self).__name__, self.x, self.y, self.z)
+
+
+class Location(Vector3D):
+    def distance(self, other):
+        return math.sqrt((self.x - other.x) ** 2 + (self.y - other.y) ** 2 + (self.z - other.z) ** 2)
+
+
+def rotation_matrix(pitch, yaw, roll):
+    """3x3 rotation matrix, same convention as carla.Rotation"""
+    cp, sp = math.cos(math.radians(pitch)), math.sin(math.radians(pitch))
+    cy, sy = math.cos(math.radians(yaw)), math.sin(math.radians(yaw))
+    cr, sr = math.cos(math.radians(roll)), math.sin(math.radians(roll))
+    return np.array([[cp * cy, cy * sp * sr - sy * cr, -cy * sp * cr - sy * sr],
+                     [cp * sy, sy * sp * sr + cy * cr, -sy * sp * cr + cy * sr],
+                     [sp, -cp * sr, cp * cr]])
+
+
+class Rotation():
+    def __init__(self, pitch=0.0, yaw=0.0, roll=0.0):
+        self.pitch = float(pitch)
+        self.yaw = float(yaw)
+        self.roll = float(roll)
+
+    def get_forward_vector(self):
+        return Vector3D(*rotation_matrix(self.pitch, self.yaw, self.roll)[:, 0])
+
+    def get_right_vector(self):
+        return Vector3D(*rotation_matrix(self.pitch, self.yaw, self.roll)[:, 1])
+
+    def get_up_vector(self):
+        return Vector3D(*rotation_matrix(self.pitch, self.yaw, self.roll)[:, 2])
+
+    def __repr__(self):
+        return "Rotation(pitch=%.6f, yaw=%.6f, roll=%.6f)" % (self.pitch, self.yaw, self.roll)
+
+
+class Transform():
+    def __init__(self, location=None, rotation=None, matrix=None):
+        self.location = location if location is not None else Location()
+        self.rotation = rotation if rotation is not None else Rotation()
+        # recorded sensor transforms keep their exact matrix
+        self._matrix = matrix
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        matrix = np.asarray(matrix, dtype=np.float64)
+        pitch = math.degrees(math.asin(max(-1.0, min(1.0, matrix[2, 0]))))
+        yaw = math.degrees(math.atan2(matrix[1, 0], matrix[0, 0]))
+        roll = math.degrees(math.atan2(-matrix[2, 1], matrix[2, 2]))
+        return cls(Location(*matrix[:3, 3]), Rotation(pitch, yaw, roll), matrix)
+
+    def get_matrix(self):
+        if self._matrix is not None:
+            return self._matrix.tolist()
+        matrix = np.identity(4)
+        matrix[:3, :3] = rotation_matrix(self.rotation.pitch, self.rotation.yaw, self.rotation.roll)
+        matrix[:3, 3] = (self.location.x, self.location.y, self.location.z)
+        return matrix.tolist()
+
+    def get_inverse_matrix(self):
+        return np.linalg.inv(np.array(self.get_matrix())).tolist()
+
+    def transform(self, point):
+        matrix = np.array(self.get_matrix())
+        return Location(*(matrix[:3, :3] @ (point.x, point.y, point.z) + matrix[:3, 3]))
+
+    def get_forward_vector(self):
+        return self.rotation.get_forward_vector()
+
+
+class BoundingBox():
+    def __init__(self, location=None, extent=None, rotation=None, world_vertices=None):
+        self.location = location if location is not None else Location()
+        self.extent = extent if extent is not None else Vector3D()
+        self.rotation = rotation if rotation is not None else Rotation()
+        # boxes recorded in world coordinates return their vertices as they are
+        self._world_vertices = world_vertices
+
+    def get_local_vertices(self):
+        signs = [(-1, -1, -1), (-1, -1, 1), (-1, 1, -1), (-1, 1, 1), (1, -1, -1), (1, -1, 1), (1, 1, -1), (1, 1, 1)]
+        rotation = rotation_matrix(self.rotation.pitch, self.rotation.yaw, self.rotation.roll)
+        extent = np.array([self.extent.x, self.extent.y, self.extent.z])
+        center = np.array([self.location.x, self.location.y, self.location.z])
+        return [Location(*(rotation @ (np.array(sign) * extent) + center)) for sign in signs]
+
+    def get_world_vertices(self, transform):
+        if self._world_vertices is not None:
+            return [Location(*vertex) for vertex in self._world_vertices]
+        location, rotation = transform.location, transform.rotation
+        matrix = rotation_matrix(rotation.pitch, rotation.yaw, rotation.roll)
+        offset = np.array([location.x, location.y, location.z])
+        return [Location(*(matrix @ (v.x, v.y, v.z) + offset)) for v in self.get_local_vertices()]
+
+
+class VehicleControl():
+    def __init__(self, throttle=0.0, steer=0.0, brake=0.0, hand_brake=False, reverse=False,
+                 manual_gear_shift=False, gear=0):
+        self.throttle = throttle
+        self.steer = steer
+        self.brake = brake
+        self.hand_brake = hand_brake
+        self.reverse = reverse
+        self.manual_gear_shift = manual_gear_shift
+        self.gear = gear
+
+
+class WalkerControl():
+    def __init__(self, direction=None, speed=0.0, jump=False):
+        self.direction = direction if direction is not None else Vector3D()
+        self.speed = speed
+        self.jump = jump
+
+
+class ColorConverter():
+    Raw = "Raw"
+    Depth = "Depth"
+    LogarithmicDepth = "LogarithmicDepth"
+    CityScapesPalette = "CityScapesPalette"
+
+
+class CityObjectLabel():
+    Car = "Car"
+    Truck = "Truck"
+    Bus = "Bus"
+    Motorcycle = "Motorcycle"
+    Bicycle = "Bicycle"
+
+
+class VehicleLightState():
+    NONE = 0
+    LowBeam = 1
+
+
+class WorldSettings():
+    def __init__(self):
+        self.synchronous_mode = True
+        self.fixed_delta_seconds = FIXED_DELTA_SECONDS
+        self.no_rendering_mode = False
+
+
+def install_carla_api():
+    """
+        Registers the types of this module as the carla module when the carla package is not installed.
+
+        Returns:
+            the carla module, the real one if it is installed
+    """
+    try:
+        import carla
+        return carla
+    except ImportError:
+        pass
+    module = types.ModuleType("carla")
+    for cls in (Vector3D, Location, Rotation, Transform, BoundingBox, VehicleControl, WalkerControl,
+                ColorConverter, CityObjectLabel, VehicleLightState, WorldSettings):
+        setattr(module, cls.__name__, cls)
+    module.command = types.SimpleNamespace(DestroyActor=lambda actor: None)
+    module.__replay__ = True
+    sys.modules["carla"] = module
+    return module
+
+
+# -- recorded episode -----------------------------------------------------------
+
+def _read_json(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _xyz(values, cls=Vector3D):
+    return cls(values["x"], values["y"], values["z"])
+
+
+def _corners(cord_bounding_box):
+    return [cord_bounding_box["cord_%d" % i] for i in range(8)]
+
+
+class ReplayEpisode():
+    """
+        Recorded files of a variant, read lazily frame by frame.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        actors_dir = os.path.join(path, "actors_data")
+        self.frames = sorted(int(name[:-len(".json")]) for name in os.listdir(actors_dir) if name.endswith(".json"))
+        if not self.frames:
+            raise ValueError("%s has no actors_data frames" % path)
+        self.attributes = _read_json(os.path.join(path, "actor_attribute.json")) or {}
+        self.static = _read_json(os.path.join(path, "static_data.json")) or {}
+        self.collision = _read_json(os.path.join(path, "collision_frame.json"))
+        self.ego_id = int(self.attributes["ego_id"]) if "ego_id" in self.attributes else None
+        self._containers = {}
+
+    def actors(self, frame):
+        return _read_json(os.path.join(self.path, "actors_data", "%08d.json" % frame))
+
+    def sensor_data(self, frame):
+        path = os.path.join(self.path, "sensor_data", "%08d.npy" % frame)
+        if not os.path.isfile(path):
+            return None
+        return np.load(path, allow_pickle=True).item()
+
+    def _container(self, name, reader):
+        if name not in self._containers:
+            path = os.path.join(self.path, name)
+            self._containers[name] = reader(path) if os.path.isfile(path) else None
+        return self._containers[name]
+
+    def has_sensor(self, modality, view):
+        if modality == "rgb":
+            return os.path.isdir(os.path.join(self.path, "rgb", view))
+        if modality == "lidar":
+            return os.path.isfile(os.path.join(self.path, "lidar.zip")) or os.path.isdir(os.path.join(self.path, "lidar"))
+        return (os.path.isfile(os.path.join(self.path, "%s_%s.zip" % (modality, view))) or
+                os.path.isdir(os.path.join(self.path, PNG_FOLDERS[modality], view)))
+
+    def _png(self, modality, view, frame):
+        path = os.path.join(self.path, PNG_FOLDERS[modality], view, "%08d.png" % frame)
+        return _read_bgra(path) if os.path.isfile(path) else None
+
+    def bgra(self, modality, view, frame):
+        """
+            Recorded camera frame as the (H, W, 4) uint8 raw_data of carla.Image, None if it is missing.
+        """
+        if modality == "rgb":
+            path = os.path.join(self.path, "rgb", view, "%08d.jpg" % frame)
+            if not os.path.isfile(path):
+                return None
+            return _read_bgra(path)
+        if modality == "instance":
+            from util.instance_storage import InstanceReader
+            reader = self._container("instance_%s.zip" % view, InstanceReader)
+            if reader is None:
+                return self._png(modality, view, frame)
+            if frame not in reader:
+                return None
+            tags, ids = reader.planes(frame)
+            return np.stack([(ids >> 8).astype(np.uint8), (ids & 0xff).astype(np.uint8), tags,
+                             np.full_like(tags, 255)], axis=-1)
+        if modality == "depth":
+            from util.depth_storage import CODE_MAX, FAR_PLANE, DepthReader
+            reader = self._container("depth_%s.zip" % view, DepthReader)
+            if reader is None:
+                return self._png(modality, view, frame)
+            if frame not in reader:
+                return None
+            code = np.clip(np.rint(reader[frame].astype(np.float64) * (CODE_MAX / FAR_PLANE)), 0, CODE_MAX)
+            code = code.astype(np.uint32)
+            return np.stack([(code >> 16).astype(np.uint8), ((code >> 8) & 0xff).astype(np.uint8),
+                             (code & 0xff).astype(np.uint8), np.full(code.shape, 255, np.uint8)], axis=-1)
+        raise ValueError("unknown camera modality %s" % modality)
+
+    def lidar(self, frame):
+        """(N, 4) float32 points of the frame, None if it is missing"""
+        from util.lidar_storage import LidarReader
+        reader = self._container("lidar.zip", LidarReader)
+        if reader is not None:
+            return reader[frame] if frame in reader else None
+        path = os.path.join(self.path, "lidar", "%08d.npy" % frame)
+        return np.load(path).astype(np.float32) if os.path.isfile(path) else None
+
+    def lanes(self):
+        """
+            Distinct lanes of the topology of the episode, in the layout of Data_Collection.collect_topology
+        """
+        path = os.path.join(self.path, "topology.npz")
+        if os.path.isfile(path):
+            from util.topology_storage import TopologyReader
+            reader = TopologyReader(path)
+            return [reader.lane(lane) for lane in range(len(reader.lane_offsets) - 1)]
+        lanes, seen = [], set()
+        directory = os.path.join(self.path, "topology")
+        for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+            for lane in np.load(os.path.join(directory, name), allow_pickle=True) or []:
+                key = (lane[6][0], lane[6][1], np.asarray(lane[2]).tobytes())
+                if key not in seen:
+                    seen.add(key)
+                    lanes.append(lane)
+        return lanes
+
+    def close(self):
+        for container in self._containers.values():
+            if container is not None:
+                container.close()
+        self._containers = {}
+
+
+def _read_bgra(path):
+    try:
+        import cv2
+        bgr = cv2.imread(path, cv2.IMREAD_COLOR)
+        return np.concatenate([bgr, np.full(bgr.shape[:2] + (1,), 255, np.uint8)], axis=-1)
+    except ImportError:
+        from PIL import Image
+        with Image.open(path) as image:
+            rgb = np.asarray(image.convert("RGB"))
+        return np.concatenate([rgb[..., ::-1], np.full(rgb.shape[:2] + (1,), 255, np.uint8)], axis=-1)
+
+
+# -- sensors --------------------------------------------------------------------
+
+class ReplayImage():
+    """
+        carla.Image of a recorded frame, decoded on first access of its data.
+    """
+
+    def __init__(self, frame, timestamp, transform, load):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.transform = transform
+        self._load = load
+        self._array = None
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = np.ascontiguousarray(self._load())
+        return self._array
+
+    @property
+    def raw_data(self):
+        return memoryview(self.array).cast("B")
+
+    @property
+    def height(self):
+        return self.array.shape[0]
+
+    @property
+    def width(self):
+        return self.array.shape[1]
+
+    def convert(self, color_converter):
+        pass
+
+    def save_to_disk(self, path, color_converter=None):
+        from PIL import Image
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        Image.fromarray(self.array[..., [2, 1, 0, 3]]).save(path if os.path.splitext(path)[1] else path + ".png")
+
+
+class ReplayLidarMeasurement(ReplayImage):
+    @property
+    def raw_data(self):
+        return memoryview(self.array.astype(np.float32)).cast("B")
+
+    def __len__(self):
+        return len(self.array)
+
+
+class ReplayIMUMeasurement():
+    def __init__(self, frame, timestamp, compass):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.compass = math.radians(compass)
+        self.accelerometer = Vector3D()
+        self.gyroscope = Vector3D()
+
+
+class ReplaySensor():
+    """
+        Sensor whose listen() callback gets the recorded measurement of every tick.
+    """
+
+    def __init__(self, world, modality, view, actor_id):
+        self.world = world
+        self.modality = modality
+        self.view = view
+        self.id = actor_id
+        self.type_id = SENSOR_TYPES.get(modality, "sensor.other." + modality)
+        self.callback = None
+
+    def listen(self, callback):
+        self.callback = callback
+
+    def stop(self):
+        self.callback = None
+
+    def is_listening(self):
+        return self.callback is not None
+
+    def destroy(self):
+        self.stop()
+        self.world.sensors = [sensor for sensor in self.world.sensors if sensor is not self]
+        return True
+
+    def get_transform(self):
+        return self.world.sensor_transform(self.view)
+
+    def get_location(self):
+        return self.get_transform().location
+
+    def measurement(self, frame, recorded_frame, timestamp):
+        episode = self.world.episode
+        if self.modality == "imu":
+            ego = self.world.recorded_actors.get(str(self.world.ego_id), {})
+            return ReplayIMUMeasurement(frame, timestamp, ego.get("compass", 0.0))
+        if self.modality == "lidar":
+
+            def load_points():
+                points = episode.lidar(recorded_frame)
+                return points if points is not None else np.zeros((0, 4), np.float32)
+            return ReplayLidarMeasurement(frame, timestamp, None, load_points)
+        transform = self.get_transform()
+
+        def load():
+            array = episode.bgra(self.modality, self.view, recorded_frame)
+            if array is None:
+                raise KeyError("%s %s frame %d is not recorded" % (self.modality, self.view, recorded_frame))
+            return array
+        return ReplayImage(frame, timestamp, transform, load)
+
+
+# -- actors ---------------------------------------------------------------------
+
+class ReplayActor():
+    """
+        Actor whose state is the one recorded at the current frame of the world.
+    """
+
+    def __init__(self, world, actor_id, type_id, bounding_box, semantic_tags=(), attributes=None):
+        self.world = world
+        self.id = actor_id
+        self.type_id = type_id
+        self.bounding_box = bounding_box
+        self.semantic_tags = list(semantic_tags)
+        self.attributes = dict(attributes or {})
+        self.parent = None
+        self.is_alive = True
+        self.static_transform = None
+        self.trigger_volume = None
+
+    @property
+    def _record(self):
+        return self.world.recorded_actors.get(str(self.id), {})
+
+    def get_world(self):
+        return self.world
+
+    def get_transform(self):
+        record = self._record
+        if "location" not in record:
+            return self.static_transform or Transform()
+        if "rotation" in record:
+            rotation = Rotation(record["rotation"]["pitch"], record["rotation"]["yaw"], record["rotation"]["roll"])
+        elif self.static_transform is not None:
+            rotation = self.static_transform.rotation
+        else:
+            # walkers are recorded without rotation, they face their walking direction
+            direction = record.get("control", {}).get("direction", {"x": 1.0, "y": 0.0})
+            rotation = Rotation(0.0, math.degrees(math.atan2(direction["y"], direction["x"])), 0.0)
+        return Transform(_xyz(record["location"], Location), rotation)
+
+    def get_location(self):
+        return self.get_transform().location
+
+    def get_velocity(self):
+        return _xyz(self._record["velocity"]) if "velocity" in self._record else Vector3D()
+
+    def get_acceleration(self):
+        return _xyz(self._record["acceleration"]) if "acceleration" in self._record else Vector3D()
+
+    def get_angular_velocity(self):
+        return _xyz(self._record["angular_velocity"]) if "angular_velocity" in self._record else Vector3D()
+
+    def get_control(self):
+        control = self._record.get("control", {})
+        if "pedestrian" in self.type_id or "walker" in self.type_id:
+            return WalkerControl(_xyz(control["direction"]) if "direction" in control else None,
+                                 control.get("speed", 0.0), control.get("jump", False))
+        return VehicleControl(**control) if isinstance(control, dict) else VehicleControl()
+
+    @property
+    def state(self):
+        return int(self._record.get("state", 0))
+
+    def apply_control(self, control):
+        self.world.applied_controls.setdefault(self.world.frame, {})[self.id] = control
+
+    def set_transform(self, transform):
+        pass
+
+    def set_target_velocity(self, velocity):
+        pass
+
+    def set_autopilot(self, enabled=True, port=None):
+        pass
+
+    def set_light_state(self, light_state):
+        pass
+
+    def set_simulate_physics(self, enabled=True):
+        pass
+
+    def destroy(self):
+        self.is_alive = False
+        return True
+
+
+class ActorList(list):
+    def filter(self, wildcard_pattern):
+        return ActorList(actor for actor in self if fnmatch.fnmatchcase(actor.type_id, wildcard_pattern))
+
+    def find(self, actor_id):
+        return next((actor for actor in self if actor.id == actor_id), None)
+
+
+class ActorSnapshot():
+    __slots__ = ("id", "_actor")
+
+    def __init__(self, actor):
+        self.id = actor.id
+        self._actor = actor
+
+    def get_transform(self):
+        return self._actor.get_transform()
+
+    def get_velocity(self):
+        return self._actor.get_velocity()
+
+    def get_acceleration(self):
+        return self._actor.get_acceleration()
+
+    def get_angular_velocity(self):
+        return self._actor.get_angular_velocity()
+
+
+class Timestamp():
+    def __init__(self, frame, elapsed_seconds, delta_seconds):
+        self.frame = frame
+        self.elapsed_seconds = elapsed_seconds
+        self.delta_seconds = delta_seconds
+        self.platform_timestamp = elapsed_seconds
+
+
+class ReplaySnapshot():
+    def __init__(self, frame, timestamp, actors):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.id = frame
+        self._actors = [ActorSnapshot(actor) for actor in actors]
+        self._index = {snapshot.id: snapshot for snapshot in self._actors}
+
+    def __iter__(self):
+        return iter(self._actors)
+
+    def __len__(self):
+        return len(self._actors)
+
+    def has_actor(self, actor_id):
+        return actor_id in self._index
+
+    def find(self, actor_id):
+        return self._index.get(actor_id)
+
+
+# -- map ------------------------------------------------------------------------
+
+class Landmark():
+    def __init__(self, waypoint):
+        self.waypoint = waypoint
+        self.type = "1000001"
+        self.name = "traffic_light"
+
+
+class ReplayWaypoint():
+    def __init__(self, town_map, index, transform, road_id, lane_id, lane_width, is_junction, is_traffic_control, s):
+        self.map = town_map
+        self.index = index
+        self.id = index
+        self.transform = transform
+        self.road_id = road_id
+        self.section_id = 0
+        self.lane_id = lane_id
+        self.lane_width = lane_width
+        self.is_junction = is_junction
+        self.is_intersection = is_junction
+        self.is_traffic_control = is_traffic_control
+        self.s = s
+        self.lane_type = "Driving"
+        self.lane_change = "NONE"
+
+    def get_landmarks(self, distance, stop_at_junction=False):
+        return [Landmark(self)] if self.is_traffic_control else []
+
+    def _step(self, distance):
+        lane = self.map.lane_waypoints[(self.road_id, self.lane_id)]
+        target = self.s + distance
+        position = int(np.searchsorted([w.s for w in lane], target, side="left" if distance > 0 else "right"))
+        position = position if distance > 0 else position - 1
+        if 0 <= position < len(lane) and lane[position] is not self:
+            return [lane[position]]
+        return []
+
+    def next(self, distance):
+        return self._step(abs(distance))
+
+    def previous(self, distance):
+        return self._step(-abs(distance))
+
+    def _neighbour(self, lane_id):
+        lane = self.map.lane_waypoints.get((self.road_id, lane_id))
+        if not lane:
+            return None
+        location = self.transform.location
+        distances = [(w.transform.location.x - location.x) ** 2 + (w.transform.location.y - location.y) ** 2
+                     for w in lane]
+        return lane[int(np.argmin(distances))]
+
+    def get_left_lane(self):
+        # lane ids grow away from the center line, lane 0 is the center line itself
+        lane_id = self.lane_id + 1 if self.lane_id < 0 else self.lane_id - 1
+        return self._neighbour(lane_id if lane_id != 0 else -self.lane_id)
+
+    def get_right_lane(self):
+        return self._neighbour(self.lane_id - 1 if self.lane_id < 0 else self.lane_id + 1)
+
+
+class ReplayMap():
+    """
+        Waypoints rebuilt from the lanes recorded around the ego, one per recorded lane segment.
+        Only the part of the town seen during the episode is known.
+    """
+
+    def __init__(self, name, lanes):
+        self.name = name
+        self.lane_waypoints = {}
+        points = {}
+        for halluc_lane_1, halluc_lane_2, center_lane, _, is_traffic_control, is_junction, (road_id, lane_id) in lanes:
+            center_lane = np.asarray(center_lane, dtype=np.float64).reshape(-1, 6)
+            widths = np.linalg.norm(np.asarray(halluc_lane_1, dtype=np.float64).reshape(-1, 6)[:, :2]
+                                    - np.asarray(halluc_lane_2, dtype=np.float64).reshape(-1, 6)[:, :2], axis=1)
+            lane_points = points.setdefault((int(road_id), int(lane_id)), {})
+            for segment, width in zip(center_lane, widths):
+                for start in (0, 3):
+                    key = tuple(np.round(segment[start:start + 3], 2))
+                    if key not in lane_points:
+                        direction = segment[3:5] - segment[0:2]
+                        lane_points[key] = (segment[start:start + 3], direction, float(width),
+                                            bool(is_junction), bool(is_traffic_control))
+
+        for (road_id, lane_id), lane_points in sorted(points.items()):
+            values = list(lane_points.values())
+            # waypoints ordered along the mean direction of the lane
+            mean_direction = np.mean([direction for _, direction, _, _, _ in values], axis=0)
+            norm = np.linalg.norm(mean_direction)
+            mean_direction = mean_direction / norm if norm else np.array([1.0, 0.0])
+            positions = np.array([position for position, _, _, _, _ in values])
+            order = np.argsort(positions[:, :2] @ mean_direction, kind="stable")
+            s = positions[order, :2] @ mean_direction
+            s = s - s[0]
+            waypoints = []
+            for rank, i in enumerate(order):
+                position, direction, width, is_junction, is_traffic_control = values[i]
+                yaw = math.degrees(math.atan2(direction[1], direction[0])) if np.any(direction) else 0.0
+                transform = Transform(Location(*position), Rotation(0.0, yaw, 0.0))
+                waypoints.append(ReplayWaypoint(self, 0, transform, road_id, lane_id, width, is_junction,
+                                                is_traffic_control, float(s[rank])))
+            self.lane_waypoints[(road_id, lane_id)] = waypoints
+
+        self.waypoints = [w for lane in self.lane_waypoints.values() for w in lane]
+        for index, waypoint in enumerate(self.waypoints):
+            waypoint.index = waypoint.id = index
+        self._positions = np.array([[w.transform.location.x, w.transform.location.y] for w in self.waypoints]).reshape(-1, 2)
+
+    def get_waypoint(self, location, project_to_road=True, lane_type=None):
+        if not self.waypoints:
+            return None
+        distances = np.sum((self._positions - (location.x, location.y)) ** 2, axis=1)
+        return self.waypoints[int(np.argmin(distances))]
+
+    def generate_waypoints(self, distance):
+        return list(self.waypoints)
+
+    def get_topology(self):
+        return [(lane[0], lane[-1]) for lane in self.lane_waypoints.values() if lane]
+
+    def get_spawn_points(self):
+        return [waypoint.transform for waypoint in self.waypoints]
+
+
+# -- world ----------------------------------------------------------------------
+
+class ReplayWorld():
+    """
+        carla.World replaying an episode in synchronous mode, tick() moves to the next recorded frame.
+    """
+
+    def __init__(self, episode, map_name=None, first_frame=None):
+        self.episode = episode if isinstance(episode, ReplayEpisode) else ReplayEpisode(episode)
+        self.ego_id = self.episode.ego_id
+        self.settings = WorldSettings()
+        self.sensors = []
+        self.tick_callbacks = {}
+        self.applied_controls = {}
+        self.actors = {}
+        self._map = None
+        self.map_name = map_name or "Replay"
+        self.frame_offset = 0 if first_frame is None else first_frame - self.episode.frames[0]
+        self.frame = None
+        self.recorded_frame = None
+        self.recorded_actors = {}
+        self._register_actors()
+        # the actors of the first frame are there before the first tick, which delivers its sensor data
+        self._load(0)
+        self.started = False
+
+    def _register_actors(self):
+        attributes = self.episode.attributes
+        for kind in ("vehicle", "pedestrian", "traffic_light", "obstacle"):
+            for actor_id, attribute in attributes.get(kind, {}).items():
+                box = attribute.get("bounding_box", {})
+                extent = _xyz(box["extent"]) if "extent" in box else Vector3D()
+                location = _xyz(box["location"], Location) if "location" in box else Location()
+                rotation = Rotation(**box["rotation"]) if "rotation" in box else Rotation()
+                actor = ReplayActor(self, int(actor_id), attribute.get("type_id", kind),
+                                    BoundingBox(location, extent, rotation),
+                                    attribute.get("semantic_tags", ()), attribute.get("attributes"))
+                if "location" in attribute:
+                    actor.static_transform = Transform(_xyz(attribute["location"], Location),
+                                                       Rotation(**attribute.get("rotation", {})))
+                self.actors[actor.id] = actor
+
+    def _actor(self, actor_id, record):
+        """Actor of a recorded entry, created on the fly for the actors missing from actor_attribute.json"""
+        if actor_id not in self.actors:
+            kind = record.get("type", "vehicle") if isinstance(record, dict) else "vehicle"
+            type_id = {"vehicle": "vehicle.replay", "pedestrian": "walker.pedestrian.replay",
+                       "traffic_light": "traffic.traffic_light", "obstacle": "static.prop.replay"}.get(kind, kind)
+            self.actors[actor_id] = ReplayActor(self, actor_id, type_id, BoundingBox())
+        actor = self.actors[actor_id]
+        if isinstance(record, dict) and "trigger_loc" in record and actor.trigger_volume is None:
+            forward = record["trigger_ori"]
+            yaw = math.degrees(math.atan2(forward[1], forward[0]))
+            actor.trigger_volume = BoundingBox(Location(*record["trigger_loc"]),
+                                               Vector3D(record["trigger_box"][0], record["trigger_box"][1], 0.0),
+                                               Rotation(0.0, yaw, 0.0),
+                                               world_vertices=_corners(record["tigger_cord_bounding_box"]))
+        return actor
+
+    def _load(self, position):
+        self.position = position
+        self.recorded_frame = self.episode.frames[position]
+        self.frame = self.recorded_frame + self.frame_offset
+        self.recorded_actors = self.episode.actors(self.recorded_frame)
+        present = []
+        for key, record in self.recorded_actors.items():
+            if key.lstrip("-").isdigit():
+                present.append(self._actor(int(key), record))
+        # obstacles are only listed by id in actors_data
+        for actor_id in self.recorded_actors.get("obstacle_ids", []):
+            if int(actor_id) in self.actors and self.actors[int(actor_id)] not in present:
+                present.append(self.actors[int(actor_id)])
+        self.present = sorted(present, key=lambda actor: actor.id)
+        self.timestamp = Timestamp(self.frame, self.position * self.settings.fixed_delta_seconds,
+                                   self.settings.fixed_delta_seconds)
+
+    @property
+    def finished(self):
+        return self.started and self.position + 1 >= len(self.episode.frames)
+
+    def tick(self, seconds=10.0):
+        """
+            Moves to the next recorded frame and runs the sensor and on_tick callbacks.
+
+            Returns:
+                the frame, as carla.World.tick
+        """
+        if self.finished:
+            raise StopIteration("end of the recorded episode")
+        if self.started:
+            self._load(self.position + 1)
+        self.started = True
+        for sensor in list(self.sensors):
+            if sensor.callback is not None:
+                sensor.callback(sensor.measurement(self.frame, self.recorded_frame, self.timestamp))
+        snapshot = None
+        for callback in list(self.tick_callbacks.values()):
+            snapshot = snapshot or self.get_snapshot()
+            callback(snapshot)
+        return self.frame
+
+    def wait_for_tick(self, seconds=10.0):
+        self.tick()
+        return self.get_snapshot()
+
+    def on_tick(self, callback):
+        callback_id = len(self.tick_callbacks) + 1
+        self.tick_callbacks[callback_id] = callback
+        return callback_id
+
+    def remove_on_tick(self, callback_id):
+        self.tick_callbacks.pop(callback_id, None)
+
+    def get_snapshot(self):
+        return ReplaySnapshot(self.frame, self.timestamp, self.present)
+
+    def get_actors(self, actor_ids=None):
+        if actor_ids is None:
+            return ActorList(self.present)
+        return ActorList(self.actors[int(actor_id)] for actor_id in actor_ids if int(actor_id) in self.actors)
+
+    def get_actor(self, actor_id):
+        return self.actors.get(int(actor_id))
+
+    def get_map(self):
+        if self._map is None:
+            self._map = ReplayMap(self.map_name, self.episode.lanes())
+        return self._map
+
+    def get_settings(self):
+        return self.settings
+
+    def apply_settings(self, settings):
+        self.settings = settings
+        return self.frame
+
+    def get_level_bbs(self, label=None):
+        boxes = []
+        for key, entry in self.episode.static.items():
+            if key == "num_of_id" or (label is not None and entry.get("type") != label):
+                continue
+            boxes.append(BoundingBox(world_vertices=_corners(entry["cord_bounding_box"])))
+        return boxes
+
+    def sensor_transform(self, view):
+        data = self.episode.sensor_data(self.recorded_frame)
+        if data is not None and view in data:
+            return Transform.from_matrix(data[view]["extrinsic"])
+        ego = self.actors.get(self.ego_id)
+        return ego.get_transform() if ego is not None else Transform()
+
+    def spawn_sensor(self, modality, view="front"):
+        sensor = ReplaySensor(self, modality, view, -(len(self.sensors) + 1))
+        self.sensors.append(sensor)
+        return sensor
+
+    def spawn_actor(self, blueprint, transform, attach_to=None, attachment_type=None):
+        """
+            The actors of a replay are the recorded ones, nothing can be spawned (see the module docstring).
+        """
+        raise RuntimeError(
+            "can not spawn %s in a replay: only the recorded actors are replayed, the recorded sensors (%s and imu) "
+            "are attached with spawn_sensor(modality, view)" % (getattr(blueprint, "id", blueprint), ", ".join(SENSOR_TYPES)))
+
+    def close(self):
+        self.episode.close()
+
+
+class ReplayClient():
+    """
+        carla.Client of a replay, every world it gives is the replayed one.
+    """
+
+    def __init__(self, episode, map_name=None):
+        self.world = ReplayWorld(episode, map_name)
+
+    def set_timeout(self, seconds):
+        pass
+
+    def get_world(self):
+        return self.world
+
+    def load_world(self, map_name=None):
+        return self.world
+
+    def reload_world(self, reset_settings=True):
+        return self.world
+
+    def apply_batch(self, commands):
+        return []
+
+    def apply_batch_sync(self, commands, due_tick_cue=False):
+        return []
+
+
+# -- game world -----------------------------------------------------------------
+
+class ReplayCameraManager():
+    """
+        Sensors of data_generator's CameraManager, each one keeping its last measurement as CameraManager does.
+    """
+
+    VIEWS = {"rgb_front": ("rgb", "front"), "ss_front": ("instance", "front"), "ss_top": ("instance", "top"),
+             "depth_front": ("depth", "front"), "lidar": ("lidar", "lidar")}
+
+    def __init__(self, world):
+        # sensors missing from the recording deliver frames too, reading their data raises KeyError
+        self.recorded = []
+        for name, (modality, view) in self.VIEWS.items():
+            setattr(self, name, None)
+            if world.episode.has_sensor(modality, view):
+                self.recorded.append(name)
+            sensor = world.spawn_sensor(modality, view)
+            setattr(self, "sensor_" + name, sensor)
+            sensor.listen(lambda measurement, name=name: setattr(self, name, measurement))
+
+
+class ReplayIMUSensor():
+    def __init__(self, world):
+        self.frame = 0
+        self.compass = 0.0
+        self.sensor = world.spawn_sensor("imu", "ego")
+        self.sensor.listen(self._callback)
+
+    def _callback(self, measurement):
+        self.compass = math.degrees(measurement.compass)
+        self.frame = measurement.frame
+
+
+class ReplayCollisionSensor():
+    """
+        Collision sensor reporting the collision of collision_frame.json from its frame on.
+    """
+
+    def __init__(self, world):
+        self.world = world
+        self.collision = False
+        self.true_collision = False
+        self.wrong_collision = False
+        self.collision_actor_id = None
+        self.collision_actor_type = None
+        self.other_actor_id = None
+        self.other_actor_ids = []
+        world.on_tick(self._callback)
+
+    def _callback(self, snapshot):
+        record = self.world.episode.collision
+        if record and not self.collision and self.world.recorded_frame >= int(record["frame"]):
+            self.collision = True
+            self.collision_actor_id = record.get("id")
+            self.collision_actor_type = record.get("type")
+
+
+class ReplayGameWorld():
+    """
+        Stand-in of data_generator's World: world, player, sensors and flags read by Data_Collection and Inference.
+    """
+
+    def __init__(self, episode, map_name=None):
+        self.client = ReplayClient(episode, map_name)
+        self.world = self.client.get_world()
+        self.map = self.world.get_map
+        self.player = self.world.get_actor(self.world.ego_id)
+        if self.player is None:
+            raise ValueError("the ego vehicle of %s is not recorded" % self.world.episode.path)
+        self.camera_manager = ReplayCameraManager(self.world)
+        self.imu_sensor = ReplayIMUSensor(self.world)
+        self.collision_sensor = ReplayCollisionSensor(self.world)
+        self.abandon_scenario = False
+
+    @property
+    def frame(self):
+        return self.world.frame
+
+    def frames(self):
+        """Ticks the world up to the end of the episode, yielding the frames"""
+        while not self.world.finished:
+            yield self.world.tick()
+
+    def destroy(self):
+        self.world.close()
+
+
+# -- drivers --------------------------------------------------------------------
+
+def replay_collection(episode_path, out_path, data_collection=None, verbose=True):
+    """
+        Runs the collection loop of game_loop on the recorded episode and saves what Data_Collection collected
+        in out_path, which is a replayed copy of the episode.
+
+        Returns:
+            number of replayed frames and their collection time in seconds
+    """
+    install_carla_api()
+    from util.data_collection import Data_Collection
+    from util.dataset_catalog import describe_episode
+
+    game_world = ReplayGameWorld(episode_path)
+    episode = game_world.world.episode
+    root = os.path.abspath(os.path.join(episode_path, "..", "..", "..", ".."))
+    record = describe_episode(os.path.abspath(episode_path), root)
+
+    if data_collection is None:
+        data_collection = Data_Collection()
+    data_collection.catalog = False
+    data_collection.set_scenario_type(record["scenario_type"])
+    data_collection.set_ego_id(game_world)
+    data_collection.set_attribute(record["scenario_type"], record["basic_scenario"], record["weather"],
+                                  record["random_actors"], record["random_seed"], record["town"])
+    if episode.attributes.get("interactor_id") is not None:
+        data_collection.set_gt_interactor(episode.attributes["interactor_id"])
+    data_collection.set_start_frame(game_world.frame)
+
+    start = time.perf_counter()
+    count = 0
+    for frame in game_world.frames():
+        data_collection.collect_sensor(frame, game_world)
+        count += 1
+    duration = time.perf_counter() - start
+    if verbose:
+        print("%d frames collected in %.2f s (%.1f frames/s)" % (count, duration, count / duration if duration else 0.0))
+
+    # only the recorded modalities are saved again
+    for name in ReplayCameraManager.VIEWS:
+        if name not in game_world.camera_manager.recorded:
+            setattr(data_collection, "sensor_lidar" if name == "lidar" else name, [])
+    data_collection.set_end_frame(game_world.frame + 1)
+    data_collection.collect_actor_attr(game_world)
+    data_collection.collect_static_actor_data(game_world)
+    os.makedirs(out_path, exist_ok=True)
+    data_collection.save_data(out_path)
+    if episode.collision:
+        data_collection.save_collision_frame(episode.collision["frame"], episode.collision.get("id"),
+                                             episode.collision.get("type"), out_path)
+    game_world.destroy()
+    return count, duration
+
+
+def replay_inference(inference, game_world, max_frames=None):
+    """
+        Runs the inference loop of game_loop on a replayed world: run_inference at every tick, its control being
+        applied to the ego. The ego follows the recording whatever the control.
+
+        Returns:
+            list of (frame, control, isReach)
+    """
+    results = []
+    inference.set_ego_id(game_world)
+    for frame in game_world.frames():
+        control, is_reach = inference.run_inference(frame, game_world)
+        game_world.player.apply_control(control)
+        results.append((frame, control, is_reach))
+        if is_reach or (max_frames is not None and len(results) >= max_frames):
+            break
+    return results
+
+
+def replay_ticks(episode_path, topology=False):
+    """
+        Ticks a replayed episode at full speed, collecting the actor states (and the topology), as a throughput test
+        of the backend.
+    """
+    install_carla_api()
+    from util.actor_state import ActorStateCollector
+
+    game_world = ReplayGameWorld(episode_path)
+    collector = ActorStateCollector(game_world.world, game_world.world.ego_id)
+    collect_topology = None
+    if topology:
+        from util.data_collection import Data_Collection
+        collect_topology = Data_Collection().collect_topology
+
+    start = time.perf_counter()
+    count = 0
+    for _ in game_world.frames():
+        collector.collect(compass=game_world.imu_sensor.compass)
+        if collect_topology is not None:
+            collect_topology(game_world)
+        count += 1
+    duration = time.perf_counter() - start
+    game_world.destroy()
+    return count, duration
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = argparser.add_subparsers(dest='command', required=True)
+    tick_parser = subparsers.add_parser('tick', help='tick the replayed episode at full speed')
+    tick_parser.add_argument('--episode', required=True, help='variant directory of the episode')
+    tick_parser.add_argument('--topology', action='store_true', help='also collect the topology at every frame')
+    collect_parser = subparsers.add_parser('collect', help='run Data_Collection on the replayed episode')
+    collect_parser.add_argument('--episode', required=True, help='variant directory of the episode')
+    collect_parser.add_argument('--out', required=True, help='directory of the replayed copy of the episode')
+    args = argparser.parse_args()
+
+    if args.command == 'tick':
+        count, duration = replay_ticks(args.episode, args.topology)
+        print("%d frames in %.2f s (%.1f frames/s)" % (count, duration, count / duration if duration else 0.0))
+    else:
+        replay_collection(args.episode, args.out)
+
+
+if __name__ == '__main__':
+    main()
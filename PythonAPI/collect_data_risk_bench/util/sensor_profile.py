@@ -0,0 +1,115 @@
+"""
+    Declarative profile of the sensors spawned by CameraManager in save mode: per sensor, whether it is spawned,
+    its sampling period in ticks and its active window in ticks relative to the scenario trigger (the frame given
+    to Data_Collection.set_start_frame).
+
+    The sensors stay attached, CameraManager drops the measurements of the ticks a sensor is not due on (and all of
+    them before the trigger) without converting them, and Data_Collection only waits on the sensors that are due.
+    The default profile collects every sensor on every tick of the recording window. A profile is a JSON file (data_generator.py --sensor_profile),
+    sensors missing from it keep the default schedule:
+
+        {
+            "ss_top": {"period": 2},
+            "lidar": {"period": 4, "window": [0, 200]},
+            "depth_front": {"enabled": false}
+        }
+
+        python -m util.sensor_profile profile.json [--ticks 20]
+"""
+import argparse
+import json
+
+# sensors of CameraManager in save mode, in the order Data_Collection waits on them
+SENSORS = ("ss_top", "rgb_front", "ss_front", "depth_front", "lidar")
+
+
+class SensorSchedule():
+    """
+        Ticks on which a sensor is collected.
+    """
+
+    def __init__(self, enabled=True, period=1, window=(0, None)):
+        """
+            Args:
+                enabled: False not to spawn the sensor at all
+                period: the sensor is collected every period ticks, from the start of its window
+                window: (start, end) ticks since the trigger, end excluded, None to collect until the end
+        """
+        start, end = window
+        if int(period) < 1:
+            raise ValueError("the sampling period must be at least one tick, got %r" % (period,))
+        if int(start) < 0 or (end is not None and int(end) < int(start)):
+            raise ValueError("invalid active window %r" % (window,))
+        self.enabled = bool(enabled)
+        self.period = int(period)
+        self.start = int(start)
+        self.end = None if end is None else int(end)
+
+    def due(self, tick):
+        """
+            Args:
+                tick: ticks since the trigger, None before the trigger
+        """
+        if not self.enabled or tick is None or tick < self.start:
+            return False
+        if self.end is not None and tick >= self.end:
+            return False
+        return (tick - self.start) % self.period == 0
+
+    def to_dict(self):
+        return {"enabled": self.enabled, "period": self.period, "window": [self.start, self.end]}
+
+
+class SensorProfile():
+    """
+        Schedules of the sensors of SENSORS, shared by CameraManager and Data_Collection.
+    """
+
+    def __init__(self, schedules=None):
+        """
+            Args:
+                schedules: {sensor name: SensorSchedule}, the sensors missing are collected on every tick
+        """
+        schedules = dict(schedules or {})
+        unknown = set(schedules) - set(SENSORS)
+        if unknown:
+            raise ValueError("unknown sensors %s, expected some of %s" % (sorted(unknown), list(SENSORS)))
+        self.schedules = {name: schedules.get(name, SensorSchedule()) for name in SENSORS}
+
+    @staticmethod
+    def from_dict(data):
+        return SensorProfile({name: SensorSchedule(**settings) for name, settings in data.items()})
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            return SensorProfile.from_dict(json.load(f))
+
+    def to_dict(self):
+        return {name: schedule.to_dict() for name, schedule in self.schedules.items()}
+
+    def enabled(self, name):
+        return self.schedules[name].enabled
+
+    def due(self, name, tick):
+        return self.schedules[name].due(tick)
+
+    def due_sensors(self, tick):
+        """Names of the sensors collected on tick, in the order of SENSORS"""
+        return [name for name in SENSORS if self.schedules[name].due(tick)]
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument('profile', nargs='?', default=None, help='JSON sensor profile, the default one if omitted')
+    argparser.add_argument('--ticks', type=int, default=20, help='number of ticks after the trigger to show')
+    args = argparser.parse_args()
+
+    profile = SensorProfile.load(args.profile) if args.profile else SensorProfile()
+    print(json.dumps(profile.to_dict(), indent=4))
+    for tick in range(args.ticks):
+        print("%4d %s" % (tick, " ".join(profile.due_sensors(tick))))
+
+
+if __name__ == '__main__':
+    main()
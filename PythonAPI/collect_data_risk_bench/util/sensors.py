@@ -7,6 +7,8 @@ from carla import ColorConverter as cc
 import numpy as np
 import pygame
 
+from util.sensor_profile import SENSORS, SensorProfile
+
 
 def get_actor_display_name(actor, truncate=250):
     name = ' '.join(actor.type_id.replace('_', '.').title().split('.')[1:])
@@ -280,10 +282,18 @@ class RadarSensor(object):
 # ==============================================================================
 
 class CameraManager(object):
-    def __init__(self, parent_actor, hud, gamma_correction, save_mode, inference_mode):
+    def __init__(self, parent_actor, hud, gamma_correction, save_mode, inference_mode, sensor_profile=None):
 
         self.ss_top = None
         self.sensor_top = None
+        self.sensor_ss_top = None
+        self.sensor_rgb_front = None
+        self.sensor_ss_front = None
+        self.sensor_depth_front = None
+        self.sensor_lidar = None
+        # sensors of the save mode that are spawned and the ticks they are collected on, see util/sensor_profile.py
+        self.sensor_profile = sensor_profile if sensor_profile is not None else SensorProfile()
+        self.start_frame = None
         self.surface = None
         self._parent = parent_actor
         self.hud = hud
@@ -507,38 +517,43 @@ class CameraManager(object):
                 if self.save_mode:
 
                     # inst top
-                    self.sensor_ss_top = self._parent.get_world().spawn_actor(
-                        self.bev_seg_bp,
-                        self._camera_transforms[14][0],
-                        attach_to=self._parent,
-                        attachment_type=self._camera_transforms[14][1])
+                    if self.sensor_profile.enabled('ss_top'):
+                        self.sensor_ss_top = self._parent.get_world().spawn_actor(
+                            self.bev_seg_bp,
+                            self._camera_transforms[14][0],
+                            attach_to=self._parent,
+                            attachment_type=self._camera_transforms[14][1])
                     # front
 
-                    self.sensor_rgb_front = self._parent.get_world().spawn_actor(
-                        self.front_cam_bp,
-                        self._camera_transforms[8][0],
-                        attach_to=self._parent,
-                        attachment_type=self._camera_transforms[0][1])
-
-                    self.sensor_ss_front = self._parent.get_world().spawn_actor(
-                        self.front_seg_bp,
-                        self._camera_transforms[8][0],
-                        attach_to=self._parent,
-                        attachment_type=self._camera_transforms[0][1])
-
-                    self.sensor_depth_front = self._parent.get_world().spawn_actor(
-                        self.depth_bp,
-                        self._camera_transforms[8][0],
-                        attach_to=self._parent,
-                        attachment_type=self._camera_transforms[0][1])
+                    if self.sensor_profile.enabled('rgb_front'):
+                        self.sensor_rgb_front = self._parent.get_world().spawn_actor(
+                            self.front_cam_bp,
+                            self._camera_transforms[8][0],
+                            attach_to=self._parent,
+                            attachment_type=self._camera_transforms[0][1])
+
+                    if self.sensor_profile.enabled('ss_front'):
+                        self.sensor_ss_front = self._parent.get_world().spawn_actor(
+                            self.front_seg_bp,
+                            self._camera_transforms[8][0],
+                            attach_to=self._parent,
+                            attachment_type=self._camera_transforms[0][1])
+
+                    if self.sensor_profile.enabled('depth_front'):
+                        self.sensor_depth_front = self._parent.get_world().spawn_actor(
+                            self.depth_bp,
+                            self._camera_transforms[8][0],
+                            attach_to=self._parent,
+                            attachment_type=self._camera_transforms[0][1])
 
                     # lidar sensor
-                    self.sensor_lidar = self._parent.get_world().spawn_actor(
-                        # self.sensors[6][-1],
-                        self.sensor_lidar_bp,
-                        self._camera_transforms[15][0],
-                        attach_to=self._parent,
-                        attachment_type=self._camera_transforms[0][1])
+                    if self.sensor_profile.enabled('lidar'):
+                        self.sensor_lidar = self._parent.get_world().spawn_actor(
+                            # self.sensors[6][-1],
+                            self.sensor_lidar_bp,
+                            self._camera_transforms[15][0],
+                            attach_to=self._parent,
+                            attachment_type=self._camera_transforms[0][1])
 
             # We need to pass the lambda a weak reference to self to avoid
             # circular reference.
@@ -556,28 +571,31 @@ class CameraManager(object):
                 self.sensor_ss_front.listen(
                     lambda image: CameraManager._parse_image(weak_self, image, 'ss_front'))
 
-            else:
-                if self.save_mode:
-
-                    self.sensor_ss_top.listen(
-                        lambda image: CameraManager._parse_image(weak_self, image, 'ss_top'))
-
-                    self.sensor_rgb_front.listen(
-                        lambda image: CameraManager._parse_image(weak_self, image, 'rgb_front'))
-
-                    self.sensor_ss_front.listen(
-                        lambda image: CameraManager._parse_image(weak_self, image, 'ss_front'))
-
-                    self.sensor_depth_front.listen(
-                        lambda image: CameraManager._parse_image(weak_self, image, 'depth_front'))
-
-                    self.sensor_lidar.listen(
-                        lambda image: CameraManager._parse_image(weak_self, image, 'lidar'))
+            elif self.save_mode:
+                # the sensors of the save mode stay attached, _parse_image drops the measurements that are not due
+                for name in SENSORS:
+                    sensor = getattr(self, 'sensor_' + name)
+                    if sensor is not None:
+                        sensor.listen(
+                            lambda image, name=name: CameraManager._parse_image(weak_self, image, name))
 
         if notify:
             self.hud.notification(self.sensors[index][2])
         self.index = index
 
+    def set_start_frame(self, frame):
+        """
+            Frame of the scenario trigger, the ticks of the sensor profile count from it. Before it is set, the
+            measurements of the save mode sensors are dropped.
+        """
+        self.start_frame = frame
+
+    def due(self, name, frame):
+        """Whether the measurement of frame of a save mode sensor is collected"""
+        if self.start_frame is None:
+            return False
+        return self.sensor_profile.due(name, frame - self.start_frame)
+
     def next_sensor(self):
         self.set_sensor(self.index + 1)
 
@@ -590,6 +608,8 @@ class CameraManager(object):
         self = weak_self()
         if not self:
             return
+        if not self.inference_mode and view in SENSORS and not self.due(view, image.frame):
+            return
         if self.sensors[self.index][0].startswith('sensor.lidar'):
             points = np.frombuffer(image.raw_data, dtype=np.dtype('f4'))
             points = np.reshape(points, (int(points.shape[0] / 4), 4))
@@ -0,0 +1,156 @@
+"""
+    Ragged storage of the lane topology collected at every frame of an episode (Data_Collection.collect_topology).
+
+    A lane of collect_topology is [halluc_lane_1, halluc_lane_2, center_lane, turn_direction, is_traffic_control,
+    is_junction, (road_id, lane_id)], the three lanes being (N, 6) arrays of segments (x, y, z of both ends).
+    The lanes are mostly static from a frame to the next, so every distinct lane is stored once:
+        coords: (S, 3, 6) float32 segments of all the distinct lanes, halluc_lane_1, halluc_lane_2 and center_lane
+        lane_offsets: (L + 1,) segments of lane i are coords[lane_offsets[i]:lane_offsets[i + 1]]
+        road_id, lane_id, turn_direction, is_traffic_control, is_junction: (L,) typed attributes of the lanes
+        frame_offsets: (F + 1,) lanes of the i-th frame are frame_lanes[frame_offsets[i]:frame_offsets[i + 1]]
+    The arrays are written uncompressed in one .npz, so that the reader maps them instead of loading them and a
+    frame is a slice of the mapped arrays.
+"""
+import zipfile
+
+import numpy as np
+
+FORMAT_VERSION = 1
+TURN_DIRECTIONS = (None, "left", "right")
+
+
+class TopologyWriter():
+    """
+        Collects the topology of the frames and deduplicates the lanes, written by close().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lane_index = {}
+        self.coords = []
+        self.attributes = []
+        self.frames = []
+        self.frame_lanes = []
+        self.missing = []
+
+    def _lane(self, lane):
+        halluc_lane_1, halluc_lane_2, center_lane, turn_direction, is_traffic_control, is_junction, (road_id, lane_id) = lane
+        coords = np.stack([np.asarray(halluc_lane_1), np.asarray(halluc_lane_2), np.asarray(center_lane)],
+                          axis=1).reshape(-1, 3, 6).astype(np.float32)
+        attributes = (int(road_id), int(lane_id), TURN_DIRECTIONS.index(turn_direction),
+                      bool(is_traffic_control), bool(is_junction))
+        key = attributes + (coords.tobytes(),)
+        if key not in self.lane_index:
+            self.lane_index[key] = len(self.coords)
+            self.coords.append(coords)
+            self.attributes.append(attributes)
+        return self.lane_index[key]
+
+    def write(self, frame, lanes):
+        """
+            Args:
+                lanes: list of lanes given by collect_topology, None when the collection failed
+        """
+        self.frames.append(frame)
+        self.missing.append(lanes is None)
+        self.frame_lanes.append([self._lane(lane) for lane in lanes or []])
+
+    def arrays(self):
+        attributes = np.array(self.attributes, dtype=np.int64).reshape(-1, 5)
+        lane_sizes = [len(coords) for coords in self.coords]
+        frame_sizes = [len(lanes) for lanes in self.frame_lanes]
+        return {
+            "version": np.array(FORMAT_VERSION),
+            "coords": np.concatenate(self.coords) if self.coords else np.empty((0, 3, 6), dtype=np.float32),
+            "lane_offsets": np.concatenate([[0], np.cumsum(lane_sizes, dtype=np.int64)]).astype(np.int64),
+            "road_id": attributes[:, 0].astype(np.int32),
+            "lane_id": attributes[:, 1].astype(np.int32),
+            "turn_direction": attributes[:, 2].astype(np.int8),
+            "is_traffic_control": attributes[:, 3].astype(bool),
+            "is_junction": attributes[:, 4].astype(bool),
+            "frames": np.array(self.frames, dtype=np.int64),
+            "missing": np.array(self.missing, dtype=bool),
+            "frame_offsets": np.concatenate([[0], np.cumsum(frame_sizes, dtype=np.int64)]).astype(np.int64),
+            "frame_lanes": np.array([i for lanes in self.frame_lanes for i in lanes], dtype=np.int32),
+        }
+
+    def close(self):
+        np.savez(self.path, **self.arrays())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _map_npz(path):
+    """
+        Memory maps the members of an uncompressed .npz.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError("%s: member %s is compressed, it can not be mapped" % (path, info.filename))
+            # the data of a member follows its local header, whose name and extra field lengths may differ
+            # from the central directory
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(f.read(4), dtype="<u2")
+            f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+            if np.lib.format.read_magic(f) == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            name = info.filename[:-len(".npy")]
+            if dtype.hasobject:
+                raise ValueError("%s: member %s holds objects" % (path, name))
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(f.name, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                         order="F" if fortran_order else "C")
+    return arrays
+
+
+class TopologyReader():
+    """
+        Topology of the frames of an episode written by TopologyWriter, the arrays are memory mapped.
+    """
+
+    def __init__(self, path):
+        arrays = _map_npz(path)
+        for name, array in arrays.items():
+            setattr(self, name, array)
+        self.frame_rows = {int(frame): row for row, frame in enumerate(self.frames)}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, frame):
+        return frame in self.frame_rows
+
+    def lane_ids(self, frame):
+        """Indices of the distinct lanes of the frame, a view of frame_lanes"""
+        row = self.frame_rows[frame]
+        return self.frame_lanes[self.frame_offsets[row]:self.frame_offsets[row + 1]]
+
+    def lane_coords(self, lane):
+        """(N, 3, 6) segments of halluc_lane_1, halluc_lane_2 and center_lane, a view of coords"""
+        return self.coords[self.lane_offsets[lane]:self.lane_offsets[lane + 1]]
+
+    def lane(self, lane):
+        """Lane in the layout of collect_topology"""
+        coords = self.lane_coords(lane)
+        return [coords[:, 0], coords[:, 1], coords[:, 2], TURN_DIRECTIONS[self.turn_direction[lane]],
+                bool(self.is_traffic_control[lane]), bool(self.is_junction[lane]),
+                (int(self.road_id[lane]), int(self.lane_id[lane]))]
+
+    def __getitem__(self, frame):
+        """
+            Returns:
+                list of the lanes of the frame in the layout of collect_topology, None if its collection failed
+        """
+        if self.missing[self.frame_rows[frame]]:
+            return None
+        return [self.lane(lane) for lane in self.lane_ids(frame)]
@@ -2,7 +2,7 @@ from PyQt5 import QtCore
 from PyQt5.QtGui import QImage, QPixmap
 from PyQt5.QtCore import QTimer 
 
-from opencv_engine import opencv_engine
+from video_reader import video_reader
 
 # videoplayer_state_dict = {
 #  "stop":0,   
@@ -16,9 +16,10 @@ class video_controller(object):
         self.ui = ui
         self.qpixmap_fix_width = 640 
         self.qpixmap_fix_height = 360
-        self.counter = 0
         self.current_frame_no = 0
         self.videoplayer_state = "stop"
+        self.reader = None
+        self.ui.slider_videoframe.valueChanged.connect(self.getslidervalue)
         self.init_video_info()
         self.set_video_player()
         
@@ -28,15 +29,20 @@ class video_controller(object):
         self.init_video_info()
 
     def init_video_info(self):
-        videoinfo = opencv_engine.getvideoinfo(self.video_path)
-        self.vc = videoinfo["vc"] 
-        self.video_fps = videoinfo["fps"] 
-        self.video_total_frame_count = videoinfo["frame_count"] 
-        self.video_width = videoinfo["width"]
-        self.video_height = videoinfo["height"] 
+        if self.reader is not None:
+            self.reader.close()
+        # frames are decoded ahead in a background thread, see video_reader
+        self.reader = video_reader(self.video_path)
+        self.video_fps = self.reader.fps
+        self.video_total_frame_count = self.reader.frame_count
+        self.video_width = self.reader.width
+        self.video_height = self.reader.height
+        # (frame number, label size) of the frame on screen, it is only rendered again when one of them changes
+        self.rendered = None
+        self.current_frame_no = 0
         
         self.ui.slider_videoframe.setRange(0, self.video_total_frame_count-1)
-        self.ui.slider_videoframe.valueChanged.connect(self.getslidervalue)
+        self.setslidervalue(0)
 
 
         # self.ui.slider_videoframe
@@ -50,20 +56,14 @@ class video_controller(object):
     def set_video_player(self):
         self.timer=QTimer() # init QTimer
         self.timer.timeout.connect(self.timer_timeout_job) # when timeout, do run one
-        # self.timer.start(1000//self.video_fps) # start Timer, here we set '1000ms//Nfps' while timeout one time
-        self.timer.start(1) # but if CPU can not decode as fast as fps, we set 1 (need decode time)
-
-    def __get_frame_from_frame_no(self, frame_no):
-        self.vc.set(1, frame_no)
-        ret, frame = self.vc.read()
-        self.ui.label_framecnt.setText(f"frame number: {frame_no}/{self.video_total_frame_count}")
-        
-        self.setslidervalue(frame_no)
-        return frame
+        # one timeout per frame of the video, decoding runs in the reader thread
+        fps = self.video_fps if self.video_fps and self.video_fps > 0 else 20
+        self.timer.start(max(1, int(1000 // fps)))
 
     def __update_label_frame(self, frame):       
         bytesPerline = 3 * self.video_width
-        qimg = QImage(frame, self.video_width, self.video_height, bytesPerline, QImage.Format_RGB888).rgbSwapped()
+        # frames of the reader are already RGB
+        qimg = QImage(frame.data, self.video_width, self.video_height, bytesPerline, QImage.Format_RGB888)
         self.qpixmap = QPixmap.fromImage(qimg)
 
         if self.qpixmap.width()/16 >= self.qpixmap.height()/9: # like 1600/16 > 90/9, height is shorter, align width
@@ -80,30 +80,26 @@ class video_controller(object):
 
     def stop(self):
         self.videoplayer_state = "stop"
+        self.current_frame_no = 0
+        self.setslidervalue(0)
 
     def pause(self):
         self.videoplayer_state = "pause"
 
     def timer_timeout_job(self):
-        frame = self.__get_frame_from_frame_no(self.current_frame_no)
-        self.__update_label_frame(frame)
+        key = (self.current_frame_no, self.ui.label_videoframe.size())
+        if key != self.rendered:
+            frame = self.reader.get(self.current_frame_no)
+            if frame is None:
+                # not decoded yet, the frame on screen stays until the next timeout
+                return
+            self.__update_label_frame(frame)
+            self.ui.label_framecnt.setText(f"frame number: {self.current_frame_no}/{self.video_total_frame_count}")
+            self.rendered = key
 
         if (self.videoplayer_state == "play"):
-            # time.sleep(1)
-            self.counter +=1
-            # use counter to slow down the video speed
-            #if self.counter == 4:
-            if self.counter == 4:
-                self.counter = 0
-                if self.current_frame_no >= self.video_total_frame_count-1:
-                    self.videoplayer_state = "stop"
-                else:
-                    self.current_frame_no += 1
-                    self.setslidervalue(self.current_frame_no)
-
-        if (self.videoplayer_state == "stop"):
-            self.current_frame_no = 0
-
-        if (self.videoplayer_state == "pause"):
-            self.current_frame_no = self.current_frame_no
-
+            if self.current_frame_no >= self.video_total_frame_count-1:
+                self.stop()
+            else:
+                self.current_frame_no += 1
+                self.setslidervalue(self.current_frame_no)
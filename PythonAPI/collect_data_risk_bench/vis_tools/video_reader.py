@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+
+
+class video_reader(object):
+    """
+        Decodes a video sequentially in a background thread into a bounded LRU cache of RGB frames.
+
+        The thread decodes from the last requested frame up to look_ahead frames after it, then sleeps until
+        another frame is requested. Requests inside the decoded window are served from the cache; a request a
+        little ahead of the decoder is reached by grabbing the frames in between (decoded but not converted);
+        only requests behind it or farther than seek_distance make the backend seek, which restarts decoding at
+        the preceding keyframe.
+    """
+
+    def __init__(self, video_path, cache_size=256, look_ahead=48, seek_distance=96):
+        self.video_path = video_path
+        self.cache_size = max(cache_size, look_ahead + 1)
+        self.look_ahead = look_ahead
+        self.seek_distance = seek_distance
+
+        self.vc = cv2.VideoCapture(video_path)
+        self.fps = self.vc.get(cv2.CAP_PROP_FPS)
+        self.frame_count = int(self.vc.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.width = int(self.vc.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.vc.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        self.cache = OrderedDict()
+        self.condition = threading.Condition()
+        self.target = 0
+        # next frame the capture will decode
+        self.position = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._decode_loop, daemon=True)
+        self.thread.start()
+
+    def get(self, frame_no):
+        """
+            Returns the RGB frame if it is decoded, None otherwise. Either way the decoder moves to frame_no and
+            the frames after it.
+        """
+        frame_no = min(max(int(frame_no), 0), max(self.frame_count - 1, 0))
+        with self.condition:
+            if self.target != frame_no:
+                self.target = frame_no
+                self.condition.notify()
+            frame = self.cache.get(frame_no)
+            if frame is not None:
+                self.cache.move_to_end(frame_no)
+            return frame
+
+    def wait(self, frame_no, timeout=None):
+        """
+            Returns the RGB frame once it is decoded, None if the video ends before it or on timeout.
+        """
+        self.get(frame_no)
+        with self.condition:
+            self.condition.wait_for(lambda: frame_no in self.cache or not self.running
+                                    or frame_no >= self.frame_count, timeout)
+            return self.cache.get(frame_no)
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+        self.vc.release()
+
+    def _next_frame_to_decode(self):
+        """First frame of [target, target + look_ahead] missing from the cache, None if there is none."""
+        end = min(self.target + self.look_ahead, self.frame_count - 1)
+        for frame_no in range(self.target, end + 1):
+            if frame_no not in self.cache:
+                return frame_no
+        return None
+
+    def _decode_loop(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: not self.running or self._next_frame_to_decode() is not None)
+                if not self.running:
+                    return
+                frame_no = self._next_frame_to_decode()
+
+            if frame_no < self.position or frame_no - self.position > self.seek_distance:
+                self.vc.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
+                self.position = frame_no
+            while self.position < frame_no:
+                if not self.vc.grab():
+                    break
+                self.position += 1
+
+            ret, frame = self.vc.read()
+            if not ret:
+                # the container reported more frames than it holds
+                with self.condition:
+                    self.frame_count = self.position
+                    self.condition.notify_all()
+                continue
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+            with self.condition:
+                self.cache[self.position] = frame
+                self.cache.move_to_end(self.position)
+                # frames in the look-ahead window of the target are kept, the least recently used others go first
+                window = range(self.target, self.target + self.look_ahead + 1)
+                for cached in list(self.cache):
+                    if len(self.cache) <= self.cache_size:
+                        break
+                    if cached not in window:
+                        del self.cache[cached]
+                self.condition.notify_all()
+            self.position += 1
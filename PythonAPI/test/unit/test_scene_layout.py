@@ -0,0 +1,328 @@
+# Copyright (c) 2019 Computer Vision Center (CVC) at the Universitat Autonoma de
+# Barcelona (UAB).
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+# Compares the layouts and dynamic objects of scene_layout.py with the implementation they replaced,
+# on an OpenDRIVE map loaded without a simulator and on stub actors.
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import carla
+
+import numpy as np
+
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'carla'))
+
+import scene_layout  # pylint: disable=wrong-import-position
+
+LANES = """
+                <left>
+                    <lane id="1" type="driving" level="false">
+                        <link><{link} id="1"/></link><width sOffset="0.0" a="3.5" b="0" c="0" d="0"/>
+                    </lane>
+                </left>
+                <center><lane id="0" type="none" level="false"/></center>
+                <right>
+                    <lane id="-1" type="driving" level="false">
+                        <link><{link} id="-1"/></link><width sOffset="0.0" a="3.5" b="0" c="0" d="0"/>
+                    </lane>
+                    <lane id="-2" type="driving" level="false">
+                        <link><{link} id="-2"/></link><width sOffset="0.0" a="3.0" b="0.02" c="0" d="0"/>
+                    </lane>
+                </right>"""
+
+OPENDRIVE = """<?xml version="1.0" standalone="yes"?>
+<OpenDRIVE>
+    <header revMajor="1" revMinor="4" name="scene_layout" version="1">
+        <geoReference><![CDATA[+proj=tmerc +lat_0=49.0 +lon_0=8.0 +k=1 +x_0=0 +y_0=0 +datum=WGS84]]></geoReference>
+    </header>
+    <road name="straight" length="30.0" id="1" junction="-1">
+        <link><successor elementType="road" elementId="2" contactPoint="start"/></link>
+        <planView>
+            <geometry s="0.0" x="0.0" y="0.0" hdg="0.3" length="30.0"><line/></geometry>
+        </planView>
+        <lanes><laneSection s="0.0">{straight}
+        </laneSection></lanes>
+    </road>
+    <road name="climbing_turn" length="20.0" id="2" junction="-1">
+        <link><predecessor elementType="road" elementId="1" contactPoint="end"/></link>
+        <planView>
+            <geometry s="0.0" x="28.66" y="8.87" hdg="0.3" length="20.0"><arc curvature="0.03"/></geometry>
+        </planView>
+        <elevationProfile><elevation s="0.0" a="0.0" b="0.05" c="0" d="0"/></elevationProfile>
+        <lanes><laneSection s="0.0">{turn}
+        </laneSection></lanes>
+    </road>
+</OpenDRIVE>
+""".format(straight=LANES.format(link='successor'), turn=LANES.format(link='predecessor'))
+
+
+# ==================================================================================================
+# -- previous implementation -----------------------------------------------------------------------
+# ==================================================================================================
+
+def previous_scene_layout(carla_map):
+    """get_scene_layout before the layout was cached as arrays."""
+
+    def _lateral_shift(transform, shift):
+        transform.rotation.yaw += 90
+        return transform.location + shift * transform.get_forward_vector()
+
+    topology = [x[0] for x in carla_map.get_topology()]
+    topology = sorted(topology, key=lambda w: w.transform.location.z)
+
+    map_dict = dict()
+    precision = 0.05
+    for waypoint in topology:
+        waypoints = [waypoint]
+        nxt = waypoint.next(precision)
+        if len(nxt) > 0:
+            nxt = nxt[0]
+            while nxt.road_id == waypoint.road_id:
+                waypoints.append(nxt)
+                nxt = nxt.next(precision)
+                if len(nxt) > 0:
+                    nxt = nxt[0]
+                else:
+                    break
+
+        left_marking = [_lateral_shift(w.transform, -w.lane_width * 0.5) for w in waypoints]
+        right_marking = [_lateral_shift(w.transform, w.lane_width * 0.5) for w in waypoints]
+        lane = {"waypoints": waypoints, "left_marking": left_marking, "right_marking": right_marking}
+
+        if map_dict.get(waypoint.road_id) is None:
+            map_dict[waypoint.road_id] = {}
+        map_dict[waypoint.road_id][waypoint.lane_id] = lane
+
+    waypoints_graph = dict()
+    for road_key in map_dict:
+        for lane_key in map_dict[road_key]:
+            lane = map_dict[road_key][lane_key]
+            for i in range(0, len(lane["waypoints"])):
+                next_ids = [w.id for w in lane["waypoints"][i + 1:len(lane["waypoints"])]]
+
+                left_lane_key = lane_key - 1 if lane_key - 1 != 0 else lane_key - 2
+                right_lane_key = lane_key + 1 if lane_key + 1 != 0 else lane_key + 2
+
+                left_lane_waypoint_id = -1
+                if left_lane_key in map_dict[road_key]:
+                    left_lane_waypoints = map_dict[road_key][left_lane_key]["waypoints"]
+                    if i < len(left_lane_waypoints):
+                        left_lane_waypoint_id = left_lane_waypoints[i].id
+
+                right_lane_waypoint_id = -1
+                if right_lane_key in map_dict[road_key]:
+                    right_lane_waypoints = map_dict[road_key][right_lane_key]["waypoints"]
+                    if i < len(right_lane_waypoints):
+                        right_lane_waypoint_id = right_lane_waypoints[i].id
+
+                lm = carla_map.transform_to_geolocation(lane["left_marking"][i])
+                rm = carla_map.transform_to_geolocation(lane["right_marking"][i])
+                wl = carla_map.transform_to_geolocation(lane["waypoints"][i].transform.location)
+                wo = lane["waypoints"][i].transform.rotation
+
+                waypoints_graph[lane["waypoints"][i].id] = {
+                    "road_id": road_key,
+                    "lane_id": lane_key,
+                    "position": [wl.latitude, wl.longitude, wl.altitude],
+                    "orientation": [wo.roll, wo.pitch, wo.yaw],
+                    "left_margin_position": [lm.latitude, lm.longitude, lm.altitude],
+                    "right_margin_position": [rm.latitude, rm.longitude, rm.altitude],
+                    "next_waypoints_ids": next_ids,
+                    "left_lane_waypoint_id": left_lane_waypoint_id,
+                    "right_lane_waypoint_id": right_lane_waypoint_id
+                }
+    return waypoints_graph
+
+
+def previous_dynamic_objects(carla_world, carla_map):
+    """get_dynamic_objects before the actors were extracted by column."""
+
+    def _geo(location):
+        g = carla_map.transform_to_geolocation(location)
+        return [g.latitude, g.longitude, g.altitude]
+
+    def _corners(actor, extent, offset, count):
+        corners = [carla.Location(x=-extent.x, y=-extent.y), carla.Location(x=extent.x, y=-extent.y),
+                   carla.Location(x=extent.x, y=extent.y), carla.Location(x=-extent.x, y=extent.y),
+                   carla.Location(x=-extent.x, y=-extent.y)][:count]
+        corners = [x + offset for x in corners]
+        actor.get_transform().transform(corners)
+        return [[g[1], g[0], g[2]] for g in map(_geo, corners)]
+
+    def _moving(actor):
+        t = actor.get_transform()
+        return {"id": actor.id, "position": _geo(t.location),
+                "orientation": [t.rotation.roll, t.rotation.pitch, t.rotation.yaw],
+                "bounding_box": _corners(actor, actor.bounding_box.extent, carla.Location(), 4)}
+
+    def _signal(actor):
+        return {"id": actor.id, "position": _geo(actor.get_transform().location),
+                "trigger_volume": _corners(actor, actor.trigger_volume.extent, actor.trigger_volume.location, 5)}
+
+    result = {'vehicles': {}, 'walkers': {}, 'traffic_lights': {}, 'stop_signs': {}, 'speed_limits': {},
+              'static_obstacles': {}}
+    heroes = []
+    for actor in carla_world.get_actors():
+        if 'vehicle' in actor.type_id:
+            result['vehicles'][actor.id] = _moving(actor)
+            if actor.attributes['role_name'] == 'hero':
+                heroes.append(actor)
+        elif 'traffic_light' in actor.type_id:
+            result['traffic_lights'][actor.id] = dict(_signal(actor), state=int(actor.state))
+        elif 'speed_limit' in actor.type_id:
+            result['speed_limits'][actor.id] = {"id": actor.id, "position": _geo(actor.get_transform().location),
+                                                "speed": int(actor.type_id.split('.')[2])}
+        elif 'walker' in actor.type_id:
+            result['walkers'][actor.id] = _moving(actor)
+        elif 'stop' in actor.type_id:
+            result['stop_signs'][actor.id] = _signal(actor)
+        elif 'static.prop' in actor.type_id:
+            result['static_obstacles'][actor.id] = {"id": actor.id,
+                                                    "position": _geo(actor.get_transform().location)}
+
+    hero = None if len(heroes) == 0 else random.choice(heroes)
+    result['hero_vehicle'] = None
+    if hero is not None:
+        hero_waypoint = carla_map.get_waypoint(hero.get_location())
+        result['hero_vehicle'] = {"id": hero.id, "position": _geo(hero.get_transform().location),
+                                  "road_id": hero_waypoint.road_id, "lane_id": hero_waypoint.lane_id}
+    return result
+
+
+# ==================================================================================================
+# -- stub world ------------------------------------------------------------------------------------
+# ==================================================================================================
+
+class StubActor(object):
+    def __init__(self, actor_id, type_id, transform, role_name='autopilot', extent=None, trigger=None,
+                 state=None):
+        self.id = actor_id
+        self.type_id = type_id
+        self.transform = transform
+        self.attributes = {'role_name': role_name}
+        if extent is not None:
+            self.bounding_box = carla.BoundingBox(carla.Location(), extent)
+        if trigger is not None:
+            self.trigger_volume = trigger
+        self.state = state
+
+    def get_transform(self):
+        return carla.Transform(self.transform.location, self.transform.rotation)
+
+    def get_location(self):
+        return self.transform.location
+
+
+class StubWorld(object):
+    def __init__(self, actors):
+        self.actors = actors
+        self.requested = []
+
+    def get_actors(self, actor_ids=None):
+        if actor_ids is None:
+            return list(self.actors)
+        self.requested.append(list(actor_ids))
+        return [actor for actor in self.actors if actor.id in actor_ids]
+
+    def get_snapshot(self):
+        # Snapshots of the actors have an id and a transform, like carla.ActorSnapshot.
+        return [StubActor(actor.id, None, actor.get_transform()) for actor in self.actors]
+
+
+def make_actors(rng):
+    def transform(z=0.0):
+        return carla.Transform(carla.Location(*rng.uniform(-50.0, 50.0, 2).tolist(), z=z),
+                               carla.Rotation(*rng.uniform(-10.0, 10.0, 3).tolist()))
+
+    trigger = carla.BoundingBox(carla.Location(1.5, -0.5, 0.2), carla.Vector3D(2.0, 1.0, 1.0))
+    return [
+        StubActor(1, 'vehicle.tesla.model3', transform(0.5), role_name='hero', extent=carla.Vector3D(2.4, 1.1, 0.8)),
+        StubActor(2, 'vehicle.audi.a2', transform(0.4), extent=carla.Vector3D(1.9, 0.9, 0.7)),
+        StubActor(3, 'walker.pedestrian.0001', transform(1.0), extent=carla.Vector3D(0.3, 0.3, 0.9)),
+        StubActor(4, 'traffic.traffic_light', transform(), trigger=trigger, state=carla.TrafficLightState.Red),
+        StubActor(5, 'traffic.traffic_light', transform(), trigger=trigger, state=carla.TrafficLightState.Green),
+        StubActor(6, 'traffic.stop', transform(), trigger=trigger),
+        StubActor(7, 'traffic.speed_limit.60', transform()),
+        StubActor(8, 'static.prop.streetbarrier', transform()),
+        StubActor(9, 'sensor.camera.rgb', transform()),
+        StubActor(10, 'vehicle.nissan.micra', transform(0.3), extent=carla.Vector3D(1.8, 0.9, 0.7)),
+    ]
+
+
+# ==================================================================================================
+# -- tests -----------------------------------------------------------------------------------------
+# ==================================================================================================
+
+class TestSceneLayout(unittest.TestCase):
+    def setUp(self):
+        self.map = carla.Map('scene_layout', OPENDRIVE)
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+
+    def assertSameObjects(self, objects, expected, path=''):
+        """
+        Same structure, the latitudes and longitudes within 1e-8 degree (about a millimetre) and
+        the altitudes within 1e-5 m, the previous implementation computing them in single precision.
+        """
+        if isinstance(expected, dict):
+            self.assertEqual(sorted(objects), sorted(expected), path)
+            for key in expected:
+                self.assertSameObjects(objects[key], expected[key], '{}/{}'.format(path, key))
+        elif isinstance(expected, list) and expected and not isinstance(expected[0], int):
+            difference = np.abs(np.subtract(objects, expected))
+            self.assertTrue(np.all(difference <= [1e-8, 1e-8, 1e-5]), '{}: {} != {}'.format(path, objects, expected))
+        else:
+            self.assertEqual(objects, expected, path)
+
+    def test_same_layout(self):
+        expected = previous_scene_layout(self.map)
+        self.assertGreater(len(expected), 1000)
+        self.assertTrue(any(w['left_lane_waypoint_id'] != -1 for w in expected.values()))
+        self.assertSameObjects(scene_layout.get_scene_layout(self.map, self.cache_dir), expected)
+        # The second call loads the cached layout.
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        self.assertSameObjects(scene_layout.get_scene_layout(self.map, self.cache_dir), expected)
+
+    def test_cached_layout(self):
+        layout = scene_layout.load_scene_layout(self.map, self.cache_dir)
+        cached = scene_layout.load_scene_layout(self.map, self.cache_dir)
+        for name in scene_layout.SceneLayout.FIELDS:
+            np.testing.assert_array_equal(getattr(cached, name), getattr(layout, name), err_msg=name)
+        row = len(layout) // 2
+        self.assertEqual(layout.ids[layout.next_rows(row)].tolist(),
+                         layout.to_dict()[int(layout.ids[row])]['next_waypoints_ids'])
+
+    def test_geolocations(self):
+        locations = np.random.default_rng(0).uniform(-500.0, 500.0, (20, 3))
+        expected = [[g.latitude, g.longitude, g.altitude] for g in
+                    (self.map.transform_to_geolocation(carla.Location(*location)) for location in locations.tolist())]
+        np.testing.assert_allclose(scene_layout.geolocations(self.map, locations), expected, rtol=0.0, atol=1e-8)
+
+    def test_same_dynamic_objects(self):
+        world = StubWorld(make_actors(np.random.default_rng(1)))
+        random.seed(0)
+        expected = previous_dynamic_objects(world, self.map)
+        self.assertIsNotNone(expected['hero_vehicle'])
+        extractor = scene_layout.DynamicObjectExtractor(world, self.map)
+        self.assertSameObjects(scene_layout.get_dynamic_objects(world, self.map, extractor), expected)
+
+        # Only the actors not seen before are read from the world.
+        world.actors[1].transform = carla.Transform(carla.Location(3.0, 4.0, 0.4), carla.Rotation(0.0, 45.0, 0.0))
+        world.actors.append(StubActor(11, 'walker.pedestrian.0002', carla.Transform(carla.Location(-5.0, 2.0, 1.0)),
+                                      extent=carla.Vector3D(0.3, 0.3, 0.9)))
+        expected = previous_dynamic_objects(world, self.map)
+        self.assertSameObjects(scene_layout.get_dynamic_objects(world, self.map, extractor), expected)
+        self.assertEqual(world.requested, [list(range(1, 11)), [11]])
+
+
+if __name__ == '__main__':
+    unittest.main()